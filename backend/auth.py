@@ -1,14 +1,16 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from models import User, UserResponse
+from database import get_database
 import os
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # JWT Settings
@@ -36,9 +38,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Verify and decode JWT token."""
-    token = credentials.credentials
+def decode_token(token: str) -> str:
+    """Decode a JWT access token and return the user id it was issued for."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -54,10 +55,31 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     except JWTError:
         raise credentials_exception
 
-async def get_current_user(user_id: str = Depends(verify_token)):
-    """Get current user from JWT token."""
-    from server import db
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Verify and decode JWT token."""
+    return decode_token(credentials.credentials)
+
+def verify_stream_token(
+    token: Optional[str] = Query(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """Verify the JWT of a streaming connection.
     
+    Browsers' EventSource cannot set headers, so the token may also be passed
+    as a query parameter.
+    """
+    if credentials:
+        return decode_token(credentials.credentials)
+    if token:
+        return decode_token(token)
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+async def get_current_user(user_id: str = Depends(verify_token), db=Depends(get_database)):
+    """Get current user from JWT token."""
     user_data = await db.users.find_one({"id": user_id})
     if user_data is None:
         raise HTTPException(
@@ -76,4 +98,8 @@ def require_role(allowed_roles: list):
                 detail="Not enough permissions"
             )
         return current_user
-    return role_checker
\ No newline at end of file
+    return role_checker
+
+async def get_current_stream_user(user_id: str = Depends(verify_stream_token), db=Depends(get_database)):
+    """Get current user for a streaming connection."""
+    return await get_current_user(user_id, db)
\ No newline at end of file
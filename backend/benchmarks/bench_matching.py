@@ -0,0 +1,70 @@
+"""Build time and scoring latency of customer-to-property matching on a large tenant.
+
+Loads --customers customers and --properties properties generated by
+benchmarks.datagen into a matching.TenantMatcher, then times top-k for one
+customer, one property and every customer. With --distinct every customer gets
+a slightly different budget, defeating the sharing of identical preference rows
+(the worst case for all-customer matching).
+
+Run from the backend directory:
+    python -m benchmarks.bench_matching
+    python -m benchmarks.bench_matching --customers 5000 --properties 10000 --distinct
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime
+
+from benchmarks.datagen import make_customer, make_property
+from matching import TenantMatcher
+
+CUSTOMERS = 20_000
+PROPERTIES = 50_000
+ROUNDS = 50
+USER_ID = "broker-bench"
+
+def timed(label: str, run, rounds: int = ROUNDS):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"{label:<28} p50 {statistics.median(timings):9.2f} ms   max {timings[-1]:9.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--customers", type=int, default=CUSTOMERS)
+    parser.add_argument("--properties", type=int, default=PROPERTIES)
+    parser.add_argument("--distinct", action="store_true", help="Give every customer a distinct budget")
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    now = datetime.utcnow()
+    properties = [make_property(rng, now, USER_ID, i) for i in range(args.properties)]
+    customers = [make_customer(rng, now, USER_ID, i) for i in range(args.customers)]
+    if args.distinct:
+        for i, customer in enumerate(customers):
+            customer["budget"] = f"₹{20 + i / 100:.2f}-{40 + i / 100:.2f} Lakh"
+
+    matcher = TenantMatcher()
+    start = time.perf_counter()
+    for doc in properties:
+        matcher.upsert_property(doc)
+    for doc in customers:
+        matcher.upsert_customer(doc)
+    print(f"loaded {len(customers)} customers x {len(properties)} properties "
+          f"in {time.perf_counter() - start:.2f}s ({len(matcher.areas)} areas)")
+
+    timed("top 10 for one customer", lambda: matcher.properties_for_customer(rng.choice(customers)["id"], 10))
+    timed("top 10 for one property", lambda: matcher.customers_for_property(rng.choice(properties)["id"], 10))
+    timed("top 5 for every customer", lambda: matcher.properties_for_all_customers(5), rounds=3)
+
+    start = time.perf_counter()
+    for doc in rng.sample(properties, 1_000):
+        matcher.upsert_property(dict(doc, price="₹42 Lakh"))
+    print(f"incremental property upsert: {time.perf_counter() - start:.3f} ms per write")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Validation and dump cost of every model in models.py, plus the create write path.
+
+For each model: model_validate of a JSON-shaped payload and model_dump of the
+result. For each *Create model with a persisted counterpart: the legacy route
+path (payload.dict() -> Model(**d) -> .dict()) against documents.build_document.
+
+Run from the backend directory:
+    python -m benchmarks.bench_models
+"""
+import inspect
+import time
+from typing import Any, Dict
+
+from pydantic import BaseModel
+
+import models
+from documents import build_document, dump_many
+
+ITERATIONS = 5_000
+ROUNDS = 5
+
+NOW = "2025-06-01T10:30:00"
+
+OWNER = {"name": "Ramesh Kumar", "phone": "9876543210", "email": "ramesh@example.com"}
+PAYMENT = {"date": NOW, "amount": "₹5 Lakh", "type": "Booking", "status": "Paid"}
+BUYER = {"name": "Priya Sharma", "phone": "9123456780", "govt_id": "ABCDE1234F", "broker": "broker@example.com"}
+PLOT = {
+    "plot_number": "A-12", "size": "1200 sq ft", "price": "₹36 Lakh", "facing": "East",
+    "status": "Sold", "is_corner": True, "buyer": BUYER, "payments": [PAYMENT, PAYMENT],
+}
+USER_RESPONSE = {
+    "id": "user-1", "email": "broker@example.com", "full_name": "Anil Mehta",
+    "phone": "9876543210", "role": "broker", "is_active": True, "created_at": NOW,
+}
+
+# JSON-shaped payloads as they arrive in request bodies (or come back from Mongo)
+CREATE_SAMPLES: Dict[str, Dict[str, Any]] = {
+    "UserCreate": {
+        "email": "broker@example.com", "password": "secret123", "confirm_password": "secret123",
+        "full_name": "Anil Mehta", "phone": "9876543210", "role": "broker",
+    },
+    "PropertyCreate": {
+        "title": "3BHK Villa near Whitefield", "type": "Villa", "status": "For Sale",
+        "price": "₹1.2 Cr", "size": "2400 sq ft", "facing": "East", "address": "12 Main Road",
+        "area": "Whitefield", "bedrooms": 3, "bathrooms": 3, "is_hot": True, "owner": OWNER,
+        "next_follow_up": NOW, "brokerage_amount": "₹2 Lakh",
+    },
+    "CustomerCreate": {
+        "name": "Suresh Iyer", "phone": "9988776655", "email": "suresh@example.com",
+        "budget": "₹80 Lakh", "interest": "2BHK Apartment", "follow_up_date": NOW,
+    },
+    "DealCreate": {
+        "property_id": "property-1", "customer_id": "customer-1", "property_title": "3BHK Villa",
+        "customer_name": "Suresh Iyer", "status": "Visit Done", "deal_value": "₹1.2 Cr",
+        "brokerage_amount": "₹2 Lakh",
+    },
+    "ProjectCreate": {
+        "name": "Green Meadows", "area": "Sarjapur Road", "total_plots": 120, "available_plots": 120,
+        "price_range": "₹30-60 Lakh", "layout_approval": "BMRDA", "completion_date": NOW,
+    },
+    "BuilderCustomerCreate": {
+        "name": "Kavya Reddy", "phone": "9090909090", "budget": "₹45 Lakh", "interest": "Corner plot",
+        "status": "Visit", "project": "Green Meadows", "plot_number": "A-12",
+    },
+    "TeamMemberCreate": {
+        "name": "Vikram Singh", "email": "vikram@example.com", "role": "Sales", "phone": "9000000001",
+        "permissions": ["projects", "customers"],
+    },
+    "FinancialRecordCreate": {
+        "month": "June", "year": 2025, "revenue": 2500000.0, "expenses": 900000.0, "category": "sales",
+    },
+    "NotificationCreate": {
+        "title": "Payment due", "message": "Installment for plot A-12 is due", "type": "payment",
+        "related_id": "project-1",
+    },
+    "EventCreate": {
+        "title": "Site visit", "type": "visit", "date": NOW, "time": "10:30 AM", "end_time": "11:30 AM",
+        "customer": "Suresh Iyer", "phone": "9988776655", "location": "Whitefield",
+        "recurrence": {"frequency": "weekly", "interval": 1, "count": 4},
+    },
+}
+
+# Fields the routes add on top of the create payload
+PERSISTED = {
+    "UserCreate": ("User", {"password": "$2b$12$hash"}, {"password", "confirm_password"}),
+    "PropertyCreate": ("Property", {"user_id": "user-1"}, None),
+    "CustomerCreate": ("Customer", {"user_id": "user-1"}, None),
+    "DealCreate": ("Deal", {"user_id": "user-1", "start_date": NOW}, None),
+    "ProjectCreate": ("Project", {"user_id": "user-1"}, None),
+    "BuilderCustomerCreate": ("BuilderCustomer", {"user_id": "user-1"}, None),
+    "TeamMemberCreate": ("TeamMember", {"user_id": "user-1", "join_date": NOW}, None),
+    "FinancialRecordCreate": ("FinancialRecord", {"user_id": "user-1", "profit": 1600000.0}, None),
+    "NotificationCreate": ("Notification", {"user_id": "user-1"}, None),
+    "EventCreate": ("Event", {"user_id": "user-1"}, None),
+}
+
+OTHER_SAMPLES: Dict[str, Dict[str, Any]] = {
+    "UserLogin": {"email": "broker@example.com", "password": "secret123"},
+    "UserResponse": USER_RESPONSE,
+    "PropertyOwner": OWNER,
+    "Payment": PAYMENT,
+    "PlotBuyer": BUYER,
+    "Plot": PLOT,
+    "NotificationBroadcast": {
+        "title": "Site closed", "message": "Site office closed on Sunday", "type": "meeting",
+        "audiences": ["team", "brokers"], "project_id": "project-1",
+    },
+    "RecurrenceRule": {"frequency": "monthly", "interval": 2, "until": NOW},
+    "BrokerageAnalytics": {
+        "user_id": "user-1", "month": "2025-06", "amount": 200000.0, "deals_count": 3, "properties_count": 12,
+    },
+    "MessageResponse": {"message": "Property deleted successfully"},
+    "TokenResponse": {"access_token": "token", "user": USER_RESPONSE},
+    "BrokerStats": {
+        "total_properties": 40, "total_customers": 95, "active_deals": 7,
+        "monthly_brokerage": "₹4.5 Lakh", "total_brokerage": "₹38 Lakh",
+    },
+    "BuilderStats": {
+        "total_projects": 4, "total_plots": 480, "sold_plots": 212,
+        "monthly_revenue": "₹1.1 Cr", "total_revenue": "₹24 Cr",
+    },
+}
+
+def persisted_samples() -> Dict[str, Dict[str, Any]]:
+    """Stored documents built from the create samples, as they come back from Mongo."""
+    samples = {}
+    for create_name, (model_name, fields, exclude) in PERSISTED.items():
+        payload = getattr(models, create_name).model_validate(CREATE_SAMPLES[create_name])
+        samples[model_name] = build_document(getattr(models, model_name), payload, exclude=exclude, **fields)
+    samples["Project"]["plots"] = [PLOT] * 20
+    return samples
+
+def model_classes():
+    return [
+        cls for _, cls in inspect.getmembers(models, inspect.isclass)
+        if issubclass(cls, BaseModel) and cls.__module__ == models.__name__ and cls is not models.BaseDocument
+    ]
+
+def best_of(func) -> float:
+    """Best per-call time over ROUNDS runs of ITERATIONS calls, in microseconds."""
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) / ITERATIONS * 1e6
+
+def bench_models(samples: Dict[str, Dict[str, Any]]):
+    missing = [cls.__name__ for cls in model_classes() if cls.__name__ not in samples]
+    if missing:
+        raise SystemExit(f"No benchmark sample for: {', '.join(missing)}")
+
+    print(f"{'model':<24} {'validate':>10} {'dump':>10}   (us/call, best of {ROUNDS})")
+    for cls in model_classes():
+        sample = samples[cls.__name__]
+        instance = cls.model_validate(sample)
+        validate = best_of(lambda: cls.model_validate(sample))
+        dump = best_of(instance.model_dump)
+        print(f"{cls.__name__:<24} {validate:10.2f} {dump:10.2f}")
+
+def bench_write_path():
+    print(f"\n{'create path':<24} {'legacy':>10} {'document':>10} {'speedup':>8}")
+    for create_name, (model_name, fields, exclude) in PERSISTED.items():
+        create_cls, model_cls = getattr(models, create_name), getattr(models, model_name)
+        payload = create_cls.model_validate(CREATE_SAMPLES[create_name])
+
+        def legacy():
+            data = payload.dict(exclude=exclude)
+            data.update(fields)
+            return model_cls(**data).dict()
+
+        legacy_us = best_of(legacy)
+        document_us = best_of(lambda: build_document(model_cls, payload, exclude=exclude, **fields))
+        print(f"{model_name:<24} {legacy_us:10.2f} {document_us:10.2f} {legacy_us / document_us:7.1f}x")
+
+    plots = [models.Plot.model_validate(PLOT)] * 100
+    legacy_us = best_of(lambda: [plot.dict() for plot in plots])
+    adapter_us = best_of(lambda: dump_many(models.Plot, plots))
+    print(f"{'Plot x100 (bulk)':<24} {legacy_us:10.2f} {adapter_us:10.2f} {legacy_us / adapter_us:7.1f}x")
+
+def main():
+    samples = {**CREATE_SAMPLES, **OTHER_SAMPLES, **persisted_samples()}
+    bench_models(samples)
+    bench_write_path()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Build time and query latency of the global search index on a large tenant.
+
+Indexes a synthetic broker with --documents entities split across properties,
+customers, deals and events (generated by benchmarks.datagen) and times a mix
+of name, phone, area and prefix queries against search.TenantIndex directly,
+without the generations round trip the endpoint adds.
+
+It then loads the same documents into the embedded engine and times how a
+worker's SearchIndexCache catches up after writes made by another worker:
+replaying the changed entities from the generation change log, against
+reloading the collection when the writes name no entities.
+
+Run from the backend directory:
+    python -m benchmarks.bench_search
+    python -m benchmarks.bench_search --documents 50000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime
+
+from benchmarks.datagen import make_customer, make_deal, make_event, make_property
+import database
+from conditional import bump_generation
+from search import SearchIndexCache, TenantIndex, query_terms
+from storage import MemoryClient
+
+DOCUMENTS = 200_000
+QUERY_ROUNDS = 200
+USER_ID = "broker-bench"
+# Writes by another worker between two searches in this one
+CATCH_UP_WRITES = (1, 10, 64)
+
+def build(documents: int, rng: random.Random):
+    now = datetime.utcnow()
+    quarter = documents // 4
+    properties = [make_property(rng, now, USER_ID, i) for i in range(quarter)]
+    customers = [make_customer(rng, now, USER_ID, i) for i in range(quarter)]
+    deals = [make_deal(rng, now, USER_ID, rng.choice(properties), rng.choice(customers)) for _ in range(quarter)]
+    events = [make_event(rng, now, USER_ID) for _ in range(documents - 3 * quarter)]
+
+    index = TenantIndex()
+    start = time.perf_counter()
+    for collection, docs in (("properties", properties), ("customers", customers), ("deals", deals), ("events", events)):
+        index.replace_collection(collection, docs, generation=0)
+    print(f"indexed {len(index)} documents, {len(index.vocabulary)} tokens in {time.perf_counter() - start:.2f}s")
+    return index, customers, properties, deals, events
+
+async def catch_up(collections, rng: random.Random):
+    client = MemoryClient()
+    database._connection = database.Connection(client, client["bench"])
+    db = database.get_db()
+    for collection, docs in collections.items():
+        await db[collection].insert_many([dict(doc) for doc in docs])
+        await bump_generation(USER_ID, collection)
+    cache = SearchIndexCache()
+    start = time.perf_counter()
+    await cache.get(USER_ID)
+    print(f"cache build from the database: {time.perf_counter() - start:.2f}s")
+
+    customers = collections["customers"]
+    print(f"{'writes':>6} {'replay ms':>10} {'reload ms':>10}")
+    for writes in CATCH_UP_WRITES:
+        timings = []
+        for with_ids in (True, False):
+            changed = [rng.choice(customers)["id"] for _ in range(writes)]
+            for i, customer_id in enumerate(changed):
+                await db.customers.update_one({"id": customer_id}, {"$set": {"name": f"Renamed Customer {i}"}})
+                await bump_generation(USER_ID, "customers", [customer_id] if with_ids else None)
+            start = time.perf_counter()
+            await cache.get(USER_ID)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{writes:>6} {timings[0]:10.2f} {timings[1]:10.2f}")
+    database._connection = None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=DOCUMENTS)
+    parser.add_argument("--rounds", type=int, default=QUERY_ROUNDS)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    index, customers, properties, deals, events = build(args.documents, rng)
+    queries = {
+        "full name": lambda: rng.choice(customers)["name"],
+        "phone": lambda: rng.choice(customers)["phone"],
+        "phone prefix": lambda: rng.choice(customers)["phone"][4:9],
+        "area": lambda: rng.choice(properties)["area"],
+        "name prefix": lambda: rng.choice(customers)["name"].split()[0][:3],
+        "title + area": lambda: f"{rng.choice(properties)['title'].split()[0]} {rng.choice(properties)['area']}",
+    }
+    collections = ["properties", "customers", "deals", "events"]
+
+    print(f"{'query':<14} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'hits':>6}")
+    for name, make_query in queries.items():
+        timings = []
+        hits = 0
+        for _ in range(args.rounds):
+            terms = query_terms(make_query())
+            start = time.perf_counter()
+            hits += len(index.search(terms, collections, 20))
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print(f"{name:<14} {statistics.median(timings):8.3f} {timings[int(len(timings) * 0.95) - 1]:8.3f} "
+              f"{timings[-1]:8.3f} {hits / args.rounds:6.1f}")
+
+    doc = dict(rng.choice(customers), name="Benchmark Renamed Customer")
+    start = time.perf_counter()
+    for _ in range(1_000):
+        index.upsert("customers", doc)
+    print(f"incremental upsert: {(time.perf_counter() - start):.3f} ms per write")
+
+    asyncio.run(catch_up(
+        {"properties": properties, "customers": customers, "deals": deals, "events": events}, rng
+    ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Per-document cost of the list response path on 10k-document lists.
+
+Compares the legacy path (serialize_docs + response_model=List[dict] validation +
+jsonable_encoder + stdlib json) with FastJSONResponse on documents read with an
+``{"_id": 0}`` projection.
+
+Run from the backend directory:
+    python -m benchmarks.bench_serialization
+"""
+import copy
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from utils import FastJSONResponse, serialize_docs
+
+DOCUMENT_COUNT = 10_000
+ROUNDS = 5
+
+AREAS = ["Whitefield", "Indiranagar", "Koramangala", "HSR Layout", "Sarjapur Road", "Hebbal"]
+FACINGS = ["East", "West", "North", "South", "North-East"]
+
+def make_property(index: int, with_object_id: bool) -> dict:
+    """A property document shaped like the ones the properties router stores."""
+    created_at = datetime(2025, 1, 1) + timedelta(minutes=index)
+    doc = {
+        "id": str(uuid.uuid4()),
+        "created_at": created_at,
+        "updated_at": created_at + timedelta(days=3),
+        "user_id": "broker-1",
+        "title": f"{random.choice(['Luxury', 'Spacious', 'Corner'])} Villa {index}",
+        "type": random.choice(["Villa", "Apartment", "Plot", "House"]),
+        "status": random.choice(["For Sale", "For Rent"]),
+        "price": f"₹{random.randint(40, 400) / 100:.2f} Cr",
+        "size": f"{random.randint(800, 4000)} sq ft",
+        "facing": random.choice(FACINGS),
+        "address": f"{index} Main Road",
+        "area": random.choice(AREAS),
+        "bedrooms": random.randint(1, 5),
+        "bathrooms": random.randint(1, 4),
+        "is_hot": index % 7 == 0,
+        "has_garden": index % 3 == 0,
+        "is_corner": index % 5 == 0,
+        "vastu_compliant": index % 2 == 0,
+        "owner": {"name": f"Owner {index}", "phone": "9876543210", "email": None},
+        "images": [],
+        "next_follow_up": created_at + timedelta(days=10),
+        "deal_status": "Interested",
+        "brokerage_amount": "₹2 Lakh",
+    }
+    if with_object_id:
+        doc["_id"] = ObjectId()
+    return doc
+
+# FastAPI builds this once per route
+LIST_OF_DICTS = TypeAdapter(List[dict])
+
+def legacy_path(docs: List[dict]) -> bytes:
+    """serialize_docs, then what FastAPI does for response_model=List[dict] and JSONResponse."""
+    content = serialize_docs(docs)
+    content = LIST_OF_DICTS.validate_python(content)
+    content = jsonable_encoder(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def fast_path(docs: List[dict]) -> bytes:
+    return FastJSONResponse(docs).body
+
+def measure(name: str, func, make_input) -> float:
+    timings = []
+    for _ in range(ROUNDS):
+        docs = make_input()
+        start = time.perf_counter()
+        func(docs)
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    per_doc_us = best / DOCUMENT_COUNT * 1e6
+    print(f"{name:<10} {best * 1000:9.1f} ms/list  {per_doc_us:7.2f} us/doc")
+    return per_doc_us
+
+def main():
+    random.seed(42)
+    with_ids = [make_property(i, with_object_id=True) for i in range(DOCUMENT_COUNT)]
+    projected = [make_property(i, with_object_id=False) for i in range(DOCUMENT_COUNT)]
+
+    print(f"Serializing {DOCUMENT_COUNT} property documents, best of {ROUNDS}")
+    # The legacy path mutates its input, so every round gets a fresh copy
+    legacy = measure("legacy", legacy_path, lambda: copy.deepcopy(with_ids))
+    fast = measure("fast", fast_path, lambda: projected)
+    print(f"speedup    {legacy / fast:9.1f}x")
+
+if __name__ == "__main__":
+    main()
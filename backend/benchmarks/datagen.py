@@ -0,0 +1,420 @@
+"""Seed a MongoDB database with synthetic Indian real-estate tenants for load testing.
+
+Default scale per broker: 50k properties, 100k customers, 5k deals, 2k events.
+Default scale per builder: 100 projects x 2k plots with payments, team and financial records.
+Prices use the formats the app stores (``₹1.25 Cr``, ``₹45 Lakh``, ``₹25,000/month``).
+
+Generation is deterministic for a given --seed. A manifest with login credentials
+and sample ids is written for the load driver (benchmarks.loadtest).
+
+Run from the backend directory against a throwaway database:
+    python -m benchmarks.datagen --mongo-url mongodb://localhost:27017 --db-name loadtest
+
+or into a snapshot for the embedded engine (STORAGE_BACKEND=memory):
+    python -m benchmarks.datagen --snapshot loadtest.bson --db-name loadtest
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import models
+from auth import get_password_hash
+from storage import MemoryClient
+from utils import compute_event_timestamp, fiscal_period
+
+INSERT_BATCH_SIZE = 5_000
+LOADTEST_PASSWORD = "LoadTest@123"
+# Ids per kind kept in the manifest for detail/mutation requests
+SAMPLE_IDS = 200
+
+AREAS = [
+    "Whitefield", "Indiranagar", "Koramangala", "HSR Layout", "Sarjapur Road", "Hebbal",
+    "Electronic City", "Bannerghatta Road", "Yelahanka", "JP Nagar", "Marathahalli", "Jayanagar",
+    "Andheri West", "Powai", "Thane West", "Baner", "Hinjewadi", "Gachibowli", "Kondapur", "Noida Sector 150",
+]
+FACINGS = ["East", "West", "North", "South", "North-East", "North-West", "South-East", "South-West"]
+FIRST_NAMES = [
+    "Aarav", "Vivaan", "Aditya", "Arjun", "Sai", "Reyansh", "Krishna", "Ishaan", "Rohan", "Karthik",
+    "Ananya", "Diya", "Priya", "Kavya", "Sneha", "Pooja", "Lakshmi", "Meera", "Neha", "Riya",
+]
+LAST_NAMES = [
+    "Sharma", "Verma", "Iyer", "Reddy", "Nair", "Patel", "Mehta", "Gupta", "Rao", "Kulkarni",
+    "Joshi", "Menon", "Singh", "Das", "Chatterjee", "Pillai", "Agarwal", "Desai", "Naidu", "Kumar",
+]
+PROPERTY_ADJECTIVES = ["Spacious", "Luxury", "Premium", "Cozy", "Modern", "Corner", "Garden-facing", "Vastu"]
+INTERESTS = ["2BHK Apartment", "3BHK Apartment", "Independent Villa", "Corner Plot", "Commercial Space", "Row House"]
+EVENT_TYPES = ["visit", "call", "meeting", "documentation", "registry"]
+LAYOUT_APPROVALS = ["BMRDA", "BBMP", "DTCP", "HMDA", "RERA Approved", "BDA"]
+FINANCE_CATEGORIES = ["sales", "marketing", "operations", "construction", "legal"]
+CLOSED_DEAL_STATUSES = {"Finalized", "Registry", "Brokerage Received"}
+
+@dataclass
+class Scale:
+    brokers: int = 1
+    properties: int = 50_000
+    customers: int = 100_000
+    deals: int = 5_000
+    events: int = 2_000
+    builders: int = 1
+    projects: int = 100
+    plots: int = 2_000
+    team_members: int = 25
+    financial_records: int = 120
+    notifications: int = 1_000
+
+def rupees(amount: float) -> str:
+    """Indian price format as entered in the app: ₹1.25 Cr, ₹45 Lakh, ₹85,000."""
+    if amount >= 1_00_00_000:
+        return f"₹{amount / 1_00_00_000:.2f}".rstrip("0").rstrip(".") + " Cr"
+    if amount >= 1_00_000:
+        return f"₹{amount / 1_00_000:.2f}".rstrip("0").rstrip(".") + " Lakh"
+    return f"₹{amount:,.0f}"
+
+def budget_range(rng: random.Random) -> str:
+    low = rng.choice([20, 30, 45, 60, 80, 100, 150, 200, 300])
+    high = int(low * rng.choice([1.25, 1.5, 2]))
+    if low >= 100:
+        return f"₹{low / 100:g}-{high / 100:g} Cr"
+    return f"₹{low}-{high} Lakh"
+
+def person(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+def phone(rng: random.Random) -> str:
+    return f"+91 {rng.randint(6, 9)}{rng.randint(1000, 9999)} {rng.randint(10000, 99999)}"
+
+def timestamps(rng: random.Random, now: datetime) -> Dict[str, Any]:
+    created_at = now - timedelta(days=rng.uniform(0, 720))
+    updated_at = created_at + timedelta(days=rng.uniform(0, 30))
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "created_at": created_at.replace(microsecond=created_at.microsecond // 1000 * 1000),
+        "updated_at": min(updated_at, now).replace(microsecond=0),
+    }
+
+def make_property(rng: random.Random, now: datetime, user_id: str, index: int) -> Dict[str, Any]:
+    property_type = rng.choice(["Villa", "Apartment", "Plot", "House"])
+    for_rent = property_type != "Plot" and rng.random() < 0.25
+    price = rng.randint(15_000, 1_50_000) if for_rent else rng.randint(25, 1_200) * 1_00_000
+    bedrooms = 0 if property_type == "Plot" else rng.randint(1, 5)
+    return {
+        **timestamps(rng, now),
+        "user_id": user_id,
+        "title": f"{rng.choice(PROPERTY_ADJECTIVES)} {bedrooms or ''}{'BHK ' if bedrooms else ''}{property_type} #{index}",
+        "type": property_type,
+        "status": "For Rent" if for_rent else "For Sale",
+        "price": f"{rupees(price)}/month" if for_rent else rupees(price),
+        "size": f"{rng.randint(6, 60) * 100} sq ft",
+        "facing": rng.choice(FACINGS),
+        "address": f"{rng.randint(1, 999)}, {rng.randint(1, 40)}th Cross, {rng.choice(AREAS)}",
+        "area": rng.choice(AREAS),
+        "bedrooms": bedrooms,
+        "bathrooms": max(bedrooms - rng.randint(0, 1), 0),
+        "is_hot": rng.random() < 0.1,
+        "has_garden": rng.random() < 0.3,
+        "is_corner": rng.random() < 0.15,
+        "vastu_compliant": rng.random() < 0.5,
+        "owner": {"name": person(rng), "phone": phone(rng), "email": None},
+        "images": [],
+        "next_follow_up": now + timedelta(days=rng.randint(-10, 60)) if rng.random() < 0.3 else None,
+        "deal_status": rng.choice([s.value for s in models.DealStatus]),
+        "brokerage_amount": rupees(price * 0.02) if not for_rent else rupees(price),
+    }
+
+def make_customer(rng: random.Random, now: datetime, user_id: str, index: int) -> Dict[str, Any]:
+    name = person(rng)
+    return {
+        **timestamps(rng, now),
+        "user_id": user_id,
+        "name": name,
+        "phone": phone(rng),
+        "email": f"{name.lower().replace(' ', '.')}{index}@example.in" if rng.random() < 0.7 else None,
+        "budget": budget_range(rng),
+        "interest": rng.choice(INTERESTS),
+        "status": rng.choice([s.value for s in models.CustomerStatus]),
+        "is_important": rng.random() < 0.1,
+        "follow_up_date": now + timedelta(days=rng.randint(-5, 30)) if rng.random() < 0.4 else None,
+        "notes": None,
+    }
+
+def make_deal(rng: random.Random, now: datetime, user_id: str, property_doc, customer_doc) -> Dict[str, Any]:
+    status = rng.choice([s.value for s in models.DealStatus])
+    start_date = now - timedelta(days=rng.uniform(0, 365))
+    return {
+        **timestamps(rng, now),
+        "user_id": user_id,
+        "property_id": property_doc["id"],
+        "customer_id": customer_doc["id"],
+        "property_title": property_doc["title"],
+        "customer_name": customer_doc["name"],
+        "status": status,
+        "deal_value": property_doc["price"],
+        "brokerage_amount": f"₹{rng.randint(1, 40) / 2:g} Lakh",
+        "start_date": start_date,
+        "close_date": start_date + timedelta(days=rng.randint(5, 90)) if status in CLOSED_DEAL_STATUSES else None,
+        "notes": None,
+    }
+
+def make_event(rng: random.Random, now: datetime, user_id: str) -> Dict[str, Any]:
+    day = (now + timedelta(days=rng.randint(-60, 60))).replace(hour=0, minute=0, second=0, microsecond=0)
+    time_text = f"{rng.randint(9, 18):02d}:{rng.choice(['00', '30'])}"
+    return {
+        **timestamps(rng, now),
+        "user_id": user_id,
+        "title": f"{rng.choice(EVENT_TYPES).title()} with {person(rng)}",
+        "type": rng.choice(EVENT_TYPES),
+        "date": day,
+        "time": time_text,
+        "end_time": None,
+        "starts_at": compute_event_timestamp(day, time_text),
+        "ends_at": None,
+        "customer": person(rng),
+        "phone": phone(rng),
+        "location": rng.choice(AREAS),
+        "notes": None,
+        "status": rng.choice(["scheduled", "scheduled", "completed", "cancelled"]),
+        "recurrence": None,
+    }
+
+def make_plot(rng: random.Random, now: datetime, number: str) -> Dict[str, Any]:
+    status = rng.choices(["Available", "Reserved", "Sold"], weights=[5, 1, 4])[0]
+    price = rng.randint(18, 150) * 1_00_000
+    plot = {
+        "plot_number": number,
+        "size": f"{rng.choice([600, 1200, 1500, 2400, 4000])} sq ft",
+        "price": rupees(price),
+        "facing": rng.choice(FACINGS),
+        "status": status,
+        "has_garden": rng.random() < 0.2,
+        "is_corner": rng.random() < 0.1,
+        "is_hot": rng.random() < 0.05,
+        "buyer": None,
+        "payments": [],
+    }
+    if status != "Available":
+        plot["buyer"] = {
+            "name": person(rng),
+            "phone": phone(rng),
+            "govt_id": f"{''.join(rng.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ', k=5))}{rng.randint(1000, 9999)}F",
+            "broker": None,
+        }
+        paid = 0
+        for installment in range(rng.randint(1, 6)):
+            amount = price * rng.choice([0.05, 0.1, 0.2])
+            paid += amount
+            plot["payments"].append({
+                "date": now - timedelta(days=rng.randint(0, 540)),
+                "amount": rupees(amount),
+                "type": "Booking" if installment == 0 else rng.choice(["Installment", "Token", "Registration"]),
+                "status": rng.choices(["Paid", "Pending", "Overdue"], weights=[7, 2, 1])[0],
+            })
+    return plot
+
+def make_project(rng: random.Random, now: datetime, user_id: str, index: int, plot_count: int) -> Dict[str, Any]:
+    plots = [make_plot(rng, now, f"{chr(65 + i // 500)}-{i % 500 + 1}") for i in range(plot_count)]
+    sold = sum(1 for plot in plots if plot["status"] == "Sold")
+    reserved = sum(1 for plot in plots if plot["status"] == "Reserved")
+    low = rng.randint(18, 60)
+    return {
+        **timestamps(rng, now),
+        "user_id": user_id,
+        "name": f"{rng.choice(['Green', 'Royal', 'Silver', 'Prestige', 'Sunrise', 'Lake'])} "
+                f"{rng.choice(['Meadows', 'Enclave', 'Gardens', 'Residency', 'County'])} Phase {index}",
+        "area": rng.choice(AREAS),
+        "total_plots": plot_count,
+        "sold_plots": sold,
+        "available_plots": plot_count - sold - reserved,
+        "reserved_plots": reserved,
+        "price_range": f"₹{low}L - ₹{low * 2}L",
+        "layout_approval": rng.choice(LAYOUT_APPROVALS),
+        "completion_date": now + timedelta(days=rng.randint(90, 1000)),
+        "plots": plots,
+    }
+
+def make_financial_record(rng: random.Random, now: datetime, user_id: str, index: int) -> Dict[str, Any]:
+    revenue = float(rng.randint(10, 500) * 1_00_000)
+    expenses = float(revenue * rng.uniform(0.3, 0.9))
+    month, year = index % 12 + 1, now.year - index // 12
+    fiscal_year, fiscal_quarter = fiscal_period(year, month)
+    return {
+        **timestamps(rng, now),
+        "user_id": user_id,
+        "month": month,
+        "year": year,
+        "fiscal_year": fiscal_year,
+        "fiscal_quarter": fiscal_quarter,
+        "revenue": revenue,
+        "expenses": expenses,
+        "profit": revenue - expenses,
+        "category": rng.choice(FINANCE_CATEGORIES),
+    }
+
+def make_notification(rng: random.Random, now: datetime, user_id: str) -> Dict[str, Any]:
+    notification_type = rng.choice([t.value for t in models.NotificationType])
+    is_read = rng.random() < 0.6
+    return {
+        **timestamps(rng, now),
+        "user_id": user_id,
+        "title": f"{notification_type.title()} update",
+        "message": f"{person(rng)} - {rng.choice(AREAS)}",
+        "type": notification_type,
+        "is_read": is_read,
+        "read_at": now if is_read else None,
+        "related_id": None,
+    }
+
+# Fail fast if the generators drift from the models the routers persist
+SHAPE_CHECKS = {
+    "properties": models.Property,
+    "customers": models.Customer,
+    "deals": models.Deal,
+    "events": models.Event,
+    "projects": models.Project,
+    "financial_records": models.FinancialRecord,
+    "notifications": models.Notification,
+}
+
+async def insert_stream(db, collection: str, docs: Iterator[Dict[str, Any]], keep: Callable = None) -> int:
+    """Insert generated documents in batches, validating the first against its model."""
+    inserted = 0
+    batch: List[Dict[str, Any]] = []
+    for doc in docs:
+        if inserted == 0 and not batch and collection in SHAPE_CHECKS:
+            SHAPE_CHECKS[collection].model_validate(doc)
+        if keep is not None:
+            keep(doc)
+        batch.append(doc)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            await db[collection].insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        await db[collection].insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+def sampler(target: List[Any], limit: int = SAMPLE_IDS, field: str = "id") -> Callable:
+    def keep(doc):
+        if len(target) < limit:
+            target.append(doc[field])
+    return keep
+
+async def seed(db, scale: Scale, seed_value: int = 42) -> Dict[str, Any]:
+    """Generate every tenant into db and return the manifest."""
+    rng = random.Random(seed_value)
+    now = datetime.utcnow().replace(microsecond=0)
+    password_hash = get_password_hash(LOADTEST_PASSWORD)
+    manifest: Dict[str, Any] = {"password": LOADTEST_PASSWORD, "scale": asdict(scale), "seed": seed_value,
+                                "brokers": [], "builders": [], "areas": AREAS}
+    counts: Dict[str, int] = {}
+
+    def add(collection: str, count: int):
+        counts[collection] = counts.get(collection, 0) + count
+
+    for role, tenant_count in (("broker", scale.brokers), ("builder", scale.builders)):
+        for tenant in range(tenant_count):
+            user = {
+                **timestamps(rng, now),
+                "email": f"{role}{tenant + 1}@loadtest.example.com",
+                "password": password_hash,
+                "full_name": person(rng),
+                "phone": phone(rng),
+                "role": role,
+                "is_active": True,
+            }
+            models.User.model_validate(user)
+            await db.users.insert_one(user)
+            add("users", 1)
+            user_id = user["id"]
+            entry = {"email": user["email"], "user_id": user_id}
+
+            if role == "broker":
+                entry["property_ids"], entry["customer_ids"], entry["deal_ids"], entry["event_ids"] = [], [], [], []
+                # Deals reference a sample of real properties and customers
+                property_refs: List[Dict[str, Any]] = []
+                customer_refs: List[Dict[str, Any]] = []
+
+                def keep_property(doc):
+                    sampler(entry["property_ids"])(doc)
+                    if len(property_refs) < 1000:
+                        property_refs.append(doc)
+
+                def keep_customer(doc):
+                    sampler(entry["customer_ids"])(doc)
+                    if len(customer_refs) < 1000:
+                        customer_refs.append(doc)
+
+                add("properties", await insert_stream(db, "properties", (
+                    make_property(rng, now, user_id, i) for i in range(scale.properties)), keep_property))
+                add("customers", await insert_stream(db, "customers", (
+                    make_customer(rng, now, user_id, i) for i in range(scale.customers)), keep_customer))
+                if property_refs and customer_refs:
+                    add("deals", await insert_stream(db, "deals", (
+                        make_deal(rng, now, user_id, rng.choice(property_refs), rng.choice(customer_refs))
+                        for _ in range(scale.deals)), sampler(entry["deal_ids"])))
+                add("events", await insert_stream(db, "events", (
+                    make_event(rng, now, user_id) for _ in range(scale.events)), sampler(entry["event_ids"])))
+            else:
+                entry["project_ids"], entry["plot_numbers"] = [], []
+                add("projects", await insert_stream(db, "projects", (
+                    make_project(rng, now, user_id, i + 1, scale.plots) for i in range(scale.projects)),
+                    sampler(entry["project_ids"])))
+                entry["plot_numbers"] = [f"A-{i + 1}" for i in range(min(scale.plots, 20))]
+                add("team_members", await insert_stream(db, "team_members", (
+                    {**timestamps(rng, now), "user_id": user_id, "name": person(rng),
+                     "email": f"team{i}.{tenant}@loadtest.example.com", "role": rng.choice(["Sales", "Site Engineer", "Accounts"]),
+                     "phone": phone(rng), "join_date": now - timedelta(days=rng.randint(0, 900)), "permissions": []}
+                    for i in range(scale.team_members))))
+                add("financial_records", await insert_stream(db, "financial_records", (
+                    make_financial_record(rng, now, user_id, i) for i in range(scale.financial_records))))
+
+            add("notifications", await insert_stream(db, "notifications", (
+                make_notification(rng, now, user_id) for _ in range(scale.notifications))))
+            manifest[f"{role}s"].append(entry)
+
+    manifest["counts"] = counts
+    return manifest
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="loadtest")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--manifest", default="loadtest_manifest.json")
+    parser.add_argument("--drop", action="store_true", help="Drop the database first")
+    parser.add_argument("--snapshot", help="Seed the embedded engine and write its snapshot here instead of MongoDB")
+    for field, default in asdict(Scale()).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=int, default=default)
+    return parser.parse_args()
+
+async def main():
+    args = parse_args()
+    scale = Scale(**{field: getattr(args, field) for field in asdict(Scale())})
+    client = MemoryClient(args.snapshot) if args.snapshot else AsyncIOMotorClient(args.mongo_url)
+    if args.drop:
+        await client.drop_database(args.db_name)
+    db = client[args.db_name]
+
+    started = time.perf_counter()
+    manifest = await seed(db, scale, args.seed)
+    manifest["db_name"] = args.db_name
+    with open(args.manifest, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(json.dumps({"counts": manifest["counts"], "seconds": round(time.perf_counter() - started, 1)}))
+    if args.snapshot:
+        client.close()
+        print(f"Manifest written to {args.manifest}; start the API with STORAGE_BACKEND=memory "
+              f"STORAGE_SNAPSHOT={args.snapshot} DB_NAME={args.db_name} to load test it")
+    else:
+        print(f"Manifest written to {args.manifest}; start the API with DB_NAME={args.db_name} to load test it")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,247 @@
+"""Async load driver replaying the app's request mix against a running API.
+
+Logs in as the tenants from a benchmarks.datagen manifest and runs a weighted
+mix of dashboard, list, search, detail and mutation requests from concurrent
+virtual users. Per endpoint it reports p50/p95/p99 latency, throughput, errors
+and Mongo commands per request (from X-Mongo-Queries, so start the server with
+MONGO_QUERY_DEBUG=1). Results are written as JSON; --compare prints the change
+against an earlier run.
+
+Run from the backend directory:
+    MONGO_QUERY_DEBUG=1 DB_NAME=loadtest uvicorn server:app --port 8002 &
+    python -m benchmarks.loadtest --base-url http://localhost:8002 --duration 60 --output run.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+# (label, weight, request builder) per role; builders return (method, path, params, json)
+Request = Tuple[str, str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+def _today() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+def _week_ahead() -> str:
+    return (datetime.utcnow() + timedelta(days=7)).strftime("%Y-%m-%d")
+
+def _new_property(rng: random.Random, areas: List[str]) -> Dict[str, Any]:
+    return {
+        "title": f"Load test {rng.randint(1, 3)}BHK Apartment",
+        "type": "Apartment",
+        "status": "For Sale",
+        "price": f"₹{rng.randint(40, 250)} Lakh",
+        "size": f"{rng.randint(8, 30) * 100} sq ft",
+        "facing": "East",
+        "address": f"{rng.randint(1, 500)}, Main Road",
+        "area": rng.choice(areas),
+        "bedrooms": rng.randint(1, 4),
+        "bathrooms": 2,
+        "owner": {"name": "Load Test Owner", "phone": "+91 98450 12345"},
+        "brokerage_amount": "₹1.5 Lakh",
+    }
+
+def broker_mix(tenant: Dict[str, Any], areas: List[str]) -> List[Tuple[str, int, Callable[[random.Random], Request]]]:
+    properties = tenant["property_ids"]
+    customers = tenant["customer_ids"]
+    return [
+        ("GET /dashboard/stats", 10, lambda r: ("GET", "/api/dashboard/stats", None, None)),
+        ("GET /properties", 8, lambda r: ("GET", "/api/properties/", None, None)),
+        ("GET /properties?area", 8, lambda r: ("GET", "/api/properties/", {"area": r.choice(areas)}, None)),
+        ("GET /properties?search", 6, lambda r: ("GET", "/api/properties/", {"search": r.choice(["Villa", "Luxury", "3BHK", "Cross"])}, None)),
+        ("GET /properties/{id}", 12, lambda r: ("GET", f"/api/properties/{r.choice(properties)}", None, None)),
+        ("GET /customers", 6, lambda r: ("GET", "/api/customers/", None, None)),
+        ("GET /customers?search", 6, lambda r: ("GET", "/api/customers/", {"search": r.choice(["Sharma", "Priya", "98450"])}, None)),
+        ("GET /customers/{id}", 8, lambda r: ("GET", f"/api/customers/{r.choice(customers)}", None, None)),
+        ("GET /deals", 5, lambda r: ("GET", "/api/deals/", None, None)),
+        ("GET /deals/analytics/brokerage", 3, lambda r: ("GET", "/api/deals/analytics/brokerage", None, None)),
+        ("GET /events?from&to", 6, lambda r: ("GET", "/api/events/", {"from": _today(), "to": _week_ahead()}, None)),
+        ("GET /events/today/list", 4, lambda r: ("GET", "/api/events/today/list", None, None)),
+        ("GET /notifications/unread/count", 10, lambda r: ("GET", "/api/notifications/unread/count", None, None)),
+        ("POST /properties", 2, lambda r: ("POST", "/api/properties/", None, _new_property(r, areas))),
+        ("PATCH /properties/{id}/hot", 2, lambda r: ("PATCH", f"/api/properties/{r.choice(properties)}/hot", None, None)),
+        ("PATCH /customers/{id}/important", 2, lambda r: ("PATCH", f"/api/customers/{r.choice(customers)}/important", None, None)),
+    ]
+
+def builder_mix(tenant: Dict[str, Any], areas: List[str]) -> List[Tuple[str, int, Callable[[random.Random], Request]]]:
+    projects = tenant["project_ids"]
+    plot_numbers = tenant["plot_numbers"]
+    return [
+        ("GET /dashboard/stats", 10, lambda r: ("GET", "/api/dashboard/stats", None, None)),
+        ("GET /projects", 6, lambda r: ("GET", "/api/projects/", None, None)),
+        ("GET /projects?search", 3, lambda r: ("GET", "/api/projects/", {"search": r.choice(["Green", "Phase 1", "Royal"])}, None)),
+        ("GET /projects/{id}", 8, lambda r: ("GET", f"/api/projects/{r.choice(projects)}", None, None)),
+        ("GET /projects/{id}/plots", 8, lambda r: ("GET", f"/api/projects/{r.choice(projects)}/plots", {"status": "Available"}, None)),
+        ("GET /notifications/unread/count", 10, lambda r: ("GET", "/api/notifications/unread/count", None, None)),
+        ("POST /projects/{id}/plots/{n}/payments", 2, lambda r: (
+            "POST", f"/api/projects/{r.choice(projects)}/plots/{r.choice(plot_numbers)}/payments", None,
+            {"date": datetime.utcnow().isoformat(), "amount": "₹2 Lakh", "type": "Installment", "status": "Paid"})),
+    ]
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.mongo_ops: Dict[str, List[int]] = {}
+
+    def record(self, label: str, seconds: float, ok: bool, mongo_ops: Optional[int]):
+        self.latencies.setdefault(label, []).append(seconds)
+        if not ok:
+            self.errors[label] = self.errors.get(label, 0) + 1
+        if mongo_ops is not None:
+            self.mongo_ops.setdefault(label, []).append(mongo_ops)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints = {}
+        for label, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            ops = self.mongo_ops.get(label)
+            endpoints[label] = {
+                "requests": len(values),
+                "errors": self.errors.get(label, 0),
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+                "mongo_ops_per_request": round(sum(ops) / len(ops), 2) if ops else None,
+            }
+        all_values = sorted(v for values in self.latencies.values() for v in values)
+        total = len(all_values)
+        return {
+            "endpoints": endpoints,
+            "total": {
+                "requests": total,
+                "errors": sum(self.errors.values()),
+                "throughput_rps": round(total / elapsed, 2) if elapsed else 0,
+                "p50_ms": round((percentile(all_values, 0.50) or 0) * 1000, 2),
+                "p95_ms": round((percentile(all_values, 0.95) or 0) * 1000, 2),
+                "p99_ms": round((percentile(all_values, 0.99) or 0) * 1000, 2),
+            },
+        }
+
+async def login(client: httpx.AsyncClient, email: str, password: str) -> Dict[str, str]:
+    response = await client.post("/api/auth/login", json={"email": email, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+async def virtual_user(client, recorder: Recorder, headers, mix, rng: random.Random, deadline: float, budget: List[int]):
+    labels = [entry[0] for entry in mix]
+    weights = [entry[1] for entry in mix]
+    builders = {entry[0]: entry[2] for entry in mix}
+    while time.monotonic() < deadline:
+        if budget[0] <= 0:
+            return
+        budget[0] -= 1
+        label = rng.choices(labels, weights=weights)[0]
+        method, path, params, body = builders[label](rng)
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, path, params=params, json=body, headers=headers)
+            ok = response.status_code < 400
+            ops = response.headers.get("x-mongo-queries")
+            mongo_ops = int(ops) if ops is not None else None
+        except httpx.HTTPError:
+            ok, mongo_ops = False, None
+        recorder.record(label, time.perf_counter() - start, ok, mongo_ops)
+
+async def run_load(
+    client: httpx.AsyncClient,
+    manifest: Dict[str, Any],
+    concurrency: int = 20,
+    duration: float = 60,
+    max_requests: int = 0,
+    seed: int = 7,
+) -> Dict[str, Any]:
+    """Run the mix with `concurrency` virtual users spread over the manifest's tenants."""
+    tenants = []
+    for role, mix_for in (("brokers", broker_mix), ("builders", builder_mix)):
+        for tenant in manifest.get(role, []):
+            headers = await login(client, tenant["email"], manifest["password"])
+            tenants.append((headers, mix_for(tenant, manifest["areas"])))
+    if not tenants:
+        raise SystemExit("Manifest has no tenants")
+
+    recorder = Recorder()
+    budget = [max_requests or 2 ** 62]
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        virtual_user(client, recorder, *tenants[i % len(tenants)], random.Random(seed + i), deadline, budget)
+        for i in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - started
+
+    result = recorder.report(elapsed)
+    result["meta"] = {
+        "run_id": uuid.uuid4().hex[:12],
+        "started_at": datetime.utcnow().isoformat(),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "seed": seed,
+        "scale": manifest.get("scale"),
+        "python": platform.python_version(),
+    }
+    return result
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> str:
+    lines = [f"{'endpoint':<42} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16} {'mongo ops':>12}"]
+
+    def cell(key, now, before):
+        if now.get(key) is None or before.get(key) is None:
+            return f"{now.get(key)!s:>16}"
+        delta = (now[key] - before[key]) / before[key] * 100 if before[key] else 0
+        return f"{now[key]:>8.1f} {delta:+6.1f}%"
+
+    for label, now in current["endpoints"].items():
+        before = baseline["endpoints"].get(label, {})
+        ops = now.get("mongo_ops_per_request")
+        ops_before = before.get("mongo_ops_per_request")
+        ops_cell = f"{ops} ({ops_before})" if ops_before is not None else f"{ops}"
+        lines.append(f"{label:<42} {cell('p50_ms', now, before)} {cell('p95_ms', now, before)} "
+                     f"{cell('p99_ms', now, before)} {ops_cell:>12}")
+    return "\n".join(lines)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8002")
+    parser.add_argument("--manifest", default="loadtest_manifest.json")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0: no limit)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default="loadtest_result.json")
+    parser.add_argument("--compare", help="Earlier result JSON to diff against")
+    return parser.parse_args()
+
+async def main():
+    args = parse_args()
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        result = await run_load(client, manifest, args.concurrency, args.duration, args.requests, args.seed)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(json.dumps(result["total"]))
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(result, json.load(f)))
+
+if __name__ == "__main__":
+    asyncio.run(main())
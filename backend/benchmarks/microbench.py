@@ -0,0 +1,241 @@
+"""Micro-benchmarks for the helpers on the response and dashboard hot paths.
+
+Covers utils.serialize_doc/serialize_docs on nested project documents and 10k
+property lists, format_currency, validate_phone/validate_email and
+brokerage_total, which the dashboard and brokerage analytics routes use to sum
+deal brokerage strings. Results are compared with the baseline stored in
+benchmarks/baselines/microbench.json; the run exits non-zero when any case's
+throughput drops by more than --threshold.
+
+Throughput is gated relative to a fixed pure-Python calibration loop timed in
+the same run, so a baseline recorded on one machine stays usable on another.
+
+Run from the backend directory:
+    python -m benchmarks.microbench                  # compare with the baseline
+    python -m benchmarks.microbench --update         # record a new baseline
+    python -m benchmarks.microbench -k serialize --threshold 0.1
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.bench_serialization import make_property
+from utils import brokerage_total, format_currency, serialize_doc, serialize_docs, validate_email, validate_phone
+
+BASELINE_PATH = Path(__file__).parent / "baselines" / "microbench.json"
+# Allowed drop in relative throughput before a case counts as a regression
+DEFAULT_THRESHOLD = float(os.environ.get("MICROBENCH_THRESHOLD", "0.2"))
+# Each repeat runs a case for at least this long; the best repeat is kept
+MIN_TIME = 0.2
+REPEATS = 5
+
+PROPERTY_COUNT = 10_000
+PLOTS_PER_PROJECT = 2_000
+SAMPLE_SIZE = 1_000
+
+@dataclass
+class Case:
+    name: str
+    run: Callable[[Any], Any]
+    # Builds the input of one call outside the timed region (serialize_doc mutates its input)
+    setup: Callable[[], Any]
+    # Items processed per call, for the per-item timing column
+    items: int = 1
+
+def make_project(plots: int) -> Dict[str, Any]:
+    """A project document with fully sold plots, each carrying a buyer and payment history."""
+    created_at = datetime(2024, 4, 1, 9, 30)
+    rng = random.Random(11)
+    return {
+        "_id": "64b7f0c2e4b0a1a2b3c4d5e6",
+        "id": "project-1",
+        "user_id": "builder-1",
+        "name": "Green Meadows Phase 2",
+        "area": "Sarjapur Road",
+        "total_plots": plots,
+        "sold_plots": plots,
+        "available_plots": 0,
+        "reserved_plots": 0,
+        "price_range": "₹45 Lakh - ₹1.2 Cr",
+        "layout_approval": "BMRDA",
+        "completion_date": created_at + timedelta(days=720),
+        "created_at": created_at,
+        "updated_at": created_at + timedelta(days=30),
+        "plots": [
+            {
+                "plot_number": f"{chr(65 + i // 100)}-{i % 100 + 1}",
+                "size": f"{rng.choice([1200, 1500, 2400])} sq ft",
+                "price": f"₹{rng.randint(45, 120)} Lakh",
+                "facing": rng.choice(["East", "West", "North", "South"]),
+                "status": "Sold",
+                "has_garden": i % 4 == 0,
+                "is_corner": i % 10 == 0,
+                "is_hot": False,
+                "buyer": {"name": f"Buyer {i}", "phone": "9845012345", "govt_id": "ABCDE1234F", "broker": None},
+                "payments": [
+                    {"date": created_at + timedelta(days=30 * n), "amount": "₹5 Lakh", "type": kind, "status": "Paid"}
+                    for n, kind in enumerate(["Token", "Booking", "Installment"])
+                ],
+            }
+            for i in range(plots)
+        ],
+    }
+
+def make_amounts(rng: random.Random) -> List[float]:
+    # Spread over the rupee, lakh and crore branches of format_currency
+    return [rng.choice([rng.uniform(1_000, 99_999), rng.uniform(1e5, 9.9e6), rng.uniform(1e7, 5e8)])
+            for _ in range(SAMPLE_SIZE)]
+
+def make_phones(rng: random.Random) -> List[str]:
+    formats = ["{}", "+91 {}", "91{}", "{} ", "+91-{}"]
+    phones = [rng.choice(formats).format(f"{rng.randint(6, 9)}{rng.randint(0, 999_999_999):09d}")
+              for _ in range(SAMPLE_SIZE)]
+    # Roughly one in ten entered with a landline prefix or a digit missing
+    for i in range(0, SAMPLE_SIZE, 10):
+        phones[i] = f"080{rng.randint(1_000_000, 9_999_999)}"
+    return phones
+
+def make_emails(rng: random.Random) -> List[str]:
+    domains = ["gmail.com", "yahoo.co.in", "realty.in", "outlook.com"]
+    emails = [f"user.{i}+{rng.randint(1, 99)}@{rng.choice(domains)}" for i in range(SAMPLE_SIZE)]
+    for i in range(0, SAMPLE_SIZE, 10):
+        emails[i] = f"user{i}@invalid"
+    return emails
+
+def make_brokerage_deals(rng: random.Random) -> List[Dict[str, Any]]:
+    return [{"brokerage_amount": rng.choice([f"₹{rng.randint(1, 40) / 2:g} Lakh", f"₹{rng.randint(10, 99)},000"])}
+            for _ in range(PROPERTY_COUNT)]
+
+def build_cases() -> List[Case]:
+    rng = random.Random(42)
+    random.seed(42)
+    project = make_project(PLOTS_PER_PROJECT)
+    properties = [make_property(i, with_object_id=True) for i in range(PROPERTY_COUNT)]
+    amounts = make_amounts(rng)
+    phones = make_phones(rng)
+    emails = make_emails(rng)
+    deals = make_brokerage_deals(rng)
+    return [
+        Case("serialize_doc[project_2k_plots]", serialize_doc, lambda: copy.deepcopy(project), items=PLOTS_PER_PROJECT),
+        Case("serialize_docs[properties_10k]", serialize_docs, lambda: copy.deepcopy(properties), items=PROPERTY_COUNT),
+        Case("format_currency", lambda values: [format_currency(v) for v in values], lambda: amounts, items=SAMPLE_SIZE),
+        Case("validate_phone", lambda values: [validate_phone(v) for v in values], lambda: phones, items=SAMPLE_SIZE),
+        Case("validate_email", lambda values: [validate_email(v) for v in values], lambda: emails, items=SAMPLE_SIZE),
+        Case("brokerage_total[10k]", brokerage_total, lambda: deals, items=PROPERTY_COUNT),
+    ]
+
+def calibration_loop(_):
+    # Fixed mix of the interpreter work the cases do: dict writes, string ops, float maths
+    doc = {}
+    for i in range(2_000):
+        doc[str(i)] = f"₹{i * 1.5:.2f}".replace("₹", "")
+    return sum(float(value) for value in doc.values())
+
+def measure(case: Case, min_time: float, repeats: int) -> float:
+    """Best calls per second over `repeats` runs of at least `min_time` seconds each."""
+    best = 0.0
+    for _ in range(repeats):
+        calls = 0
+        elapsed = 0.0
+        while elapsed < min_time:
+            argument = case.setup()
+            start = time.perf_counter()
+            case.run(argument)
+            elapsed += time.perf_counter() - start
+            calls += 1
+        best = max(best, calls / elapsed)
+    return best
+
+def run(cases: List[Case], min_time: float, repeats: int) -> Dict[str, Any]:
+    calibration = measure(Case("calibration", calibration_loop, lambda: None), min_time, repeats)
+    results = {}
+    for case in cases:
+        ops = measure(case, min_time, repeats)
+        results[case.name] = {
+            "ops_per_sec": round(ops, 3),
+            "us_per_item": round(1e6 / ops / case.items, 4),
+            "relative": round(ops / calibration, 6),
+        }
+    return {
+        "meta": {
+            "recorded_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "calibration_ops_per_sec": round(calibration, 3),
+        },
+        "cases": results,
+    }
+
+def find_regressions(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    for name, result in current["cases"].items():
+        before = baseline["cases"].get(name)
+        if before is None:
+            continue
+        change = result["relative"] / before["relative"] - 1
+        if change < -threshold:
+            regressions.append(f"{name}: {change:+.1%} (allowed -{threshold:.0%})")
+    return regressions
+
+def print_results(current: Dict[str, Any], baseline: Optional[Dict[str, Any]]):
+    print(f"{'case':<34} {'ops/s':>12} {'us/item':>10} {'vs baseline':>12}")
+    for name, result in current["cases"].items():
+        before = (baseline or {}).get("cases", {}).get(name)
+        change = f"{result['relative'] / before['relative'] - 1:+.1%}" if before else "new"
+        print(f"{name:<34} {result['ops_per_sec']:12.2f} {result['us_per_item']:10.4f} {change:>12}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed fractional throughput drop, e.g. 0.2 for 20%%")
+    parser.add_argument("-k", dest="keyword", help="Only run cases whose name contains this")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--output", type=Path, help="Also write this run's results here")
+    return parser.parse_args()
+
+def main() -> int:
+    args = parse_args()
+    cases = [case for case in build_cases() if not args.keyword or args.keyword in case.name]
+    current = run(cases, args.min_time, args.repeats)
+
+    baseline = None
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+    print_results(current, baseline)
+
+    if args.output:
+        args.output.write_text(json.dumps(current, indent=2) + "\n")
+    if args.update:
+        if baseline is not None and args.keyword:
+            # A filtered run only replaces the cases it measured
+            current["cases"] = {**baseline["cases"], **current["cases"]}
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(current, indent=2) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update to record one")
+        return 0
+
+    regressions = find_regressions(current, baseline, args.threshold)
+    if regressions:
+        print("\nRegressions:\n  " + "\n  ".join(regressions))
+        return 1
+    print(f"\nNo case regressed by more than {args.threshold:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import Request, Response, status
+from pymongo import ReturnDocument
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Per-user, per-collection write counters that version list responses:
+# {"_id": "<user_id>:<collection>", "generation": int, "updated_at": datetime,
+#  "changes": [{"ids": [entity id, ...] | None}, ...]}
+# changes holds the last CHANGE_LOG_SIZE writes, oldest first, so the last entry
+# is the current generation; ids None marks a write whose entities are unknown.
+GENERATIONS_COLLECTION = "collection_generations"
+CHANGE_LOG_SIZE = 64
+
+# Responses may be stored but must be revalidated on every use
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+def _short_hash(*parts: str) -> str:
+    return hashlib.blake2b("\x1f".join(parts).encode(), digest_size=8).hexdigest()
+
+def _http_date(value: datetime) -> str:
+    return formatdate(value.replace(tzinfo=timezone.utc).timestamp(), usegmt=True)
+
+async def bump_generation(user_id: str, collection: str, entity_ids: Optional[Iterable[str]] = None) -> int:
+    """Record a write to one of a user's collections, invalidating their cached lists.
+
+    entity_ids are the documents the write touched; other workers' caches replay
+    just those (see TenantCache), while a write without them reloads the collection.
+    Returns the new generation so in-process indexes can tell whether this was
+    the only write since they last caught up.
+    """
+    change = {"ids": list(entity_ids) if entity_ids is not None else None}
+    counter = await get_db()[GENERATIONS_COLLECTION].find_one_and_update(
+        {"_id": f"{user_id}:{collection}"},
+        {
+            "$inc": {"generation": 1},
+            "$set": {"updated_at": datetime.utcnow()},
+            "$push": {"changes": {"$each": [change], "$slice": -CHANGE_LOG_SIZE}}
+        },
+        upsert=True,
+        projection={"generation": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["generation"]
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """Evaluate If-None-Match (weak comparison), falling back to If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        opaque = etag.removeprefix("W/")
+        return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+def cache_headers(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = _http_date(last_modified)
+    return headers
+
+def not_modified(headers: Dict[str, str]) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+def entity_etag(doc: Dict[str, Any]) -> str:
+    """Strong ETag for a stored entity: every write path sets updated_at."""
+    updated_at = doc.get("updated_at") or doc.get("created_at")
+    version = int(updated_at.replace(tzinfo=timezone.utc).timestamp() * 1000) if updated_at else 0
+    return f'"{doc["id"]}-{version}"'
+
+def entity_headers(doc: Dict[str, Any]) -> Dict[str, str]:
+    return cache_headers(entity_etag(doc), doc.get("updated_at"))
+
+async def entity_not_modified(request: Request, collection, query: Dict[str, Any]) -> Optional[Response]:
+    """304 response when the client's copy of the entity is current, else None.
+
+    Only conditional requests pay for this lookup, which reads just the
+    version fields; the full document is fetched only when it changed.
+    """
+    if "if-none-match" not in request.headers and "if-modified-since" not in request.headers:
+        return None
+    stamp = await collection.find_one(query, {"_id": 0, "id": 1, "created_at": 1, "updated_at": 1})
+    if stamp is None:
+        return None
+    headers = entity_headers(stamp)
+    if is_not_modified(request, headers["ETag"], stamp.get("updated_at")):
+        return not_modified(headers)
+    return None
+
+async def read_generation(user_id: str, collection: str) -> Tuple[int, Optional[datetime]]:
+    """A user's current generation of a collection and when it was last bumped."""
+    counter = await get_db()[GENERATIONS_COLLECTION].find_one(
+        {"_id": f"{user_id}:{collection}"}, {"generation": 1, "updated_at": 1}
+    )
+    if counter is None:
+        return 0, None
+    return counter["generation"], counter.get("updated_at")
+
+async def list_validators(request: Request, user_id: str, collection: str) -> Tuple[Dict[str, str], Optional[Response]]:
+    """Cache headers for a user's list endpoint, and a 304 response if the client is current.
+
+    The weak ETag combines the collection's generation with the user and the
+    query string, so one primary-key read decides whether anything changed.
+    Call it before reading the data and bump after writing: a racing write then
+    leaves an outdated ETag (one extra full response), never a wrong 304.
+    """
+    generation, last_modified = await read_generation(user_id, collection)
+
+    params = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    etag = f'W/"{generation}-{_short_hash(user_id, request.url.path, params)}"'
+    headers = cache_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return headers, not_modified(headers)
+    return headers, None
+
+class TenantCache:
+    """Per-worker LRU of state derived from some of each user's collections.
+
+    The state is built on first use and records the generation each collection
+    was loaded at. Writes in this worker patch it directly when their new
+    generation is the next one it expects (see caught_up). Any other write
+    (another worker, a racing request, a background job) leaves the stored
+    generation ahead, and the next get() catches that collection up: it
+    refetches just the entities named in the counter's change log since the
+    cached generation, or reloads the whole collection through the state's
+    ``async reload(sources, generations)`` when the log does not reach back
+    that far or names no entities. States also provide ``upsert(collection, doc)``
+    and ``remove(collection, entity_id)``.
+    """
+
+    def __init__(self, factory: Callable[[], Any], projections: Dict[str, Dict[str, int]], max_tenants: int):
+        self.factory = factory
+        self.projections = projections
+        self.max_tenants = max_tenants
+        self._tenants: "OrderedDict[str, Any]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def stored_counters(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        """The user's generation counter of each cached collection, change log included."""
+        cursor = get_db()[GENERATIONS_COLLECTION].find(
+            {"_id": {"$in": [f"{user_id}:{collection}" for collection in self.projections]}},
+            {"generation": 1, "changes": 1}
+        )
+        stored = {counter["_id"].split(":", 1)[1]: counter async for counter in cursor}
+        return {collection: stored.get(collection, {"generation": 0}) for collection in self.projections}
+
+    def _stale(self, state: Any, generations: Dict[str, int]) -> List[str]:
+        if state is None:
+            return list(self.projections)
+        return [c for c, generation in generations.items() if state.generations.get(c) != generation]
+
+    @staticmethod
+    def changed_ids(cached: Optional[int], counter: Dict[str, Any]) -> Optional[Set[str]]:
+        """Entities written after the cached generation, or None when only a reload will do."""
+        behind = counter["generation"] - cached if cached is not None else 0
+        changes = counter.get("changes") or []
+        if behind <= 0 or behind > len(changes):
+            return None
+        ids: Set[str] = set()
+        for change in changes[len(changes) - behind:]:
+            if change.get("ids") is None:
+                return None
+            ids.update(change["ids"])
+        return ids
+
+    async def _replay(self, state: Any, user_id: str, collection: str, ids: Set[str], generation: int):
+        # Local writes that land while the entities are fetched are dropped, as during a reload
+        state.generations[collection] = None
+        found = set()
+        async for doc in get_db()[collection].find(
+            {"user_id": user_id, "id": {"$in": list(ids)}}, self.projections[collection]
+        ):
+            state.upsert(collection, doc)
+            found.add(doc["id"])
+        for entity_id in ids - found:
+            state.remove(collection, entity_id)
+        state.generations[collection] = generation
+
+    async def get(self, user_id: str) -> Any:
+        """The user's state, brought up to date with the stored generations."""
+        counters = await self.stored_counters(user_id)
+        generations = {collection: counter["generation"] for collection, counter in counters.items()}
+        state = self._tenants.get(user_id)
+        if state is not None:
+            self._tenants.move_to_end(user_id)
+            if not self._stale(state, generations):
+                return state
+
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        async with lock:
+            state = self._tenants.get(user_id) or self.factory()
+            reload = []
+            for collection in self._stale(state, generations):
+                ids = self.changed_ids(state.generations.get(collection), counters[collection])
+                if ids is None:
+                    reload.append(collection)
+                else:
+                    await self._replay(state, user_id, collection, ids, generations[collection])
+                    logger.debug("Replayed %d %s for user %s in %s", len(ids), collection, user_id, type(state).__name__)
+            if reload:
+                db = get_db()
+                await state.reload({
+                    collection: db[collection].find({"user_id": user_id}, self.projections[collection])
+                    for collection in reload
+                }, generations)
+                logger.debug("Reloaded %s for user %s in %s", ", ".join(reload), user_id, type(state).__name__)
+
+            self._tenants[user_id] = state
+            self._tenants.move_to_end(user_id)
+            while len(self._tenants) > self.max_tenants:
+                evicted, _ = self._tenants.popitem(last=False)
+                evicted_lock = self._locks.get(evicted)
+                if evicted_lock is not None and not evicted_lock.locked():
+                    del self._locks[evicted]
+        return state
+
+    def caught_up(self, user_id: str, collection: str, generation: int) -> Optional[Any]:
+        """The user's cached state if it saw every write before this one, else None.
+
+        After a gap the state is left as it is: its generation is still behind
+        the stored one, so the next get() replays this write with the ones it
+        missed from the change log.
+        """
+        state = self._tenants.get(user_id)
+        if state is None or collection not in self.projections:
+            return None
+        if state.generations.get(collection) != generation - 1:
+            return None
+        state.generations[collection] = generation
+        return state
@@ -0,0 +1,130 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import LeasedPeriodicJob, get_db
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_INTERVAL = timedelta(minutes=10)
+RECONCILE_LEASE_ID = "notification_counter_reconciler"
+
+# Counter documents are keyed by user id:
+# {"_id": user_id, "unread": int, "by_type": {"payment": int, ...}, "updated_at": datetime}
+COUNTERS_COLLECTION = "notification_counters"
+
+def _type_value(notification_type) -> str:
+    return getattr(notification_type, "value", notification_type)
+
+async def count_unread(user_id: str) -> Dict[str, Any]:
+    """Count unread notifications from the notifications collection itself."""
+    pipeline = [
+        {"$match": {"user_id": user_id, "is_read": False}},
+        {"$group": {"_id": "$type", "count": {"$sum": 1}}}
+    ]
+    by_type = {}
+    async for row in get_db().notifications.aggregate(pipeline):
+        by_type[row["_id"]] = row["count"]
+    return {"unread": sum(by_type.values()), "by_type": by_type}
+
+async def get_unread_counts(user_id: str) -> Dict[str, Any]:
+    """Return a user's unread counters with a single primary-key read.
+
+    Counters are created lazily from a real count the first time they are read;
+    until then increments are skipped because there is no baseline to apply them to.
+    """
+    counters = get_db()[COUNTERS_COLLECTION]
+    counter = await counters.find_one({"_id": user_id})
+    if counter is not None:
+        by_type = {k: v for k, v in counter.get("by_type", {}).items() if v > 0}
+        return {"unread": max(counter.get("unread", 0), 0), "by_type": by_type}
+
+    counts = await count_unread(user_id)
+    try:
+        await counters.insert_one({"_id": user_id, **counts, "updated_at": datetime.utcnow()})
+    except DuplicateKeyError:
+        # Initialised concurrently; that document is as good as ours
+        pass
+    return counts
+
+async def increment_unread(notifications: List[Dict[str, Any]]):
+    """Count newly inserted unread notifications, one $inc per user."""
+    await _adjust_unread(notifications, 1)
+
+async def release_unread(notifications: List[Dict[str, Any]]):
+    """Uncount notifications removed from the hot collection in bulk (e.g. archived)."""
+    await _adjust_unread(notifications, -1)
+
+async def _adjust_unread(notifications: List[Dict[str, Any]], delta: int):
+    increments: Dict[str, Dict[str, int]] = {}
+    for notification in notifications:
+        if notification.get("is_read"):
+            continue
+        user_increments = increments.setdefault(notification["user_id"], {"unread": 0})
+        type_key = f"by_type.{_type_value(notification['type'])}"
+        user_increments["unread"] += delta
+        user_increments[type_key] = user_increments.get(type_key, 0) + delta
+
+    if not increments:
+        return
+    await get_db()[COUNTERS_COLLECTION].bulk_write([
+        UpdateOne({"_id": user_id}, {"$inc": inc, "$set": {"updated_at": datetime.utcnow()}})
+        for user_id, inc in increments.items()
+    ], ordered=False)
+
+async def decrement_unread(user_id: str, notification_type):
+    """Account for one notification leaving the unread set."""
+    await get_db()[COUNTERS_COLLECTION].update_one(
+        {"_id": user_id},
+        {
+            "$inc": {"unread": -1, f"by_type.{_type_value(notification_type)}": -1},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
+    )
+
+async def reset_unread(user_id: str):
+    """Atomically zero a user's counters (mark-all-read)."""
+    await get_db()[COUNTERS_COLLECTION].update_one(
+        {"_id": user_id},
+        {"$set": {"unread": 0, "by_type": {}, "updated_at": datetime.utcnow()}}
+    )
+
+async def reconcile_unread_counters():
+    """Rewrite every existing counter from a real count, repairing drift from races or crashes.
+
+    Counters are read before notifications are counted, and each is rewritten
+    only if it still has the value and updated_at that were read: one that
+    changed meanwhile counted a notification the count may have missed, and is
+    left for the next run.
+    """
+    db = get_db()
+    counters = await db[COUNTERS_COLLECTION].find({}, {"unread": 1, "by_type": 1, "updated_at": 1}).to_list(None)
+
+    pipeline = [
+        {"$match": {"is_read": False}},
+        {"$group": {"_id": {"user_id": "$user_id", "type": "$type"}, "count": {"$sum": 1}}}
+    ]
+    actual: Dict[str, Dict[str, int]] = {}
+    async for row in db.notifications.aggregate(pipeline, allowDiskUse=True):
+        actual.setdefault(row["_id"]["user_id"], {})[row["_id"]["type"]] = row["count"]
+
+    now = datetime.utcnow()
+    updates = []
+    for counter in counters:
+        by_type = actual.get(counter["_id"], {})
+        unread = sum(by_type.values())
+        stored_types = {k: v for k, v in counter.get("by_type", {}).items() if v}
+        if counter.get("unread") != unread or stored_types != by_type:
+            updates.append(UpdateOne(
+                {"_id": counter["_id"], "unread": counter.get("unread"), "updated_at": counter.get("updated_at")},
+                {"$set": {"unread": unread, "by_type": by_type, "updated_at": now}}
+            ))
+    if updates:
+        result = await db[COUNTERS_COLLECTION].bulk_write(updates, ordered=False)
+        logger.info("Reconciled %d notification counters; %d changed meanwhile and were skipped",
+                    result.matched_count, len(updates) - result.matched_count)
+
+counter_reconciler = LeasedPeriodicJob(RECONCILE_LEASE_ID, RECONCILE_INTERVAL, reconcile_unread_counters)
@@ -1,33 +1,77 @@
+from fastapi import Request
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Optional
+import asyncio
+import logging
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from metrics import mongo_command_metrics
+from query_budget import query_monitor
+from storage import STORAGE_BACKEND, STORAGE_SNAPSHOT, MemoryClient
 import os
+import uuid
 
-class Database:
-    client: Optional[AsyncIOMotorClient] = None
-    database = None
+logger = logging.getLogger(__name__)
 
-db_instance = Database()
+# Documents per bulk_write when backfilling existing collections
+BACKFILL_BATCH_SIZE = 500
 
-async def get_database():
-    return db_instance.database
+# Read notifications are deleted this long after being read
+NOTIFICATION_READ_TTL_DAYS = int(os.environ.get("NOTIFICATION_READ_TTL_DAYS", "30"))
 
-async def connect_to_mongo():
-    """Create database connection"""
-    mongo_url = os.environ['MONGO_URL']
-    db_instance.client = AsyncIOMotorClient(mongo_url)
-    db_instance.database = db_instance.client[os.environ.get('DB_NAME', 'realestate_db')]
+class Connection:
+    """A storage client and database opened by one process.
+    
+    Motor clients are not fork-safe, so a connection is only usable in the
+    process that opened it; each worker opens its own in the app's lifespan.
+    """
+    
+    def __init__(self, client, database):
+        # AsyncIOMotorClient, or storage.MemoryClient with STORAGE_BACKEND=memory
+        self.client = client
+        self.database = database
+        self.pid = os.getpid()
+
+# This process's connection; set by connect_to_mongo, cleared on close and in forked children
+_connection: Optional[Connection] = None
+
+def _forget_inherited_connection():
+    global _connection
+    _connection = None
+
+os.register_at_fork(after_in_child=_forget_inherited_connection)
+
+async def connect_to_mongo() -> Connection:
+    """Open this process's database connection and prepare indexes and backfills"""
+    global _connection
+    if STORAGE_BACKEND == "memory":
+        if int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+            # Each worker would hold its own copy of the data and overwrite the others' snapshots
+            raise RuntimeError("STORAGE_BACKEND=memory runs in a single process; set WEB_CONCURRENCY=1")
+        client = MemoryClient(STORAGE_SNAPSHOT, event_listeners=[mongo_command_metrics, query_monitor])
+        client.start_snapshots()
+    else:
+        mongo_url = os.environ['MONGO_URL']
+        client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_command_metrics, query_monitor])
+        query_monitor.attach(client, asyncio.get_running_loop())
+    _connection = Connection(client, client[os.environ.get('DB_NAME', 'realestate_db')])
     
     # Create indexes for better performance
     await create_indexes()
+    await backfill_notification_read_at()
+    return _connection
 
 async def close_mongo_connection():
-    """Close database connection"""
-    if db_instance.client:
-        db_instance.client.close()
+    """Close this process's database connection"""
+    global _connection
+    if _connection is not None:
+        _connection.client.close()
+        _connection = None
 
 async def create_indexes():
     """Create database indexes for better performance"""
-    db = db_instance.database
+    db = get_db()
     
     # User indexes
     await db.users.create_index("email", unique=True)
@@ -38,21 +82,26 @@ async def create_indexes():
     await db.properties.create_index("area")
     await db.properties.create_index("type")
     await db.properties.create_index("status")
+    await db.properties.create_index("next_follow_up")
+    await db.properties.create_index([("user_id", 1), ("location", "2dsphere")])
     
     # Customer indexes
     await db.customers.create_index("user_id")
     await db.customers.create_index("status")
     await db.customers.create_index("phone")
+    await db.customers.create_index("follow_up_date")
     
     # Deal indexes
     await db.deals.create_index("user_id")
     await db.deals.create_index("status")
     await db.deals.create_index("property_id")
     await db.deals.create_index("customer_id")
+    await db.deal_transitions.create_index([("user_id", 1), ("deal_id", 1)])
     
     # Project indexes
     await db.projects.create_index("user_id")
     await db.projects.create_index("area")
+    await db.projects.create_index([("user_id", 1), ("location", "2dsphere")])
     
     # Builder customer indexes
     await db.builder_customers.create_index("user_id")
@@ -61,19 +110,121 @@ async def create_indexes():
     # Notification indexes
     await db.notifications.create_index("user_id")
     await db.notifications.create_index("is_read")
+    # Lets the archiver walk aged notifications across all users oldest first
+    await db.notifications.create_index("created_at")
+    await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
+    await db.notifications.create_index([("user_id", 1), ("is_read", 1), ("created_at", -1)])
+    await db.notifications.create_index(
+        "read_at",
+        expireAfterSeconds=NOTIFICATION_READ_TTL_DAYS * 24 * 3600
+    )
+    await db.notifications_archive.create_index([("user_id", 1), ("created_at", -1)])
+    await db.notifications.create_index(
+        "reminder_key",
+        unique=True,
+        partialFilterExpression={"reminder_key": {"$exists": True}}
+    )
+    await db.fired_reminders.create_index("fired_at")
     
     # Event indexes
     await db.events.create_index("user_id")
     await db.events.create_index("date")
+    await db.events.create_index([("user_id", 1), ("starts_at", 1)])
+    await db.events.create_index([("status", 1), ("starts_at", 1)])
     await db.events.create_index("status")
+    # Range reads skip recurring series that ended before the window
+    await db.events.create_index([("user_id", 1), ("series_ends_at", 1)])
     
     # Financial record indexes
     await db.financial_records.create_index("user_id")
     await db.financial_records.create_index([("year", 1), ("month", 1)])
+    await db.financial_records.create_index([("user_id", 1), ("year", 1), ("month", 1)])
+    await db.pnl_monthly.create_index([("user_id", 1), ("period", 1)])
+    await db.pnl_monthly.create_index([("user_id", 1), ("project_id", 1), ("category", 1)])
     
     # Team member indexes
     await db.team_members.create_index("user_id")
     await db.team_members.create_index("email")
 
+async def acquire_lease(name: str, owner: str, ttl: timedelta) -> bool:
+    """Take or renew a named lease so only one worker runs a background job.
+    
+    Returns False while the lease is unexpired and held by another owner.
+    """
+    now = datetime.utcnow()
+    try:
+        await get_db().scheduler_leases.find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + ttl}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # The upsert collided with the other owner's lease document
+        return False
+    return True
+
+async def migration_done(name: str) -> bool:
+    """Whether the named one-off migration has completed, so startup can skip it."""
+    return await get_db().migrations.find_one({"_id": name}) is not None
+
+async def mark_migration_done(name: str):
+    """Record that a one-off migration completed; workers racing on it upsert the same marker."""
+    await get_db().migrations.update_one(
+        {"_id": name},
+        {"$setOnInsert": {"completed_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+async def backfill_notification_read_at():
+    """Give already-read notifications a read_at so the TTL index can expire them."""
+    await get_db().notifications.update_many(
+        {"is_read": True, "read_at": {"$exists": False}},
+        [{"$set": {"read_at": "$updated_at"}}]
+    )
+
+class LeasedPeriodicJob:
+    """Runs a coroutine function every ``interval`` on whichever worker holds its lease."""
+    
+    def __init__(self, name: str, interval: timedelta, job: Callable[[], Awaitable[None]]):
+        self.name = name
+        self.interval = interval
+        self.job = job
+        self.worker_id: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        # Taken at start, in the worker process, so forked workers never share an id
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval.total_seconds())
+            try:
+                # Lease outlives the interval slightly so the holder keeps it between runs
+                if await acquire_lease(self.name, self.worker_id, self.interval * 1.5):
+                    await self.job()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Periodic job %s failed", self.name)
+
 def get_db():
-    return db_instance.database
\ No newline at end of file
+    """The database of this process's connection, for code running outside a request (jobs, listeners)."""
+    if _connection is None or _connection.pid != os.getpid():
+        raise RuntimeError("Database is not connected in this process")
+    return _connection.database
+
+def get_database(request: Request):
+    """FastAPI dependency: the database opened by the application's lifespan."""
+    return request.app.state.db
\ No newline at end of file
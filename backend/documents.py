@@ -0,0 +1,69 @@
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple, Type
+
+from pydantic import BaseModel, TypeAdapter
+
+def utc_now_ms() -> datetime:
+    """Current UTC time truncated to the millisecond precision MongoDB stores."""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+@lru_cache(maxsize=None)
+def _document_shape(model_cls: Type[BaseModel]) -> Tuple[Dict[str, Any], Dict[str, Callable[[], Any]], FrozenSet[str]]:
+    """Static defaults, default factories and required field names of a persisted model."""
+    defaults: Dict[str, Any] = {}
+    factories: Dict[str, Callable[[], Any]] = {}
+    required: Set[str] = set()
+    for name, field in model_cls.model_fields.items():
+        if field.default_factory is not None:
+            factories[name] = field.default_factory
+        elif field.is_required():
+            required.add(name)
+        else:
+            defaults[name] = field.default
+    return defaults, factories, frozenset(required)
+
+def build_document(
+    model_cls: Type[BaseModel],
+    payload: BaseModel,
+    exclude: Optional[Set[str]] = None,
+    **fields: Any
+) -> Dict[str, Any]:
+    """Assemble the document to persist for ``model_cls`` from an already validated payload.
+
+    FastAPI has validated ``payload`` against its ``*Create`` model, so instead of
+    re-validating through ``model_cls`` this fills in the persisted model's defaults,
+    generates id/timestamps and adds ``fields`` (user_id etc.) directly.
+    """
+    defaults, factories, required = _document_shape(model_cls)
+
+    # Copy mutable defaults so documents never share list/dict instances
+    doc = {name: value.copy() if isinstance(value, (list, dict)) else value for name, value in defaults.items()}
+    doc.update(payload.model_dump(exclude=exclude))
+    doc.update(fields)
+
+    now = None
+    for name, factory in factories.items():
+        if name in doc:
+            continue
+        if factory == datetime.utcnow:
+            # created_at/updated_at share one instant, as stored by MongoDB
+            now = now or utc_now_ms()
+            doc[name] = now
+        else:
+            doc[name] = factory()
+
+    missing = required - doc.keys()
+    if missing:
+        raise ValueError(f"{model_cls.__name__} document is missing fields: {sorted(missing)}")
+    return doc
+
+@lru_cache(maxsize=None)
+def list_adapter(model_cls: Type[BaseModel]) -> TypeAdapter:
+    """Cached TypeAdapter for List[model_cls]; building one per call is the expensive part."""
+    return TypeAdapter(List[model_cls])
+
+def dump_many(model_cls: Type[BaseModel], items: Iterable[BaseModel]) -> List[Dict[str, Any]]:
+    """Dump a list of validated models in a single pydantic-core call."""
+    return list_adapter(model_cls).dump_python(list(items))
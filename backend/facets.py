@@ -0,0 +1,103 @@
+"""Facet counts returned alongside list pages.
+
+With ``?facets=area,type`` a list endpoint returns ``{"items", "total",
+"facets"}`` instead of a bare array: one page of results plus, for each
+requested field, how many documents of the whole filtered set have each value.
+Page and counts come from one ``$facet`` aggregation. Counts are cached per
+tenant, collection, filter set and field list under the collection's
+generation, so any write invalidates them; the TTL only bounds how long
+abandoned filter sets stay in memory.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from conditional import read_generation
+
+FACET_TTL_SECONDS = float(os.environ.get("FACET_TTL_SECONDS", "60"))
+FACET_CACHE_SIZE = int(os.environ.get("FACET_CACHE_SIZE", "2048"))
+# The page shares the aggregation's single (16 MB) result document with the counts
+FACET_PAGE_SIZE = 100
+
+PROPERTY_FACETS = ("area", "type", "status", "bedrooms", "deal_status")
+CUSTOMER_FACETS = ("status", "is_important")
+DEAL_FACETS = ("status",)
+
+def parse_facets(value: Optional[str], allowed: Tuple[str, ...]) -> List[str]:
+    """Requested facet fields in order, without duplicates; ValueError for unknown ones."""
+    if not value:
+        return []
+    fields = list(dict.fromkeys(field.strip() for field in value.split(",") if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown facets: {', '.join(unknown)} (expected {', '.join(allowed)})")
+    return fields
+
+class FacetCache:
+    """Per-worker LRU of facet counts, valid for one generation and at most FACET_TTL_SECONDS."""
+
+    def __init__(self, max_entries: int = FACET_CACHE_SIZE, ttl: float = FACET_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[int, float, Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, key: Tuple, generation: int) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        cached_generation, expires_at, counts = entry
+        if cached_generation != generation or expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return counts
+
+    def put(self, key: Tuple, generation: int, counts: Dict[str, Any]):
+        self._entries[key] = (generation, time.monotonic() + self.ttl, counts)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+facet_cache = FacetCache()
+
+async def faceted_list(
+    collection,
+    user_id: str,
+    first_stage: Dict[str, Any],
+    sort: Optional[Dict[str, int]],
+    skip: int,
+    limit: Optional[int],
+    fields: List[str]
+) -> Dict[str, Any]:
+    """One page of a tenant's filtered list with its total and facet counts.
+
+    ``first_stage`` selects the documents: a ``$match`` (then ``sort`` orders
+    the page) or a ``$geoNear``, which already returns them nearest first.
+    """
+    generation, _ = await read_generation(user_id, collection.name)
+    key = (user_id, collection.name, orjson.dumps(first_stage, option=orjson.OPT_SORT_KEYS, default=str), tuple(fields))
+    page = [{"$sort": sort}] if sort else []
+    page += [{"$skip": skip}, {"$limit": limit or FACET_PAGE_SIZE}, {"$project": {"_id": 0}}]
+
+    counts = facet_cache.get(key, generation)
+    if counts is not None:
+        items = await collection.aggregate([first_stage, *page]).to_list(None)
+        return {"items": items, **counts}
+
+    spec = {"items": page, "total": [{"$count": "count"}]}
+    for field in fields:
+        # $sortByCount, with ties in value order
+        spec[f"by_{field}"] = [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}, {"$sort": {"count": -1, "_id": 1}}]
+    result = (await collection.aggregate([first_stage, {"$facet": spec}]).to_list(None))[0]
+    counts = {
+        "total": result["total"][0]["count"] if result["total"] else 0,
+        "facets": {
+            field: [{"value": bucket["_id"], "count": bucket["count"]} for bucket in result[f"by_{field}"]]
+            for field in fields
+        },
+    }
+    facet_cache.put(key, generation, counts)
+    return {"items": result["items"], **counts}
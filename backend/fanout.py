@@ -0,0 +1,94 @@
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from pymongo.errors import BulkWriteError
+
+from counters import increment_unread
+from database import get_db
+from models import Notification
+from pubsub import notification_bus
+from utils import serialize_doc
+
+# Notifications per insert_many call
+INSERT_BATCH_SIZE = 1000
+
+async def deliver_notifications(notifications: List[Dict[str, Any]]) -> int:
+    """Insert notification documents in batches, update unread counters and push them.
+
+    Documents whose unique reminder_key already exists are skipped silently.
+    Returns the number of notifications actually delivered.
+    """
+    db = get_db()
+    delivered = []
+    for start in range(0, len(notifications), INSERT_BATCH_SIZE):
+        batch = notifications[start:start + INSERT_BATCH_SIZE]
+        try:
+            await db.notifications.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in write_errors):
+                raise
+            duplicates = {error["index"] for error in write_errors}
+            batch = [n for i, n in enumerate(batch) if i not in duplicates]
+        delivered.extend(batch)
+
+    if not delivered:
+        return 0
+
+    await increment_unread(delivered)
+    await notification_bus.publish_many([
+        (notification["user_id"], "notification.created", serialize_doc(dict(notification)))
+        for notification in delivered
+    ])
+    return len(delivered)
+
+def build_notifications(recipient_ids: List[str], **fields) -> List[Dict[str, Any]]:
+    """Build one notification document per recipient from a single validated template."""
+    template = Notification(user_id="", **fields).dict()
+    now = datetime.utcnow()
+    return [
+        {**template, "id": str(uuid.uuid4()), "user_id": user_id, "created_at": now, "updated_at": now}
+        for user_id in recipient_ids
+    ]
+
+async def resolve_broadcast_recipients(
+    builder_id: str,
+    audiences: List[str],
+    project_id: Optional[str] = None
+) -> List[str]:
+    """Resolve a builder's broadcast audience to user ids.
+
+    Team members are matched to accounts by email; brokers are those referenced
+    by ``PlotBuyer.broker`` (as an email or user id) in the builder's projects.
+    """
+    db = get_db()
+    recipients: Set[str] = set()
+
+    if "team" in audiences:
+        emails = await db.team_members.distinct("email", {"user_id": builder_id})
+        if emails:
+            async for user in db.users.find({"email": {"$in": emails}}, {"_id": 0, "id": 1}):
+                recipients.add(user["id"])
+
+    if "brokers" in audiences:
+        project_match = {"user_id": builder_id}
+        if project_id:
+            project_match["id"] = project_id
+        pipeline = [
+            {"$match": project_match},
+            {"$unwind": "$plots"},
+            {"$match": {"plots.buyer.broker": {"$nin": [None, ""]}}},
+            {"$group": {"_id": "$plots.buyer.broker"}}
+        ]
+        broker_refs = [row["_id"] async for row in db.projects.aggregate(pipeline)]
+        if broker_refs:
+            broker_query = {
+                "role": "broker",
+                "$or": [{"email": {"$in": broker_refs}}, {"id": {"$in": broker_refs}}]
+            }
+            async for user in db.users.find(broker_query, {"_id": 0, "id": 1}):
+                recipients.add(user["id"])
+
+    recipients.discard(builder_id)
+    return sorted(recipients)
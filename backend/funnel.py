@@ -0,0 +1,227 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Deal pipeline in order; Cancelled leaves the funnel without advancing it
+FUNNEL_STAGES = [
+    "Interested", "Call", "Visit Done", "Follow-up",
+    "Finalized", "Agreement", "Registry", "Brokerage Received",
+]
+STAGE_INDEX = {stage: index for index, stage in enumerate(FUNNEL_STAGES)}
+
+# One document per status change:
+# {"user_id", "deal_id", "from": status | None, "to": status, "at": datetime, "days": int | None}
+# where days is how long the deal spent in "from", in whole days
+TRANSITIONS_COLLECTION = "deal_transitions"
+
+# Funnel documents are keyed by user id:
+# {"_id": user_id, "current": {status: int}, "furthest": {stage: int},
+#  "dwell": {status: {"<days>": int}}, "transitions": int, "building": bool, "updated_at": datetime}
+# "furthest" counts deals (deleted ones included) by the furthest stage they reached;
+# "building" is set while a build reads the sources, and writes leave the counters alone
+FUNNELS_COLLECTION = "deal_funnels"
+# Builds repeated while writes keep landing during them, before keeping the last one
+MAX_BUILD_ATTEMPTS = 3
+
+# Stays longer than this share the last dwell bucket, keeping funnel documents small
+MAX_DWELL_DAYS = 365
+
+def _status_value(status) -> Optional[str]:
+    return getattr(status, "value", status)
+
+def _furthest(deal: Optional[Dict[str, Any]]) -> Optional[str]:
+    if deal is None:
+        return None
+    return _status_value(deal.get("furthest_status")) or (
+        _status_value(deal.get("status")) if _status_value(deal.get("status")) in STAGE_INDEX else None
+    )
+
+def _advance(furthest: Optional[str], status: str) -> Optional[str]:
+    if status in STAGE_INDEX and (furthest is None or STAGE_INDEX[status] > STAGE_INDEX[furthest]):
+        return status
+    return furthest
+
+def _entered_at(deal: Dict[str, Any]) -> Optional[datetime]:
+    return deal.get("status_changed_at") or deal.get("start_date") or deal.get("created_at")
+
+def status_fields(previous: Optional[Dict[str, Any]], status, now: datetime) -> Dict[str, Any]:
+    """Fields to store on a deal entering ``status`` (previous is None for a new deal)."""
+    return {"status_changed_at": now, "furthest_status": _advance(_furthest(previous), _status_value(status))}
+
+async def record_transition(user_id: str, deal_id: str, previous: Optional[Dict[str, Any]], status, now: datetime):
+    """Log a deal's status change and apply it to the user's funnel, if it has one yet.
+
+    Call after the deal write, with the deal as it was before (None when created).
+    """
+    status = _status_value(status)
+    from_status = _status_value(previous.get("status")) if previous else None
+    if previous is not None and from_status == status:
+        return
+    days = None
+    if previous is not None and _entered_at(previous) is not None:
+        days = max(int((now - _entered_at(previous)).total_seconds() // 86400), 0)
+
+    db = get_db()
+    await db[TRANSITIONS_COLLECTION].insert_one({
+        "user_id": user_id, "deal_id": deal_id, "from": from_status, "to": status, "at": now, "days": days
+    })
+
+    increments = {"transitions": 1, f"current.{status}": 1}
+    if from_status is not None:
+        increments[f"current.{from_status}"] = -1
+    if days is not None:
+        increments[f"dwell.{from_status}.{min(days, MAX_DWELL_DAYS)}"] = 1
+    before, after = _furthest(previous), _advance(_furthest(previous), status)
+    if after != before:
+        increments[f"furthest.{after}"] = 1
+        if before is not None:
+            increments[f"furthest.{before}"] = -1
+    # Funnels are built lazily; until one is built there is no baseline to apply increments to
+    await db[FUNNELS_COLLECTION].update_one(
+        {"_id": user_id, "building": {"$ne": True}}, {"$inc": increments, "$set": {"updated_at": now}}
+    )
+
+async def release_deal(user_id: str, deal: Dict[str, Any]):
+    """Account for a deleted deal: it leaves its current stage, its history stays."""
+    await get_db()[FUNNELS_COLLECTION].update_one(
+        {"_id": user_id, "building": {"$ne": True}},
+        {"$inc": {f"current.{_status_value(deal['status'])}": -1}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+
+async def _seed_transitions(user_id: str):
+    """Log an initial transition for deals that predate the log, so they count once."""
+    db = get_db()
+    logged = set(await db[TRANSITIONS_COLLECTION].distinct("deal_id", {"user_id": user_id}))
+    seeds = [
+        {"user_id": user_id, "deal_id": deal["id"], "from": None, "to": deal["status"],
+         "at": _entered_at(deal), "days": None}
+        async for deal in db.deals.find(
+            {"user_id": user_id}, {"_id": 0, "id": 1, "status": 1, "start_date": 1, "created_at": 1}
+        )
+        if deal["id"] not in logged
+    ]
+    if seeds:
+        await db[TRANSITIONS_COLLECTION].insert_many(seeds)
+        logger.info("Seeded %d deal transitions for user %s", len(seeds), user_id)
+
+async def build_funnel(user_id: str) -> Dict[str, Any]:
+    """Compute a user's funnel from the transition log and their current deals."""
+    await _seed_transitions(user_id)
+    db = get_db()
+    current: Dict[str, int] = {}
+    async for row in db.deals.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]):
+        current[row["_id"]] = row["count"]
+
+    furthest: Dict[str, int] = {}
+    async for row in db[TRANSITIONS_COLLECTION].aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": "$deal_id", "stages": {"$addToSet": "$to"}}}
+    ]):
+        stages = [stage for stage in row["stages"] if stage in STAGE_INDEX]
+        if stages:
+            stage = max(stages, key=STAGE_INDEX.__getitem__)
+            furthest[stage] = furthest.get(stage, 0) + 1
+
+    dwell: Dict[str, Dict[str, int]] = {}
+    transitions = 0
+    async for row in db[TRANSITIONS_COLLECTION].aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": {"from": "$from", "days": "$days"}, "count": {"$sum": 1}}}
+    ]):
+        transitions += row["count"]
+        source, days = row["_id"].get("from"), row["_id"].get("days")
+        if source is not None and days is not None:
+            bucket = dwell.setdefault(source, {})
+            key = str(min(days, MAX_DWELL_DAYS))
+            bucket[key] = bucket.get(key, 0) + row["count"]
+    return {"current": current, "furthest": furthest, "dwell": dwell, "transitions": transitions}
+
+async def _matches_sources(user_id: str, funnel: Dict[str, Any]) -> bool:
+    """Whether stored counters account for every logged transition and every current deal."""
+    db = get_db()
+    transitions = await db[TRANSITIONS_COLLECTION].count_documents({"user_id": user_id})
+    deals = await db.deals.count_documents({"user_id": user_id})
+    return funnel.get("transitions") == transitions and sum(funnel.get("current", {}).values()) == deals
+
+async def get_funnel(user_id: str) -> Dict[str, Any]:
+    """Return a user's funnel counters with a single primary-key read, building them on first use.
+
+    The build marks the funnel as building before it reads deals and the log,
+    so writes landing meanwhile skip their increments instead of losing them
+    to a document that does not exist yet or double counting them in one that
+    is about to be replaced. Once stored, the counters are checked against the
+    log and the deals, and rebuilt if such a write was not in the build's reads.
+    """
+    funnels = get_db()[FUNNELS_COLLECTION]
+    funnel = await funnels.find_one({"_id": user_id})
+    if funnel is not None and not funnel.get("building"):
+        return funnel
+
+    for _ in range(MAX_BUILD_ATTEMPTS):
+        await funnels.update_one({"_id": user_id}, {"$set": {"building": True}}, upsert=True)
+        funnel = await build_funnel(user_id)
+        stored = await funnels.find_one_and_update(
+            {"_id": user_id},
+            {"$set": {**funnel, "building": False, "updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if await _matches_sources(user_id, stored):
+            return stored
+        logger.info("Deal funnel of user %s changed while it was built; rebuilding", user_id)
+    # Still changing: serve this build, and leave the next read to build again
+    await funnels.update_one({"_id": user_id}, {"$set": {"building": True}})
+    return stored
+
+def _median(histogram: Dict[str, int]) -> Optional[int]:
+    total = sum(count for count in histogram.values() if count > 0)
+    if not total:
+        return None
+    seen = 0
+    for days, count in sorted(((int(days), count) for days, count in histogram.items() if count > 0)):
+        seen += count
+        if seen * 2 >= total:
+            return days
+    return None
+
+def funnel_report(funnel: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage counts, stage-to-stage conversion and median whole days per stage.
+
+    A deal has reached a stage when its furthest stage is that one or later,
+    so deals that skip stages still count as having passed them.
+    """
+    current = funnel.get("current", {})
+    furthest = funnel.get("furthest", {})
+    dwell = funnel.get("dwell", {})
+
+    reached: List[int] = []
+    running = 0
+    for stage in reversed(FUNNEL_STAGES):
+        running += max(furthest.get(stage, 0), 0)
+        reached.append(running)
+    reached.reverse()
+
+    stages = []
+    for index, stage in enumerate(FUNNEL_STAGES):
+        following = reached[index + 1] if index + 1 < len(FUNNEL_STAGES) else None
+        stages.append({
+            "status": stage,
+            "current": max(current.get(stage, 0), 0),
+            "reached": reached[index],
+            "conversion": round(following / reached[index], 4) if following is not None and reached[index] else None,
+            "median_days": _median(dwell.get(stage, {})),
+        })
+    return {
+        "stages": stages,
+        "cancelled": max(current.get("Cancelled", 0), 0),
+        "overall_conversion": round(reached[-1] / reached[0], 4) if reached[0] else None,
+        "transitions": funnel.get("transitions", 0),
+    }
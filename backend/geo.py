@@ -0,0 +1,95 @@
+"""Location filters for list endpoints over documents with a GeoJSON ``location``.
+
+Locations are GeoJSON Points ([longitude, latitude]) covered by a 2dsphere
+index. ``near`` runs as a ``$geoNear`` aggregation so results come back
+nearest first with their distance; ``within`` is a ``$geoWithin`` bounding box
+that keeps the endpoint's usual ordering. Coordinates come from the client (the
+backfill endpoints accept them in bulk) since there is no geocoding service.
+"""
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from models import LocationUpdate
+
+MAX_RADIUS_KM = 500
+# Page size of near queries that don't pass a limit
+NEAR_PAGE_SIZE = 50
+# Items accepted per location backfill request
+BACKFILL_BATCH = 5000
+
+def _numbers(value: str, count: int, name: str) -> List[float]:
+    try:
+        numbers = [float(part) for part in value.split(",")]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count:
+        raise ValueError(f"{name} must be {count} comma-separated numbers")
+    return numbers
+
+def _check_coordinates(longitude: float, latitude: float, name: str):
+    if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+        raise ValueError(f"{name} must be longitude in [-180, 180] and latitude in [-90, 90]")
+
+def parse_point(value: str) -> Dict[str, Any]:
+    """GeoJSON Point for ``"longitude,latitude"``; ValueError when malformed."""
+    longitude, latitude = _numbers(value, 2, "near")
+    _check_coordinates(longitude, latitude, "near")
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+def parse_box(value: str) -> Dict[str, Any]:
+    """``$geoWithin`` condition for ``"min_lng,min_lat,max_lng,max_lat"``; ValueError when malformed."""
+    min_lng, min_lat, max_lng, max_lat = _numbers(value, 4, "within")
+    _check_coordinates(min_lng, min_lat, "within")
+    _check_coordinates(max_lng, max_lat, "within")
+    # Polygons wider than a hemisphere are rejected by MongoDB
+    if not (min_lng < max_lng and min_lat < max_lat and max_lng - min_lng < 180):
+        raise ValueError("within must be min_lng,min_lat,max_lng,max_lat spanning less than 180 degrees")
+    ring = [[min_lng, min_lat], [max_lng, min_lat], [max_lng, max_lat], [min_lng, max_lat], [min_lng, min_lat]]
+    return {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [ring]}}}
+
+def location_filters(query: Dict[str, Any], near: Optional[str], radius_km: Optional[float],
+                     within: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Add ``within`` to ``query`` and return the ``$geoNear`` stage for ``near``, if any.
+
+    Raises ValueError for malformed parameters, or a radius without ``near``.
+    """
+    if within:
+        query["location"] = parse_box(within)
+    if not near:
+        if radius_km is not None:
+            raise ValueError("radius_km requires near")
+        return None
+    stage = {
+        "near": parse_point(near),
+        "key": "location",
+        "distanceField": "distance_km",
+        "distanceMultiplier": 0.001,
+        "spherical": True,
+        "query": query,
+    }
+    if radius_km is not None:
+        stage["maxDistance"] = radius_km * 1000
+    return {"$geoNear": stage}
+
+async def find_near(collection, geo_near: Dict[str, Any], skip: int, limit: int) -> List[Dict[str, Any]]:
+    """One page of documents nearest first, each with ``distance_km``."""
+    pipeline = [geo_near, {"$skip": skip}, {"$limit": limit}, {"$project": {"_id": 0}}]
+    return await collection.aggregate(pipeline).to_list(None)
+
+async def backfill_locations(collection, user_id: str, updates: List[LocationUpdate], now) -> Dict[str, Any]:
+    """Set (or clear, for a null location) the locations of a tenant's documents by id."""
+    requests = [
+        UpdateOne(
+            {"id": update.id, "user_id": user_id},
+            {"$set": {"location": update.location.model_dump() if update.location else None, "updated_at": now}}
+        )
+        for update in updates
+    ]
+    result = await collection.bulk_write(requests, ordered=False)
+    found = set(await collection.distinct("id", {"user_id": user_id, "id": {"$in": [u.id for u in updates]}}))
+    return {
+        "matched": result.matched_count,
+        "modified": result.modified_count,
+        "not_found": [update.id for update in updates if update.id not in found],
+    }
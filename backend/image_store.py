@@ -0,0 +1,214 @@
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import anyio
+from pymongo import UpdateOne
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+from conditional import bump_generation
+from database import BACKFILL_BATCH_SIZE, get_db, mark_migration_done, migration_done
+
+logger = logging.getLogger(__name__)
+
+# Images live at <IMAGE_STORAGE_DIR>/<sha256[:2]>/<sha256>; identical uploads share one file
+IMAGE_STORAGE_DIR = Path(os.environ.get("IMAGE_STORAGE_DIR", Path(__file__).parent / "uploads" / "images"))
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+# What Property.images stores for uploaded images; the digest is the reference
+IMAGE_URL_PREFIX = "/api/images/"
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Content-addressed files never change, so clients may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Leading bytes of the image formats we accept
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+def detect_content_type(head: bytes) -> Optional[str]:
+    """Content type from the file's magic bytes; None for anything that is not a supported image."""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def image_url(digest: str) -> str:
+    return f"{IMAGE_URL_PREFIX}{digest}"
+
+def image_path(digest: str) -> Path:
+    return IMAGE_STORAGE_DIR / digest[:2] / digest
+
+@lru_cache(maxsize=4096)
+def _cached_content_type(digest: str) -> Optional[str]:
+    # Raises FileNotFoundError for missing files; lru_cache does not cache exceptions
+    with open(image_path(digest), "rb") as f:
+        return detect_content_type(f.read(16))
+
+def stored_content_type(digest: str) -> Optional[str]:
+    """Content type of a stored image, or None if it does not exist (yet)."""
+    try:
+        return _cached_content_type(digest)
+    except FileNotFoundError:
+        return None
+
+def open_temp_file():
+    """A temporary file on the same filesystem as the store, so commit is an atomic rename."""
+    tmp_dir = IMAGE_STORAGE_DIR / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    return os.fdopen(fd, "wb"), tmp_path
+
+def commit_file(tmp_path: str, digest: str) -> bool:
+    """Move a fully written temp file into place; returns False when the content already existed."""
+    final_path = image_path(digest)
+    if final_path.exists():
+        os.unlink(tmp_path)
+        return False
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    # Concurrent uploads of the same bytes race harmlessly: both renames yield identical files
+    os.replace(tmp_path, final_path)
+    return True
+
+def image_info(digest: str, size: int, content_type: str) -> Dict[str, Any]:
+    return {"id": digest, "url": image_url(digest), "size": size, "content_type": content_type}
+
+def _store_bytes(data: bytes) -> Optional[Dict[str, Any]]:
+    content_type = detect_content_type(data[:16])
+    if content_type is None:
+        return None
+    digest = hashlib.sha256(data).hexdigest()
+    out, tmp_path = open_temp_file()
+    with out:
+        out.write(data)
+    commit_file(tmp_path, digest)
+    return image_info(digest, len(data), content_type)
+
+def decode_inline_image(value: str) -> Optional[bytes]:
+    """Bytes of a base64 image, with or without a data: URI header; None if it is not one."""
+    if value.startswith(("http://", "https://", IMAGE_URL_PREFIX)):
+        return None
+    data = value.split(",", 1)[1] if value.startswith("data:") else value
+    try:
+        return base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+async def extract_inline_images(images: List[str]) -> Tuple[List[str], bool]:
+    """Replace inline base64 images with store references.
+
+    Returns the new list and whether anything changed. Decoding, hashing and
+    writing run in the threadpool to keep the event loop free.
+    """
+    extracted = []
+    changed = False
+    for image in images:
+        data = decode_inline_image(image) if isinstance(image, str) else None
+        info = await run_in_threadpool(_store_bytes, data) if data else None
+        if info is None:
+            extracted.append(image)
+        else:
+            extracted.append(info["url"])
+            changed = True
+    return extracted, changed
+
+# Migration marker; the write paths extract inline images themselves once it has run
+INLINE_IMAGES_MIGRATION = "inline_images_to_store"
+
+async def migrate_inline_images():
+    """One-time migration: move base64 images embedded in property documents into the store."""
+    if await migration_done(INLINE_IMAGES_MIGRATION):
+        return
+    db = get_db()
+    # Stored references and external URLs never look like this; inline images always do
+    query = {"images": {"$elemMatch": {"$not": {"$regex": r"^(https?://|/api/images/)"}}}}
+    updates = []
+    migrated = 0
+    owners = set()
+    async for doc in db.properties.find(query, {"_id": 1, "user_id": 1, "images": 1}):
+        images, changed = await extract_inline_images(doc["images"])
+        if not changed:
+            continue
+        # The representation changes, so cached copies must not revalidate
+        updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"images": images, "updated_at": datetime.utcnow()}}))
+        owners.add(doc.get("user_id"))
+        if len(updates) >= BACKFILL_BATCH_SIZE:
+            await db.properties.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+            updates = []
+    if updates:
+        await db.properties.bulk_write(updates, ordered=False)
+        migrated += len(updates)
+    for user_id in owners:
+        await bump_generation(user_id, "properties")
+    if migrated:
+        logger.info("Moved inline images of %d properties to the image store", migrated)
+    await mark_migration_done(INLINE_IMAGES_MIGRATION)
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range ``Range: bytes=`` header into inclusive (start, end).
+
+    Returns None for headers we serve in full (malformed or multi-range) and
+    raises ValueError when the range is unsatisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+class FileRangeResponse(Response):
+    """206 response streaming one byte range of a file."""
+
+    def __init__(self, path: Path, start: int, end: int, size: int, media_type: str, headers: Dict[str, str]):
+        super().__init__(status_code=206, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, "rb") as f:
+            await f.seek(self.start)
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
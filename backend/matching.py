@@ -0,0 +1,410 @@
+import asyncio
+import math
+import os
+import re
+from typing import Any, AsyncIterable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from conditional import TenantCache
+from models import PropertyType
+from utils import parse_amount, parse_amount_range
+
+# Tenants whose feature matrices are kept in memory per worker
+MATCHING_MAX_TENANTS = int(os.environ.get("MATCHING_MAX_TENANTS", "32"))
+# Distinct customer preference rows scored together in all-customer matching
+SCORE_BLOCK = 64
+# Documents loaded between yields to the event loop
+RELOAD_BATCH = 1_000
+
+# A preference group the customer says nothing about scores half its weight for every property
+WEIGHTS = {"budget": 0.45, "type": 0.2, "area": 0.15, "bedrooms": 0.1, "facing": 0.05, "vastu": 0.05}
+# Budget fit is 1 inside the range and falls to 0 at half the low end and 20% over the high end
+BELOW_BUDGET_SLACK = 0.5
+ABOVE_BUDGET_SLACK = 0.2
+
+# Properties in these deal stages are off the market; customers in these statuses are not leads
+OFF_MARKET_DEAL_STATUSES = {"Agreement", "Finalized", "Registry", "Brokerage Received"}
+INACTIVE_CUSTOMER_STATUSES = {"Deal Lost", "Closed"}
+
+PROPERTY_TYPES = [t.value for t in PropertyType]
+TYPE_KEYWORDS = {
+    "villa": "Villa", "bungalow": "Villa",
+    "apartment": "Apartment", "flat": "Apartment", "penthouse": "Apartment",
+    "plot": "Plot", "land": "Plot", "site": "Plot",
+    "house": "House",
+}
+FACINGS = ["North", "South", "East", "West", "North-East", "North-West", "South-East", "South-West"]
+MAX_BEDROOMS = 5
+
+_WORD_RE = re.compile(r"[a-z]+")
+_BHK_RE = re.compile(r"(\d)\s*bhk")
+_FACING_RE = re.compile(r"\b(north|south|east|west)(?:[\s-]?(east|west))?[\s-]*facing\b")
+
+# Feature columns shared by customer preference rows and property rows, so the
+# non-budget part of every score is one matrix product. Area columns follow and
+# grow with the tenant's areas.
+COL_BIAS = 0
+COL_TYPES = 1
+COL_BEDROOMS = COL_TYPES + len(PROPERTY_TYPES)
+COL_FACINGS = COL_BEDROOMS + MAX_BEDROOMS + 1
+COL_VASTU = COL_FACINGS + len(FACINGS)
+COL_AREAS = COL_VASTU + 1
+INITIAL_AREA_SLOTS = 32
+
+def _text(value: Any) -> str:
+    return str(getattr(value, "value", value) or "")
+
+def _facing_index(value: str) -> Optional[int]:
+    normalized = value.strip().lower().replace(" ", "-").replace("_", "-")
+    for i, facing in enumerate(FACINGS):
+        if facing.lower() == normalized:
+            return i
+    return None
+
+def customer_text(doc: Dict[str, Any]) -> str:
+    return f"{_text(doc.get('interest'))} {_text(doc.get('notes'))}".lower()
+
+def mentions_area(text: str, name: str) -> bool:
+    """Whether lower-cased text names an area as whole words ("baner", not "banerjee")."""
+    start = text.find(name)
+    while start >= 0:
+        end = start + len(name)
+        if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+            return True
+        start = text.find(name, start + 1)
+    return False
+
+def customer_preferences(text: str) -> Dict[str, Any]:
+    """Types, bedrooms, facings and vastu a customer asked for, read from their interest and notes."""
+    words = set(_WORD_RE.findall(text))
+    types = {TYPE_KEYWORDS[word] for word in words if word in TYPE_KEYWORDS}
+    bedrooms = {min(int(n), MAX_BEDROOMS) for n in _BHK_RE.findall(text)}
+    facings = set()
+    for first, second in _FACING_RE.findall(text):
+        index = _facing_index(f"{first}-{second}" if second else first)
+        if index is not None:
+            facings.add(index)
+    return {"types": types, "bedrooms": bedrooms, "facings": facings, "vastu": "vastu" in words}
+
+def budget_fit(low: np.ndarray, high: np.ndarray, price: np.ndarray) -> np.ndarray:
+    """Budget fit in [0, 1], broadcasting customer (low, high) against property prices."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        under = (low - price) / (low * BELOW_BUDGET_SLACK)
+        over = (price - high) / (high * ABOVE_BUDGET_SLACK)
+    # fmax drops the NaNs from open-ended (0 or infinite) bounds
+    fit = 1 - np.fmax(under, 0) - np.fmax(over, 0)
+    return np.clip(fit, 0, 1, out=fit)
+
+def _top(scores: np.ndarray, limit: int) -> np.ndarray:
+    """Indices of the best positive scores, best first."""
+    limit = min(limit, scores.shape[-1])
+    if limit <= 0:
+        return np.empty(0, dtype=np.intp)
+    best = np.argpartition(-scores, limit - 1)[:limit]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return best[scores[best] > 0]
+
+class FeatureTable:
+    """Feature rows for one side of the match, looked up by entity id.
+
+    Capacity doubles as rows are added; deleting moves the last row into the
+    hole so live rows stay contiguous.
+    """
+
+    def __init__(self, width: int, scalars: Tuple[str, ...]):
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.features = np.zeros((64, width), dtype=np.float32)
+        self.scalars = {name: np.zeros(64, dtype=np.float32) for name in scalars}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def column(self, name: str) -> np.ndarray:
+        return self.scalars[name][:len(self.ids)]
+
+    def matrix(self) -> np.ndarray:
+        return self.features[:len(self.ids)]
+
+    def widen(self, width: int):
+        features = np.zeros((self.features.shape[0], width), dtype=np.float32)
+        features[:, :self.features.shape[1]] = self.features
+        self.features = features
+
+    def set(self, entity_id: str, features: np.ndarray, **scalars: float) -> int:
+        row = self.rows.get(entity_id)
+        if row is None:
+            row = len(self.ids)
+            if row == self.features.shape[0]:
+                self.features = np.concatenate([self.features, np.zeros_like(self.features)])
+                for name, values in self.scalars.items():
+                    self.scalars[name] = np.concatenate([values, np.zeros_like(values)])
+            self.ids.append(entity_id)
+            self.rows[entity_id] = row
+        self.features[row] = features
+        for name, value in scalars.items():
+            self.scalars[name][row] = value
+        return row
+
+    def delete(self, entity_id: str):
+        row = self.rows.pop(entity_id, None)
+        if row is None:
+            return
+        last = len(self.ids) - 1
+        if row != last:
+            moved = self.ids[last]
+            self.ids[row] = moved
+            self.rows[moved] = row
+            self.features[row] = self.features[last]
+            for values in self.scalars.values():
+                values[row] = values[last]
+        self.ids.pop()
+
+class TenantMatcher:
+    """One user's customers and properties as NumPy feature matrices.
+
+    A customer's preference row dotted with a property's feature row gives the
+    type, area, bedroom, facing and vastu part of their score; budget fit is
+    computed elementwise from the parsed budget range and price.
+    """
+
+    def __init__(self):
+        # Lower-cased area name -> column offset past COL_AREAS
+        self.areas: Dict[str, int] = {}
+        self.width = COL_AREAS + INITIAL_AREA_SLOTS
+        self.customers = FeatureTable(self.width, ("low", "high", "budget_known", "active"))
+        self.properties = FeatureTable(self.width, ("price", "price_known", "available"))
+        # Interest and notes, rescanned when a new area appears
+        self.customer_texts: Dict[str, str] = {}
+        self.generations: Dict[str, Optional[int]] = {}
+
+    def _area_column(self, area: str) -> Optional[int]:
+        """Column for a property area, adding it (and flagging customers who mention it) if new."""
+        name = area.strip().lower()
+        if not name:
+            return None
+        offset = self.areas.get(name)
+        if offset is None:
+            offset = self.areas[name] = len(self.areas)
+            if COL_AREAS + offset >= self.width:
+                self.width = COL_AREAS + 2 * len(self.areas)
+                self.customers.widen(self.width)
+                self.properties.widen(self.width)
+            weight = WEIGHTS["area"]
+            for customer_id, text in self.customer_texts.items():
+                if mentions_area(text, name):
+                    row = self.customers.rows[customer_id]
+                    # First mentioned area: the customer now has an area preference
+                    if not self.customers.features[row, COL_AREAS:].any():
+                        self.customers.features[row, COL_BIAS] -= 0.5 * weight
+                    self.customers.features[row, COL_AREAS + offset] = weight
+        return COL_AREAS + offset
+
+    def upsert_customer(self, doc: Dict[str, Any]):
+        text = customer_text(doc)
+        preferences = customer_preferences(text)
+        row = np.zeros(self.width, dtype=np.float32)
+
+        def prefer(group: str, columns: List[int], partial: Tuple[List[int], float] = ((), 0)):
+            weight = WEIGHTS[group]
+            if not columns:
+                row[COL_BIAS] += 0.5 * weight
+                return
+            partial_columns, share = partial
+            row[list(partial_columns)] = share * weight
+            row[columns] = weight
+
+        prefer("type", [COL_TYPES + PROPERTY_TYPES.index(t) for t in preferences["types"]])
+        prefer("bedrooms", [COL_BEDROOMS + n for n in preferences["bedrooms"]], (
+            [COL_BEDROOMS + n + d for n in preferences["bedrooms"] for d in (-1, 1) if 0 <= n + d <= MAX_BEDROOMS],
+            0.5
+        ))
+        prefer("facing", [COL_FACINGS + i for i in preferences["facings"]])
+        prefer("vastu", [COL_VASTU] if preferences["vastu"] else [])
+        prefer("area", [COL_AREAS + offset for name, offset in self.areas.items() if mentions_area(text, name)])
+
+        low, high = parse_amount_range(doc.get("budget"))
+        self.customer_texts[doc["id"]] = text
+        self.customers.set(
+            doc["id"], row,
+            low=low if low is not None else 0.0,
+            high=high if high is not None else math.inf,
+            budget_known=low is not None,
+            active=_text(doc.get("status")) not in INACTIVE_CUSTOMER_STATUSES
+        )
+
+    def upsert_property(self, doc: Dict[str, Any]):
+        row = np.zeros(self.width, dtype=np.float32)
+        row[COL_BIAS] = 1
+        property_type = _text(doc.get("type"))
+        if property_type in PROPERTY_TYPES:
+            row[COL_TYPES + PROPERTY_TYPES.index(property_type)] = 1
+        row[COL_BEDROOMS + min(max(int(doc.get("bedrooms") or 0), 0), MAX_BEDROOMS)] = 1
+        facing = _facing_index(_text(doc.get("facing")))
+        if facing is not None:
+            row[COL_FACINGS + facing] = 1
+        row[COL_VASTU] = 1 if doc.get("vastu_compliant") else 0
+        area_column = self._area_column(_text(doc.get("area")))
+        if area_column is not None:
+            if area_column >= row.shape[0]:
+                row = np.concatenate([row, np.zeros(self.width - row.shape[0], dtype=np.float32)])
+            row[area_column] = 1
+
+        price = parse_amount(doc.get("price"))
+        self.properties.set(
+            doc["id"], row,
+            price=price if price is not None else 0.0,
+            price_known=price is not None,
+            available=_text(doc.get("deal_status")) not in OFF_MARKET_DEAL_STATUSES
+        )
+
+    def remove(self, collection: str, entity_id: str):
+        if collection == "customers":
+            self.customers.delete(entity_id)
+            self.customer_texts.pop(entity_id, None)
+        else:
+            self.properties.delete(entity_id)
+
+    def upsert(self, collection: str, doc: Dict[str, Any]):
+        if collection == "customers":
+            self.upsert_customer(doc)
+        else:
+            self.upsert_property(doc)
+
+    async def reload(self, sources: Dict[str, AsyncIterable[Dict[str, Any]]], generations: Dict[str, int]):
+        """Rebuild the given sides from async cursors, yielding every RELOAD_BATCH documents.
+
+        Properties load first so customers' area preferences see every area.
+        """
+        for collection in sources:
+            self.generations[collection] = None
+        for collection in sorted(sources, key=lambda c: c != "properties"):
+            if collection == "customers":
+                self.customers = FeatureTable(self.width, ("low", "high", "budget_known", "active"))
+                self.customer_texts = {}
+            else:
+                self.properties = FeatureTable(self.width, ("price", "price_known", "available"))
+            loaded = 0
+            async for doc in sources[collection]:
+                self.upsert(collection, doc)
+                loaded += 1
+                if loaded % RELOAD_BATCH == 0:
+                    await asyncio.sleep(0)
+        for collection in sources:
+            self.generations[collection] = generations[collection]
+
+    def _scores(self, customer_rows: np.ndarray, property_rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Scores of the given customers (rows) against properties (columns); out-of-budget pairs are 0."""
+        customers, properties = self.customers, self.properties
+        features = properties.matrix()
+        price = properties.column("price")
+        price_known = properties.column("price_known")
+        available = properties.column("available")
+        if property_rows is not None:
+            features, price, price_known, available = (
+                features[property_rows], price[property_rows], price_known[property_rows], available[property_rows]
+            )
+
+        low = customers.column("low")[customer_rows, None]
+        high = customers.column("high")[customer_rows, None]
+        fit = budget_fit(low, high, price[None, :])
+        # Unknown budgets or prices are neutral rather than a perfect fit
+        fit[customers.column("budget_known")[customer_rows] == 0] = 0.5
+        fit[:, price_known == 0] = 0.5
+
+        scores = customers.matrix()[customer_rows] @ features.T
+        scores += WEIGHTS["budget"] * fit
+        scores[(fit <= 0) | (available[None, :] == 0)] = 0
+        return scores
+
+    def properties_for_customer(self, customer_id: str, limit: int) -> Optional[List[Tuple[str, float]]]:
+        row = self.customers.rows.get(customer_id)
+        if row is None:
+            return None
+        scores = self._scores(np.array([row]))[0]
+        return [(self.properties.ids[i], float(scores[i])) for i in _top(scores, limit)]
+
+    def customers_for_property(self, property_id: str, limit: int) -> Optional[List[Tuple[str, float]]]:
+        row = self.properties.rows.get(property_id)
+        if row is None:
+            return None
+        active = np.flatnonzero(self.customers.column("active"))
+        scores = self._scores(active, np.array([row]))[:, 0]
+        return [(self.customers.ids[active[i]], float(scores[i])) for i in _top(scores, limit)]
+
+    def properties_for_all_customers(self, limit: int) -> Dict[str, List[Tuple[str, float]]]:
+        """Top properties for every active customer.
+
+        Customers with identical preference rows and budgets rank properties
+        identically, so each distinct row is scored once. Rows are scored
+        SCORE_BLOCK at a time in budget order, each block only against the
+        properties priced inside its budget window plus those without a price.
+        """
+        customers, properties = self.customers, self.properties
+        active = np.flatnonzero(customers.column("active"))
+        if not len(active) or not len(properties):
+            return {customers.ids[i]: [] for i in active}
+
+        low = customers.column("low")[active]
+        high = customers.column("high")[active]
+        budget_known = customers.column("budget_known")[active]
+        signatures = np.column_stack([customers.matrix()[active], low, high, budget_known])
+        # Grouping on row bytes is much cheaper than np.unique(axis=0), which sorts the rows
+        groups: Dict[bytes, int] = {}
+        inverse = np.array([groups.setdefault(signature.tobytes(), len(groups)) for signature in signatures])
+        _, representatives = np.unique(inverse, return_index=True)
+        # Unknown budgets (open window) last so they don't widen the known blocks
+        representatives = representatives[np.lexsort((low[representatives], budget_known[representatives] == 0))]
+
+        available = np.flatnonzero(properties.column("available"))
+        price_known = properties.column("price_known")[available]
+        unpriced = available[price_known == 0]
+        priced = available[price_known != 0]
+        priced = priced[np.argsort(properties.column("price")[priced], kind="stable")]
+        sorted_price = properties.column("price")[priced]
+
+        ranked: List[List[Tuple[str, float]]] = [[] for _ in representatives]
+        property_ids = properties.ids
+        for start in range(0, len(representatives), SCORE_BLOCK):
+            block = representatives[start:start + SCORE_BLOCK]
+            # Prices outside (low * (1 - below slack), high * (1 + above slack)) fit no one in the block
+            first = np.searchsorted(sorted_price, low[block].min() * (1 - BELOW_BUDGET_SLACK), side="right")
+            last = np.searchsorted(sorted_price, high[block].max() * (1 + ABOVE_BUDGET_SLACK), side="left")
+            columns = np.concatenate([priced[first:last], unpriced])
+            k = min(limit, len(columns))
+            if k <= 0:
+                continue
+            scores = self._scores(active[block], columns)
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1, kind="stable")
+            best = columns[np.take_along_axis(best, order, axis=1)]
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            for group, indices, values in zip(block.tolist(), best.tolist(), best_scores.tolist()):
+                ranked[inverse[group]] = [(property_ids[i], v) for i, v in zip(indices, values) if v > 0]
+
+        return {customers.ids[row]: ranked[group] for row, group in zip(active.tolist(), inverse.tolist())}
+
+class MatcherCache(TenantCache):
+    """Per-worker LRU of tenant matchers, built on first use and patched on writes."""
+
+    def __init__(self, max_tenants: int = MATCHING_MAX_TENANTS):
+        super().__init__(TenantMatcher, {
+            "properties": {"_id": 0, "id": 1, "type": 1, "area": 1, "bedrooms": 1, "facing": 1,
+                           "vastu_compliant": 1, "price": 1, "deal_status": 1},
+            "customers": {"_id": 0, "id": 1, "budget": 1, "interest": 1, "notes": 1, "status": 1},
+        }, max_tenants)
+
+    def upsert(self, user_id: str, collection: str, generation: int, doc: Dict[str, Any]):
+        """Apply a created or updated document, given the generation its write bumped to."""
+        matcher = self.caught_up(user_id, collection, generation)
+        if matcher is not None:
+            matcher.upsert(collection, doc)
+
+    def remove(self, user_id: str, collection: str, generation: int, entity_id: str):
+        matcher = self.caught_up(user_id, collection, generation)
+        if matcher is not None:
+            matcher.remove(collection, entity_id)
+
+matcher_cache = MatcherCache()
@@ -0,0 +1,198 @@
+import hmac
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+# Upper bounds in seconds; requests and Mongo commands share one bucket layout
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Route label for requests that matched no route, to keep label cardinality bounded
+UNMATCHED_ROUTE = "<unmatched>"
+
+# /api/metrics requires "Authorization: Bearer <METRICS_TOKEN>" and is not served without one
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def metrics_token_matches(authorization: Optional[str]) -> bool:
+    """Constant-time check of an Authorization header against METRICS_TOKEN."""
+    return bool(METRICS_TOKEN) and authorization is not None and hmac.compare_digest(
+        authorization, f"Bearer {METRICS_TOKEN}"
+    )
+
+class Histogram:
+    """Cumulative-on-render histogram: observe() is one bisect and three increments."""
+
+    __slots__ = ("counts", "sum")
+
+    def __init__(self):
+        # One slot per bucket plus the +Inf overflow
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+
+# Request metrics are only touched from the event loop thread
+request_latency: Dict[Tuple[str, str], Histogram] = {}
+request_statuses: Dict[Tuple[str, str, int], int] = {}
+requests_in_flight = 0
+
+# Mongo metrics are written from Motor's executor threads
+_mongo_lock = threading.Lock()
+mongo_latency: Dict[Tuple[str, str], Histogram] = {}
+mongo_documents: Dict[Tuple[str, str], int] = {}
+mongo_failures: Dict[Tuple[str, str], int] = {}
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route latency, status codes and in-flight requests.
+
+    Routes are labelled by their path template (``/api/properties/{property_id}``),
+    read from the scope after FastAPI has matched the request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        global requests_in_flight
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        requests_in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight -= 1
+            route = scope.get("route")
+            key = (scope["method"], route.path if route is not None else UNMATCHED_ROUTE)
+            histogram = request_latency.get(key)
+            if histogram is None:
+                histogram = request_latency[key] = Histogram()
+            histogram.observe(elapsed)
+            status_key = key + (status_code,)
+            request_statuses[status_key] = request_statuses.get(status_key, 0) + 1
+
+def _reply_documents(reply) -> int:
+    """Documents returned or written by a command, from its reply."""
+    cursor = reply.get("cursor")
+    if cursor is not None:
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or ())
+    n = reply.get("n")
+    return n if isinstance(n, int) else 0
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records per-collection, per-command latency, document counts and failures.
+
+    The collection is only known from the started event, so it is parked by
+    (connection, request id) until the matching succeeded/failed event arrives.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[object, int], str] = {}
+
+    def started(self, event):
+        command = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection", "")
+        else:
+            collection = command if isinstance(command, str) else ""
+        self._pending[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        key = (collection, event.command_name)
+        documents = _reply_documents(event.reply)
+        with _mongo_lock:
+            histogram = mongo_latency.get(key)
+            if histogram is None:
+                histogram = mongo_latency[key] = Histogram()
+            histogram.observe(event.duration_micros / 1e6)
+            mongo_documents[key] = mongo_documents.get(key, 0) + documents
+
+    def failed(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        key = (collection, event.command_name)
+        with _mongo_lock:
+            histogram = mongo_latency.get(key)
+            if histogram is None:
+                histogram = mongo_latency[key] = Histogram()
+            histogram.observe(event.duration_micros / 1e6)
+            mongo_failures[key] = mongo_failures.get(key, 0) + 1
+
+mongo_command_metrics = MongoCommandMetrics()
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return ",".join(pairs)
+
+def _render_histograms(lines: List[str], name: str, help_text: str, label_names: Tuple[str, ...], histograms):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for values, histogram in sorted(histograms.items()):
+        labels = _labels(label_names, values)
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        cumulative += histogram.counts[-1]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+def _render_counters(lines: List[str], name: str, help_text: str, label_names: Tuple[str, ...], counters):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for values, value in sorted(counters.items()):
+        lines.append(f"{name}{{{_labels(label_names, values)}}} {value}")
+
+def render_metrics() -> str:
+    """All metrics of this process in the Prometheus text exposition format."""
+    with _mongo_lock:
+        mongo_snapshot = (
+            {key: _copy(histogram) for key, histogram in mongo_latency.items()},
+            dict(mongo_documents),
+            dict(mongo_failures),
+        )
+
+    lines = [
+        "# HELP http_requests_in_flight Requests currently being served.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {requests_in_flight}",
+    ]
+    _render_histograms(lines, "http_request_duration_seconds", "Request latency by route.",
+                       ("method", "route"), dict(request_latency))
+    _render_counters(lines, "http_requests_total", "Requests by route and status code.",
+                     ("method", "route", "status"), dict(request_statuses))
+    _render_histograms(lines, "mongodb_command_duration_seconds", "MongoDB command latency.",
+                       ("collection", "command"), mongo_snapshot[0])
+    _render_counters(lines, "mongodb_command_documents_total", "Documents returned or written by MongoDB commands.",
+                     ("collection", "command"), mongo_snapshot[1])
+    _render_counters(lines, "mongodb_command_failures_total", "Failed MongoDB commands.",
+                     ("collection", "command"), mongo_snapshot[2])
+    return "\n".join(lines) + "\n"
+
+def _copy(histogram: Histogram) -> Histogram:
+    snapshot = Histogram()
+    snapshot.counts = list(histogram.counts)
+    snapshot.sum = histogram.sum
+    return snapshot
@@ -1,9 +1,11 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, EmailStr, field_validator
+from typing import List, Literal, Optional, Dict, Any
 from datetime import datetime
 from enum import Enum
 import uuid
 
+from utils import parse_month
+
 # Enums
 class UserRole(str, Enum):
     BROKER = "broker"
@@ -55,12 +57,34 @@ class NotificationType(str, Enum):
     INQUIRY = "inquiry"
     MEETING = "meeting"
 
+class RecurrenceFrequency(str, Enum):
+    DAILY = "daily"
+    WEEKLY = "weekly"
+    MONTHLY = "monthly"
+
 # Base Models
 class BaseDocument(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+# GeoJSON Point, coordinates in [longitude, latitude] order
+class GeoPoint(BaseModel):
+    type: Literal["Point"] = "Point"
+    coordinates: List[float] = Field(..., min_length=2, max_length=2)
+
+    @field_validator("coordinates")
+    @classmethod
+    def check_range(cls, coordinates: List[float]) -> List[float]:
+        longitude, latitude = coordinates
+        if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+            raise ValueError("coordinates must be [longitude, latitude] within [-180, 180] and [-90, 90]")
+        return coordinates
+
+class LocationUpdate(BaseModel):
+    id: str
+    location: Optional[GeoPoint] = None
+
 # User Models
 class User(BaseDocument):
     email: EmailStr
@@ -114,10 +138,11 @@ class Property(BaseDocument):
     is_corner: bool = False
     vastu_compliant: bool = False
     owner: PropertyOwner
-    images: List[str] = []
+    images: List[str] = []  # /api/images/<sha256> references or external URLs
     next_follow_up: Optional[datetime] = None
     deal_status: DealStatus = DealStatus.INTERESTED
     brokerage_amount: str
+    location: Optional[GeoPoint] = None
 
 class PropertyCreate(BaseModel):
     title: str
@@ -135,10 +160,11 @@ class PropertyCreate(BaseModel):
     is_corner: bool = False
     vastu_compliant: bool = False
     owner: PropertyOwner
-    images: List[str] = []
+    images: List[str] = []  # /api/images/<sha256> references or external URLs
     next_follow_up: Optional[datetime] = None
     deal_status: DealStatus = DealStatus.INTERESTED
     brokerage_amount: str
+    location: Optional[GeoPoint] = None
 
 # Customer Models
 class Customer(BaseDocument):
@@ -177,6 +203,8 @@ class Deal(BaseDocument):
     start_date: datetime
     close_date: Optional[datetime] = None
     notes: Optional[str] = None
+    status_changed_at: Optional[datetime] = None
+    furthest_status: Optional[DealStatus] = None  # furthest pipeline stage reached, for funnel analytics
 
 class DealCreate(BaseModel):
     property_id: str
@@ -224,6 +252,7 @@ class Project(BaseDocument):
     price_range: str
     layout_approval: str
     completion_date: datetime
+    location: Optional[GeoPoint] = None
     plots: List[Plot] = []
 
 class ProjectCreate(BaseModel):
@@ -234,6 +263,7 @@ class ProjectCreate(BaseModel):
     price_range: str
     layout_approval: str
     completion_date: datetime
+    location: Optional[GeoPoint] = None
 
 # Builder Customer Models
 class BuilderCustomer(BaseDocument):
@@ -279,19 +309,30 @@ class TeamMemberCreate(BaseModel):
 # Financial Models
 class FinancialRecord(BaseDocument):
     user_id: str
-    month: str
+    month: int  # 1-12
     year: int
+    fiscal_year: int  # April-March financial year, by its starting year
+    fiscal_quarter: int  # 1 = April-June
     revenue: float
     expenses: float
     profit: float
     category: str  # sales, marketing, operations, etc.
+    project_id: Optional[str] = None  # set for project-specific income and costs
 
 class FinancialRecordCreate(BaseModel):
-    month: str
-    year: int
+    month: int = Field(..., ge=1, le=12)
+    year: int = Field(..., ge=1900, le=2200)
     revenue: float
     expenses: float
     category: str
+    project_id: Optional[str] = None
+
+    @field_validator("month", mode="before")
+    @classmethod
+    def month_number(cls, value: Any) -> Any:
+        # Month names ("April", "Apr") and numeric strings are accepted as well
+        month = parse_month(value)
+        return month if month is not None else value
 
 # Notification Models
 class Notification(BaseDocument):
@@ -300,6 +341,7 @@ class Notification(BaseDocument):
     message: str
     type: NotificationType
     is_read: bool = False
+    read_at: Optional[datetime] = None  # Set when read; read notifications expire via TTL
     related_id: Optional[str] = None  # ID of related entity (customer, property, etc.)
 
 class NotificationCreate(BaseModel):
@@ -308,28 +350,54 @@ class NotificationCreate(BaseModel):
     type: NotificationType
     related_id: Optional[str] = None
 
+class BroadcastAudience(str, Enum):
+    TEAM = "team"
+    BROKERS = "brokers"
+
+class NotificationBroadcast(BaseModel):
+    title: str
+    message: str
+    type: NotificationType
+    related_id: Optional[str] = None
+    audiences: List[BroadcastAudience] = [BroadcastAudience.TEAM, BroadcastAudience.BROKERS]
+    project_id: Optional[str] = None  # Limit brokers to buyers of this project
+    background: bool = False  # Queue the writes and return immediately
+
 # Event/Calendar Models
+class RecurrenceRule(BaseModel):
+    frequency: RecurrenceFrequency
+    interval: int = Field(default=1, ge=1)
+    until: Optional[datetime] = None
+    count: Optional[int] = Field(default=None, ge=1)
+
 class Event(BaseDocument):
     user_id: str
     title: str
     type: str  # visit, call, meeting, documentation, registry
     date: datetime
     time: str
+    end_time: Optional[str] = None
+    starts_at: Optional[datetime] = None  # UTC, computed from date + time at write time
+    ends_at: Optional[datetime] = None  # UTC, computed from date + end_time
     customer: str
     phone: str
     location: str
     notes: Optional[str] = None
     status: str = "scheduled"  # scheduled, completed, cancelled
+    recurrence: Optional[RecurrenceRule] = None  # Stored once, expanded per requested window
+    series_ends_at: Optional[datetime] = None  # UTC start of a series' last occurrence; None if open-ended
 
 class EventCreate(BaseModel):
     title: str
     type: str
     date: datetime
     time: str
+    end_time: Optional[str] = None
     customer: str
     phone: str
     location: str
     notes: Optional[str] = None
+    recurrence: Optional[RecurrenceRule] = None
 
 # Analytics Models
 class BrokerageAnalytics(BaseModel):
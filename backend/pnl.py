@@ -0,0 +1,309 @@
+"""Monthly profit and loss rollup behind the rolling-window trend endpoint.
+
+Financial records and paid plot payments are folded into one document per
+tenant, project, category and month, so multi-year trends read a few hundred
+small rows through the ``(user_id, period)`` index instead of rescanning
+records and every project's embedded payments. A tenant's rollup is built from
+scratch on their first trend read; after that, records are applied as ``$inc``
+deltas when they are written and a project's payment rows are recomputed from
+its plots whenever they change.
+
+Rolling sums run in the database: ``$densify`` fills months without activity
+and ``$setWindowFields`` sums each window over calendar months (MongoDB 5.1+).
+"""
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from pymongo import InsertOne, UpdateOne
+
+from conditional import bump_generation, read_generation
+from database import BACKFILL_BATCH_SIZE, get_db, mark_migration_done, migration_done
+from utils import fiscal_period, parse_amount, parse_month
+
+logger = logging.getLogger(__name__)
+
+# Rows: {"_id": "<user>:<project>:<category>:<YYYY-MM>", "user_id", "project_id": str | None,
+#        "category", "period": datetime (first of the month), "revenue", "expenses"}
+ROLLUP_COLLECTION = "pnl_monthly"
+# {"_id": user_id, "building": bool, "built_at": datetime, "writers": [{"token", "at": datetime}]};
+# writes only update built rollups, and register in writers while they run
+ROLLUP_STATE_COLLECTION = "pnl_rollup_state"
+# Writers registered longer ago than this died mid-request and no longer hold builds back
+WRITER_TIMEOUT = timedelta(minutes=5)
+# Builds repeated while writes keep landing during them, before leaving it to the next read
+MAX_BUILD_ATTEMPTS = 3
+# Amounts that cancel out leave float residue; below half a paisa a row counts as empty
+ZERO_TOLERANCE = 0.005
+
+# Category of the revenue rows derived from paid plot payments
+PAYMENTS_CATEGORY = "plot_payments"
+
+# One-off normalization of legacy string months, recorded in the migrations collection
+FINANCIAL_MONTHS_MIGRATION = "financial_months_normalized"
+
+TREND_WINDOWS = (3, 6, 12)
+# What a trend is split by: one series per project, per category, or a single total
+TREND_SPLITS = {"project": "$project_id", "category": "$category", "total": None}
+
+def _period(year: int, month: int) -> datetime:
+    return datetime(year, month, 1)
+
+def _row_id(user_id: str, project_id: Optional[str], category: str, period: datetime) -> str:
+    return f"{user_id}:{project_id or '-'}:{category}:{period:%Y-%m}"
+
+async def _rollup_built(user_id: str) -> bool:
+    state = await get_db()[ROLLUP_STATE_COLLECTION].find_one({"_id": user_id}, {"building": 1})
+    return state is not None and not state.get("building")
+
+def _row(user_id: str, project_id: Optional[str], category: str, period: datetime) -> Dict[str, Any]:
+    return {
+        "_id": _row_id(user_id, project_id, category, period),
+        "user_id": user_id, "project_id": project_id, "category": category, "period": period,
+    }
+
+@asynccontextmanager
+async def record_write(user_id: str) -> AsyncIterator[None]:
+    """Wrap a financial record write and its apply_record calls.
+
+    While the write is registered no build of the tenant's rollup completes, so
+    a build never counts a record whose delta is applied after it finishes.
+    """
+    state = get_db()[ROLLUP_STATE_COLLECTION]
+    token = uuid.uuid4().hex
+    await state.update_one(
+        {"_id": user_id},
+        {"$push": {"writers": {"token": token, "at": datetime.utcnow()}}, "$setOnInsert": {"building": True}},
+        upsert=True
+    )
+    try:
+        yield
+    finally:
+        await state.update_one({"_id": user_id}, {"$pull": {"writers": {"token": token}}})
+
+async def apply_record(user_id: str, record: Dict[str, Any], sign: int = 1):
+    """Add (sign 1) or remove (sign -1) a financial record's amounts from the rollup."""
+    if not isinstance(record.get("month"), int) or not isinstance(record.get("year"), int):
+        # Legacy months that could not be normalized have no place in a monthly series
+        return
+    if not await _rollup_built(user_id):
+        # The build reads the record itself
+        return
+    row = _row(user_id, record.get("project_id"), record["category"], _period(record["year"], record["month"]))
+    row_id = row.pop("_id")
+    rollup = get_db()[ROLLUP_COLLECTION]
+    await rollup.update_one(
+        {"_id": row_id},
+        {"$inc": {"revenue": sign * record["revenue"], "expenses": sign * record["expenses"]}, "$setOnInsert": row},
+        upsert=True
+    )
+    if sign < 0:
+        # A month emptied by moves and deletes would otherwise start series with zeros
+        empty = {"$gt": -ZERO_TOLERANCE, "$lt": ZERO_TOLERANCE}
+        await rollup.delete_one({"_id": row_id, "revenue": empty, "expenses": empty})
+
+def _payment_rows(user_id: str, project_id: str, plots: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    rows: Dict[str, Dict[str, Any]] = {}
+    for plot in plots:
+        for payment in plot.get("payments") or []:
+            amount = parse_amount(payment.get("amount"))
+            if payment.get("status") != "Paid" or amount is None or not payment.get("date"):
+                continue
+            row = _row(user_id, project_id, PAYMENTS_CATEGORY, _period(payment["date"].year, payment["date"].month))
+            row = rows.setdefault(row["_id"], {**row, "revenue": 0.0, "expenses": 0.0})
+            row["revenue"] += amount
+    return list(rows.values())
+
+async def replace_project_payments(user_id: str, project_id: str, plots: Iterable[Dict[str, Any]]):
+    """Recompute a project's payment rows from its plots (pass [] once it is deleted)."""
+    if not await _rollup_built(user_id):
+        return
+    rollup = get_db()[ROLLUP_COLLECTION]
+    await rollup.delete_many({"user_id": user_id, "project_id": project_id, "category": PAYMENTS_CATEGORY})
+    rows = _payment_rows(user_id, project_id, plots)
+    if rows:
+        await rollup.bulk_write([InsertOne(row) for row in rows], ordered=False)
+
+async def build_rollup(user_id: str):
+    """Rebuild a tenant's rollup from their financial records and projects."""
+    db = get_db()
+    rows: Dict[str, Dict[str, Any]] = {}
+    async for record in db.financial_records.find(
+        {"user_id": user_id, "month": {"$type": "int"}},
+        {"_id": 0, "project_id": 1, "category": 1, "year": 1, "month": 1, "revenue": 1, "expenses": 1}
+    ):
+        row = _row(user_id, record.get("project_id"), record["category"], _period(record["year"], record["month"]))
+        row = rows.setdefault(row["_id"], {**row, "revenue": 0.0, "expenses": 0.0})
+        row["revenue"] += record["revenue"]
+        row["expenses"] += record["expenses"]
+    async for project in db.projects.find({"user_id": user_id}, {"_id": 0, "id": 1, "plots.payments": 1}):
+        for row in _payment_rows(user_id, project["id"], project.get("plots", [])):
+            rows[row["_id"]] = row
+
+    rollup = db[ROLLUP_COLLECTION]
+    await rollup.delete_many({"user_id": user_id})
+    if rows:
+        await rollup.bulk_write([InsertOne(row) for row in rows.values()], ordered=False)
+    logger.info("Built P&L rollup for user %s: %d rows", user_id, len(rows))
+
+async def _writes_in_flight(user_id: str) -> bool:
+    state = await get_db()[ROLLUP_STATE_COLLECTION].find_one({"_id": user_id}, {"writers": 1})
+    cutoff = datetime.utcnow() - WRITER_TIMEOUT
+    return any(writer["at"] >= cutoff for writer in (state or {}).get("writers") or [])
+
+async def _source_generations(user_id: str) -> List[int]:
+    return [(await read_generation(user_id, collection))[0] for collection in ("financial_records", "projects")]
+
+async def ensure_rollup(user_id: str):
+    """Build a tenant's rollup unless it already exists.
+
+    The state is marked building before the sources are read, so writes landing
+    meanwhile leave the rollup alone instead of updating rows the build is
+    about to replace. Writes bump their collection's generation before touching
+    the rollup, so a build that saw the generations move missed some of them
+    and runs again, as does one that ends while a record write is registered
+    (see record_write): that write may have been read by the build and still be
+    about to apply its delta.
+    """
+    state = get_db()[ROLLUP_STATE_COLLECTION]
+    current = await state.find_one({"_id": user_id})
+    if current is not None and not current.get("building"):
+        return
+    for _ in range(MAX_BUILD_ATTEMPTS):
+        await state.update_one({"_id": user_id}, {"$set": {"building": True}}, upsert=True)
+        generations = await _source_generations(user_id)
+        await build_rollup(user_id)
+        await state.update_one({"_id": user_id}, {
+            "$set": {"building": False, "built_at": datetime.utcnow()},
+            "$pull": {"writers": {"at": {"$lt": datetime.utcnow() - WRITER_TIMEOUT}}}
+        })
+        if await _source_generations(user_id) == generations and not await _writes_in_flight(user_id):
+            return
+        logger.info("P&L sources of user %s changed while its rollup was built; rebuilding", user_id)
+    # Still changing: serve this build, and leave the next read to build again
+    await state.update_one({"_id": user_id}, {"$set": {"building": True}})
+
+async def normalize_financial_months():
+    """Convert legacy string months ("April", "4") of financial records to 1-12 and
+    add the financial year and quarter the analytics pipelines group on.
+
+    Runs once: later records are stored normalized. Tenants whose records changed
+    get their cached lists invalidated and their rollup rebuilt on the next trend
+    read, since it left out the months that were strings. Records whose month
+    cannot be parsed are left as they are and logged.
+    """
+    if await migration_done(FINANCIAL_MONTHS_MIGRATION):
+        return
+    db = get_db()
+
+    batch = []
+    owners = set()
+    unparseable = 0
+    cursor = db.financial_records.find(
+        {"$or": [{"month": {"$type": "string"}}, {"fiscal_year": {"$exists": False}}]},
+        {"_id": 1, "user_id": 1, "month": 1, "year": 1}
+    )
+    async for record in cursor:
+        month = parse_month(record.get("month"))
+        if month is None or not isinstance(record.get("year"), int):
+            unparseable += 1
+            continue
+        fiscal_year, fiscal_quarter = fiscal_period(record["year"], month)
+        batch.append(UpdateOne({"_id": record["_id"]}, {"$set": {
+            "month": month, "fiscal_year": fiscal_year, "fiscal_quarter": fiscal_quarter
+        }}))
+        owners.add(record.get("user_id"))
+
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            await db.financial_records.bulk_write(batch, ordered=False)
+            batch = []
+
+    if batch:
+        await db.financial_records.bulk_write(batch, ordered=False)
+    for user_id in owners:
+        await bump_generation(user_id, "financial_records")
+    if owners:
+        # Marked for a rebuild rather than deleted, which would drop registered writers
+        await db[ROLLUP_STATE_COLLECTION].update_many({"_id": {"$in": list(owners)}}, {"$set": {"building": True}})
+    if unparseable:
+        logger.warning("%d financial records have a month or year that could not be normalized", unparseable)
+    await mark_migration_done(FINANCIAL_MONTHS_MIGRATION)
+
+def parse_windows(value: Optional[str]) -> List[int]:
+    """Window lengths in months, e.g. "3,6,12"; ValueError when malformed."""
+    if not value:
+        return list(TREND_WINDOWS)
+    try:
+        windows = sorted({int(part) for part in value.split(",") if part.strip()})
+    except ValueError:
+        windows = []
+    if not windows or not all(1 <= window <= 120 for window in windows):
+        raise ValueError("windows must be comma-separated month counts between 1 and 120")
+    return windows
+
+def _shift_months(period: datetime, months: int) -> datetime:
+    index = period.year * 12 + period.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def _amounts(revenue: float, expenses: float) -> Dict[str, float]:
+    # Rounded to paise, dropping the residue of summing float amounts
+    return {"revenue": round(revenue, 2), "expenses": round(expenses, 2), "profit": round(revenue - expenses, 2)}
+
+async def trend(
+    user_id: str,
+    windows: List[int],
+    split: str = "total",
+    project_id: Optional[str] = None,
+    category: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Monthly revenue, expenses and profit with rolling sums over each window, per series."""
+    await ensure_rollup(user_id)
+    match: Dict[str, Any] = {"user_id": user_id}
+    if project_id is not None:
+        match["project_id"] = project_id
+    if category:
+        match["category"] = category
+    if start or end:
+        match["period"] = {}
+        if start:
+            # Earlier months feed the first windows of the requested range
+            match["period"]["$gte"] = _shift_months(start, 1 - max(windows))
+        if end:
+            match["period"]["$lte"] = end
+
+    output = {}
+    for window in windows:
+        bounds = {"range": [1 - window, 0], "unit": "month"}
+        output[f"revenue_{window}m"] = {"$sum": "$revenue", "window": bounds}
+        output[f"expenses_{window}m"] = {"$sum": "$expenses", "window": bounds}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"period": "$period", "key": TREND_SPLITS[split]},
+            "revenue": {"$sum": "$revenue"},
+            "expenses": {"$sum": "$expenses"}
+        }},
+        {"$project": {"_id": 0, "period": "$_id.period", "key": "$_id.key", "revenue": 1, "expenses": 1}},
+        {"$densify": {"field": "period", "partitionByFields": ["key"], "range": {"step": 1, "unit": "month", "bounds": "partition"}}},
+        {"$setWindowFields": {"partitionBy": "$key", "sortBy": {"period": 1}, "output": output}},
+    ]
+    if start:
+        pipeline.append({"$match": {"period": {"$gte": start}}})
+    pipeline.append({"$sort": {"key": 1, "period": 1}})
+
+    series: Dict[Any, List[Dict[str, Any]]] = {}
+    async for row in get_db()[ROLLUP_COLLECTION].aggregate(pipeline):
+        revenue, expenses = row.get("revenue", 0), row.get("expenses", 0)
+        point = {"period": f"{row['period']:%Y-%m}", **_amounts(revenue, expenses)}
+        for window in windows:
+            point[f"{window}m"] = _amounts(row[f"revenue_{window}m"], row[f"expenses_{window}m"])
+        series.setdefault(row.get("key"), []).append(point)
+    return {
+        "split": split,
+        "windows": windows,
+        "series": [{"key": key, "points": points} for key, points in series.items()],
+    }
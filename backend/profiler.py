@@ -0,0 +1,219 @@
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Profiling is only reachable when a token is configured; without one it cannot be switched on
+PROFILER_TOKEN = os.environ.get("PROFILER_TOKEN")
+PROFILER_SAMPLE_HZ = float(os.environ.get("PROFILER_SAMPLE_HZ", "100"))
+PROFILER_OUTPUT_DIR = Path(os.environ.get("PROFILER_OUTPUT_DIR", Path(__file__).parent / "profiles"))
+PROFILER_MAX_SECONDS = 300
+
+# Frames kept per sample, innermost first; deeper stacks are truncated at the root end
+MAX_STACK_DEPTH = 128
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+class SamplingProfiler:
+    """Statistical profiler sampling every thread's stack from a background thread.
+
+    Each sample is one ``sys._current_frames()`` call and a walk of code objects;
+    labels are built once per code object and only when the profile is written,
+    so the sampled threads pay only for the GIL hand-off.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._samples: Counter = Counter()
+        self._started_at = 0.0
+        self._deadline = 0.0
+        self._interval = 1 / PROFILER_SAMPLE_HZ
+        self._label = ""
+        self._stem: Optional[Path] = None
+        self.last_output: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def output_path(self, suffix: str) -> Path:
+        """Where the current (or last) session's file with this suffix is written."""
+        return self._stem.with_name(self._stem.name + suffix)
+
+    def start(self, duration: float, label: str = "session", sample_hz: Optional[float] = None) -> bool:
+        """Start sampling for up to duration seconds; False if a session is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self._samples = Counter()
+            self._interval = 1 / (sample_hz or PROFILER_SAMPLE_HZ)
+            self._label = label
+            self._stem = PROFILER_OUTPUT_DIR / f"profile-{datetime.utcnow():%Y%m%d-%H%M%S-%f}-{label}"
+            self._started_at = time.monotonic()
+            self._deadline = self._started_at + min(duration, PROFILER_MAX_SECONDS)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> Optional[Dict[str, Any]]:
+        """Stop the running session and wait for its files to be written."""
+        thread = self._thread
+        if thread is None:
+            return self.last_output
+        self._stop.set()
+        thread.join()
+        return self.last_output
+
+    def _run(self):
+        own_id = threading.get_ident()
+        interval = self._interval
+        samples = self._samples
+        next_tick = time.monotonic()
+        while not self._stop.is_set() and next_tick < self._deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                samples[(thread_id, tuple(stack))] += 1
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # Fell behind (e.g. GIL contention); skip missed ticks rather than burst
+                next_tick = time.monotonic()
+        elapsed = time.monotonic() - self._started_at
+        try:
+            self.last_output = self._write(samples, elapsed)
+        except Exception:
+            logger.exception("Failed to write profile")
+
+    def _write(self, samples: Counter, elapsed: float) -> Dict[str, Any]:
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        labels: Dict[Any, Tuple[str, str, int]] = {}
+
+        def frame_info(code) -> Tuple[str, str, int]:
+            info = labels.get(code)
+            if info is None:
+                info = labels[code] = (code.co_name, code.co_filename, code.co_firstlineno)
+            return info
+
+        collapsed: Counter = Counter()
+        by_thread: Dict[str, List[Tuple[List[Tuple[str, str, int]], int]]] = {}
+        for (thread_id, stack), count in samples.items():
+            thread_name = thread_names.get(thread_id, f"thread-{thread_id}")
+            frames = [frame_info(code) for code in reversed(stack)]
+            key = ";".join([thread_name] + [f"{name} ({os.path.basename(file)}:{line})" for name, file, line in frames])
+            collapsed[key] += count
+            by_thread.setdefault(thread_name, []).append((frames, count))
+
+        PROFILER_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        collapsed_path = self.output_path(".collapsed")
+        with open(collapsed_path, "w") as f:
+            for key, count in collapsed.most_common():
+                f.write(f"{key} {count}\n")
+
+        speedscope_path = self.output_path(".speedscope.json")
+        with open(speedscope_path, "w") as f:
+            json.dump(self._speedscope(by_thread, elapsed), f)
+
+        total = sum(samples.values())
+        logger.info("Wrote profile %s (%d samples over %.1fs)", collapsed_path, total, elapsed)
+        return {
+            "collapsed": str(collapsed_path),
+            "speedscope": str(speedscope_path),
+            "samples": total,
+            "seconds": round(elapsed, 3),
+        }
+
+    def _speedscope(self, by_thread, elapsed: float) -> Dict[str, Any]:
+        frame_index: Dict[Tuple[str, str, int], int] = {}
+        frames = []
+        profiles = []
+        for thread_name, stacks in sorted(by_thread.items()):
+            sample_list, weights = [], []
+            for stack, count in stacks:
+                indices = []
+                for info in stack:
+                    index = frame_index.get(info)
+                    if index is None:
+                        index = frame_index[info] = len(frames)
+                        frames.append({"name": info[0], "file": info[1], "line": info[2]})
+                    indices.append(index)
+                sample_list.append(indices)
+                weights.append(count * self._interval)
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": elapsed,
+                "samples": sample_list,
+                "weights": weights,
+            })
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": self._label,
+            "exporter": "realestate-pro sampling profiler",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+profiler = SamplingProfiler()
+
+def token_matches(value: Optional[str]) -> bool:
+    return bool(PROFILER_TOKEN) and value is not None and hmac.compare_digest(value, PROFILER_TOKEN)
+
+class RequestProfilerMiddleware:
+    """Profiles a single request when it carries ``X-Profile-Request: <PROFILER_TOKEN>``.
+
+    All threads are sampled, so concurrent requests show up too. The response
+    names the speedscope file in X-Profile-Output; it is written once the
+    request has finished.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILER_TOKEN:
+            await self.app(scope, receive, send)
+            return
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile-request":
+                token = value.decode("latin-1")
+                break
+        if not token_matches(token) or not profiler.start(PROFILER_MAX_SECONDS, label="request"):
+            await self.app(scope, receive, send)
+            return
+
+        output = str(profiler.output_path(".speedscope.json")).encode()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-output", output)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Joining the sampler and writing files must not block the event loop
+            await run_in_threadpool(profiler.stop)
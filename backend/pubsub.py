@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Messages kept per user for Last-Event-ID replay (in-memory backend)
+REPLAY_BUFFER_SIZE = 100
+# Messages queued per connected client before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+STREAM_COLLECTION = "notification_stream"
+STREAM_COLLECTION_BYTES = 16 * 1024 * 1024
+
+class InMemoryBackend:
+    """Single-process backend: publishes dispatch directly, replay from a per-user ring buffer."""
+
+    def __init__(self):
+        # Event ids embed a per-process token so ids from another process force a resync
+        self._boot = uuid.uuid4().hex[:8]
+        self._sequences: Dict[str, int] = {}
+        self._buffers: Dict[str, deque] = {}
+        self._dispatch = None
+
+    async def start(self, dispatch):
+        self._dispatch = dispatch
+
+    async def stop(self):
+        pass
+
+    async def publish_many(self, messages: List[Tuple[str, str, Dict[str, Any]]]):
+        for user_id, event, data in messages:
+            sequence = self._sequences.get(user_id, 0) + 1
+            self._sequences[user_id] = sequence
+            message = {
+                "id": f"{self._boot}-{sequence}",
+                "user_id": user_id,
+                "event": event,
+                "data": data,
+            }
+            buffer = self._buffers.get(user_id)
+            if buffer is None:
+                buffer = self._buffers[user_id] = deque(maxlen=REPLAY_BUFFER_SIZE)
+            buffer.append((sequence, message))
+            self._dispatch(message)
+
+    async def replay(self, user_id: str, last_event_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Messages after last_event_id, or None when the gap cannot be replayed."""
+        boot, _, sequence = last_event_id.partition("-")
+        if boot != self._boot or not sequence.isdigit():
+            return None
+        last_sequence = int(sequence)
+        if last_sequence > self._sequences.get(user_id, 0):
+            return None
+        buffer = self._buffers.get(user_id, ())
+        if buffer and buffer[0][0] > last_sequence + 1:
+            # Messages after the client's position were already evicted
+            return None
+        return [message for sequence, message in buffer if sequence > last_sequence]
+
+class MongoBackend:
+    """Multi-worker backend: messages go through a capped collection tailed by every worker.
+
+    Works on a standalone mongod (no change streams needed); event ids are the
+    capped documents' ObjectIds, so any worker can replay after a reconnect.
+    """
+
+    def __init__(self):
+        self._dispatch = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, dispatch):
+        self._dispatch = dispatch
+        db = get_db()
+        try:
+            await db.create_collection(STREAM_COLLECTION, capped=True, size=STREAM_COLLECTION_BYTES)
+        except CollectionInvalid:
+            pass
+        await db[STREAM_COLLECTION].create_index([("user_id", 1), ("_id", 1)])
+        self._task = asyncio.create_task(self._tail())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish_many(self, messages: List[Tuple[str, str, Dict[str, Any]]]):
+        created_at = datetime.utcnow()
+        await get_db()[STREAM_COLLECTION].insert_many([
+            {"user_id": user_id, "event": event, "data": data, "created_at": created_at}
+            for user_id, event, data in messages
+        ])
+
+    async def replay(self, user_id: str, last_event_id: str) -> Optional[List[Dict[str, Any]]]:
+        try:
+            last_id = ObjectId(last_event_id)
+        except (InvalidId, TypeError):
+            return None
+        collection = get_db()[STREAM_COLLECTION]
+        oldest = await collection.find_one({}, {"_id": 1}, sort=[("$natural", 1)])
+        if oldest is None or oldest["_id"] > last_id:
+            # The capped collection has already rolled past the client's position
+            return None
+        docs = await collection.find({"user_id": user_id, "_id": {"$gt": last_id}})\
+            .sort("_id", 1)\
+            .limit(REPLAY_BUFFER_SIZE)\
+            .to_list(None)
+        return [self._to_message(doc) for doc in docs]
+
+    @staticmethod
+    def _to_message(doc: Dict[str, Any]) -> Dict[str, Any]:
+        return {"id": str(doc["_id"]), "user_id": doc["user_id"], "event": doc["event"], "data": doc["data"]}
+
+    async def _tail(self):
+        collection = get_db()[STREAM_COLLECTION]
+        latest = await collection.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+        last_id = latest["_id"] if latest else ObjectId.from_datetime(datetime.utcnow())
+        while True:
+            try:
+                cursor = collection.find({"_id": {"$gt": last_id}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc["_id"]
+                        self._dispatch(self._to_message(doc))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Notification stream tailer failed")
+            # A tailable cursor on an empty collection dies immediately
+            await asyncio.sleep(1)
+
+BACKENDS = {
+    "memory": InMemoryBackend,
+    "mongo": MongoBackend,
+}
+
+class NotificationBus:
+    """Per-user pub/sub for pushing notification changes to connected clients."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    async def start(self):
+        if self.backend is None:
+            backend_name = os.environ.get("NOTIFICATION_BUS_BACKEND", "memory")
+            self.backend = BACKENDS[backend_name]()
+        await self.backend.start(self._dispatch)
+
+    async def stop(self):
+        if self.backend is not None:
+            await self.backend.stop()
+
+    async def publish(self, user_id: str, event: str, data: Dict[str, Any]):
+        """Publish an event to every connection of a user, on any worker."""
+        await self.publish_many([(user_id, event, data)])
+
+    async def publish_many(self, messages: List[Tuple[str, str, Dict[str, Any]]]):
+        """Publish (user_id, event, data) messages in one backend round trip."""
+        if self.backend is None or not messages:
+            return
+        try:
+            await self.backend.publish_many(messages)
+        except Exception:
+            # Push is best effort; clients resync on reconnect
+            logger.exception("Failed to publish %d messages", len(messages))
+
+    async def replay(self, user_id: str, last_event_id: str) -> Optional[List[Dict[str, Any]]]:
+        return await self.backend.replay(user_id, last_event_id)
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def _dispatch(self, message: Dict[str, Any]):
+        for queue in self._subscribers.get(message["user_id"], ()):
+            if queue.full():
+                # Slow client: drop the oldest message rather than block publishers
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+notification_bus = NotificationBus()
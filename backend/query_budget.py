@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Mongo commands a single request may issue before it is flagged
+QUERY_BUDGET = int(os.environ.get("MONGO_QUERY_BUDGET", "8"))
+# Commands slower than this are logged with their filter shape and plan
+SLOW_QUERY_MS = float(os.environ.get("MONGO_SLOW_QUERY_MS", "100"))
+# The same collection/command/filter keys this many times in one request looks like N+1
+REPEATED_QUERY_THRESHOLD = int(os.environ.get("MONGO_REPEATED_QUERY_THRESHOLD", "5"))
+# Adds X-Mongo-Queries / X-Mongo-Time-Ms response headers
+QUERY_DEBUG = os.environ.get("MONGO_QUERY_DEBUG", "").lower() in ("1", "true", "yes")
+
+# A slow shape is explained at most once per interval
+EXPLAIN_INTERVAL_SECONDS = 600
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct"}
+# Session and cluster fields that must not be copied into an explain
+COMMAND_ENVELOPE_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction"}
+
+class QueryStats:
+    """Mongo commands issued within one request (or one track_queries block)."""
+
+    __slots__ = ("count", "duration_ms", "repeats", "_lock")
+
+    def __init__(self):
+        self.count = 0
+        self.duration_ms = 0.0
+        self.repeats: Dict[Tuple, int] = {}
+        # Motor runs commands, and so the listener, on executor threads
+        self._lock = threading.Lock()
+
+    def record(self, key: Tuple, duration_ms: float):
+        with self._lock:
+            self.count += 1
+            self.duration_ms += duration_ms
+            self.repeats[key] = self.repeats.get(key, 0) + 1
+
+    def repeated(self):
+        return {key: count for key, count in self.repeats.items() if count >= REPEATED_QUERY_THRESHOLD}
+
+# Motor copies the context into its executor, so the listener sees the request's stats
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+
+@contextmanager
+def track_queries():
+    """Count Mongo commands issued inside the block, e.g. to assert a budget in tests."""
+    stats = QueryStats()
+    token = current_query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_query_stats.reset(token)
+
+def command_filter(command_name: str, command: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The query filter of a command, where it has one."""
+    if command_name == "find":
+        return command.get("filter")
+    if command_name in ("count", "distinct", "findAndModify"):
+        return command.get("query")
+    if command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or ()
+        return statements[0].get("q") if statements else None
+    if command_name == "aggregate":
+        for stage in command.get("pipeline", ()):
+            if "$match" in stage:
+                return stage["$match"]
+    return None
+
+def filter_shape(value: Any) -> Any:
+    """A filter with its values replaced by placeholders, for logging without data."""
+    if isinstance(value, dict):
+        return {key: filter_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, dict) for item in value):
+            return [filter_shape(item) for item in value]
+        return ["?"]
+    return "?"
+
+def plan_summary(explain: Dict[str, Any]) -> str:
+    """Winning plan stages and execution counts from an explain result."""
+    planner = _find_key(explain, "queryPlanner") or {}
+    stages = []
+    stage = planner.get("winningPlan", {})
+    while stage:
+        name = stage.get("stage", "?")
+        if stage.get("indexName"):
+            name += f"({stage['indexName']})"
+        stages.append(name)
+        stage = stage.get("inputStage") or (stage.get("inputStages") or [None])[0]
+    execution = _find_key(explain, "executionStats") or {}
+    return "{} returned={} keys={} docs={} ms={}".format(
+        " <- ".join(stages) or "?",
+        execution.get("nReturned"),
+        execution.get("totalKeysExamined"),
+        execution.get("totalDocsExamined"),
+        execution.get("executionTimeMillis"),
+    )
+
+def _find_key(value: Any, key: str) -> Optional[Dict[str, Any]]:
+    # Aggregate explains nest the planner output under stages/shards
+    if isinstance(value, dict):
+        if key in value:
+            return value[key]
+        children = value.values()
+    elif isinstance(value, list):
+        children = value
+    else:
+        return None
+    for child in children:
+        found = _find_key(child, key)
+        if found is not None:
+            return found
+    return None
+
+class QueryMonitor(monitoring.CommandListener):
+    """Per-request command counting plus slow-query logging with explain plans."""
+
+    def __init__(self):
+        self._pending: Dict[Tuple[object, int], Tuple[Optional[QueryStats], str, Dict[str, Any]]] = {}
+        self._explained: Dict[str, float] = {}
+        self._client = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach(self, client, loop: asyncio.AbstractEventLoop):
+        """Give the monitor a Motor client and loop to run explains on."""
+        self._client = client
+        self._loop = loop
+
+    def started(self, event):
+        self._pending[(event.connection_id, event.request_id)] = (
+            current_query_stats.get(),
+            event.database_name,
+            event.command,
+        )
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        stats, database_name, command = pending
+        command_name = event.command_name
+        collection = command.get(command_name)
+        if command_name == "getMore":
+            collection = command.get("collection")
+        duration_ms = event.duration_micros / 1000
+
+        if stats is not None:
+            query_filter = command_filter(command_name, command)
+            keys = tuple(sorted(query_filter)) if isinstance(query_filter, dict) else ()
+            stats.record((collection, command_name, keys), duration_ms)
+
+        if duration_ms >= SLOW_QUERY_MS and command_name != "explain":
+            shape = filter_shape(command_filter(command_name, command))
+            logger.warning("Slow Mongo %s on %s.%s took %.1f ms, filter=%s",
+                           command_name, database_name, collection, duration_ms, shape)
+            self._schedule_explain(database_name, collection, command_name, command, shape)
+
+    def _schedule_explain(self, database_name, collection, command_name, command, shape):
+        if command_name not in EXPLAINABLE_COMMANDS or self._client is None or self._loop is None:
+            return
+        shape_key = f"{database_name}.{collection}:{command_name}:{shape}"
+        now = time.monotonic()
+        if now - self._explained.get(shape_key, -EXPLAIN_INTERVAL_SECONDS) < EXPLAIN_INTERVAL_SECONDS:
+            return
+        self._explained[shape_key] = now
+        body = {k: v for k, v in command.items() if not k.startswith("$") and k not in COMMAND_ENVELOPE_FIELDS}
+        asyncio.run_coroutine_threadsafe(self._explain(database_name, body, shape_key), self._loop)
+
+    async def _explain(self, database_name: str, body: Dict[str, Any], shape_key: str):
+        try:
+            explain = await self._client[database_name].command(
+                {"explain": body, "verbosity": "executionStats"}
+            )
+            logger.warning("Plan for slow %s: %s", shape_key, plan_summary(explain))
+        except Exception as e:
+            logger.warning("Could not explain slow %s: %s", shape_key, e)
+
+query_monitor = QueryMonitor()
+
+class QueryBudgetMiddleware:
+    """Scopes QueryStats to each HTTP request and reports requests over budget or with N+1 patterns."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+
+        async def send_wrapper(message):
+            if QUERY_DEBUG and message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-mongo-queries", str(stats.count).encode()),
+                    (b"x-mongo-time-ms", f"{stats.duration_ms:.1f}".encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_query_stats.reset(token)
+            route = scope.get("route")
+            path = route.path if route is not None else scope["path"]
+            if stats.count > QUERY_BUDGET:
+                logger.warning("%s %s issued %d Mongo commands (budget %d) in %.1f ms",
+                               scope["method"], path, stats.count, QUERY_BUDGET, stats.duration_ms)
+            for (collection, command_name, keys), count in stats.repeated().items():
+                logger.warning("%s %s repeated %s on %s by %s %d times (possible N+1)",
+                               scope["method"], path, command_name, collection, list(keys), count)
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from pymongo.errors import BulkWriteError
+
+from counters import COUNTERS_COLLECTION, release_unread
+from database import LeasedPeriodicJob, get_db
+
+logger = logging.getLogger(__name__)
+
+# Notifications older than this leave the hot collection whether read or not
+ARCHIVE_AFTER_DAYS = int(os.environ.get("NOTIFICATION_ARCHIVE_AFTER_DAYS", "90"))
+# Unread notifications kept per user; older ones beyond the cap are archived
+UNREAD_CAP_PER_USER = int(os.environ.get("NOTIFICATION_UNREAD_CAP", "500"))
+
+ARCHIVE_INTERVAL = timedelta(hours=1)
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_LEASE_ID = "notification_archiver"
+
+async def archive_matching(query: Dict[str, Any]) -> int:
+    """Move notifications matching query to notifications_archive, oldest first, in batches."""
+    db = get_db()
+    archived = 0
+    while True:
+        batch = await db.notifications.find(query)\
+            .sort("created_at", 1)\
+            .limit(ARCHIVE_BATCH_SIZE)\
+            .to_list(None)
+        if not batch:
+            return archived
+
+        archived_at = datetime.utcnow()
+        for notification in batch:
+            notification["archived_at"] = archived_at
+        try:
+            await db.notifications_archive.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Copies left behind by an interrupted run share the same _id
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+        # Unread ones are uncounted only if still unread when deleted: a request that
+        # marked or deleted one meanwhile has already adjusted the counter itself
+        deleted = await asyncio.gather(*(
+            db.notifications.find_one_and_delete({"_id": n["_id"], "is_read": False}, {"user_id": 1, "type": 1})
+            for n in batch if not n.get("is_read")
+        ))
+        await db.notifications.delete_many({"_id": {"$in": [n["_id"] for n in batch]}})
+        await release_unread([n for n in deleted if n is not None])
+        archived += len(batch)
+
+        # Give request handlers a turn between batches
+        await asyncio.sleep(0)
+
+async def archive_notifications():
+    """Apply the retention policy: archive aged notifications and cap unread ones per user."""
+    db = get_db()
+
+    cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    archived = await archive_matching({"created_at": {"$lt": cutoff}})
+
+    # Counters make finding users over the cap a small indexed read
+    async for counter in db[COUNTERS_COLLECTION].find({"unread": {"$gt": UNREAD_CAP_PER_USER}}, {"_id": 1}):
+        user_id = counter["_id"]
+        boundary = await db.notifications.find(
+            {"user_id": user_id, "is_read": False},
+            {"created_at": 1}
+        ).sort("created_at", -1).skip(UNREAD_CAP_PER_USER).limit(1).to_list(None)
+        if boundary:
+            archived += await archive_matching({
+                "user_id": user_id,
+                "is_read": False,
+                "created_at": {"$lte": boundary[0]["created_at"]}
+            })
+
+    if archived:
+        logger.info("Archived %d notifications", archived)
+
+notification_archiver = LeasedPeriodicJob(ARCHIVE_LEASE_ID, ARCHIVE_INTERVAL, archive_notifications)
@@ -1,21 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from typing import List, Optional
 from models import Customer, CustomerCreate, UserResponse
 from auth import get_current_user, require_role
-from database import get_db
-from utils import serialize_doc, serialize_docs
+from database import get_database
+from documents import build_document
+from conditional import bump_generation, entity_headers, entity_not_modified, list_validators
+from search import search_index
+from matching import matcher_cache
+from facets import CUSTOMER_FACETS, faceted_list, parse_facets
+from utils import FastJSONResponse
+from scheduler import reminder_scheduler
 from datetime import datetime
 
 router = APIRouter(prefix="/customers", tags=["customers"])
 
 @router.get("/", response_model=List[dict])
 async def get_customers(
+    request: Request,
     status_filter: Optional[str] = Query(None, alias="status"),
     search: Optional[str] = Query(None),
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    facets: Optional[str] = Query(None, description="Comma-separated: status, is_important"),
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Get all customers for the current broker"""
-    db = get_db()
+    headers, unchanged = await list_validators(request, current_user.id, "customers")
+    if unchanged:
+        return unchanged
     
     query = {"user_id": current_user.id}
     
@@ -31,38 +44,52 @@ async def get_customers(
             {"email": {"$regex": search, "$options": "i"}}
         ]
     
-    customers = await db.customers.find(query).sort("created_at", -1).to_list(None)
-    return serialize_docs(customers)
+    try:
+        facet_fields = parse_facets(facets, CUSTOMER_FACETS)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    if facet_fields:
+        page = await faceted_list(db.customers, current_user.id, {"$match": query}, {"created_at": -1}, skip, limit, facet_fields)
+        return FastJSONResponse(page, headers=headers)
+    
+    customers = await db.customers.find(query, {"_id": 0}).sort("created_at", -1)\
+        .skip(skip).limit(limit or 0).to_list(None)
+    return FastJSONResponse(customers, headers=headers)
 
 @router.post("/", response_model=dict)
 async def create_customer(
     customer_data: CustomerCreate,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Create a new customer"""
-    db = get_db()
-    
-    customer_dict = customer_data.dict()
-    customer_dict["user_id"] = current_user.id
-    
-    customer_obj = Customer(**customer_dict)
-    result = await db.customers.insert_one(customer_obj.dict())
-    
-    created_customer = await db.customers.find_one({"_id": result.inserted_id})
-    return serialize_doc(created_customer)
+    created_customer = build_document(Customer, customer_data, user_id=current_user.id)
+    await db.customers.insert_one(created_customer)
+    generation = await bump_generation(current_user.id, "customers", [created_customer["id"]])
+    created_customer.pop("_id")
+    search_index.upsert(current_user.id, "customers", generation, created_customer)
+    matcher_cache.upsert(current_user.id, "customers", generation, created_customer)
+    
+    reminder_scheduler.track("customer", created_customer)
+    return FastJSONResponse(created_customer)
 
 @router.get("/{customer_id}", response_model=dict)
 async def get_customer(
     customer_id: str,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    request: Request,
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Get a specific customer"""
-    db = get_db()
+    unchanged = await entity_not_modified(request, db.customers, {"id": customer_id, "user_id": current_user.id})
+    if unchanged:
+        return unchanged
     
     customer_data = await db.customers.find_one({
         "id": customer_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not customer_data:
         raise HTTPException(
@@ -70,17 +97,16 @@ async def get_customer(
             detail="Customer not found"
         )
     
-    return serialize_doc(customer_data)
+    return FastJSONResponse(customer_data, headers=entity_headers(customer_data))
 
 @router.put("/{customer_id}", response_model=dict)
 async def update_customer(
     customer_id: str,
     customer_data: CustomerCreate,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Update a customer"""
-    db = get_db()
-    
     # Check if customer exists and belongs to user
     existing_customer = await db.customers.find_one({
         "id": customer_id,
@@ -101,18 +127,21 @@ async def update_customer(
         {"id": customer_id},
         {"$set": update_data}
     )
+    generation = await bump_generation(current_user.id, "customers", [customer_id])
     
-    updated_customer = await db.customers.find_one({"id": customer_id})
-    return serialize_doc(updated_customer)
+    updated_customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
+    search_index.upsert(current_user.id, "customers", generation, updated_customer)
+    matcher_cache.upsert(current_user.id, "customers", generation, updated_customer)
+    reminder_scheduler.track("customer", updated_customer)
+    return FastJSONResponse(updated_customer)
 
 @router.delete("/{customer_id}")
 async def delete_customer(
     customer_id: str,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Delete a customer"""
-    db = get_db()
-    
     # Check if customer exists and belongs to user
     existing_customer = await db.customers.find_one({
         "id": customer_id,
@@ -126,20 +155,23 @@ async def delete_customer(
         )
     
     await db.customers.delete_one({"id": customer_id})
+    generation = await bump_generation(current_user.id, "customers", [customer_id])
+    search_index.remove(current_user.id, "customers", generation, customer_id)
+    matcher_cache.remove(current_user.id, "customers", generation, customer_id)
+    reminder_scheduler.forget("customer", customer_id)
     return {"message": "Customer deleted successfully"}
 
 @router.patch("/{customer_id}/important", response_model=dict)
 async def toggle_important_customer(
     customer_id: str,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Toggle important customer status"""
-    db = get_db()
-    
     customer_data = await db.customers.find_one({
         "id": customer_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not customer_data:
         raise HTTPException(
@@ -153,17 +185,19 @@ async def toggle_important_customer(
         {"id": customer_id},
         {"$set": {"is_important": new_important_status, "updated_at": datetime.utcnow()}}
     )
+    generation = await bump_generation(current_user.id, "customers", [customer_id])
     
-    updated_customer = await db.customers.find_one({"id": customer_id})
-    return serialize_doc(updated_customer)
+    updated_customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
+    search_index.upsert(current_user.id, "customers", generation, updated_customer)
+    matcher_cache.upsert(current_user.id, "customers", generation, updated_customer)
+    return FastJSONResponse(updated_customer)
 
 @router.get("/export/csv")
 async def export_customers_csv(
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Export customers as CSV"""
-    db = get_db()
-    
     customers = await db.customers.find({"user_id": current_user.id}).to_list(None)
     
     # Create CSV content
@@ -1,21 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from typing import List, Optional
 from models import Deal, DealCreate, UserResponse
 from auth import get_current_user, require_role
-from database import get_db
-from utils import serialize_doc, serialize_docs
+from database import get_database
+from documents import build_document, utc_now_ms
+from conditional import bump_generation, entity_headers, entity_not_modified, list_validators
+from search import search_index
+from facets import DEAL_FACETS, faceted_list, parse_facets
+from funnel import funnel_report, get_funnel, record_transition, release_deal, status_fields
+from utils import FastJSONResponse, brokerage_total
 from datetime import datetime
+from pymongo import ReturnDocument
 
 router = APIRouter(prefix="/deals", tags=["deals"])
 
+# Re-reads of a deal whose status changed under a concurrent update before giving up
+UPDATE_ATTEMPTS = 3
+
 @router.get("/", response_model=List[dict])
 async def get_deals(
+    request: Request,
     status_filter: Optional[str] = Query(None, alias="status"),
     search: Optional[str] = Query(None),
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    facets: Optional[str] = Query(None, description="Comma-separated: status"),
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Get all deals for the current broker"""
-    db = get_db()
+    headers, unchanged = await list_validators(request, current_user.id, "deals")
+    if unchanged:
+        return unchanged
     
     query = {"user_id": current_user.id}
     
@@ -30,39 +46,54 @@ async def get_deals(
             {"customer_name": {"$regex": search, "$options": "i"}}
         ]
     
-    deals = await db.deals.find(query).sort("created_at", -1).to_list(None)
-    return serialize_docs(deals)
+    try:
+        facet_fields = parse_facets(facets, DEAL_FACETS)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    if facet_fields:
+        page = await faceted_list(db.deals, current_user.id, {"$match": query}, {"created_at": -1}, skip, limit, facet_fields)
+        return FastJSONResponse(page, headers=headers)
+    
+    deals = await db.deals.find(query, {"_id": 0}).sort("created_at", -1)\
+        .skip(skip).limit(limit or 0).to_list(None)
+    return FastJSONResponse(deals, headers=headers)
 
 @router.post("/", response_model=dict)
 async def create_deal(
     deal_data: DealCreate,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Create a new deal"""
-    db = get_db()
-    
-    deal_dict = deal_data.dict()
-    deal_dict["user_id"] = current_user.id
-    deal_dict["start_date"] = datetime.utcnow()
-    
-    deal_obj = Deal(**deal_dict)
-    result = await db.deals.insert_one(deal_obj.dict())
+    now = utc_now_ms()
+    created_deal = build_document(
+        Deal, deal_data, user_id=current_user.id, start_date=now, **status_fields(None, deal_data.status, now)
+    )
+    await db.deals.insert_one(created_deal)
+    generation = await bump_generation(current_user.id, "deals", [created_deal["id"]])
+    created_deal.pop("_id")
+    await record_transition(current_user.id, created_deal["id"], None, deal_data.status, now)
+    search_index.upsert(current_user.id, "deals", generation, created_deal)
     
-    created_deal = await db.deals.find_one({"_id": result.inserted_id})
-    return serialize_doc(created_deal)
+    return FastJSONResponse(created_deal)
 
 @router.get("/{deal_id}", response_model=dict)
 async def get_deal(
     deal_id: str,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    request: Request,
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Get a specific deal"""
-    db = get_db()
+    unchanged = await entity_not_modified(request, db.deals, {"id": deal_id, "user_id": current_user.id})
+    if unchanged:
+        return unchanged
     
     deal_data = await db.deals.find_one({
         "id": deal_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not deal_data:
         raise HTTPException(
@@ -70,139 +101,141 @@ async def get_deal(
             detail="Deal not found"
         )
     
-    return serialize_doc(deal_data)
+    return FastJSONResponse(deal_data, headers=entity_headers(deal_data))
 
 @router.put("/{deal_id}", response_model=dict)
 async def update_deal(
     deal_id: str,
     deal_data: DealCreate,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Update a deal"""
-    db = get_db()
-    
-    # Check if deal exists and belongs to user
-    existing_deal = await db.deals.find_one({
-        "id": deal_id,
-        "user_id": current_user.id
-    })
-    
-    if not existing_deal:
+    for _ in range(UPDATE_ATTEMPTS):
+        # Check if deal exists and belongs to user
+        existing_deal = await db.deals.find_one({
+            "id": deal_id,
+            "user_id": current_user.id
+        })
+        
+        if not existing_deal:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Deal not found"
+            )
+        
+        # Update deal
+        update_data = deal_data.dict()
+        update_data["updated_at"] = now = utc_now_ms()
+        status_changed = deal_data.status != existing_deal.get("status")
+        if status_changed:
+            update_data.update(status_fields(existing_deal, deal_data.status, now))
+        
+        # If status is being changed to "Closed", set close_date
+        if update_data.get("status") == "Closed" and not existing_deal.get("close_date"):
+            update_data["close_date"] = now
+        
+        # Only applies while the deal is still in the status read above, so two
+        # concurrent updates can't both log a transition out of it
+        previous_deal = await db.deals.find_one_and_update(
+            {
+                "id": deal_id,
+                "user_id": current_user.id,
+                "status": existing_deal.get("status"),
+                "status_changed_at": existing_deal.get("status_changed_at")
+            },
+            {"$set": update_data},
+            return_document=ReturnDocument.BEFORE
+        )
+        if previous_deal is not None:
+            break
+    else:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Deal not found"
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Deal is being changed by another request; try again"
         )
+    generation = await bump_generation(current_user.id, "deals", [deal_id])
+    if status_changed:
+        await record_transition(current_user.id, deal_id, previous_deal, deal_data.status, now)
     
-    # Update deal
-    update_data = deal_data.dict()
-    update_data["updated_at"] = datetime.utcnow()
-    
-    # If status is being changed to "Closed", set close_date
-    if update_data.get("status") == "Closed" and not existing_deal.get("close_date"):
-        update_data["close_date"] = datetime.utcnow()
-    
-    await db.deals.update_one(
-        {"id": deal_id},
-        {"$set": update_data}
-    )
-    
-    updated_deal = await db.deals.find_one({"id": deal_id})
-    return serialize_doc(updated_deal)
+    updated_deal = await db.deals.find_one({"id": deal_id}, {"_id": 0})
+    search_index.upsert(current_user.id, "deals", generation, updated_deal)
+    return FastJSONResponse(updated_deal)
 
 @router.delete("/{deal_id}")
 async def delete_deal(
     deal_id: str,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Delete a deal"""
-    db = get_db()
-    
-    # Check if deal exists and belongs to user
-    existing_deal = await db.deals.find_one({
+    # The deleted document, so concurrent deletes release the deal's stage only once
+    deleted_deal = await db.deals.find_one_and_delete({
         "id": deal_id,
         "user_id": current_user.id
     })
     
-    if not existing_deal:
+    if not deleted_deal:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Deal not found"
         )
     
-    await db.deals.delete_one({"id": deal_id})
+    generation = await bump_generation(current_user.id, "deals", [deal_id])
+    await release_deal(current_user.id, deleted_deal)
+    search_index.remove(current_user.id, "deals", generation, deal_id)
     return {"message": "Deal deleted successfully"}
 
+@router.get("/analytics/funnel")
+async def get_funnel_analytics(
+    current_user: UserResponse = Depends(require_role(["broker"]))
+):
+    """Get deal counts, conversion and median days per pipeline stage"""
+    return FastJSONResponse(funnel_report(await get_funnel(current_user.id)))
+
 @router.get("/analytics/brokerage")
 async def get_brokerage_analytics(
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Get brokerage analytics data"""
-    db = get_db()
-    
-    # Get monthly brokerage data for the last 6 months
+    # Get monthly brokerage data for the last 6 months. Amounts are free text
+    # ("₹2.5 Lakh", "₹50,000", "₹1.2 Cr"), so each month's are summed with the
+    # same parser as everywhere else rather than converted in the pipeline
     pipeline = [
-        {"$match": {"user_id": current_user.id, "status": "Closed"}},
+        {"$match": {"user_id": current_user.id, "status": "Closed", "close_date": {"$ne": None}}},
         {"$group": {
             "_id": {
                 "year": {"$year": "$close_date"},
                 "month": {"$month": "$close_date"}
             },
-            "total_brokerage": {"$sum": {"$toDouble": {"$replaceAll": {
-                "input": {"$replaceAll": {"input": "$brokerage_amount", "find": "₹", "replacement": ""}},
-                "find": "Lakh", "replacement": ""
-            }}}},
+            "amounts": {"$push": "$brokerage_amount"},
             "deals_count": {"$sum": 1}
         }},
-        {"$sort": {"_id.year": 1, "_id.month": 1}},
+        {"$sort": {"_id.year": -1, "_id.month": -1}},
         {"$limit": 6}
     ]
+    brokerage_data = await db.deals.aggregate(pipeline).to_list(None)
     
-    try:
-        brokerage_data = await db.deals.aggregate(pipeline).to_list(None)
-        
-        # Format the data
-        formatted_data = []
-        for data in brokerage_data:
-            month_names = ["", "Jan", "Feb", "Mar", "Apr", "May", "Jun", 
-                          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-            formatted_data.append({
-                "month": month_names[data["_id"]["month"]],
-                "amount": data["total_brokerage"] * 100000,  # Convert back to actual amount
-                "deals_count": data["deals_count"]
-            })
-        
-        return {"brokerage_data": formatted_data}
-    except Exception as e:
-        # Fallback to simple query if aggregation fails
-        deals = await db.deals.find({
-            "user_id": current_user.id,
-            "status": "Closed"
-        }).to_list(None)
-        
-        # Simple monthly calculation
-        monthly_data = {}
-        for deal in deals:
-            if deal.get("close_date"):
-                month_key = deal["close_date"].strftime("%b")
-                if month_key not in monthly_data:
-                    monthly_data[month_key] = {"amount": 0, "deals_count": 0}
-                
-                # Extract amount (simplified)
-                brokerage_str = deal.get("brokerage_amount", "₹0")
-                amount = float(brokerage_str.replace("₹", "").replace("Lakh", "").replace(",", "")) * 100000
-                monthly_data[month_key]["amount"] += amount
-                monthly_data[month_key]["deals_count"] += 1
-        
-        formatted_data = [{"month": k, **v} for k, v in monthly_data.items()]
-        return {"brokerage_data": formatted_data}
+    # Format the data, oldest month first
+    month_names = ["", "Jan", "Feb", "Mar", "Apr", "May", "Jun", 
+                   "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+    formatted_data = [
+        {
+            "month": month_names[data["_id"]["month"]],
+            "amount": brokerage_total({"brokerage_amount": amount} for amount in data["amounts"]),
+            "deals_count": data["deals_count"]
+        }
+        for data in reversed(brokerage_data)
+    ]
+    return {"brokerage_data": formatted_data}
 
 @router.get("/export/csv")
 async def export_deals_csv(
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Export deals as CSV"""
-    db = get_db()
-    
     deals = await db.deals.find({"user_id": current_user.id}).to_list(None)
     
     # Create CSV content
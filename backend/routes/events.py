@@ -1,75 +1,269 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from typing import List, Optional
 from models import Event, EventCreate, UserResponse
 from auth import get_current_user
-from database import get_db
-from utils import serialize_doc, serialize_docs
-from datetime import datetime, date
+from database import BACKFILL_BATCH_SIZE, get_database, get_db, mark_migration_done, migration_done
+from documents import build_document
+from conditional import bump_generation, entity_headers, entity_not_modified, list_validators
+from search import search_index
+from utils import (
+    FastJSONResponse, expand_recurrence, series_end,
+    parse_event_time, compute_event_timestamp, local_to_utc, EVENT_TIMEZONE
+)
+from scheduler import reminder_scheduler
+from datetime import datetime, date, timedelta
+from pymongo import UpdateOne
 
 router = APIRouter(prefix="/events", tags=["events"])
 
+# Largest window a single range query may expand recurring events over
+MAX_RANGE_DAYS = 366
+
+# Calendar views never need Mongo's internal _id
+EVENT_PROJECTION = {"_id": 0}
+
+# How far ahead recurring series are expanded when a window has no end
+SERIES_HORIZON_DAYS = 90
+
+# One-off backfills, recorded in the migrations collection
+EVENT_TIMESTAMPS_MIGRATION = "event_timestamps_backfilled"
+SERIES_ENDS_MIGRATION = "event_series_ends_backfilled"
+
+def parse_date_param(value: str) -> date:
+    """Parse a YYYY-MM-DD query parameter."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid date format. Use YYYY-MM-DD"
+        )
+
+def local_day_bounds(start_day: date, end_day: date):
+    """Return the UTC bounds covering whole local days from start_day to end_day."""
+    return (
+        local_to_utc(datetime.combine(start_day, datetime.min.time())),
+        local_to_utc(datetime.combine(end_day, datetime.max.time()))
+    )
+
+def apply_event_timestamps(event_dict: dict) -> dict:
+    """Compute the canonical starts_at/ends_at/series_ends_at timestamps for an event being written."""
+    for field in ("time", "end_time"):
+        if event_dict.get(field) and parse_event_time(event_dict[field]) is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid {field} format. Use HH:MM or HH:MM AM/PM"
+            )
+    
+    event_dict["starts_at"] = compute_event_timestamp(event_dict["date"], event_dict["time"])
+    event_dict["ends_at"] = (
+        compute_event_timestamp(event_dict["date"], event_dict["end_time"])
+        if event_dict.get("end_time") else None
+    )
+    event_dict["series_ends_at"] = series_end(event_dict)
+    return event_dict
+
+async def backfill_event_timestamps():
+    """Populate starts_at/ends_at on events written before they were computed at write time.
+    
+    Legacy date/time values are wall-clock times in EVENT_TIMEZONE and are
+    converted to UTC the same way the write path does. Runs once: later events
+    are stored with their timestamps. Tenants whose events changed get their
+    cached lists invalidated.
+    """
+    if await migration_done(EVENT_TIMESTAMPS_MIGRATION):
+        return
+    db = get_db()
+    
+    batch = []
+    owners = set()
+    cursor = db.events.find(
+        {"starts_at": {"$exists": False}},
+        {"_id": 1, "user_id": 1, "date": 1, "time": 1, "end_time": 1}
+    )
+    async for event in cursor:
+        if not event.get("date"):
+            continue
+        
+        update = {
+            "starts_at": compute_event_timestamp(event["date"], event.get("time")),
+            "ends_at": (
+                compute_event_timestamp(event["date"], event["end_time"])
+                if event.get("end_time") else None
+            )
+        }
+        batch.append(UpdateOne({"_id": event["_id"]}, {"$set": update}))
+        owners.add(event.get("user_id"))
+        
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            await db.events.bulk_write(batch, ordered=False)
+            batch = []
+    
+    if batch:
+        await db.events.bulk_write(batch, ordered=False)
+    for user_id in owners:
+        await bump_generation(user_id, "events")
+    await mark_migration_done(EVENT_TIMESTAMPS_MIGRATION)
+
+async def backfill_series_ends():
+    """Populate series_ends_at on recurring events written before it was computed.
+    
+    Runs once, after backfill_event_timestamps. Until then such series have no
+    series_ends_at and are read by every window, like open-ended ones.
+    """
+    if await migration_done(SERIES_ENDS_MIGRATION):
+        return
+    db = get_db()
+    
+    batch = []
+    owners = set()
+    cursor = db.events.find(
+        {"recurrence": {"$ne": None}, "starts_at": {"$exists": True}, "series_ends_at": {"$exists": False}},
+        {"_id": 1, "user_id": 1, "starts_at": 1, "recurrence": 1}
+    )
+    async for event in cursor:
+        batch.append(UpdateOne({"_id": event["_id"]}, {"$set": {"series_ends_at": series_end(event)}}))
+        owners.add(event.get("user_id"))
+        
+        if len(batch) >= BACKFILL_BATCH_SIZE:
+            await db.events.bulk_write(batch, ordered=False)
+            batch = []
+    
+    if batch:
+        await db.events.bulk_write(batch, ordered=False)
+    for user_id in owners:
+        await bump_generation(user_id, "events")
+    await mark_migration_done(SERIES_ENDS_MIGRATION)
+
+def series_window(window_start: datetime, window_end: datetime) -> dict:
+    """Filter for recurring series that may have an occurrence inside the UTC window."""
+    return {
+        "recurrence": {"$ne": None},
+        "starts_at": {"$lte": window_end},
+        "$or": [{"series_ends_at": None}, {"series_ends_at": {"$gte": window_start}}]
+    }
+
+async def find_events_in_window(
+    db,
+    query: dict,
+    window_start: datetime,
+    window_end: Optional[datetime] = None,
+    limit: int = 0
+):
+    """Return events starting inside the UTC window, recurring series expanded, ordered by starts_at.
+    
+    One-off events are read index-sorted from {user_id, starts_at}; series that
+    have started and not ended by the window are expanded in memory for the
+    window only. An open-ended window expands series SERIES_HORIZON_DAYS ahead.
+    """
+    starts_at_range = {"$gte": window_start}
+    if window_end is not None:
+        starts_at_range["$lte"] = window_end
+    else:
+        window_end = window_start + timedelta(days=SERIES_HORIZON_DAYS)
+    
+    one_off_query = {**query, "recurrence": None, "starts_at": starts_at_range}
+    events = await db.events.find(one_off_query, EVENT_PROJECTION)\
+        .sort("starts_at", 1)\
+        .limit(limit)\
+        .to_list(None)
+    
+    series_query = {**query, **series_window(window_start, window_end)}
+    occurrences = []
+    async for series in db.events.find(series_query, EVENT_PROJECTION):
+        occurrences.extend(expand_recurrence(series, window_start, window_end))
+    
+    if occurrences:
+        events = sorted(events + occurrences, key=lambda event: event["starts_at"])
+        if limit:
+            events = events[:limit]
+    return events
+
 @router.get("/", response_model=List[dict])
 async def get_events(
+    request: Request,
     date_filter: Optional[str] = Query(None),
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
     type_filter: Optional[str] = Query(None, alias="type"),
     status_filter: Optional[str] = Query(None, alias="status"),
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
-    """Get events for the current user"""
-    db = get_db()
+    """Get events for the current user, optionally within a day or a from/to range"""
+    headers, unchanged = await list_validators(request, current_user.id, "events")
+    if unchanged:
+        return unchanged
     
     query = {"user_id": current_user.id}
     
-    # Apply filters
-    if date_filter:
-        try:
-            filter_date = datetime.strptime(date_filter, "%Y-%m-%d").date()
-            start_datetime = datetime.combine(filter_date, datetime.min.time())
-            end_datetime = datetime.combine(filter_date, datetime.max.time())
-            query["date"] = {"$gte": start_datetime, "$lte": end_datetime}
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid date format. Use YYYY-MM-DD"
-            )
-    
     if type_filter:
         query["type"] = type_filter
     if status_filter:
         query["status"] = status_filter
     
-    events = await db.events.find(query).sort("date", 1).to_list(None)
-    return serialize_docs(events)
+    # Without a window there is nothing to expand recurring events into
+    if not (date_filter or date_from or date_to):
+        events = await db.events.find(query, EVENT_PROJECTION).sort("starts_at", 1).to_list(None)
+        return FastJSONResponse(events, headers=headers)
+    
+    if date_filter:
+        range_start = range_end = parse_date_param(date_filter)
+    else:
+        if not (date_from and date_to):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Both 'from' and 'to' are required for a range query"
+            )
+        range_start = parse_date_param(date_from)
+        range_end = parse_date_param(date_to)
+        if range_end < range_start:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="'to' must not be before 'from'"
+            )
+        if (range_end - range_start).days > MAX_RANGE_DAYS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Date range cannot exceed {MAX_RANGE_DAYS} days"
+            )
+    
+    window_start, window_end = local_day_bounds(range_start, range_end)
+    events = await find_events_in_window(db, query, window_start, window_end)
+    return FastJSONResponse(events, headers=headers)
 
 @router.post("/", response_model=dict)
 async def create_event(
     event_data: EventCreate,
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Create a new event"""
-    db = get_db()
-    
-    event_dict = event_data.dict()
-    event_dict["user_id"] = current_user.id
+    created_event = apply_event_timestamps(build_document(Event, event_data, user_id=current_user.id))
+    await db.events.insert_one(created_event)
+    generation = await bump_generation(current_user.id, "events", [created_event["id"]])
+    created_event.pop("_id")
+    search_index.upsert(current_user.id, "events", generation, created_event)
     
-    event_obj = Event(**event_dict)
-    result = await db.events.insert_one(event_obj.dict())
-    
-    created_event = await db.events.find_one({"_id": result.inserted_id})
-    return serialize_doc(created_event)
+    reminder_scheduler.track("event", created_event)
+    return FastJSONResponse(created_event)
 
 @router.get("/{event_id}", response_model=dict)
 async def get_event(
     event_id: str,
-    current_user: UserResponse = Depends(get_current_user)
+    request: Request,
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Get a specific event"""
-    db = get_db()
+    unchanged = await entity_not_modified(request, db.events, {"id": event_id, "user_id": current_user.id})
+    if unchanged:
+        return unchanged
     
     event_data = await db.events.find_one({
         "id": event_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not event_data:
         raise HTTPException(
@@ -77,17 +271,16 @@ async def get_event(
             detail="Event not found"
         )
     
-    return serialize_doc(event_data)
+    return FastJSONResponse(event_data, headers=entity_headers(event_data))
 
 @router.put("/{event_id}", response_model=dict)
 async def update_event(
     event_id: str,
     event_data: EventCreate,
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Update an event"""
-    db = get_db()
-    
     # Check if event exists and belongs to user
     existing_event = await db.events.find_one({
         "id": event_id,
@@ -101,25 +294,27 @@ async def update_event(
         )
     
     # Update event
-    update_data = event_data.dict()
+    update_data = apply_event_timestamps(event_data.dict())
     update_data["updated_at"] = datetime.utcnow()
     
     await db.events.update_one(
         {"id": event_id},
         {"$set": update_data}
     )
+    generation = await bump_generation(current_user.id, "events", [event_id])
     
-    updated_event = await db.events.find_one({"id": event_id})
-    return serialize_doc(updated_event)
+    updated_event = await db.events.find_one({"id": event_id}, {"_id": 0})
+    search_index.upsert(current_user.id, "events", generation, updated_event)
+    reminder_scheduler.track("event", updated_event)
+    return FastJSONResponse(updated_event)
 
 @router.delete("/{event_id}")
 async def delete_event(
     event_id: str,
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Delete an event"""
-    db = get_db()
-    
     # Check if event exists and belongs to user
     existing_event = await db.events.find_one({
         "id": event_id,
@@ -133,20 +328,22 @@ async def delete_event(
         )
     
     await db.events.delete_one({"id": event_id})
+    generation = await bump_generation(current_user.id, "events", [event_id])
+    search_index.remove(current_user.id, "events", generation, event_id)
+    reminder_scheduler.forget("event", event_id)
     return {"message": "Event deleted successfully"}
 
 @router.patch("/{event_id}/complete", response_model=dict)
 async def mark_event_completed(
     event_id: str,
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Mark an event as completed"""
-    db = get_db()
-    
     event_data = await db.events.find_one({
         "id": event_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not event_data:
         raise HTTPException(
@@ -158,42 +355,36 @@ async def mark_event_completed(
         {"id": event_id},
         {"$set": {"status": "completed", "updated_at": datetime.utcnow()}}
     )
+    generation = await bump_generation(current_user.id, "events", [event_id])
     
-    updated_event = await db.events.find_one({"id": event_id})
-    return serialize_doc(updated_event)
+    updated_event = await db.events.find_one({"id": event_id}, {"_id": 0})
+    search_index.upsert(current_user.id, "events", generation, updated_event)
+    reminder_scheduler.track("event", updated_event)
+    return FastJSONResponse(updated_event)
 
 @router.get("/today/list")
 async def get_today_events(
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Get today's events"""
-    db = get_db()
-    
-    today = date.today()
-    start_datetime = datetime.combine(today, datetime.min.time())
-    end_datetime = datetime.combine(today, datetime.max.time())
+    today = datetime.now(EVENT_TIMEZONE).date()
+    window_start, window_end = local_day_bounds(today, today)
     
-    events = await db.events.find({
-        "user_id": current_user.id,
-        "date": {"$gte": start_datetime, "$lte": end_datetime}
-    }).sort("time", 1).to_list(None)
-    
-    return serialize_docs(events)
+    events = await find_events_in_window(db, {"user_id": current_user.id}, window_start, window_end)
+    return FastJSONResponse(events)
 
 @router.get("/upcoming/list")
 async def get_upcoming_events(
     limit: int = Query(10, le=50),
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Get upcoming events"""
-    db = get_db()
-    
-    now = datetime.utcnow()
-    
-    events = await db.events.find({
-        "user_id": current_user.id,
-        "date": {"$gte": now},
-        "status": "scheduled"
-    }).sort("date", 1).limit(limit).to_list(None)
-    
-    return serialize_docs(events)
\ No newline at end of file
+    events = await find_events_in_window(
+        db,
+        {"user_id": current_user.id, "status": "scheduled"},
+        datetime.utcnow(),
+        limit=limit
+    )
+    return FastJSONResponse(events)
@@ -0,0 +1,275 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from typing import List, Optional
+from models import FinancialRecord, FinancialRecordCreate, UserResponse
+from auth import require_role
+from database import get_database
+from documents import build_document
+from conditional import bump_generation, entity_headers, entity_not_modified, list_validators
+from pnl import TREND_SPLITS, apply_record, parse_windows, record_write, trend
+from utils import FastJSONResponse, fiscal_period, fiscal_year_label, parse_month
+from datetime import datetime
+from pymongo import ReturnDocument
+
+router = APIRouter(prefix="/financials", tags=["financials"])
+
+# Group key, sort order and label of each analytics breakdown
+PERIODS = {
+    "month": (
+        {"year": "$year", "month": "$month"},
+        {"_id.year": 1, "_id.month": 1},
+        lambda key: f"{key['year']}-{key['month']:02d}"
+    ),
+    "quarter": (
+        {"fiscal_year": "$fiscal_year", "fiscal_quarter": "$fiscal_quarter"},
+        {"_id.fiscal_year": 1, "_id.fiscal_quarter": 1},
+        lambda key: f"{fiscal_year_label(key['fiscal_year'])} Q{key['fiscal_quarter']}"
+    ),
+    "fiscal_year": ("$fiscal_year", {"_id": 1}, fiscal_year_label),
+    "category": ("$category", {"revenue": -1, "_id": 1}, str),
+}
+
+async def check_project(db, user_id: str, record_data: FinancialRecordCreate):
+    if record_data.project_id and not await db.projects.find_one(
+        {"id": record_data.project_id, "user_id": user_id}, {"_id": 0, "id": 1}
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Project not found"
+        )
+
+def parse_period(value: Optional[str], name: str) -> Optional[datetime]:
+    """First day of a "YYYY-MM" month."""
+    if not value:
+        return None
+    year, _, month = value.partition("-")
+    month_number = parse_month(month)
+    if not year.isdigit() or not 1 <= int(year) <= 9999 or month_number is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{name} must be a month as YYYY-MM"
+        )
+    return datetime(int(year), month_number, 1)
+
+def record_fields(record_data: FinancialRecordCreate) -> dict:
+    """Derived fields stored with every record: profit and the financial year/quarter."""
+    fiscal_year, fiscal_quarter = fiscal_period(record_data.year, record_data.month)
+    return {
+        "profit": record_data.revenue - record_data.expenses,
+        "fiscal_year": fiscal_year,
+        "fiscal_quarter": fiscal_quarter,
+    }
+
+@router.get("/", response_model=List[dict])
+async def get_financial_records(
+    request: Request,
+    year: Optional[int] = Query(None),
+    fiscal_year: Optional[int] = Query(None, description="Starting year of an April-March financial year"),
+    category: Optional[str] = Query(None),
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
+):
+    """Get financial records for the current builder, newest month first"""
+    headers, unchanged = await list_validators(request, current_user.id, "financial_records")
+    if unchanged:
+        return unchanged
+    
+    query = {"user_id": current_user.id}
+    
+    # Apply filters
+    if year is not None:
+        query["year"] = year
+    if fiscal_year is not None:
+        query["fiscal_year"] = fiscal_year
+    if category:
+        query["category"] = category
+    
+    records = await db.financial_records.find(query, {"_id": 0})\
+        .sort([("year", -1), ("month", -1), ("created_at", -1)])\
+        .to_list(None)
+    return FastJSONResponse(records, headers=headers)
+
+@router.post("/", response_model=dict)
+async def create_financial_record(
+    record_data: FinancialRecordCreate,
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
+):
+    """Create a financial record"""
+    await check_project(db, current_user.id, record_data)
+    created_record = build_document(
+        FinancialRecord, record_data, user_id=current_user.id, **record_fields(record_data)
+    )
+    async with record_write(current_user.id):
+        await db.financial_records.insert_one(created_record)
+        await bump_generation(current_user.id, "financial_records")
+        await apply_record(current_user.id, created_record)
+    created_record.pop("_id")
+    
+    return FastJSONResponse(created_record)
+
+@router.get("/analytics")
+async def get_financial_analytics(
+    period: str = Query("month", description="month, quarter, fiscal_year or category"),
+    fiscal_year: Optional[int] = Query(None, description="Only this April-March financial year"),
+    category: Optional[str] = Query(None),
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
+):
+    """Get revenue, expenses and profit per month, financial quarter, financial year or category"""
+    if period not in PERIODS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown period: {period} (expected {', '.join(PERIODS)})"
+        )
+    group_key, sort, label = PERIODS[period]
+    
+    # Records whose legacy month could not be normalized have no financial year and are left out
+    match = {"user_id": current_user.id, "fiscal_year": {"$exists": True}}
+    if fiscal_year is not None:
+        match["fiscal_year"] = fiscal_year
+    if category:
+        match["category"] = category
+    
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": group_key,
+            "revenue": {"$sum": "$revenue"},
+            "expenses": {"$sum": "$expenses"},
+            "profit": {"$sum": "$profit"},
+            "records": {"$sum": 1}
+        }},
+        {"$sort": sort}
+    ]
+    rows = await db.financial_records.aggregate(pipeline).to_list(None)
+    
+    buckets = [
+        {
+            "period": label(row["_id"]),
+            "revenue": row["revenue"],
+            "expenses": row["expenses"],
+            "profit": row["profit"],
+            "records": row["records"]
+        }
+        for row in rows
+    ]
+    totals = {field: sum(bucket[field] for bucket in buckets) for field in ("revenue", "expenses", "profit")}
+    return FastJSONResponse({"period": period, "buckets": buckets, "totals": totals})
+
+@router.get("/trends")
+async def get_financial_trends(
+    windows: Optional[str] = Query(None, description="Rolling window lengths in months, default 3,6,12"),
+    split: str = Query("total", description="One series per project, per category, or total"),
+    project_id: Optional[str] = Query(None),
+    category: Optional[str] = Query(None),
+    start: Optional[str] = Query(None, alias="from", description="First month, YYYY-MM"),
+    end: Optional[str] = Query(None, alias="to", description="Last month, YYYY-MM"),
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
+):
+    """Get monthly revenue, expenses and profit with rolling 3/6/12-month sums.
+    
+    Revenue includes paid plot payments, under their project and the
+    plot_payments category.
+    """
+    if split not in TREND_SPLITS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown split: {split} (expected {', '.join(TREND_SPLITS)})"
+        )
+    try:
+        window_months = parse_windows(windows)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    first, last = parse_period(start, "from"), parse_period(end, "to")
+    if first and last and first > last:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="from must not be after to"
+        )
+    
+    result = await trend(current_user.id, window_months, split, project_id, category, first, last)
+    return FastJSONResponse(result)
+
+@router.get("/{record_id}", response_model=dict)
+async def get_financial_record(
+    record_id: str,
+    request: Request,
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
+):
+    """Get a specific financial record"""
+    unchanged = await entity_not_modified(request, db.financial_records, {"id": record_id, "user_id": current_user.id})
+    if unchanged:
+        return unchanged
+    
+    record = await db.financial_records.find_one({
+        "id": record_id,
+        "user_id": current_user.id
+    }, {"_id": 0})
+    
+    if not record:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Financial record not found"
+        )
+    
+    return FastJSONResponse(record, headers=entity_headers(record))
+
+@router.put("/{record_id}", response_model=dict)
+async def update_financial_record(
+    record_id: str,
+    record_data: FinancialRecordCreate,
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
+):
+    """Update a financial record"""
+    await check_project(db, current_user.id, record_data)
+    
+    update_data = record_data.dict()
+    update_data.update(record_fields(record_data))
+    update_data["updated_at"] = datetime.utcnow()
+    
+    async with record_write(current_user.id):
+        # The replaced document, so concurrent updates each remove the amounts they overwrote
+        existing_record = await db.financial_records.find_one_and_update(
+            {"id": record_id, "user_id": current_user.id},
+            {"$set": update_data},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        
+        if not existing_record:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Financial record not found"
+            )
+        
+        await bump_generation(current_user.id, "financial_records")
+        updated_record = {**existing_record, **update_data}
+        await apply_record(current_user.id, existing_record, -1)
+        await apply_record(current_user.id, updated_record)
+    return FastJSONResponse(updated_record)
+
+@router.delete("/{record_id}")
+async def delete_financial_record(
+    record_id: str,
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
+):
+    """Delete a financial record"""
+    async with record_write(current_user.id):
+        existing_record = await db.financial_records.find_one_and_delete({
+            "id": record_id,
+            "user_id": current_user.id
+        })
+        
+        if not existing_record:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Financial record not found"
+            )
+        
+        await bump_generation(current_user.id, "financial_records")
+        await apply_record(current_user.id, existing_record, -1)
+    return {"message": "Financial record deleted successfully"}
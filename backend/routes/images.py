@@ -0,0 +1,100 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.responses import FileResponse, Response
+from models import UserResponse
+from auth import get_current_user
+from image_store import (
+    DIGEST_PATTERN, IMMUTABLE_CACHE_CONTROL, MAX_IMAGE_BYTES,
+    FileRangeResponse, commit_file, detect_content_type, image_info, image_path,
+    open_temp_file, parse_range, stored_content_type
+)
+from starlette.concurrency import run_in_threadpool
+import hashlib
+import os
+
+router = APIRouter(prefix="/images", tags=["images"])
+
+def image_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Image exceeds {MAX_IMAGE_BYTES // (1024 * 1024)} MB"
+    )
+
+@router.post("/", response_model=dict)
+async def upload_image(
+    request: Request,
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """Upload an image sent as the raw request body; returns the reference to store in Property.images"""
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > MAX_IMAGE_BYTES:
+        raise image_too_large()
+
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    out, tmp_path = await run_in_threadpool(open_temp_file)
+    try:
+        try:
+            # Hash while copying the body as it arrives; the image is never held in memory whole
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > MAX_IMAGE_BYTES:
+                    raise image_too_large()
+                if len(head) < 16:
+                    head += chunk[:16 - len(head)]
+                digest.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+        finally:
+            await run_in_threadpool(out.close)
+
+        content_type = detect_content_type(head)
+        if content_type is None:
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail="Only JPEG, PNG, GIF and WebP images are supported"
+            )
+
+        await run_in_threadpool(commit_file, tmp_path, digest.hexdigest())
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    return image_info(digest.hexdigest(), size, content_type)
+
+@router.api_route("/{digest}", methods=["GET", "HEAD"])
+async def get_image(digest: str, request: Request):
+    """Serve a stored image.
+
+    Unauthenticated so it can back <img src>: references are SHA-256 digests of
+    the content, so they can only be obtained from documents that hold them.
+    """
+    content_type = await run_in_threadpool(stored_content_type, digest) if DIGEST_PATTERN.match(digest) else None
+    if content_type is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found"
+        )
+
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    path = image_path(digest)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        stat_result = await run_in_threadpool(os.stat, path)
+        try:
+            byte_range = parse_range(range_header, stat_result.st_size)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{stat_result.st_size}"}
+            )
+        if byte_range is not None:
+            return FileRangeResponse(path, *byte_range, stat_result.st_size, content_type, headers)
+
+    # Uses the server's pathsend/sendfile support when available
+    return FileResponse(path, media_type=content_type, headers=headers)
@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from typing import Dict, List, Tuple
+from models import UserResponse
+from auth import require_role
+from database import get_database
+from matching import matcher_cache
+from utils import FastJSONResponse
+
+router = APIRouter(prefix="/matching", tags=["matching"])
+
+async def with_documents(collection, user_id: str, matches: List[Tuple[str, float]], key: str) -> List[Dict]:
+    """Attach the user's matched documents to (id, score) pairs, keeping the ranking."""
+    docs = await collection.find(
+        {"user_id": user_id, "id": {"$in": [entity_id for entity_id, _ in matches]}}, {"_id": 0}
+    ).to_list(None)
+    by_id = {doc["id"]: doc for doc in docs}
+    return [
+        {"score": round(score, 4), key: by_id[entity_id]}
+        for entity_id, score in matches if entity_id in by_id
+    ]
+
+@router.get("/customers")
+async def match_all_customers(
+    limit: int = Query(5, ge=1, le=50),
+    current_user: UserResponse = Depends(require_role(["broker"]))
+):
+    """Best properties for every active customer, as property ids and scores"""
+    matcher = await matcher_cache.get(current_user.id)
+    matches = matcher.properties_for_all_customers(limit)
+    return FastJSONResponse({
+        "matches": {
+            customer_id: [{"property_id": property_id, "score": round(score, 4)} for property_id, score in ranked]
+            for customer_id, ranked in matches.items()
+        }
+    })
+
+@router.get("/customers/{customer_id}")
+async def match_customer(
+    customer_id: str,
+    limit: int = Query(10, ge=1, le=100),
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
+):
+    """Properties that best fit a customer's budget, type, area and feature preferences"""
+    matcher = await matcher_cache.get(current_user.id)
+    matches = matcher.properties_for_customer(customer_id, limit)
+    if matches is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Customer not found"
+        )
+    return FastJSONResponse({
+        "customer_id": customer_id,
+        "matches": await with_documents(db.properties, current_user.id, matches, "property")
+    })
+
+@router.get("/properties/{property_id}")
+async def match_property(
+    property_id: str,
+    limit: int = Query(10, ge=1, le=100),
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
+):
+    """Active customers a property fits best"""
+    matcher = await matcher_cache.get(current_user.id)
+    matches = matcher.customers_for_property(property_id, limit)
+    if matches is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Property not found"
+        )
+    return FastJSONResponse({
+        "property_id": property_id,
+        "matches": await with_documents(db.customers, current_user.id, matches, "customer")
+    })
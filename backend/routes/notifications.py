@@ -1,23 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Query, Header
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
-from models import Notification, NotificationCreate, UserResponse
-from auth import get_current_user
-from database import get_db
-from utils import serialize_doc, serialize_docs
+from models import Notification, NotificationCreate, NotificationBroadcast, UserResponse
+from auth import get_current_user, get_current_stream_user, require_role
+from database import get_database
+from documents import build_document
+from utils import FastJSONResponse, serialize_doc
+from pubsub import notification_bus
+from counters import get_unread_counts, decrement_unread, reset_unread
+from fanout import build_notifications, deliver_notifications, resolve_broadcast_recipients
 from datetime import datetime
+import asyncio
+import json
 
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_SECONDS = 15
+# Client reconnect delay advertised to EventSource, in milliseconds
+RECONNECT_MS = 3000
+
+def format_sse(message: dict) -> str:
+    """Encode a bus message as a Server-Sent Events frame."""
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
 @router.get("/", response_model=List[dict])
 async def get_notifications(
     is_read: Optional[bool] = Query(None),
     type_filter: Optional[str] = Query(None, alias="type"),
     limit: int = Query(50, le=100),
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Get notifications for the current user"""
-    db = get_db()
-    
     query = {"user_id": current_user.id}
     
     # Apply filters
@@ -26,12 +41,12 @@ async def get_notifications(
     if type_filter:
         query["type"] = type_filter
     
-    notifications = await db.notifications.find(query)\
+    notifications = await db.notifications.find(query, {"_id": 0})\
         .sort("created_at", -1)\
         .limit(limit)\
         .to_list(None)
     
-    return serialize_docs(notifications)
+    return FastJSONResponse(notifications)
 
 @router.post("/", response_model=dict)
 async def create_notification(
@@ -39,29 +54,47 @@ async def create_notification(
     current_user: UserResponse = Depends(get_current_user)
 ):
     """Create a new notification"""
-    db = get_db()
+    # Same write path as broadcasts and reminders: insert, count, push
+    notification_doc = build_document(Notification, notification_data, user_id=current_user.id)
+    await deliver_notifications([notification_doc])
+    return serialize_doc(notification_doc)
+
+@router.post("/broadcast", response_model=dict)
+async def broadcast_notification(
+    broadcast_data: NotificationBroadcast,
+    background_tasks: BackgroundTasks,
+    current_user: UserResponse = Depends(require_role(["builder"]))
+):
+    """Send a notification to a builder's team members and linked brokers"""
+    recipient_ids = await resolve_broadcast_recipients(
+        current_user.id,
+        broadcast_data.audiences,
+        broadcast_data.project_id
+    )
     
-    notification_dict = notification_data.dict()
-    notification_dict["user_id"] = current_user.id
+    notifications = build_notifications(
+        recipient_ids,
+        **broadcast_data.dict(include={"title", "message", "type", "related_id"})
+    )
     
-    notification_obj = Notification(**notification_dict)
-    result = await db.notifications.insert_one(notification_obj.dict())
+    if broadcast_data.background:
+        background_tasks.add_task(deliver_notifications, notifications)
+        return {"message": "Broadcast queued", "recipients": len(notifications)}
     
-    created_notification = await db.notifications.find_one({"_id": result.inserted_id})
-    return serialize_doc(created_notification)
+    delivered = await deliver_notifications(notifications)
+    return {"message": f"Notified {delivered} recipients", "recipients": delivered}
 
 @router.patch("/{notification_id}/read", response_model=dict)
 async def mark_notification_read(
     notification_id: str,
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Mark a notification as read"""
-    db = get_db()
-    
     notification_data = await db.notifications.find_one({
         "id": notification_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not notification_data:
         raise HTTPException(
@@ -69,37 +102,47 @@ async def mark_notification_read(
             detail="Notification not found"
         )
     
-    await db.notifications.update_one(
-        {"id": notification_id},
-        {"$set": {"is_read": True, "updated_at": datetime.utcnow()}}
+    # Only the request that actually flips is_read adjusts the counter;
+    # read_at starts the TTL retention clock
+    now = datetime.utcnow()
+    result = await db.notifications.update_one(
+        {"id": notification_id, "is_read": False},
+        {"$set": {"is_read": True, "read_at": now, "updated_at": now}}
     )
+    if result.modified_count:
+        await decrement_unread(current_user.id, notification_data["type"])
+        await notification_bus.publish(current_user.id, "notification.read", {"id": notification_id})
     
-    updated_notification = await db.notifications.find_one({"id": notification_id})
-    return serialize_doc(updated_notification)
+    updated_notification = await db.notifications.find_one({"id": notification_id}, {"_id": 0})
+    return FastJSONResponse(updated_notification)
 
 @router.patch("/mark-all-read")
 async def mark_all_notifications_read(
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Mark all notifications as read for the current user"""
-    db = get_db()
+    # Reset the badge first; notifications created after this point stay unread
+    reset_at = datetime.utcnow()
+    await reset_unread(current_user.id)
     
     result = await db.notifications.update_many(
-        {"user_id": current_user.id, "is_read": False},
-        {"$set": {"is_read": True, "updated_at": datetime.utcnow()}}
+        {"user_id": current_user.id, "is_read": False, "created_at": {"$lte": reset_at}},
+        {"$set": {"is_read": True, "read_at": reset_at, "updated_at": reset_at}}
     )
     
+    if result.modified_count:
+        await notification_bus.publish(current_user.id, "notification.read_all", {})
     return {"message": f"Marked {result.modified_count} notifications as read"}
 
 @router.delete("/{notification_id}")
 async def delete_notification(
     notification_id: str,
-    current_user: UserResponse = Depends(get_current_user)
+    current_user: UserResponse = Depends(get_current_user),
+    db=Depends(get_database)
 ):
     """Delete a notification"""
-    db = get_db()
-    
-    notification_data = await db.notifications.find_one({
+    notification_data = await db.notifications.find_one_and_delete({
         "id": notification_id,
         "user_id": current_user.id
     })
@@ -110,19 +153,64 @@ async def delete_notification(
             detail="Notification not found"
         )
     
-    await db.notifications.delete_one({"id": notification_id})
+    if not notification_data.get("is_read"):
+        await decrement_unread(current_user.id, notification_data["type"])
+    await notification_bus.publish(current_user.id, "notification.deleted", {"id": notification_id})
     return {"message": "Notification deleted successfully"}
 
 @router.get("/unread/count")
 async def get_unread_notifications_count(
     current_user: UserResponse = Depends(get_current_user)
 ):
-    """Get count of unread notifications"""
-    db = get_db()
-    
-    count = await db.notifications.count_documents({
-        "user_id": current_user.id,
-        "is_read": False
-    })
-    
-    return {"unread_count": count}
\ No newline at end of file
+    """Get count of unread notifications, in total and per type"""
+    counts = await get_unread_counts(current_user.id)
+    return {"unread_count": counts["unread"], "by_type": counts["by_type"]}
+
+@router.get("/stream")
+async def stream_notifications(
+    last_event_id: Optional[str] = Query(None),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+    current_user: UserResponse = Depends(get_current_stream_user)
+):
+    """Push notification changes to the client as Server-Sent Events.
+    
+    On reconnect the browser sends Last-Event-ID and missed events are replayed;
+    when they are no longer available a "resync" event tells the client to refetch.
+    """
+    user_id = current_user.id
+    resume_from = last_event_id_header or last_event_id
+    
+    # Subscribe before replaying so nothing published in between is lost
+    queue = notification_bus.subscribe(user_id)
+    
+    async def event_stream():
+        try:
+            yield f"retry: {RECONNECT_MS}\n\n"
+            
+            replayed_ids = set()
+            if resume_from:
+                missed = await notification_bus.replay(user_id, resume_from)
+                if missed is None:
+                    yield "event: resync\ndata: {}\n\n"
+                else:
+                    for message in missed:
+                        replayed_ids.add(message["id"])
+                        yield format_sse(message)
+            
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if message["id"] in replayed_ids:
+                    continue
+                yield format_sse(message)
+        finally:
+            notification_bus.unsubscribe(user_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
\ No newline at end of file
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header
+from typing import Optional
+from profiler import PROFILER_MAX_SECONDS, PROFILER_TOKEN, profiler, token_matches
+from starlette.concurrency import run_in_threadpool
+
+router = APIRouter(prefix="/debug/profiler", tags=["debug"], include_in_schema=False)
+
+async def verify_profiler_token(x_profiler_token: Optional[str] = Header(None)):
+    """Gate the profiler behind PROFILER_TOKEN; without one configured it does not exist."""
+    if not PROFILER_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not Found"
+        )
+    if not token_matches(x_profiler_token):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid profiler token"
+        )
+
+@router.get("/", dependencies=[Depends(verify_profiler_token)])
+async def get_profiler_status():
+    """Whether a profile is being recorded, and the files of the last one"""
+    return {"running": profiler.running, "last_output": profiler.last_output}
+
+@router.post("/start", dependencies=[Depends(verify_profiler_token)])
+async def start_profiler(
+    duration: float = Query(30, gt=0, le=PROFILER_MAX_SECONDS),
+    sample_hz: Optional[float] = Query(None, gt=0, le=1000)
+):
+    """Sample all threads for `duration` seconds, then write collapsed-stack and speedscope files"""
+    if not profiler.start(duration, label="session", sample_hz=sample_hz):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A profile is already being recorded"
+        )
+    return {
+        "running": True,
+        "duration": duration,
+        "collapsed": str(profiler.output_path(".collapsed")),
+        "speedscope": str(profiler.output_path(".speedscope.json"))
+    }
+
+@router.post("/stop", dependencies=[Depends(verify_profiler_token)])
+async def stop_profiler():
+    """Stop the running profile early and return its files"""
+    output = await run_in_threadpool(profiler.stop)
+    return {"running": False, "last_output": output}
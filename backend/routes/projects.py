@@ -1,21 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from typing import List, Optional
-from models import Project, ProjectCreate, UserResponse, Plot, PlotBuyer, Payment
+from models import Project, ProjectCreate, UserResponse, Plot, PlotBuyer, Payment, LocationUpdate
 from auth import get_current_user, require_role
-from database import get_db
-from utils import serialize_doc, serialize_docs
+from database import get_database
+from documents import build_document, dump_many
+from conditional import bump_generation, entity_headers, entity_not_modified, list_validators
+from pnl import replace_project_payments
+from geo import BACKFILL_BATCH, MAX_RADIUS_KM, NEAR_PAGE_SIZE, backfill_locations, find_near, location_filters
+from utils import FastJSONResponse
 from datetime import datetime
 
 router = APIRouter(prefix="/projects", tags=["projects"])
 
 @router.get("/", response_model=List[dict])
 async def get_projects(
+    request: Request,
     area: Optional[str] = Query(None),
     search: Optional[str] = Query(None),
-    current_user: UserResponse = Depends(require_role(["builder"]))
+    near: Optional[str] = Query(None, description="longitude,latitude; sorts nearest first"),
+    radius_km: Optional[float] = Query(None, gt=0, le=MAX_RADIUS_KM),
+    within: Optional[str] = Query(None, description="min_lng,min_lat,max_lng,max_lat"),
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
 ):
     """Get all projects for the current builder"""
-    db = get_db()
+    headers, unchanged = await list_validators(request, current_user.id, "projects")
+    if unchanged:
+        return unchanged
     
     query = {"user_id": current_user.id}
     
@@ -30,41 +43,69 @@ async def get_projects(
             {"area": {"$regex": search, "$options": "i"}}
         ]
     
-    projects = await db.projects.find(query).sort("created_at", -1).to_list(None)
-    return serialize_docs(projects)
+    try:
+        geo_near = location_filters(query, near, radius_km, within)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    if geo_near:
+        projects = await find_near(db.projects, geo_near, skip, limit or NEAR_PAGE_SIZE)
+    else:
+        projects = await db.projects.find(query, {"_id": 0}).sort("created_at", -1)\
+            .skip(skip).limit(limit or 0).to_list(None)
+    return FastJSONResponse(projects, headers=headers)
 
 @router.post("/", response_model=dict)
 async def create_project(
     project_data: ProjectCreate,
-    current_user: UserResponse = Depends(require_role(["builder"]))
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
 ):
     """Create a new project"""
-    db = get_db()
+    # sold_plots, reserved_plots and plots start from the Project defaults
+    created_project = build_document(Project, project_data, user_id=current_user.id)
+    await db.projects.insert_one(created_project)
+    await bump_generation(current_user.id, "projects")
+    created_project.pop("_id")
     
-    project_dict = project_data.dict()
-    project_dict["user_id"] = current_user.id
-    project_dict["sold_plots"] = 0
-    project_dict["reserved_plots"] = 0
-    project_dict["plots"] = []
-    
-    project_obj = Project(**project_dict)
-    result = await db.projects.insert_one(project_obj.dict())
+    return FastJSONResponse(created_project)
+
+@router.post("/locations", response_model=dict)
+async def backfill_project_locations(
+    updates: List[LocationUpdate],
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
+):
+    """Set the coordinates of many projects at once"""
+    if not updates:
+        return {"matched": 0, "modified": 0, "not_found": []}
+    if len(updates) > BACKFILL_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {BACKFILL_BATCH} locations per request"
+        )
     
-    created_project = await db.projects.find_one({"_id": result.inserted_id})
-    return serialize_doc(created_project)
+    result = await backfill_locations(db.projects, current_user.id, updates, datetime.utcnow())
+    if result["modified"]:
+        await bump_generation(current_user.id, "projects")
+    return result
 
 @router.get("/{project_id}", response_model=dict)
 async def get_project(
     project_id: str,
-    current_user: UserResponse = Depends(require_role(["builder"]))
+    request: Request,
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
 ):
     """Get a specific project"""
-    db = get_db()
+    unchanged = await entity_not_modified(request, db.projects, {"id": project_id, "user_id": current_user.id})
+    if unchanged:
+        return unchanged
     
     project_data = await db.projects.find_one({
         "id": project_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not project_data:
         raise HTTPException(
@@ -72,17 +113,16 @@ async def get_project(
             detail="Project not found"
         )
     
-    return serialize_doc(project_data)
+    return FastJSONResponse(project_data, headers=entity_headers(project_data))
 
 @router.put("/{project_id}", response_model=dict)
 async def update_project(
     project_id: str,
     project_data: ProjectCreate,
-    current_user: UserResponse = Depends(require_role(["builder"]))
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
 ):
     """Update a project"""
-    db = get_db()
-    
     # Check if project exists and belongs to user
     existing_project = await db.projects.find_one({
         "id": project_id,
@@ -97,24 +137,27 @@ async def update_project(
     
     # Update project
     update_data = project_data.dict()
+    if "location" not in project_data.model_fields_set:
+        # Clients that predate locations must not clear backfilled coordinates
+        del update_data["location"]
     update_data["updated_at"] = datetime.utcnow()
     
     await db.projects.update_one(
         {"id": project_id},
         {"$set": update_data}
     )
+    await bump_generation(current_user.id, "projects")
     
-    updated_project = await db.projects.find_one({"id": project_id})
-    return serialize_doc(updated_project)
+    updated_project = await db.projects.find_one({"id": project_id}, {"_id": 0})
+    return FastJSONResponse(updated_project)
 
 @router.delete("/{project_id}")
 async def delete_project(
     project_id: str,
-    current_user: UserResponse = Depends(require_role(["builder"]))
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
 ):
     """Delete a project"""
-    db = get_db()
-    
     # Check if project exists and belongs to user
     existing_project = await db.projects.find_one({
         "id": project_id,
@@ -128,21 +171,22 @@ async def delete_project(
         )
     
     await db.projects.delete_one({"id": project_id})
+    await bump_generation(current_user.id, "projects")
+    await replace_project_payments(current_user.id, project_id, [])
     return {"message": "Project deleted successfully"}
 
 @router.get("/{project_id}/plots", response_model=List[dict])
 async def get_project_plots(
     project_id: str,
     status_filter: Optional[str] = Query(None, alias="status"),
-    current_user: UserResponse = Depends(require_role(["builder"]))
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
 ):
     """Get all plots for a specific project"""
-    db = get_db()
-    
     project_data = await db.projects.find_one({
         "id": project_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0, "plots": 1})
     
     if not project_data:
         raise HTTPException(
@@ -156,21 +200,20 @@ async def get_project_plots(
     if status_filter:
         plots = [plot for plot in plots if plot.get("status") == status_filter]
     
-    return plots
+    return FastJSONResponse(plots)
 
 @router.post("/{project_id}/plots", response_model=dict)
 async def add_plot_to_project(
     project_id: str,
     plot_data: Plot,
-    current_user: UserResponse = Depends(require_role(["builder"]))
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
 ):
     """Add a new plot to a project"""
-    db = get_db()
-    
     project_data = await db.projects.find_one({
         "id": project_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not project_data:
         raise HTTPException(
@@ -207,6 +250,8 @@ async def add_plot_to_project(
             }
         }
     )
+    await bump_generation(current_user.id, "projects")
+    await replace_project_payments(current_user.id, project_id, existing_plots)
     
     return {"message": "Plot added successfully", "plot": new_plot}
 
@@ -215,15 +260,14 @@ async def update_plot(
     project_id: str,
     plot_number: str,
     plot_data: Plot,
-    current_user: UserResponse = Depends(require_role(["builder"]))
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
 ):
     """Update a specific plot in a project"""
-    db = get_db()
-    
     project_data = await db.projects.find_one({
         "id": project_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not project_data:
         raise HTTPException(
@@ -260,6 +304,8 @@ async def update_plot(
             }
         }
     )
+    await bump_generation(current_user.id, "projects")
+    await replace_project_payments(current_user.id, project_id, plots)
     
     return {"message": "Plot updated successfully", "plot": plot_data.dict()}
 
@@ -268,15 +314,14 @@ async def add_payment_to_plot(
     project_id: str,
     plot_number: str,
     payment_data: Payment,
-    current_user: UserResponse = Depends(require_role(["builder"]))
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
 ):
     """Add a payment to a specific plot"""
-    db = get_db()
-    
     project_data = await db.projects.find_one({
         "id": project_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not project_data:
         raise HTTPException(
@@ -308,6 +353,8 @@ async def add_payment_to_plot(
             }
         }
     )
+    await bump_generation(current_user.id, "projects")
+    await replace_project_payments(current_user.id, project_id, plots)
     
     return {"message": "Payment added successfully", "payment": payment_data.dict()}
 
@@ -315,15 +362,14 @@ async def add_payment_to_plot(
 async def bulk_upload_plots(
     project_id: str,
     plots_data: List[Plot],
-    current_user: UserResponse = Depends(require_role(["builder"]))
+    current_user: UserResponse = Depends(require_role(["builder"])),
+    db=Depends(get_database)
 ):
     """Bulk upload plots to a project"""
-    db = get_db()
-    
     project_data = await db.projects.find_one({
         "id": project_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not project_data:
         raise HTTPException(
@@ -351,7 +397,7 @@ async def bulk_upload_plots(
         )
     
     # Add all plots
-    new_plots = [plot.dict() for plot in plots_data]
+    new_plots = dump_many(Plot, plots_data)
     all_plots = existing_plots + new_plots
     
     # Update project statistics
@@ -372,6 +418,8 @@ async def bulk_upload_plots(
             }
         }
     )
+    await bump_generation(current_user.id, "projects")
+    await replace_project_payments(current_user.id, project_id, all_plots)
     
     return {
         "message": f"Successfully uploaded {len(new_plots)} plots",
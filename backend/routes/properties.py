@@ -1,23 +1,41 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from typing import List, Optional
-from models import Property, PropertyCreate, UserResponse
+from models import Property, PropertyCreate, UserResponse, LocationUpdate
 from auth import get_current_user, require_role
-from database import get_db
-from utils import serialize_doc, serialize_docs
+from database import get_database
+from documents import build_document
+from conditional import bump_generation, entity_headers, entity_not_modified, list_validators
+from search import search_index
+from matching import matcher_cache
+from facets import PROPERTY_FACETS, faceted_list, parse_facets
+from geo import BACKFILL_BATCH, MAX_RADIUS_KM, NEAR_PAGE_SIZE, backfill_locations, find_near, location_filters
+from utils import FastJSONResponse
+from scheduler import reminder_scheduler
+from image_store import extract_inline_images
 from datetime import datetime
 
 router = APIRouter(prefix="/properties", tags=["properties"])
 
 @router.get("/", response_model=List[dict])
 async def get_properties(
+    request: Request,
     area: Optional[str] = Query(None),
     property_type: Optional[str] = Query(None),
-    status: Optional[str] = Query(None),
+    status_filter: Optional[str] = Query(None, alias="status"),
     search: Optional[str] = Query(None),
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    near: Optional[str] = Query(None, description="longitude,latitude; sorts nearest first"),
+    radius_km: Optional[float] = Query(None, gt=0, le=MAX_RADIUS_KM),
+    within: Optional[str] = Query(None, description="min_lng,min_lat,max_lng,max_lat"),
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    facets: Optional[str] = Query(None, description="Comma-separated: area, type, status, bedrooms, deal_status"),
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Get all properties for the current broker"""
-    db = get_db()
+    headers, unchanged = await list_validators(request, current_user.id, "properties")
+    if unchanged:
+        return unchanged
     
     query = {"user_id": current_user.id}
     
@@ -26,8 +44,8 @@ async def get_properties(
         query["area"] = area
     if property_type:
         query["type"] = property_type
-    if status:
-        query["status"] = status
+    if status_filter:
+        query["status"] = status_filter
     
     # Apply search
     if search:
@@ -37,38 +55,61 @@ async def get_properties(
             {"area": {"$regex": search, "$options": "i"}}
         ]
     
-    properties = await db.properties.find(query).sort("created_at", -1).to_list(None)
-    return serialize_docs(properties)
+    try:
+        geo_near = location_filters(query, near, radius_km, within)
+        facet_fields = parse_facets(facets, PROPERTY_FACETS)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    if facet_fields:
+        # $geoNear already orders by distance
+        page = await faceted_list(
+            db.properties, current_user.id, geo_near or {"$match": query},
+            None if geo_near else {"created_at": -1}, skip, limit, facet_fields
+        )
+        return FastJSONResponse(page, headers=headers)
+    if geo_near:
+        properties = await find_near(db.properties, geo_near, skip, limit or NEAR_PAGE_SIZE)
+    else:
+        properties = await db.properties.find(query, {"_id": 0}).sort("created_at", -1)\
+            .skip(skip).limit(limit or 0).to_list(None)
+    return FastJSONResponse(properties, headers=headers)
 
 @router.post("/", response_model=dict)
 async def create_property(
     property_data: PropertyCreate,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Create a new property"""
-    db = get_db()
-    
-    property_dict = property_data.dict()
-    property_dict["user_id"] = current_user.id
-    
-    property_obj = Property(**property_dict)
-    result = await db.properties.insert_one(property_obj.dict())
-    
-    created_property = await db.properties.find_one({"_id": result.inserted_id})
-    return serialize_doc(created_property)
+    created_property = build_document(Property, property_data, user_id=current_user.id)
+    # Clients still sending base64 get their images moved to the image store
+    created_property["images"], _ = await extract_inline_images(created_property["images"])
+    await db.properties.insert_one(created_property)
+    generation = await bump_generation(current_user.id, "properties", [created_property["id"]])
+    created_property.pop("_id")
+    search_index.upsert(current_user.id, "properties", generation, created_property)
+    matcher_cache.upsert(current_user.id, "properties", generation, created_property)
+    
+    reminder_scheduler.track("property", created_property)
+    return FastJSONResponse(created_property)
 
 @router.get("/{property_id}", response_model=dict)
 async def get_property(
     property_id: str,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    request: Request,
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Get a specific property"""
-    db = get_db()
+    unchanged = await entity_not_modified(request, db.properties, {"id": property_id, "user_id": current_user.id})
+    if unchanged:
+        return unchanged
     
     property_data = await db.properties.find_one({
         "id": property_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not property_data:
         raise HTTPException(
@@ -76,17 +117,16 @@ async def get_property(
             detail="Property not found"
         )
     
-    return serialize_doc(property_data)
+    return FastJSONResponse(property_data, headers=entity_headers(property_data))
 
 @router.put("/{property_id}", response_model=dict)
 async def update_property(
     property_id: str,
     property_data: PropertyCreate,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Update a property"""
-    db = get_db()
-    
     # Check if property exists and belongs to user
     existing_property = await db.properties.find_one({
         "id": property_id,
@@ -101,24 +141,31 @@ async def update_property(
     
     # Update property
     update_data = property_data.dict()
+    if "location" not in property_data.model_fields_set:
+        # Clients that predate locations must not clear backfilled coordinates
+        del update_data["location"]
+    update_data["images"], _ = await extract_inline_images(update_data["images"])
     update_data["updated_at"] = datetime.utcnow()
     
     await db.properties.update_one(
         {"id": property_id},
         {"$set": update_data}
     )
+    generation = await bump_generation(current_user.id, "properties", [property_id])
     
-    updated_property = await db.properties.find_one({"id": property_id})
-    return serialize_doc(updated_property)
+    updated_property = await db.properties.find_one({"id": property_id}, {"_id": 0})
+    search_index.upsert(current_user.id, "properties", generation, updated_property)
+    matcher_cache.upsert(current_user.id, "properties", generation, updated_property)
+    reminder_scheduler.track("property", updated_property)
+    return FastJSONResponse(updated_property)
 
 @router.delete("/{property_id}")
 async def delete_property(
     property_id: str,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Delete a property"""
-    db = get_db()
-    
     # Check if property exists and belongs to user
     existing_property = await db.properties.find_one({
         "id": property_id,
@@ -132,20 +179,23 @@ async def delete_property(
         )
     
     await db.properties.delete_one({"id": property_id})
+    generation = await bump_generation(current_user.id, "properties", [property_id])
+    search_index.remove(current_user.id, "properties", generation, property_id)
+    matcher_cache.remove(current_user.id, "properties", generation, property_id)
+    reminder_scheduler.forget("property", property_id)
     return {"message": "Property deleted successfully"}
 
 @router.patch("/{property_id}/hot", response_model=dict)
 async def toggle_hot_property(
     property_id: str,
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Toggle hot property status"""
-    db = get_db()
-    
     property_data = await db.properties.find_one({
         "id": property_id,
         "user_id": current_user.id
-    })
+    }, {"_id": 0})
     
     if not property_data:
         raise HTTPException(
@@ -159,26 +209,47 @@ async def toggle_hot_property(
         {"id": property_id},
         {"$set": {"is_hot": new_hot_status, "updated_at": datetime.utcnow()}}
     )
+    generation = await bump_generation(current_user.id, "properties", [property_id])
+    
+    updated_property = await db.properties.find_one({"id": property_id}, {"_id": 0})
+    search_index.upsert(current_user.id, "properties", generation, updated_property)
+    matcher_cache.upsert(current_user.id, "properties", generation, updated_property)
+    return FastJSONResponse(updated_property)
+
+@router.post("/locations", response_model=dict)
+async def backfill_property_locations(
+    updates: List[LocationUpdate],
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
+):
+    """Set the coordinates of many properties at once"""
+    if not updates:
+        return {"matched": 0, "modified": 0, "not_found": []}
+    if len(updates) > BACKFILL_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {BACKFILL_BATCH} locations per request"
+        )
     
-    updated_property = await db.properties.find_one({"id": property_id})
-    return serialize_doc(updated_property)
+    result = await backfill_locations(db.properties, current_user.id, updates, datetime.utcnow())
+    if result["modified"]:
+        await bump_generation(current_user.id, "properties", [update.id for update in updates])
+    return result
 
 @router.get("/areas/list")
 async def get_property_areas(
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Get list of all areas where user has properties"""
-    db = get_db()
-    
     areas = await db.properties.distinct("area", {"user_id": current_user.id})
     return {"areas": areas}
 
 @router.get("/types/list")
 async def get_property_types(
-    current_user: UserResponse = Depends(require_role(["broker"]))
+    current_user: UserResponse = Depends(require_role(["broker"])),
+    db=Depends(get_database)
 ):
     """Get list of all property types for user"""
-    db = get_db()
-    
     types = await db.properties.distinct("type", {"user_id": current_user.id})
     return {"types": types}
\ No newline at end of file
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from typing import Optional
+from models import UserResponse
+from auth import require_role
+from search import SEARCH_TYPES, search_index
+from utils import FastJSONResponse
+
+router = APIRouter(prefix="/search", tags=["search"])
+
+@router.get("/")
+async def global_search(
+    q: str = Query(..., min_length=1, max_length=200),
+    types: Optional[str] = Query(None, description="Comma-separated: property, customer, deal, event"),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: UserResponse = Depends(require_role(["broker"]))
+):
+    """Search properties, customers, deals and events by name, phone, area, title or notes"""
+    requested = [t.strip() for t in types.split(",") if t.strip()] if types else None
+    unknown = [t for t in requested or [] if t not in SEARCH_TYPES]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown search types: {', '.join(unknown)}"
+        )
+
+    results = await search_index.search(current_user.id, q, requested, limit)
+    return FastJSONResponse({"query": q, "results": results})
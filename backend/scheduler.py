@@ -0,0 +1,314 @@
+import asyncio
+import heapq
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from database import acquire_lease, get_db
+from fanout import deliver_notifications
+from models import Notification, NotificationType
+from utils import expand_recurrence, local_to_utc, utc_to_local
+
+logger = logging.getLogger(__name__)
+
+# Only reminders due within this window are kept in memory
+LOOKAHEAD = timedelta(minutes=15)
+# Reminders missed while no worker was leading are still delivered up to this age
+CATCHUP = timedelta(hours=24)
+# Full reload from the database; bounds how late changes made on other workers fire
+REFRESH_INTERVAL = timedelta(minutes=1)
+# Longest the loop sleeps before renewing its lease
+TICK_SECONDS = 15
+LEASE_TTL = timedelta(seconds=60)
+LEASE_ID = "reminder_scheduler"
+FIRE_BATCH_SIZE = 500
+
+# One marker per delivered reminder: {"_id": reminder_key, "fired_at": datetime}.
+# Reloads skip marked reminders; markers older than CATCHUP are pruned on reload.
+FIRED_COLLECTION = "fired_reminders"
+
+EVENT_REMINDER_LEAD = timedelta(minutes=int(os.environ.get("EVENT_REMINDER_LEAD_MINUTES", "30")))
+
+# Customers in these states no longer need follow-ups
+CLOSED_CUSTOMER_STATUSES = ["Closed", "Deal Lost"]
+
+def _follow_up_reminders(kind: str, doc: Dict[str, Any], field: str) -> List[Dict[str, Any]]:
+    """Build the reminder for a follow-up datetime entered as wall-clock time."""
+    if not doc.get(field):
+        return []
+    due_at = local_to_utc(doc[field])
+    if kind == "property":
+        title = "Property follow-up due"
+        message = f"Follow up on {doc.get('title', 'property')}"
+    else:
+        title = "Customer follow-up due"
+        message = f"Follow up with {doc.get('name', 'customer')}"
+    return [{
+        "kind": kind,
+        "entity_id": doc["id"],
+        "user_id": doc["user_id"],
+        "due_at": due_at,
+        "title": title,
+        "message": message,
+        "type": NotificationType.FOLLOWUP,
+    }]
+
+def _event_reminders(doc: Dict[str, Any], window_start: datetime, window_end: datetime) -> List[Dict[str, Any]]:
+    """Build reminders for an event (or the occurrences of a series) due inside the window."""
+    if not doc.get("starts_at") or doc.get("status", "scheduled") != "scheduled":
+        return []
+    reminders = []
+    occurrences = expand_recurrence(doc, window_start + EVENT_REMINDER_LEAD, window_end + EVENT_REMINDER_LEAD)
+    for occurrence in occurrences:
+        reminders.append({
+            "kind": "event",
+            "entity_id": doc["id"],
+            "user_id": doc["user_id"],
+            "due_at": occurrence["starts_at"] - EVENT_REMINDER_LEAD,
+            "title": f"Upcoming {doc.get('type', 'event')}",
+            "message": f"{doc.get('title', 'Event')} at {doc.get('time', '')} with {doc.get('customer', '')}".strip(),
+            "type": NotificationType.MEETING,
+        })
+    return reminders
+
+def build_reminders(kind: str, doc: Dict[str, Any], window_start: datetime, window_end: datetime) -> List[Dict[str, Any]]:
+    """Return the reminders for a single document that fall due inside [window_start, window_end]."""
+    if kind == "property":
+        reminders = _follow_up_reminders(kind, doc, "next_follow_up")
+    elif kind == "customer":
+        if doc.get("status") in CLOSED_CUSTOMER_STATUSES:
+            return []
+        reminders = _follow_up_reminders(kind, doc, "follow_up_date")
+    else:
+        return _event_reminders(doc, window_start, window_end)
+    return [r for r in reminders if window_start <= r["due_at"] <= window_end]
+
+def reminder_key(reminder: Dict[str, Any]) -> str:
+    """Deterministic key for a reminder; the unique index on it makes delivery exactly-once."""
+    return f"{reminder['kind']}:{reminder['entity_id']}:{reminder['due_at'].isoformat()}"
+
+class ReminderScheduler:
+    """Turns follow-up dates and scheduled events into notifications when they come due.
+
+    Keeps a min-heap of reminders due within LOOKAHEAD. Routers call ``track``/``forget``
+    as they mutate the underlying fields; a periodic reload picks up changes made by
+    other workers. Only the worker holding the lease document fires reminders. Each
+    reload covers the whole CATCHUP window minus the reminders already marked fired,
+    so a reminder written on another worker that came due before the reload still
+    fires, just late. The unique ``reminder_key`` index on notifications guards lease
+    hand-overs.
+    """
+
+    def __init__(self):
+        self.worker_id: Optional[str] = None
+        self.is_leader = False
+        self._heap: List[tuple] = []
+        self._versions: Dict[tuple, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_reload: Optional[datetime] = None
+
+    async def start(self):
+        """Start the scheduler loop in the background."""
+        # Taken at start, in the worker process, so forked workers never share an id
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the loop and release the lease so another worker can take over immediately."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await get_db().scheduler_leases.update_one(
+                {"_id": LEASE_ID, "owner": self.worker_id},
+                {"$set": {"expires_at": datetime.utcnow()}}
+            )
+            self.is_leader = False
+
+    def track(self, kind: str, doc: Dict[str, Any]):
+        """(Re)schedule the reminders of a document that was just created or updated."""
+        if not self.is_leader:
+            # The leader picks the change up on its next reload
+            return
+        version = self._bump(kind, doc["id"])
+        now = datetime.utcnow()
+        for reminder in build_reminders(kind, doc, now - CATCHUP, now + LOOKAHEAD):
+            self._push(reminder, version)
+        self._wake()
+
+    def forget(self, kind: str, entity_id: str):
+        """Drop pending reminders of a deleted document."""
+        if self.is_leader:
+            self._bump(kind, entity_id)
+
+    def _bump(self, kind: str, entity_id: str) -> int:
+        version = self._versions.get((kind, entity_id), 0) + 1
+        self._versions[(kind, entity_id)] = version
+        return version
+
+    def _push(self, reminder: Dict[str, Any], version: int):
+        heapq.heappush(self._heap, (reminder["due_at"], reminder_key(reminder), version, reminder))
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _tick(self, now: datetime):
+        """One loop iteration: renew the lease and, while leading, reload if stale and fire."""
+        self.is_leader = await self._acquire_lease()
+        if self.is_leader:
+            if self._last_reload is None or now - self._last_reload >= REFRESH_INTERVAL:
+                await self._reload(now)
+            await self._fire_due(now)
+
+    async def _run(self):
+        while True:
+            try:
+                await self._tick(datetime.utcnow())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Reminder scheduler iteration failed")
+
+            timeout = TICK_SECONDS
+            if self.is_leader and self._heap:
+                seconds_until_due = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+                timeout = max(0.0, min(timeout, seconds_until_due))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _acquire_lease(self) -> bool:
+        """Take or renew the single-leader lease; False while another worker holds it."""
+        acquired = await acquire_lease(LEASE_ID, self.worker_id, LEASE_TTL)
+        if not acquired and self.is_leader:
+            # Lost the lease; reload from scratch if it comes back
+            self._last_reload = None
+        return acquired
+
+    async def _reload(self, now: datetime):
+        """Rebuild the heap from indexed queries over the due fields."""
+        window_start = now - CATCHUP
+        fired_reminders = get_db()[FIRED_COLLECTION]
+        await fired_reminders.delete_many({"fired_at": {"$lt": window_start}})
+        # A reminder fires at or after it is due, so every marker that matters is this recent
+        fired = {marker["_id"] async for marker in fired_reminders.find({"fired_at": {"$gte": window_start}}, {"_id": 1})}
+
+        reminders = await load_reminders(window_start, now + LOOKAHEAD)
+        self._heap = []
+        self._versions = {}
+        for reminder in reminders:
+            if reminder_key(reminder) not in fired:
+                self._push(reminder, 0)
+        self._last_reload = now
+
+    async def _fire_due(self, now: datetime):
+        """Deliver every reminder that has come due, in batches."""
+        while self._heap and self._heap[0][0] <= now:
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < FIRE_BATCH_SIZE:
+                _, key, version, reminder = heapq.heappop(self._heap)
+                if self._versions.get((reminder["kind"], reminder["entity_id"]), 0) == version:
+                    due.append(reminder)
+            if due:
+                await deliver_reminders(due)
+
+REMINDER_SOURCES = {
+    "property": ("properties", "next_follow_up"),
+    "customer": ("customers", "follow_up_date"),
+    "event": ("events", "starts_at"),
+}
+
+async def load_reminders(window_start: datetime, window_end: datetime, ids: Optional[Dict[str, List[str]]] = None) -> List[Dict[str, Any]]:
+    """Load reminders due inside the window, optionally restricted to specific entity ids per kind."""
+    db = get_db()
+    reminders = []
+    for kind, (collection, field) in REMINDER_SOURCES.items():
+        if ids is not None and not ids.get(kind):
+            continue
+
+        if kind == "event":
+            # One-off events by their (UTC) start; series that have begun by the window end
+            # and not ended before its start
+            query = {
+                "status": "scheduled",
+                "$or": [
+                    {"recurrence": None, "starts_at": {
+                        "$gte": window_start + EVENT_REMINDER_LEAD,
+                        "$lte": window_end + EVENT_REMINDER_LEAD
+                    }},
+                    {
+                        "recurrence": {"$ne": None},
+                        "starts_at": {"$lte": window_end + EVENT_REMINDER_LEAD},
+                        "$or": [
+                            {"series_ends_at": None},
+                            {"series_ends_at": {"$gte": window_start + EVENT_REMINDER_LEAD}}
+                        ]
+                    }
+                ]
+            }
+        else:
+            # Follow-up dates are stored as wall-clock time
+            query = {field: {"$gte": utc_to_local(window_start), "$lte": utc_to_local(window_end)}}
+        if ids is not None:
+            query["id"] = {"$in": ids[kind]}
+
+        async for doc in db[collection].find(query, {"_id": 0}):
+            reminders.extend(build_reminders(kind, doc, window_start, window_end))
+    return reminders
+
+async def deliver_reminders(due: List[Dict[str, Any]]):
+    """Insert notifications for due reminders that still match the database and mark them fired.
+
+    Reminders are re-read in one query per kind so edits made on other workers since
+    the last reload are respected; already fired and duplicate reminder keys are
+    skipped silently.
+    """
+    ids: Dict[str, List[str]] = {}
+    for reminder in due:
+        ids.setdefault(reminder["kind"], []).append(reminder["entity_id"])
+    window_start = min(r["due_at"] for r in due)
+    window_end = max(r["due_at"] for r in due)
+
+    current_keys = {reminder_key(r) for r in await load_reminders(window_start, window_end, ids)}
+    fired_reminders = get_db()[FIRED_COLLECTION]
+    current_keys -= {
+        marker["_id"] async for marker in fired_reminders.find({"_id": {"$in": list(current_keys)}}, {"_id": 1})
+    }
+
+    notifications = []
+    for reminder in due:
+        key = reminder_key(reminder)
+        if key not in current_keys:
+            continue
+        notification = Notification(
+            user_id=reminder["user_id"],
+            title=reminder["title"],
+            message=reminder["message"],
+            type=reminder["type"],
+            related_id=reminder["entity_id"]
+        ).dict()
+        notification["reminder_key"] = key
+        notifications.append(notification)
+
+    if notifications:
+        await deliver_notifications(notifications)
+        now = datetime.utcnow()
+        await fired_reminders.bulk_write([
+            UpdateOne({"_id": notification["reminder_key"]}, {"$setOnInsert": {"fired_at": now}}, upsert=True)
+            for notification in notifications
+        ], ordered=False)
+
+reminder_scheduler = ReminderScheduler()
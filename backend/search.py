@@ -0,0 +1,344 @@
+import asyncio
+import heapq
+import os
+import re
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from conditional import TenantCache
+
+# Tenants whose index is kept in memory per worker; the least recently searched is dropped
+SEARCH_INDEX_MAX_TENANTS = int(os.environ.get("SEARCH_INDEX_MAX_TENANTS", "64"))
+# Shorter terms only match whole tokens
+MIN_PREFIX_LENGTH = 2
+# Vocabulary tokens a single prefix may expand to
+MAX_PREFIX_EXPANSION = 256
+# Score multiplier for a prefix match relative to a whole-token match
+PREFIX_WEIGHT = 0.5
+# Postings at least this long are also kept grouped by weight for ranking
+TIERED_POSTING_SIZE = 256
+# Documents (re)indexed between yields to the event loop
+REINDEX_BATCH = 500
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+_PHONE_QUERY_RE = re.compile(r"[\d\s+\-().]+")
+_NON_DIGIT_RE = re.compile(r"\D")
+
+# (collection, entity id)
+Ref = Tuple[str, str]
+
+@dataclass(frozen=True)
+class EntitySpec:
+    type: str
+    # Indexed field path -> weight of a match in that field
+    fields: Dict[str, int]
+    title: str
+    subtitle: Tuple[str, ...]
+
+ENTITY_SPECS: Dict[str, EntitySpec] = {
+    "properties": EntitySpec(
+        "property",
+        {"title": 8, "owner.phone": 8, "owner.name": 5, "area": 5, "address": 3, "type": 1, "status": 1},
+        "title", ("area", "price")
+    ),
+    "customers": EntitySpec(
+        "customer",
+        {"name": 8, "phone": 8, "email": 6, "interest": 3, "notes": 2},
+        "name", ("phone", "interest")
+    ),
+    "deals": EntitySpec(
+        "deal",
+        {"customer_name": 6, "property_title": 6, "notes": 2, "status": 1},
+        "property_title", ("customer_name", "status")
+    ),
+    "events": EntitySpec(
+        "event",
+        {"title": 6, "phone": 8, "customer": 5, "location": 4, "notes": 2, "type": 1},
+        "title", ("customer", "location")
+    ),
+}
+SEARCH_TYPES = {spec.type: collection for collection, spec in ENTITY_SPECS.items()}
+
+def _field(doc: Dict[str, Any], path: str) -> Any:
+    if "." not in path:
+        return doc.get(path)
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+def _text(value: Any) -> str:
+    return str(getattr(value, "value", value))
+
+def _projection(spec: EntitySpec) -> Dict[str, int]:
+    fields = {"_id": 0, "id": 1, spec.title: 1}
+    fields.update({path: 1 for path in spec.fields})
+    fields.update({path: 1 for path in spec.subtitle})
+    return fields
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+def _phone_tokens(phone: str) -> List[str]:
+    # "+91 98450 12345" is found by its typed groups, its digits and the ten-digit
+    # national number, but not by the country code every number shares
+    digits = _NON_DIGIT_RE.sub("", phone)
+    groups = tokenize(phone)
+    if len(digits) > 10 and groups and groups[0] == digits[:-10]:
+        groups = groups[1:]
+    return groups + [digits, digits[-10:]]
+
+def document_tokens(spec: EntitySpec, doc: Dict[str, Any]) -> Dict[str, int]:
+    """Token -> best field weight for one document."""
+    weights: Dict[str, int] = {}
+    for path, weight in spec.fields.items():
+        value = _field(doc, path)
+        if not value:
+            continue
+        text = _text(value)
+        tokens = _phone_tokens(text) if path.endswith("phone") else tokenize(text)
+        for token in tokens:
+            if weights.get(token, 0) < weight:
+                weights[token] = weight
+    return weights
+
+def query_terms(query: str) -> List[str]:
+    """Terms that must all match; phone-like queries collapse to one digit string."""
+    if _PHONE_QUERY_RE.fullmatch(query.strip()):
+        digits = _NON_DIGIT_RE.sub("", query)
+        if len(digits) >= 5:
+            return [digits[-10:]]
+    return list(dict.fromkeys(tokenize(query)))
+
+class TenantIndex:
+    """Inverted index over one user's searchable entities.
+
+    postings maps token -> {ref: weight}; vocabulary is the sorted token list
+    used to expand prefixes. Each collection records the generation (see
+    conditional.bump_generation) its contents reflect.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[Ref, int]] = {}
+        self.vocabulary: List[str] = []
+        # collection -> entity id -> (tokens, display fields)
+        self.documents: Dict[str, Dict[str, Tuple[Tuple[str, ...], Dict[str, Any]]]] = {c: {} for c in ENTITY_SPECS}
+        self.generations: Dict[str, Optional[int]] = {}
+        # Long postings grouped by weight, so ranking them needs only set operations
+        self.tiers: Dict[str, Dict[int, Set[Ref]]] = {}
+        # Set during a bulk reload, which sorts the vocabulary once at the end
+        self.loading = False
+
+    def __len__(self) -> int:
+        return sum(len(docs) for docs in self.documents.values())
+
+    def _add(self, collection: str, doc: Dict[str, Any], keep_sorted: bool):
+        spec = ENTITY_SPECS[collection]
+        ref = (collection, doc["id"])
+        weights = document_tokens(spec, doc)
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                if keep_sorted:
+                    insort(self.vocabulary, token)
+            posting[ref] = weight
+            tiers = self.tiers.get(token)
+            if tiers is not None:
+                tiers.setdefault(weight, set()).add(ref)
+            elif keep_sorted and len(posting) >= TIERED_POSTING_SIZE:
+                self._build_tiers(token)
+        subtitle = " · ".join(_text(value) for value in (_field(doc, path) for path in spec.subtitle) if value)
+        self.documents[collection][doc["id"]] = (
+            tuple(weights), {"type": spec.type, "id": doc["id"], "title": _field(doc, spec.title), "subtitle": subtitle}
+        )
+
+    def _remove(self, collection: str, entity_id: str, keep_sorted: bool):
+        entry = self.documents[collection].pop(entity_id, None)
+        if entry is None:
+            return
+        ref = (collection, entity_id)
+        for token in entry[0]:
+            posting = self.postings[token]
+            weight = posting.pop(ref)
+            tiers = self.tiers.get(token)
+            if tiers is not None:
+                tiers[weight].discard(ref)
+            if not posting:
+                del self.postings[token]
+                self.tiers.pop(token, None)
+                if keep_sorted:
+                    del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    def upsert(self, collection: str, doc: Dict[str, Any]):
+        self._remove(collection, doc["id"], keep_sorted=not self.loading)
+        self._add(collection, doc, keep_sorted=not self.loading)
+
+    def remove(self, collection: str, entity_id: str):
+        self._remove(collection, entity_id, keep_sorted=not self.loading)
+
+    def _finish_load(self):
+        self.vocabulary = sorted(self.postings)
+        for token, posting in self.postings.items():
+            if len(posting) >= TIERED_POSTING_SIZE and token not in self.tiers:
+                self._build_tiers(token)
+
+    def replace_collection(self, collection: str, docs: Iterable[Dict[str, Any]], generation: int):
+        """Reindex one collection in a single step, sorting the vocabulary once rather than per token."""
+        for entity_id in list(self.documents[collection]):
+            self._remove(collection, entity_id, keep_sorted=False)
+        for doc in docs:
+            self._add(collection, doc, keep_sorted=False)
+        self._finish_load()
+        self.generations[collection] = generation
+
+    async def reload(self, sources: Dict[str, AsyncIterable[Dict[str, Any]]], generations: Dict[str, int]):
+        """Reindex collections from async cursors without holding the event loop.
+
+        Yields every REINDEX_BATCH documents. Until it finishes, writes to the
+        collections being reloaded are dropped (they stay stale and reload again
+        on the next search) and writes to the others skip vocabulary upkeep.
+        """
+        for collection in sources:
+            self.generations[collection] = None
+        self.loading = True
+        try:
+            processed = 0
+            for collection, docs in sources.items():
+                for entity_id in list(self.documents[collection]):
+                    self._remove(collection, entity_id, keep_sorted=False)
+                    processed += 1
+                    if processed % REINDEX_BATCH == 0:
+                        await asyncio.sleep(0)
+                async for doc in docs:
+                    self._add(collection, doc, keep_sorted=False)
+                    processed += 1
+                    if processed % REINDEX_BATCH == 0:
+                        await asyncio.sleep(0)
+        finally:
+            self.loading = False
+            self._finish_load()
+        for collection in sources:
+            self.generations[collection] = generations[collection]
+
+    def _expand(self, term: str) -> List[str]:
+        if len(term) < MIN_PREFIX_LENGTH:
+            return [term] if term in self.postings else []
+        start = bisect_left(self.vocabulary, term)
+        tokens = []
+        for token in self.vocabulary[start:start + MAX_PREFIX_EXPANSION]:
+            if not token.startswith(term):
+                break
+            tokens.append(token)
+        return tokens
+
+    def _build_tiers(self, token: str):
+        tiers: Dict[int, Set[Ref]] = {}
+        for ref, weight in self.postings[token].items():
+            tiers.setdefault(weight, set()).add(ref)
+        self.tiers[token] = tiers
+
+    def _matching(self, term: str) -> List[Tuple[float, str]]:
+        return [(1.0 if token == term else PREFIX_WEIGHT, token) for token in self._expand(term)]
+
+    def _levels(self, matching: List[Tuple[float, str]], candidates: Set[Ref]) -> List[Tuple[float, Set[Ref]]]:
+        """Partition one term's candidates by score, best first; a document counts at its best match."""
+        by_score: Dict[float, Set[Ref]] = {}
+        for factor, token in matching:
+            tiers = self.tiers.get(token)
+            if tiers is not None:
+                for weight, refs in tiers.items():
+                    by_score.setdefault(weight * factor, set()).update(candidates.intersection(refs))
+                continue
+            for ref, weight in self.postings[token].items():
+                if ref in candidates:
+                    by_score.setdefault(weight * factor, set()).add(ref)
+
+        levels = []
+        seen: Set[Ref] = set()
+        for score in sorted(by_score, reverse=True):
+            refs = by_score[score] - seen
+            if refs:
+                levels.append((score, refs))
+                seen |= refs
+        return levels
+
+    def search(self, terms: Sequence[str], collections: Sequence[str], limit: int) -> List[Dict[str, Any]]:
+        """Entities matching every term, by whole token or prefix, best first."""
+        matches = [self._matching(term) for term in terms]
+        if not matches or any(not matching for matching in matches):
+            return []
+
+        # Intersect on posting keys first (set operations run in C), rarest term first
+        candidates = None
+        for matching in sorted(matches, key=lambda matching: sum(len(self.postings[t]) for _, t in matching)):
+            postings = [self.postings[token].keys() for _, token in matching]
+            refs = postings[0] if len(postings) == 1 else set().union(*postings)
+            candidates = set(refs) if candidates is None else candidates.intersection(refs)
+            if not candidates:
+                return []
+        if len(collections) < len(ENTITY_SPECS):
+            candidates = {ref for ref in candidates if ref[0] in collections}
+            if not candidates:
+                return []
+        term_levels = [self._levels(matching, candidates) for matching in matches]
+
+        # A document's score is the sum of its level in each term. Walk combinations of
+        # levels from the highest total down, so only the top documents are ever ranked.
+        first = (0,) * len(term_levels)
+        heap = [(-sum(levels[0][0] for levels in term_levels), first)]
+        visited = {first}
+        ranked: List[Tuple[float, Ref]] = []
+        while heap:
+            negative_total, combination = heapq.heappop(heap)
+            if len(ranked) >= limit and -negative_total < ranked[limit - 1][0]:
+                break
+            sets = sorted((term_levels[i][j][1] for i, j in enumerate(combination)), key=len)
+            refs = sets[0].intersection(*sets[1:])
+            ranked.extend((-negative_total, ref) for ref in heapq.nlargest(limit, refs))
+            for i, j in enumerate(combination):
+                if j + 1 < len(term_levels[i]):
+                    following = combination[:i] + (j + 1,) + combination[i + 1:]
+                    if following not in visited:
+                        visited.add(following)
+                        total = sum(term_levels[t][k][0] for t, k in enumerate(following))
+                        heapq.heappush(heap, (-total, following))
+
+        return [
+            {**self.documents[collection][entity_id][1], "score": score}
+            for score, (collection, entity_id) in heapq.nlargest(limit, ranked)
+        ]
+
+class SearchIndexCache(TenantCache):
+    """Per-worker LRU of tenant indexes, built on first search and patched on writes."""
+
+    def __init__(self, max_tenants: int = SEARCH_INDEX_MAX_TENANTS):
+        super().__init__(
+            TenantIndex,
+            {collection: _projection(spec) for collection, spec in ENTITY_SPECS.items()},
+            max_tenants
+        )
+
+    async def search(self, user_id: str, query: str, types: Optional[Sequence[str]] = None,
+                     limit: int = 20) -> List[Dict[str, Any]]:
+        terms = query_terms(query)
+        if not terms:
+            return []
+        collections = [SEARCH_TYPES[t] for t in types] if types else list(ENTITY_SPECS)
+        index = await self.get(user_id)
+        return index.search(terms, collections, limit)
+
+    def upsert(self, user_id: str, collection: str, generation: int, doc: Dict[str, Any]):
+        """Apply a created or updated document, given the generation its write bumped to."""
+        index = self.caught_up(user_id, collection, generation)
+        if index is not None:
+            index.upsert(collection, doc)
+
+    def remove(self, user_id: str, collection: str, generation: int, entity_id: str):
+        index = self.caught_up(user_id, collection, generation)
+        if index is not None:
+            index.remove(collection, entity_id)
+
+search_index = SearchIndexCache()
@@ -1,59 +1,41 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, UploadFile, File, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 from pathlib import Path
+from contextlib import asynccontextmanager
 import os
 import logging
 from datetime import datetime, timedelta
 from typing import List, Optional
 
+ROOT_DIR = Path(__file__).parent
+# Modules below read their settings from the environment at import time
+load_dotenv(ROOT_DIR / '.env')
+
 # Import our models and utilities
 from models import *
 from auth import *
-from database import connect_to_mongo, close_mongo_connection, get_db
-from utils import serialize_doc, serialize_docs, calculate_dashboard_stats, format_currency
+from database import connect_to_mongo, close_mongo_connection, get_database
+from documents import build_document
+from scheduler import reminder_scheduler
+from pubsub import notification_bus
+from counters import counter_reconciler
+from retention import notification_archiver
+from image_store import migrate_inline_images
+from pnl import normalize_financial_months
+from query_budget import QueryBudgetMiddleware
+from profiler import RequestProfilerMiddleware
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, METRICS_TOKEN, MetricsMiddleware, metrics_token_matches, render_metrics
+from utils import serialize_doc, serialize_docs, calculate_dashboard_stats, format_currency, brokerage_total, FastJSONResponse
 
 # Import route modules
-from routes import properties, customers, deals, projects, notifications, events
-
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
-
-# Create the main app
-app = FastAPI(
-    title="RealEstate Pro API",
-    description="Comprehensive Real Estate Management Platform",
-    version="1.0.0"
-)
+from routes import properties, customers, deals, projects, financials, notifications, events, images, search as search_routes, matching as matching_routes, profiler as profiler_routes
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Global database reference
-db = None
-
-@app.on_event("startup")
-async def startup_db_client():
-    """Initialize database connection"""
-    await connect_to_mongo()
-    global db
-    db = get_db()
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    """Close database connection"""
-    await close_mongo_connection()
-
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -66,9 +48,24 @@ logger = logging.getLogger(__name__)
 async def root():
     return {"message": "RealEstate Pro API - Version 1.0.0"}
 
+@api_router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus scrape endpoint for this worker; without METRICS_TOKEN configured it does not exist"""
+    if not METRICS_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Not Found"
+        )
+    if not metrics_token_matches(request.headers.get("authorization")):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token"
+        )
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 # Authentication Routes
 @api_router.post("/auth/signup", response_model=TokenResponse)
-async def signup(user_data: UserCreate):
+async def signup(user_data: UserCreate, db=Depends(get_database)):
     """User registration"""
     # Check if passwords match
     if user_data.password != user_data.confirm_password:
@@ -87,23 +84,20 @@ async def signup(user_data: UserCreate):
     
     # Hash password and create user
     hashed_password = get_password_hash(user_data.password)
-    user_dict = user_data.dict(exclude={"password", "confirm_password"})
-    user_dict["password"] = hashed_password
-    
-    user = User(**user_dict)
-    await db.users.insert_one(user.dict())
+    user_doc = build_document(User, user_data, exclude={"password", "confirm_password"}, password=hashed_password)
+    await db.users.insert_one(user_doc)
     
     # Create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.id}, expires_delta=access_token_expires
+        data={"sub": user_doc["id"]}, expires_delta=access_token_expires
     )
     
-    user_response = UserResponse(**user.dict())
+    user_response = UserResponse.model_validate(user_doc)
     return TokenResponse(access_token=access_token, user=user_response)
 
 @api_router.post("/auth/login", response_model=TokenResponse)
-async def login(user_credentials: UserLogin):
+async def login(user_credentials: UserLogin, db=Depends(get_database)):
     """User login"""
     # Find user by email
     user_data = await db.users.find_one({"email": user_credentials.email})
@@ -136,7 +130,7 @@ async def get_current_user_info(current_user: UserResponse = Depends(get_current
 
 # Dashboard Routes
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats(current_user: UserResponse = Depends(get_current_user)):
+async def get_dashboard_stats(current_user: UserResponse = Depends(get_current_user), db=Depends(get_database)):
     """Get dashboard statistics"""
     if current_user.role == "broker":
         # Calculate broker stats
@@ -160,14 +154,14 @@ async def get_dashboard_stats(current_user: UserResponse = Depends(get_current_u
             }
         }).to_list(None)
         
-        monthly_brokerage = sum([float(deal.get("brokerage_amount", "0").replace("₹", "").replace("Lakh", "").replace("Cr", "").replace(",", "")) for deal in monthly_deals])
+        monthly_brokerage = brokerage_total(monthly_deals)
         
         all_deals = await db.deals.find({
             "user_id": current_user.id,
             "status": "Closed"
         }).to_list(None)
         
-        total_brokerage = sum([float(deal.get("brokerage_amount", "0").replace("₹", "").replace("Lakh", "").replace("Cr", "").replace(",", "")) for deal in all_deals])
+        total_brokerage = brokerage_total(all_deals)
         
         return BrokerStats(
             total_properties=properties_count,
@@ -180,26 +174,27 @@ async def get_dashboard_stats(current_user: UserResponse = Depends(get_current_u
     else:  # builder
         projects_count = await db.projects.count_documents({"user_id": current_user.id})
         
-        # Calculate plots statistics
-        projects = await db.projects.find({"user_id": current_user.id}).to_list(None)
-        total_plots = sum([project.get("total_plots", 0) for project in projects])
-        sold_plots = sum([project.get("sold_plots", 0) for project in projects])
+        # Plot and revenue totals are summed server-side rather than loading every document
+        plot_totals = await db.projects.aggregate([
+            {"$match": {"user_id": current_user.id}},
+            {"$group": {"_id": None, "total_plots": {"$sum": "$total_plots"}, "sold_plots": {"$sum": "$sold_plots"}}}
+        ]).to_list(None)
+        total_plots = plot_totals[0]["total_plots"] if plot_totals else 0
+        sold_plots = plot_totals[0]["sold_plots"] if plot_totals else 0
         
-        # Calculate revenue (simplified)
-        financial_records = await db.financial_records.find({
-            "user_id": current_user.id
-        }).to_list(None)
-        
-        current_month_revenue = 0
-        total_revenue = 0
-        
-        current_month = datetime.utcnow().month
-        current_year = datetime.utcnow().year
-        
-        for record in financial_records:
-            total_revenue += record.get("revenue", 0)
-            if record.get("year") == current_year and record.get("month") == str(current_month):
-                current_month_revenue += record.get("revenue", 0)
+        now = datetime.utcnow()
+        revenue_totals = await db.financial_records.aggregate([
+            {"$match": {"user_id": current_user.id}},
+            {"$group": {
+                "_id": None,
+                "total_revenue": {"$sum": "$revenue"},
+                "current_month_revenue": {"$sum": {"$cond": [
+                    {"$and": [{"$eq": ["$year", now.year]}, {"$eq": ["$month", now.month]}]}, "$revenue", 0
+                ]}}
+            }}
+        ]).to_list(None)
+        total_revenue = revenue_totals[0]["total_revenue"] if revenue_totals else 0
+        current_month_revenue = revenue_totals[0]["current_month_revenue"] if revenue_totals else 0
         
         return BuilderStats(
             total_projects=projects_count,
@@ -214,8 +209,71 @@ api_router.include_router(properties.router)
 api_router.include_router(customers.router)
 api_router.include_router(deals.router)
 api_router.include_router(projects.router)
+api_router.include_router(financials.router)
 api_router.include_router(notifications.router)
 api_router.include_router(events.router)
+api_router.include_router(images.router)
+api_router.include_router(search_routes.router)
+api_router.include_router(matching_routes.router)
+api_router.include_router(profiler_routes.router)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open this worker's database connection and run its background tasks.
+    
+    Runs in each worker process after any fork, so every worker gets its own
+    Motor client, caches and background tasks.
+    """
+    connection = await connect_to_mongo()
+    app.state.db = connection.database
+    await migrate_inline_images()
+    await normalize_financial_months()
+    await events.backfill_event_timestamps()
+    await events.backfill_series_ends()
+    await notification_bus.start()
+    await reminder_scheduler.start()
+    await counter_reconciler.start()
+    await notification_archiver.start()
+    try:
+        yield
+    finally:
+        await notification_archiver.stop()
+        await counter_reconciler.stop()
+        await reminder_scheduler.stop()
+        await notification_bus.stop()
+        await close_mongo_connection()
+
+def create_app() -> FastAPI:
+    """Build the application; no database connection is made until its lifespan starts."""
+    app = FastAPI(
+        title="RealEstate Pro API",
+        description="Comprehensive Real Estate Management Platform",
+        version="1.0.0",
+        default_response_class=FastJSONResponse,
+        lifespan=lifespan
+    )
+    
+    # Include the main router in the app
+    app.include_router(api_router)
+    
+    # CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    
+    # Inert unless PROFILER_TOKEN is set and a request sends it in X-Profile-Request
+    app.add_middleware(RequestProfilerMiddleware)
+    
+    # Per-request Mongo command counting; X-Mongo-* headers when MONGO_QUERY_DEBUG is set
+    app.add_middleware(QueryBudgetMiddleware)
+    
+    # Outermost, so latency includes CORS handling
+    app.add_middleware(MetricsMiddleware)
+    return app
 
-# Include the main router in the app
-app.include_router(api_router)
+# For `uvicorn server:app`; `uvicorn server:create_app --factory` builds a fresh app instead
+app = create_app()
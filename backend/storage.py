@@ -0,0 +1,1785 @@
+"""Storage backends behind ``database.get_db()``.
+
+Routers and background jobs use the Motor database/collection API directly.
+The storage interface is the subset of that API the app relies on:
+
+* ``db.<name>`` / ``db[name]`` collections, ``create_collection``, ``drop_collection``
+* ``find(filter, projection, sort=, skip=, limit=)`` returning a cursor with
+  ``sort``/``skip``/``limit``/``to_list`` and ``async for``; ``find_one``
+* ``insert_one``/``insert_many``, ``update_one``/``update_many`` (``$set``,
+  ``$unset``, ``$inc``, ``$push``, ``$addToSet``, ``$pull``, ``$min``, ``$max``,
+  ``$setOnInsert``, pipeline updates, ``upsert``), ``delete_one``/``delete_many``,
+  ``find_one_and_update``/``find_one_and_delete``, ``bulk_write``
+* ``count_documents``, ``distinct``, ``create_index`` (unique and partial indexes)
+* ``aggregate`` with ``$match``, ``$group``, ``$sort``, ``$skip``, ``$limit``,
+  ``$unwind``, ``$project``, ``$addFields``/``$set``, ``$unset``, ``$count``, ``$facet``,
+  ``$densify`` and ``$setWindowFields`` (``$sum``/``$avg``/``$min``/``$max``/``$count`` windows)
+* ``$geoWithin`` filters and a leading ``$geoNear`` stage over GeoJSON points
+  (``$near`` filters in ``find`` are not supported; use ``$geoNear``)
+
+``STORAGE_BACKEND=mongo`` (the default) uses Motor. ``STORAGE_BACKEND=memory``
+uses the embedded engine below: documents live in process, every collection is
+partitioned by ``user_id`` and hash-indexed on ``id`` and on the key prefixes of
+its ``create_index`` calls, so tenant-scoped reads touch only that tenant's
+documents. Stored documents round-trip through BSON, so values come back
+exactly as Motor returns them. With ``STORAGE_SNAPSHOT`` set, data is loaded
+from that file at startup and written back periodically and on shutdown.
+
+The embedded engine is single-process: ``connect_to_mongo`` refuses to start it
+with ``WEB_CONCURRENCY`` above 1, and a client holds an exclusive lock on
+``<snapshot>.lock`` while it has the snapshot open, so a second process fails
+at startup instead of overwriting the first one's writes.
+Collection commands are reported to the client's ``event_listeners`` as
+pymongo command events, so query budgets and Mongo metrics cover both backends.
+TTL indexes are accepted but not enforced. 2dsphere indexes are recorded (so
+``$geoNear`` can find its key) but geo queries scan the tenant's documents.
+"""
+import asyncio
+import fcntl
+import itertools
+import logging
+import math
+import os
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import bson
+from bson import ObjectId
+from pymongo import InsertOne, DeleteMany, DeleteOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongo")
+STORAGE_SNAPSHOT = os.environ.get("STORAGE_SNAPSHOT")
+SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get("STORAGE_SNAPSHOT_INTERVAL", "60"))
+
+# Fields hash-indexed in every collection: the app's own ids and the tenant key
+DEFAULT_INDEXES = (("id",), ("user_id",))
+# Compound index prefixes longer than this are not worth a hash index of their own
+MAX_INDEX_PREFIX = 2
+
+DUPLICATE_KEY = 11000
+
+# Sphere radius MongoDB uses for GeoJSON distances, in meters
+EARTH_RADIUS_METERS = 6378100
+
+_MISSING = object()
+
+def _hash_key(value: Any) -> Any:
+    """A hashable stand-in for a BSON value with Mongo's equality (1 == 1.0, True != 1)."""
+    if isinstance(value, bool):
+        return ("bool", value)
+    if isinstance(value, dict):
+        return ("doc", tuple((key, _hash_key(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return ("array", tuple(_hash_key(item) for item in value))
+    return value
+
+def _clone(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _clone(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_clone(item) for item in value]
+    return value
+
+def _resolve(value: Any, parts: Tuple[str, ...]) -> List[Any]:
+    """Values at a dotted path, descending into arrays the way Mongo queries do."""
+    if not parts:
+        return [value]
+    if isinstance(value, dict):
+        if parts[0] in value:
+            return _resolve(value[parts[0]], parts[1:])
+        return []
+    if isinstance(value, list):
+        if parts[0].isdigit():
+            index = int(parts[0])
+            return _resolve(value[index], parts[1:]) if index < len(value) else []
+        found = []
+        for item in value:
+            if isinstance(item, dict):
+                found.extend(_resolve(item, parts))
+        return found
+    return []
+
+@lru_cache(maxsize=1024)
+def _split(path: str) -> Tuple[str, ...]:
+    return tuple(path.split("."))
+
+def _get(doc: Dict[str, Any], path: str) -> Any:
+    """The value at a dotted path for expressions: arrays of subdocuments map to arrays."""
+    value: Any = doc
+    for part in _split(path):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list):
+            value = [item.get(part, _MISSING) if isinstance(item, dict) else _MISSING for item in value]
+            value = [item for item in value if item is not _MISSING]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+def _set_path(doc: Dict[str, Any], path: str, value: Any):
+    parts = _split(path)
+    target: Any = doc
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)]
+            continue
+        child = target.get(part)
+        if not isinstance(child, (dict, list)):
+            child = target[part] = {}
+        target = child
+    if isinstance(target, list):
+        index = int(parts[-1])
+        target.extend([None] * (index + 1 - len(target)))
+        target[index] = value
+    else:
+        target[parts[-1]] = value
+
+def _unset_path(doc: Dict[str, Any], path: str):
+    parts = _split(path)
+    target: Any = doc
+    for part in parts[:-1]:
+        target = target.get(part) if isinstance(target, dict) else None
+        if target is None:
+            return
+    if isinstance(target, dict):
+        target.pop(parts[-1], None)
+
+def _with_path(doc: Dict[str, Any], parts: Tuple[str, ...], value: Any) -> Dict[str, Any]:
+    """A copy of doc with one path replaced, copying only the dicts along that path."""
+    copied = dict(doc)
+    if len(parts) == 1:
+        copied[parts[0]] = value
+    else:
+        child = doc.get(parts[0])
+        copied[parts[0]] = _with_path(child if isinstance(child, dict) else {}, parts[1:], value)
+    return copied
+
+# BSON comparison order for values of different types
+def _type_rank(value: Any) -> int:
+    if value is None or value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    rank = _type_rank(value)
+    if rank == 1:
+        return (rank, 0)
+    if rank in (4, 5, 10):
+        return (rank, repr(value))
+    return (rank, value)
+
+def _equal(a: Any, b: Any) -> bool:
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b) and a == b
+    if isinstance(a, re.Pattern):
+        return isinstance(b, str) and a.search(b) is not None
+    try:
+        return a == b
+    except TypeError:
+        return False
+
+def _compare(a: Any, b: Any) -> Optional[int]:
+    """-1/0/1 for values Mongo compares in a range query, None for different types."""
+    if _type_rank(a) != _type_rank(b) or a is None or b is None:
+        return None
+    try:
+        return (a > b) - (a < b)
+    except TypeError:
+        return None
+
+def _point(value: Any) -> Optional[Tuple[float, float]]:
+    """(longitude, latitude) of a GeoJSON Point or legacy [x, y] pair, else None."""
+    if isinstance(value, dict):
+        if value.get("type") != "Point":
+            return None
+        value = value.get("coordinates")
+    if (isinstance(value, (list, tuple)) and len(value) == 2
+            and all(isinstance(c, (int, float)) and not isinstance(c, bool) for c in value)):
+        return float(value[0]), float(value[1])
+    return None
+
+def _spherical_distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Great-circle distance between two (longitude, latitude) points, in radians."""
+    lng1, lat1, lng2, lat2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * math.asin(min(1.0, math.sqrt(h)))
+
+def _in_ring(point: Tuple[float, float], ring: List[Any]) -> bool:
+    """Even-odd test of a point against a closed ring, treating edges as planar."""
+    x, y = point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+def _geo_within(point: Tuple[float, float], shape: Dict[str, Any]) -> bool:
+    if "$geometry" in shape:
+        geometry = shape["$geometry"]
+        polygons = {"Polygon": [geometry.get("coordinates")],
+                    "MultiPolygon": geometry.get("coordinates")}.get(geometry.get("type"))
+        if polygons is None:
+            raise OperationFailure(f"$geoWithin not supported with geometry type {geometry.get('type')}", code=2)
+        return any(_in_ring(point, rings[0]) and not any(_in_ring(point, hole) for hole in rings[1:])
+                   for rings in polygons)
+    if "$centerSphere" in shape:
+        center, radius = shape["$centerSphere"]
+        return _spherical_distance(_point(center), point) <= radius
+    if "$box" in shape:
+        (x1, y1), (x2, y2) = shape["$box"]
+        return min(x1, x2) <= point[0] <= max(x1, x2) and min(y1, y2) <= point[1] <= max(y1, y2)
+    if "$polygon" in shape:
+        ring = [list(vertex) for vertex in shape["$polygon"]]
+        return _in_ring(point, ring + ring[:1])
+    raise OperationFailure(f"unknown $geoWithin shape: {sorted(shape)}", code=2)
+
+@lru_cache(maxsize=512)
+def _compile(pattern: str, options: str = "") -> re.Pattern:
+    flags = 0
+    for option, flag in (("i", re.IGNORECASE), ("m", re.MULTILINE), ("s", re.DOTALL), ("x", re.VERBOSE)):
+        if option in options:
+            flags |= flag
+    return re.compile(pattern, flags)
+
+def _is_operator_doc(value: Any) -> bool:
+    return isinstance(value, dict) and bool(value) and next(iter(value)).startswith("$")
+
+def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """Whether a document satisfies a Mongo query filter."""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, sub) for sub in condition):
+                return False
+        elif key.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {key}", code=2)
+        elif not _field_matches(_resolve(doc, _split(key)), condition):
+            return False
+    return True
+
+def _field_matches(values: List[Any], condition: Any) -> bool:
+    if _is_operator_doc(condition):
+        options = condition.get("$options", "")
+        return all(
+            _operator_matches(values, operator, operand, options)
+            for operator, operand in condition.items() if operator != "$options"
+        )
+    return _any_equal(values, condition)
+
+def _expand(values: List[Any]) -> Iterator[Any]:
+    """Each value, and the elements of array values: how Mongo matches scalars against arrays."""
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+def _any_equal(values: List[Any], target: Any) -> bool:
+    if target is None and not values:
+        return True
+    if isinstance(target, re.Pattern):
+        return any(isinstance(value, str) and target.search(value) for value in _expand(values))
+    return any(_equal(value, target) for value in _expand(values))
+
+def _operator_matches(values: List[Any], operator: str, operand: Any, options: str = "") -> bool:
+    if operator == "$eq":
+        return _any_equal(values, operand)
+    if operator == "$ne":
+        return not _any_equal(values, operand)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        for value in _expand(values):
+            order = _compare(value, operand)
+            if order is None:
+                continue
+            if (operator == "$gt" and order > 0 or operator == "$gte" and order >= 0
+                    or operator == "$lt" and order < 0 or operator == "$lte" and order <= 0):
+                return True
+        return False
+    if operator == "$in":
+        return any(_any_equal(values, target) for target in operand)
+    if operator == "$nin":
+        return not any(_any_equal(values, target) for target in operand)
+    if operator == "$exists":
+        return bool(values) == bool(operand)
+    if operator == "$regex":
+        pattern = operand if isinstance(operand, re.Pattern) else _compile(operand, options)
+        return any(isinstance(value, str) and pattern.search(value) for value in _expand(values))
+    if operator == "$not":
+        if isinstance(operand, re.Pattern):
+            return not _any_equal(values, operand)
+        return not _field_matches(values, operand)
+    if operator == "$elemMatch":
+        for value in values:
+            if not isinstance(value, list):
+                continue
+            for element in value:
+                if _is_operator_doc(operand):
+                    if _field_matches([element], operand):
+                        return True
+                elif isinstance(element, dict) and matches(element, operand):
+                    return True
+        return False
+    if operator == "$size":
+        return any(isinstance(value, list) and len(value) == operand for value in values)
+    if operator == "$all":
+        return all(_any_equal(values, target) for target in operand)
+    if operator == "$type":
+        names = operand if isinstance(operand, list) else [operand]
+        return any(_type_name(value) in names for value in values)
+    if operator == "$geoWithin":
+        points = (_point(value) for value in values)
+        return any(point is not None and _geo_within(point, operand) for point in points)
+    if operator in ("$near", "$nearSphere"):
+        raise OperationFailure(f"{operator} is not supported by the embedded engine; use a $geoNear aggregation", code=2)
+    raise OperationFailure(f"unknown operator: {operator}", code=2)
+
+def _type_name(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int" if -2 ** 31 <= value < 2 ** 31 else "long"
+    return {
+        float: "double", str: "string", dict: "object", list: "array",
+        ObjectId: "objectId", datetime: "date", bytes: "binData",
+    }.get(type(value), "unknown")
+
+def _normalize_sort(key_or_list: Any, direction: Optional[int] = None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(key, value) for key, value in key_or_list]
+
+def sort_documents(docs: List[Dict[str, Any]], spec: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    docs = list(docs)
+    # Stable sorts from the least significant key; reverse=True keeps ties in order
+    for key, direction in reversed(spec):
+        if key == "$natural":
+            if direction < 0:
+                docs.reverse()
+            continue
+        parts = _split(key)
+
+        def field_key(doc, parts=parts, descending=direction < 0):
+            values = list(_expand(_resolve(doc, parts))) or [None]
+            # Arrays sort by their smallest element ascending and their largest descending
+            keys = [_sort_key(value) for value in values if not isinstance(value, list)] or [_sort_key(None)]
+            return max(keys) if descending else min(keys)
+
+        docs.sort(key=field_key, reverse=direction < 0)
+    return docs
+
+def _projection_tree(fields: Iterable[str]) -> Dict[str, Any]:
+    tree: Dict[str, Any] = {}
+    for field in fields:
+        node = tree
+        parts = _split(field)
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is True:
+                break
+        else:
+            node[parts[-1]] = True
+    return tree
+
+def _include(value: Any, tree: Dict[str, Any]) -> Any:
+    if isinstance(value, list):
+        return [_include(item, tree) for item in value if isinstance(item, (dict, list))]
+    if not isinstance(value, dict):
+        return value
+    result = {}
+    for key, item in value.items():
+        node = tree.get(key)
+        if node is True:
+            result[key] = item
+        elif node is not None and isinstance(item, (dict, list)):
+            result[key] = _include(item, node)
+    return result
+
+def _exclude(value: Any, tree: Dict[str, Any]) -> Any:
+    if isinstance(value, list):
+        return [_exclude(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {}
+    for key, item in value.items():
+        node = tree.get(key)
+        if node is True:
+            continue
+        result[key] = _exclude(item, node) if node is not None else item
+    return result
+
+def project(doc: Dict[str, Any], projection: Optional[Any]) -> Dict[str, Any]:
+    """Apply a find() projection to an already copied document."""
+    if not projection:
+        return doc
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    include_id = projection.get("_id", 1)
+    if fields and all(fields.values()):
+        tree = _projection_tree(fields)
+        if include_id and "_id" in doc:
+            tree["_id"] = True
+        return _include(doc, tree)
+    if not fields and include_id:
+        return {"_id": doc["_id"]} if "_id" in projection and "_id" in doc else doc
+    excluded = [key for key, value in fields.items() if not value]
+    if not include_id:
+        excluded.append("_id")
+    return _exclude(doc, _projection_tree(excluded))
+
+def evaluate(expression: Any, doc: Dict[str, Any], variables: Optional[Dict[str, Any]] = None) -> Any:
+    """Evaluate an aggregation expression against a document (_MISSING for absent fields)."""
+    if isinstance(expression, str) and expression.startswith("$"):
+        if expression.startswith("$$"):
+            name, _, path = expression[2:].partition(".")
+            if name == "ROOT" or name == "CURRENT":
+                base = doc
+            elif name == "NOW":
+                return datetime.utcnow()
+            else:
+                base = (variables or {}).get(name, _MISSING)
+            return _get(base, path) if path and isinstance(base, dict) else base
+        return _get(doc, expression[1:])
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator, operand = next(iter(expression.items()))
+            if operator.startswith("$"):
+                return _evaluate_operator(operator, operand, doc, variables)
+        return {key: _value(evaluate(item, doc, variables)) for key, item in expression.items()}
+    if isinstance(expression, list):
+        return [_value(evaluate(item, doc, variables)) for item in expression]
+    return expression
+
+def _value(value: Any) -> Any:
+    return None if value is _MISSING else value
+
+def _arguments(operand: Any, doc, variables) -> List[Any]:
+    if not isinstance(operand, list):
+        operand = [operand]
+    return [_value(evaluate(item, doc, variables)) for item in operand]
+
+def _numbers(values: Iterable[Any]) -> List[Any]:
+    return [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+def _to_double(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return (value - datetime(1970, 1, 1)).total_seconds() * 1000
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise OperationFailure(f"Failed to parse number '{value}' in $convert", code=241)
+
+DATE_PARTS = {
+    "$year": lambda d: d.year,
+    "$month": lambda d: d.month,
+    "$dayOfMonth": lambda d: d.day,
+    "$hour": lambda d: d.hour,
+    "$minute": lambda d: d.minute,
+    "$second": lambda d: d.second,
+    # Mongo numbers days of the week from Sunday = 1
+    "$dayOfWeek": lambda d: (d.isoweekday() % 7) + 1,
+    "$dayOfYear": lambda d: d.timetuple().tm_yday,
+}
+
+def _evaluate_operator(operator: str, operand: Any, doc, variables) -> Any:
+    if operator == "$literal":
+        return operand
+    if operator in DATE_PARTS:
+        if isinstance(operand, dict) and "date" in operand:
+            operand = operand["date"]
+        value = _value(evaluate(operand, doc, variables))
+        return DATE_PARTS[operator](value) if isinstance(value, datetime) else None
+    if operator == "$dateToString":
+        value = _value(evaluate(operand["date"], doc, variables))
+        if not isinstance(value, datetime):
+            return None
+        return value.strftime(operand.get("format", "%Y-%m-%dT%H:%M:%S.%LZ").replace("%L", f"{value.microsecond // 1000:03d}"))
+    if operator == "$cond":
+        if isinstance(operand, list):
+            condition, then, otherwise = operand
+        else:
+            condition, then, otherwise = operand["if"], operand["then"], operand["else"]
+        return evaluate(then if _truthy(evaluate(condition, doc, variables)) else otherwise, doc, variables)
+    if operator == "$ifNull":
+        for item in operand:
+            value = _value(evaluate(item, doc, variables))
+            if value is not None:
+                return value
+        return None
+    if operator == "$and":
+        return all(_truthy(evaluate(item, doc, variables)) for item in operand)
+    if operator == "$or":
+        return any(_truthy(evaluate(item, doc, variables)) for item in operand)
+
+    args = _arguments(operand, doc, variables)
+    if operator == "$not":
+        return not _truthy(args[0])
+    if operator in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$cmp"):
+        a, b = args
+        order = _compare(a, b)
+        if order is None:
+            order = (_sort_key(a) > _sort_key(b)) - (_sort_key(a) < _sort_key(b))
+        return {
+            "$eq": order == 0, "$ne": order != 0, "$gt": order > 0, "$gte": order >= 0,
+            "$lt": order < 0, "$lte": order <= 0, "$cmp": order,
+        }[operator]
+    if operator == "$in":
+        return any(_equal(args[0], item) for item in args[1] or ())
+    if operator in ("$sum", "$avg", "$min", "$max"):
+        values = args[0] if len(args) == 1 and isinstance(args[0], list) else args
+        return _accumulate(operator, values)
+    if operator == "$add":
+        if any(value is None for value in args):
+            return None
+        total = sum(value for value in args if not isinstance(value, datetime))
+        dates = [value for value in args if isinstance(value, datetime)]
+        if dates:
+            return dates[0] + timedelta(milliseconds=total)
+        return total
+    if operator == "$subtract":
+        a, b = args
+        if a is None or b is None:
+            return None
+        if isinstance(a, datetime) and isinstance(b, datetime):
+            return int((a - b).total_seconds() * 1000)
+        if isinstance(a, datetime):
+            return a - timedelta(milliseconds=b)
+        return a - b
+    if operator == "$multiply":
+        if any(value is None for value in args):
+            return None
+        result = 1
+        for value in args:
+            result *= value
+        return result
+    if operator == "$divide":
+        a, b = args
+        if a is None or b is None:
+            return None
+        if b == 0:
+            raise OperationFailure("can't $divide by zero", code=2)
+        return a / b
+    if operator == "$round":
+        value, places = (args + [0])[:2]
+        return None if value is None else round(value, places)
+    if operator == "$toDouble":
+        return _to_double(args[0])
+    if operator == "$toInt" or operator == "$toLong":
+        value = _to_double(args[0])
+        return None if value is None else int(value)
+    if operator == "$toString":
+        value = args[0]
+        return None if value is None else str(value)
+    if operator == "$concat":
+        return None if any(value is None for value in args) else "".join(args)
+    if operator in ("$replaceAll", "$replaceOne"):
+        spec = {key: _value(evaluate(value, doc, variables)) for key, value in operand.items()}
+        if spec["input"] is None:
+            return None
+        return spec["input"].replace(spec["find"], spec["replacement"], -1 if operator == "$replaceAll" else 1)
+    if operator == "$toLower":
+        return (args[0] or "").lower()
+    if operator == "$toUpper":
+        return (args[0] or "").upper()
+    if operator == "$size":
+        if not isinstance(args[0], list):
+            raise OperationFailure("The argument to $size must be an array", code=17124)
+        return len(args[0])
+    if operator == "$arrayElemAt":
+        array, index = args
+        return array[index] if isinstance(array, list) and -len(array) <= index < len(array) else _MISSING
+    if operator == "$first":
+        return args[0][0] if isinstance(args[0], list) and args[0] else _MISSING
+    if operator == "$last":
+        return args[0][-1] if isinstance(args[0], list) and args[0] else _MISSING
+    raise OperationFailure(f"Unsupported expression operator in the embedded engine: {operator}", code=168)
+
+def _truthy(value: Any) -> bool:
+    return value not in (None, False, 0, _MISSING)
+
+def _accumulate(operator: str, values: Iterable[Any]) -> Any:
+    if operator == "$sum":
+        return sum(_numbers(values))
+    if operator == "$avg":
+        numbers = _numbers(values)
+        return sum(numbers) / len(numbers) if numbers else None
+    present = [value for value in values if value is not None and value is not _MISSING]
+    if not present:
+        return None
+    keyed = sorted(present, key=_sort_key)
+    return keyed[0] if operator == "$min" else keyed[-1]
+
+def _group(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    key_expression = spec["_id"]
+    accumulators = {field: next(iter(acc.items())) for field, acc in spec.items() if field != "_id"}
+    groups: Dict[Any, Dict[str, Any]] = {}
+    collected: Dict[Any, Dict[str, List[Any]]] = {}
+    for doc in docs:
+        key = _value(evaluate(key_expression, doc))
+        hashed = _hash_key(key)
+        if hashed not in groups:
+            groups[hashed] = {"_id": key}
+            collected[hashed] = {field: [] for field in accumulators}
+        for field, (operator, expression) in accumulators.items():
+            collected[hashed][field].append(evaluate(expression, doc) if operator != "$count" else 1)
+
+    results = []
+    for hashed, group in groups.items():
+        for field, (operator, _) in accumulators.items():
+            values = collected[hashed][field]
+            if operator in ("$sum", "$avg", "$min", "$max"):
+                group[field] = _accumulate(operator, values)
+            elif operator == "$count":
+                group[field] = len(values)
+            elif operator == "$first":
+                group[field] = _value(values[0])
+            elif operator == "$last":
+                group[field] = _value(values[-1])
+            elif operator == "$push":
+                group[field] = [value for value in values if value is not _MISSING]
+            elif operator == "$addToSet":
+                unique = {}
+                for value in values:
+                    if value is not _MISSING:
+                        unique.setdefault(_hash_key(value), value)
+                group[field] = list(unique.values())
+            else:
+                raise OperationFailure(f"Unsupported accumulator in the embedded engine: {operator}", code=15952)
+        results.append(group)
+    return results
+
+def _unwind(docs: List[Dict[str, Any]], spec: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(spec, str):
+        spec = {"path": spec}
+    parts = _split(spec["path"][1:])
+    preserve = spec.get("preserveNullAndEmptyArrays", False)
+    index_field = spec.get("includeArrayIndex")
+    for doc in docs:
+        value = _get(doc, spec["path"][1:])
+        if isinstance(value, list) and value:
+            for index, element in enumerate(value):
+                unwound = _with_path(doc, parts, element)
+                if index_field:
+                    unwound[index_field] = index
+                yield unwound
+        elif isinstance(value, list) or value is _MISSING or value is None:
+            if preserve:
+                unwound = dict(doc)
+                if value == []:
+                    _unset_path(unwound, spec["path"][1:])
+                if index_field:
+                    unwound[index_field] = None
+                yield unwound
+        else:
+            unwound = dict(doc)
+            if index_field:
+                unwound[index_field] = None
+            yield unwound
+
+def _add_fields(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    for doc in docs:
+        result = dict(doc)
+        for field, expression in spec.items():
+            value = evaluate(expression, doc)
+            if value is _MISSING:
+                continue
+            if "." in field:
+                result = _with_path(result, _split(field), value)
+            else:
+                result[field] = value
+        yield result
+
+def _project_stage(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    computed = {key: value for key, value in spec.items()
+                if not (isinstance(value, (bool, int)) and value in (0, 1))}
+    if not computed:
+        for doc in docs:
+            yield project(doc, spec)
+        return
+    plain = {key: value for key, value in spec.items() if key not in computed}
+    for doc in docs:
+        result = project(doc, plain) if any(plain.values()) else ({"_id": doc["_id"]} if "_id" in doc and plain.get("_id", 1) else {})
+        for field, expression in computed.items():
+            value = evaluate(expression, doc)
+            if value is not _MISSING:
+                result[field] = value
+        yield result
+
+# Calendar units are added by month arithmetic, the others are fixed lengths
+DATE_UNIT_MONTHS = {"year": 12, "quarter": 3, "month": 1}
+DATE_UNIT_DELTAS = {
+    "week": timedelta(weeks=1), "day": timedelta(days=1), "hour": timedelta(hours=1),
+    "minute": timedelta(minutes=1), "second": timedelta(seconds=1), "millisecond": timedelta(milliseconds=1),
+}
+
+def _add_units(value: Any, amount: int, unit: Optional[str]) -> Any:
+    """``value`` moved by ``amount`` units; without a unit it is a plain number."""
+    if unit is None:
+        return value + amount
+    if unit in DATE_UNIT_MONTHS:
+        month_index = value.month - 1 + amount * DATE_UNIT_MONTHS[unit]
+        year, month = value.year + month_index // 12, month_index % 12 + 1
+        following = datetime(year + month // 12, month % 12 + 1, 1)
+        return value.replace(year=year, month=month, day=min(value.day, (following - timedelta(days=1)).day))
+    if unit in DATE_UNIT_DELTAS:
+        return value + amount * DATE_UNIT_DELTAS[unit]
+    raise OperationFailure(f"Unknown time unit: {unit}", code=5439014)
+
+def _window_members(keys: List[Any], position: int, window: Dict[str, Any]) -> List[int]:
+    """Indexes of the sorted partition inside ``window`` for the document at ``position``."""
+    if "range" in window:
+        lower, upper = window["range"]
+        unit = window.get("unit")
+        current = keys[position]
+        if current is None:
+            return []
+        low = None if lower == "unbounded" else current if lower == "current" else _add_units(current, lower, unit)
+        high = None if upper == "unbounded" else current if upper == "current" else _add_units(current, upper, unit)
+        return [
+            index for index, key in enumerate(keys)
+            if key is not None and (low is None or key >= low) and (high is None or key <= high)
+        ]
+    lower, upper = window.get("documents", ["unbounded", "unbounded"])
+    start = 0 if lower == "unbounded" else position + (0 if lower == "current" else lower)
+    end = len(keys) - 1 if upper == "unbounded" else position + (0 if upper == "current" else upper)
+    return list(range(max(start, 0), min(end, len(keys) - 1) + 1))
+
+def _set_window_fields(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """``$setWindowFields`` with ``$sum``/``$avg``/``$min``/``$max``/``$count`` over
+    document or range windows (ranges sort on a single numeric or date field)."""
+    sort_spec = _normalize_sort(spec.get("sortBy") or {})
+    partitions: Dict[Any, List[Dict[str, Any]]] = {}
+    for doc in docs:
+        key = _value(evaluate(spec["partitionBy"], doc)) if "partitionBy" in spec else None
+        partitions.setdefault(_hash_key(key), []).append(doc)
+
+    results = []
+    for members in partitions.values():
+        members = sort_documents(members, sort_spec)
+        outputs = [dict(doc) for doc in members]
+        for field, definition in spec["output"].items():
+            window = definition.get("window", {})
+            operator, expression = next((key, value) for key, value in definition.items() if key != "window")
+            if "range" in window and len(sort_spec) != 1:
+                raise OperationFailure("Range-based windows require sortBy a single field", code=5339902)
+            keys = [_value(_get(doc, sort_spec[0][0])) for doc in members] if "range" in window else members
+            values = [evaluate(expression, doc) for doc in members] if operator != "$count" else None
+            for position, output in enumerate(outputs):
+                selected = _window_members(keys, position, window)
+                if operator == "$count":
+                    result = len(selected)
+                elif operator in ("$sum", "$avg", "$min", "$max"):
+                    result = _accumulate(operator, [values[index] for index in selected])
+                else:
+                    raise OperationFailure(f"Unsupported window operator in the embedded engine: {operator}", code=5371601)
+                if "." in field:
+                    outputs[position] = _with_path(output, _split(field), result)
+                else:
+                    output[field] = result
+        results.extend(outputs)
+    return results
+
+def _densify(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """``$densify``: fill missing steps of a numeric or date field, per partition."""
+    field, partition_fields = spec["field"], spec.get("partitionByFields", [])
+    step, unit, bounds = spec["range"]["step"], spec["range"].get("unit"), spec["range"]["bounds"]
+    passthrough, partitions = [], {}
+    for doc in docs:
+        if _get(doc, field) in (_MISSING, None):
+            passthrough.append(doc)
+            continue
+        key = tuple(_value(_get(doc, name)) for name in partition_fields)
+        partitions.setdefault(tuple(_hash_key(value) for value in key), (key, []))[1].append(doc)
+
+    everything = [_get(doc, field) for _, members in partitions.values() for doc in members]
+    results = []
+    for key, members in partitions.values():
+        members = sort_documents(members, [(field, 1)])
+        present = [_get(doc, field) for doc in members]
+        if bounds == "full":
+            low, high, inclusive = min(everything), max(everything), True
+        elif bounds == "partition":
+            low, high, inclusive = present[0], present[-1], True
+        else:
+            (low, high), inclusive = bounds, False
+        existing = {_hash_key(value) for value in present}
+        generated = []
+        value = low
+        while value < high or (inclusive and value == high):
+            if _hash_key(value) not in existing:
+                filler: Dict[str, Any] = {}
+                for name, part in zip(partition_fields, key):
+                    filler = _with_path(filler, _split(name), part)
+                generated.append(_with_path(filler, _split(field), value))
+            value = _add_units(value, step, unit)
+        results.extend(sort_documents(members + generated, [(field, 1)]))
+    return passthrough + results
+
+def run_pipeline(docs: List[Dict[str, Any]], pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Run aggregation stages over documents; stages never mutate their input documents."""
+    for stage in pipeline:
+        name, spec = next(iter(stage.items()))
+        if name == "$match":
+            docs = [doc for doc in docs if matches(doc, spec)]
+        elif name == "$group":
+            docs = _group(docs, spec)
+        elif name == "$sort":
+            docs = sort_documents(docs, _normalize_sort(spec))
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$unwind":
+            docs = list(_unwind(docs, spec))
+        elif name in ("$addFields", "$set"):
+            docs = list(_add_fields(docs, spec))
+        elif name == "$project":
+            docs = list(_project_stage(docs, spec))
+        elif name == "$unset":
+            fields = [spec] if isinstance(spec, str) else spec
+            docs = [project(dict(doc), {field: 0 for field in fields}) for doc in docs]
+        elif name == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        elif name == "$facet":
+            docs = [{field: run_pipeline(docs, sub_pipeline) for field, sub_pipeline in spec.items()}]
+        elif name == "$replaceRoot":
+            docs = [_value(evaluate(spec["newRoot"], doc)) for doc in docs]
+        elif name == "$sortByCount":
+            docs = sort_documents(_group(docs, {"_id": spec, "count": {"$sum": 1}}), [("count", -1)])
+        elif name == "$setWindowFields":
+            docs = _set_window_fields(docs, spec)
+        elif name == "$densify":
+            docs = _densify(docs, spec)
+        elif name == "$geoNear":
+            raise OperationFailure("$geoNear is only valid as the first stage in a pipeline", code=40603)
+        else:
+            raise OperationFailure(f"Unsupported aggregation stage in the embedded engine: {name}", code=40324)
+    return docs
+
+def _apply_pipeline_update(doc: Dict[str, Any], pipeline: List[Dict[str, Any]]) -> Dict[str, Any]:
+    updated = run_pipeline([doc], pipeline)[0]
+    updated["_id"] = doc["_id"]
+    return updated
+
+def apply_update(doc: Dict[str, Any], update: Any, inserting: bool = False) -> Dict[str, Any]:
+    """Apply update operators (or an update pipeline) to a mutable copy of a document."""
+    if isinstance(update, list):
+        return _apply_pipeline_update(doc, update)
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            if operator in ("$set", "$setOnInsert"):
+                _set_path(doc, path, _clone(value))
+            elif operator == "$unset":
+                _unset_path(doc, path)
+            elif operator == "$inc":
+                current = _get(doc, path)
+                _set_path(doc, path, value if current is _MISSING or current is None else current + value)
+            elif operator in ("$min", "$max"):
+                current = _get(doc, path)
+                order = _compare(value, current) if current is not _MISSING else None
+                if current is _MISSING or (order is not None and (order < 0 if operator == "$min" else order > 0)):
+                    _set_path(doc, path, _clone(value))
+            elif operator in ("$push", "$addToSet"):
+                current = _get(doc, path)
+                if current is _MISSING:
+                    current = []
+                    _set_path(doc, path, current)
+                elif not isinstance(current, list):
+                    raise OperationFailure(f"The field '{path}' must be an array", code=2)
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                for item in items:
+                    if operator == "$push" or not any(_equal(existing, item) for existing in current):
+                        current.append(_clone(item))
+                if operator == "$push" and isinstance(value, dict) and "$slice" in value:
+                    limit = value["$slice"]
+                    current[:] = current[limit:] if limit < 0 else current[:limit]
+            elif operator == "$pull":
+                current = _get(doc, path)
+                if isinstance(current, list):
+                    current[:] = [
+                        item for item in current
+                        if not (matches(item, value) if isinstance(value, dict) and not _is_operator_doc(value) and isinstance(item, dict)
+                                else _field_matches([item], value))
+                    ]
+            elif operator == "$currentDate":
+                _set_path(doc, path, datetime.utcnow())
+            else:
+                raise OperationFailure(f"Unsupported update operator in the embedded engine: {operator}", code=9)
+    return doc
+
+def _validate_update(update: Any):
+    if isinstance(update, dict) and update and not next(iter(update)).startswith("$"):
+        raise ValueError("update only works with $ operators")
+
+def _upsert_seed(query: Dict[str, Any]) -> Dict[str, Any]:
+    """The equality fields of a filter, which an upserted document starts from."""
+    doc: Dict[str, Any] = {}
+    for key, condition in query.items():
+        if key.startswith("$"):
+            if key == "$and":
+                for sub in condition:
+                    for sub_key, sub_value in _upsert_seed(sub).items():
+                        _set_path(doc, sub_key, sub_value)
+            continue
+        if _is_operator_doc(condition):
+            if "$eq" in condition:
+                _set_path(doc, key, _clone(condition["$eq"]))
+            continue
+        _set_path(doc, key, _clone(condition))
+    return doc
+
+class _CommandEvent:
+    """The fields of pymongo's command monitoring events that listeners read."""
+
+    __slots__ = ("command_name", "command", "database_name", "request_id", "connection_id",
+                 "duration_micros", "reply", "failure")
+
+    def __init__(self, command_name: str, command: Dict[str, Any], database_name: str, request_id: int):
+        self.command_name = command_name
+        self.command = command
+        self.database_name = database_name
+        self.request_id = request_id
+        self.connection_id = ("memory", 0)
+        self.duration_micros = 0
+        self.reply: Dict[str, Any] = {}
+        self.failure: Dict[str, Any] = {}
+
+def _reply(result: Any) -> Dict[str, Any]:
+    """A command reply carrying the documents returned or written, as the server reports them."""
+    if isinstance(result, list):
+        return {"cursor": {"firstBatch": result}}
+    if isinstance(result, int):
+        return {"n": result}
+    if isinstance(result, (UpdateResult, DeleteResult)):
+        return result.raw_result
+    if isinstance(result, InsertOneResult):
+        return {"n": 1}
+    if isinstance(result, InsertManyResult):
+        return {"n": len(result.inserted_ids)}
+    return {"value": result}
+
+# Statement list of each write command, which bulk_write batches requests into
+BULK_STATEMENTS = {"insert": "documents", "update": "updates", "delete": "deletes"}
+
+def _bulk_command(request: Any) -> str:
+    if isinstance(request, InsertOne):
+        return "insert"
+    if isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+        return "update"
+    if isinstance(request, (DeleteOne, DeleteMany)):
+        return "delete"
+    raise TypeError(f"{request!r} is not a valid request")
+
+def _bulk_statement(request: Any) -> Any:
+    if isinstance(request, InsertOne):
+        return request._doc
+    if isinstance(request, (DeleteOne, DeleteMany)):
+        return {"q": request._filter, "limit": int(isinstance(request, DeleteOne))}
+    return {"q": request._filter, "u": request._doc, "upsert": request._upsert,
+            "multi": isinstance(request, UpdateMany)}
+
+class _Entry:
+    """A stored document: the decoded dict used for matching and its BSON for copies."""
+
+    __slots__ = ("doc", "raw")
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self.doc = bson.decode(raw)
+
+class _HashIndex:
+    """Equality index over a key tuple; buckets keep insertion order for $natural reads."""
+
+    def __init__(self, keys: Tuple[str, ...]):
+        self.keys = keys
+        self.paths = [_split(key) for key in keys]
+        self.top_level = all(len(parts) == 1 for parts in self.paths)
+        self.buckets: Dict[Any, Dict[Any, None]] = {}
+
+    def _bucket_keys(self, doc: Dict[str, Any]) -> List[Any]:
+        if self.top_level:
+            # Fast path for scalar top-level fields, which is nearly every indexed field
+            values = []
+            for key in self.keys:
+                value = doc.get(key)
+                if isinstance(value, (list, dict, bool)):
+                    break
+                values.append(value)
+            else:
+                return [tuple(values)]
+        combinations: List[Tuple] = [()]
+        for parts in self.paths:
+            values = list(_expand(_resolve(doc, parts))) or [None]
+            unique = {_hash_key(value): None for value in values}
+            combinations = [combo + (value,) for combo in combinations for value in unique]
+        return combinations
+
+    def add(self, primary: Any, doc: Dict[str, Any]):
+        for key in self._bucket_keys(doc):
+            self.buckets.setdefault(key, {})[primary] = None
+
+    def remove(self, primary: Any, doc: Dict[str, Any]):
+        for key in self._bucket_keys(doc):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.pop(primary, None)
+                if not bucket:
+                    del self.buckets[key]
+
+    def lookup(self, query: Dict[str, Any]) -> Optional[List[Any]]:
+        """Primary keys possibly matching the query, or None if the index cannot serve it."""
+        value_sets: List[List[Any]] = []
+        for key in self.keys:
+            if key not in query:
+                return None
+            condition = query[key]
+            if _is_operator_doc(condition):
+                if set(condition) == {"$eq"}:
+                    values = [condition["$eq"]]
+                elif set(condition) == {"$in"} and len(self.keys) == 1:
+                    values = list(condition["$in"])
+                else:
+                    return None
+            else:
+                values = [condition]
+            if any(isinstance(value, (re.Pattern, dict, list)) for value in values):
+                return None
+            value_sets.append([_hash_key(value) for value in values])
+
+        combinations: List[Tuple] = [()]
+        for values in value_sets:
+            combinations = [combo + (value,) for combo in combinations for value in values]
+        if len(combinations) == 1:
+            return list(self.buckets.get(combinations[0], ()))
+        found: Dict[Any, None] = {}
+        for combo in combinations:
+            found.update(self.buckets.get(combo, {}))
+        return list(found)
+
+class _UniqueIndex:
+    def __init__(self, name: str, keys: Tuple[str, ...], partial: Optional[Dict[str, Any]]):
+        self.name = name
+        self.keys = keys
+        self.partial = partial
+        self.owners: Dict[Any, Any] = {}
+
+    def key(self, doc: Dict[str, Any]) -> Optional[Tuple]:
+        if self.partial is not None and not matches(doc, self.partial):
+            return None
+        values = []
+        for key in self.keys:
+            found = _resolve(doc, _split(key))
+            values.append(_hash_key(found[0]) if found else None)
+        return tuple(values)
+
+class MemoryCollection:
+    """One collection of the embedded engine."""
+
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._entries: Dict[Any, _Entry] = {}
+        self._indexes: Dict[Tuple[str, ...], _HashIndex] = {keys: _HashIndex(keys) for keys in DEFAULT_INDEXES}
+        self._unique: Dict[str, _UniqueIndex] = {}
+        self._index_specs: Dict[str, Dict[str, Any]] = {"_id_": {"key": [("_id", 1)]}}
+
+
+    def _candidates(self, query: Optional[Dict[str, Any]]) -> Iterable[_Entry]:
+        if not query:
+            return list(self._entries.values())
+        if "_id" in query:
+            condition = query["_id"]
+            if not _is_operator_doc(condition):
+                entry = self._entries.get(_hash_key(condition))
+                return [entry] if entry is not None else []
+            if set(condition) == {"$in"}:
+                entries = (self._entries.get(_hash_key(value)) for value in condition["$in"])
+                return [entry for entry in entries if entry is not None]
+        best: Optional[List[Any]] = None
+        for index in self._indexes.values():
+            primaries = index.lookup(query)
+            if primaries is not None and (best is None or len(primaries) < len(best)):
+                best = primaries
+                if not best:
+                    break
+        if best is None:
+            return list(self._entries.values())
+        return [self._entries[primary] for primary in best]
+
+    def _matching(self, query: Optional[Dict[str, Any]]) -> List[_Entry]:
+        return [entry for entry in self._candidates(query) if not query or matches(entry.doc, query)]
+
+    def _check_unique(self, doc: Dict[str, Any], primary: Any, ignore: Any = _MISSING):
+        if primary != ignore and primary in self._entries:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.full_name} index: _id_ dup key: {{ _id: {doc['_id']!r} }}",
+                DUPLICATE_KEY, {"keyPattern": {"_id": 1}, "keyValue": {"_id": doc["_id"]}}
+            )
+        for index in self._unique.values():
+            key = index.key(doc)
+            if key is None:
+                continue
+            owner = index.owners.get(key, _MISSING)
+            if owner is not _MISSING and owner != primary:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.full_name} index: {index.name}",
+                    DUPLICATE_KEY, {"keyPattern": {key: 1 for key in index.keys}}
+                )
+
+    def _add(self, primary: Any, entry: _Entry):
+        self._entries[primary] = entry
+        for index in self._indexes.values():
+            index.add(primary, entry.doc)
+        for index in self._unique.values():
+            key = index.key(entry.doc)
+            if key is not None:
+                index.owners[key] = primary
+        self.database._touch()
+
+    def _remove(self, primary: Any) -> _Entry:
+        entry = self._entries.pop(primary)
+        for index in self._indexes.values():
+            index.remove(primary, entry.doc)
+        for index in self._unique.values():
+            key = index.key(entry.doc)
+            if key is not None and index.owners.get(key) == primary:
+                del index.owners[key]
+        self.database._touch()
+        return entry
+
+    def _insert(self, document: Dict[str, Any]) -> Any:
+        if "_id" not in document:
+            # Like pymongo, the caller's document gets the generated _id
+            document["_id"] = ObjectId()
+        entry = _Entry(bson.encode(document))
+        primary = _hash_key(entry.doc["_id"])
+        self._check_unique(entry.doc, primary)
+        self._add(primary, entry)
+        return entry.doc["_id"]
+
+    def _replace(self, entry: _Entry, updated: Dict[str, Any]) -> bool:
+        """Store an updated document in place of entry; False when nothing changed."""
+        raw = bson.encode(updated)
+        if raw == entry.raw:
+            return False
+        primary = _hash_key(entry.doc["_id"])
+        new_entry = _Entry(raw)
+        if _hash_key(new_entry.doc["_id"]) != primary:
+            raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'", code=66)
+        self._check_unique(new_entry.doc, primary, ignore=primary)
+        # Replace in place so the document keeps its $natural position
+        for index in self._indexes.values():
+            index.remove(primary, entry.doc)
+        for index in self._unique.values():
+            key = index.key(entry.doc)
+            if key is not None and index.owners.get(key) == primary:
+                del index.owners[key]
+        self._entries[primary] = new_entry
+        for index in self._indexes.values():
+            index.add(primary, new_entry.doc)
+        for index in self._unique.values():
+            key = index.key(new_entry.doc)
+            if key is not None:
+                index.owners[key] = primary
+        self.database._touch()
+        return True
+
+    def _update(self, query, update, upsert: bool, multi: bool, sort=None) -> Tuple[Dict[str, Any], Optional[_Entry], Optional[_Entry]]:
+        """Run an update; returns the raw result and the (before, after) entries of the first document."""
+        _validate_update(update)
+        entries = self._matching(query)
+        if sort:
+            by_doc = {id(entry.doc): entry for entry in entries}
+            entries = [by_doc[id(doc)] for doc in sort_documents([entry.doc for entry in entries], sort)]
+        if not multi:
+            entries = entries[:1]
+        if not entries:
+            if not upsert:
+                return {"n": 0, "nModified": 0}, None, None
+            document = apply_update(_upsert_seed(query or {}), update, inserting=True)
+            if isinstance(update, list):
+                document.pop("_id", None)
+            inserted_id = self._insert(document)
+            after = self._entries[_hash_key(inserted_id)]
+            return {"n": 1, "nModified": 0, "upserted": inserted_id}, None, after
+
+        modified = 0
+        for entry in entries:
+            updated = apply_update(_clone(entry.doc), update)
+            if self._replace(entry, updated):
+                modified += 1
+        first_after = self._entries[_hash_key(entries[0].doc["_id"])]
+        return {"n": len(entries), "nModified": modified}, entries[0], first_after
+
+    def _copy(self, entry: _Entry, projection=None) -> Dict[str, Any]:
+        return project(bson.decode(entry.raw), projection)
+
+    def _command(self, command_name: str, body: Dict[str, Any], run: Callable[[], Any]) -> Any:
+        """Run one command's work, reporting it to the client's command listeners as Motor does."""
+        client = self.database.client
+        if not client.event_listeners:
+            return run()
+        event = _CommandEvent(command_name, {command_name: self.name, **body}, self.database.name, next(client.request_ids))
+        for listener in client.event_listeners:
+            listener.started(event)
+        start = time.perf_counter()
+        try:
+            result = run()
+        except Exception as e:
+            event.duration_micros = int((time.perf_counter() - start) * 1e6)
+            event.failure = {"errmsg": str(e), "code": getattr(e, "code", None)}
+            for listener in client.event_listeners:
+                listener.failed(event)
+            raise
+        event.duration_micros = int((time.perf_counter() - start) * 1e6)
+        event.reply = _reply(result)
+        for listener in client.event_listeners:
+            listener.succeeded(event)
+        return result
+
+
+    def find(self, filter: Optional[Dict[str, Any]] = None, projection=None, sort=None,
+             skip: int = 0, limit: int = 0, **kwargs) -> "MemoryCursor":
+        cursor = MemoryCursor(self, filter or {}, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    async def find_one(self, filter: Optional[Any] = None, projection=None, sort=None, **kwargs) -> Optional[Dict[str, Any]]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        documents = await self.find(filter, projection, sort=sort, limit=1).to_list(1)
+        return documents[0] if documents else None
+
+    async def count_documents(self, filter: Dict[str, Any], skip: int = 0, limit: int = 0, **kwargs) -> int:
+        def run():
+            if not filter and not skip and not limit:
+                return len(self._entries)
+            count = max(len(self._matching(filter)) - skip, 0)
+            return min(count, limit) if limit else count
+        # pymongo counts with an aggregate
+        return self._command("aggregate", {"pipeline": [{"$match": filter}, {"$group": {"_id": 1, "n": {"$sum": 1}}}]}, run)
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return self._command("count", {}, lambda: len(self._entries))
+
+    async def distinct(self, key: str, filter: Optional[Dict[str, Any]] = None, **kwargs) -> List[Any]:
+        def run():
+            values: Dict[Any, Any] = {}
+            parts = _split(key)
+            for entry in self._matching(filter):
+                for value in _resolve(entry.doc, parts):
+                    for item in (value if isinstance(value, list) else [value]):
+                        values.setdefault(_hash_key(item), item)
+            return [_clone(value) for value in values.values()]
+        return self._command("distinct", {"key": key, "query": filter}, run)
+
+    def _geo_key(self, key: Optional[str]) -> str:
+        """The field of the 2dsphere index $geoNear should use, as MongoDB resolves it."""
+        fields = [field for spec in self._index_specs.values()
+                  for field, kind in spec["key"] if kind == "2dsphere" and (key is None or field == key)]
+        if len(set(fields)) != 1:
+            raise OperationFailure(
+                f"$geoNear requires {'a' if not fields else 'exactly one'} 2dsphere index"
+                f"{f' on {key}' if key else ''} in {self.full_name}", code=291
+            )
+        return fields[0]
+
+    def _geo_near(self, spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+        parts = _split(self._geo_key(spec.get("key")))
+        near = spec["near"]
+        center = _point(near)
+        # GeoJSON distances are meters; legacy pairs with spherical=True are radians
+        scale = EARTH_RADIUS_METERS if isinstance(near, dict) else 1.0
+        multiplier = spec.get("distanceMultiplier", 1)
+        max_distance = spec.get("maxDistance", math.inf)
+        min_distance = spec.get("minDistance", 0)
+        found = []
+        for entry in self._matching(spec.get("query") or {}):
+            points = [point for point in map(_point, _resolve(entry.doc, parts)) if point is not None]
+            if not points:
+                continue
+            distance = min(_spherical_distance(center, point) for point in points) * scale
+            if min_distance <= distance <= max_distance:
+                found.append((distance, entry.doc))
+        found.sort(key=lambda item: item[0])
+        field = _split(spec["distanceField"])
+        return [_with_path(doc, field, distance * multiplier) for distance, doc in found]
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> "MemoryCommandCursor":
+        def run():
+            stages = list(pipeline)
+            if stages and "$geoNear" in stages[0]:
+                docs = self._geo_near(stages.pop(0)["$geoNear"])
+            elif stages and "$match" in stages[0]:
+                docs = [entry.doc for entry in self._matching(stages.pop(0)["$match"])]
+            else:
+                docs = [entry.doc for entry in self._entries.values()]
+            return [_clone(doc) for doc in run_pipeline(docs, stages)]
+        return MemoryCommandCursor(self, pipeline, run)
+
+
+    async def insert_one(self, document: Dict[str, Any], **kwargs) -> InsertOneResult:
+        return self._command("insert", {"documents": [document]}, lambda: InsertOneResult(self._insert(document), True))
+
+    async def insert_many(self, documents: Iterable[Dict[str, Any]], ordered: bool = True, **kwargs) -> InsertManyResult:
+        documents = list(documents)
+        return self._command("insert", {"documents": documents, "ordered": ordered},
+                             lambda: self._insert_many(documents, ordered))
+
+    def _insert_many(self, documents: List[Dict[str, Any]], ordered: bool) -> InsertManyResult:
+        inserted_ids, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                inserted_ids.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": DUPLICATE_KEY, "errmsg": str(e), "op": document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": len(inserted_ids),
+                "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+            })
+        return InsertManyResult(inserted_ids, True)
+
+    async def update_one(self, filter, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        body = {"updates": [{"q": filter, "u": update, "upsert": upsert, "multi": False}]}
+        return self._command("update", body, lambda: UpdateResult(self._update(filter, update, upsert, multi=False)[0], True))
+
+    async def update_many(self, filter, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        body = {"updates": [{"q": filter, "u": update, "upsert": upsert, "multi": True}]}
+        return self._command("update", body, lambda: UpdateResult(self._update(filter, update, upsert, multi=True)[0], True))
+
+    async def replace_one(self, filter, replacement: Dict[str, Any], upsert: bool = False, **kwargs) -> UpdateResult:
+        body = {"updates": [{"q": filter, "u": replacement, "upsert": upsert, "multi": False}]}
+        return self._command("update", body, lambda: self._replace_one(filter, replacement, upsert))
+
+    def _replace_one(self, filter, replacement: Dict[str, Any], upsert: bool) -> UpdateResult:
+        entries = self._matching(filter)[:1]
+        if not entries:
+            if not upsert:
+                return UpdateResult({"n": 0, "nModified": 0}, True)
+            document = {**_upsert_seed(filter), **replacement}
+            return UpdateResult({"n": 1, "nModified": 0, "upserted": self._insert(document)}, True)
+        updated = {"_id": entries[0].doc["_id"], **{k: v for k, v in replacement.items() if k != "_id"}}
+        modified = self._replace(entries[0], updated)
+        return UpdateResult({"n": 1, "nModified": int(modified)}, True)
+
+    async def delete_one(self, filter, **kwargs) -> DeleteResult:
+        return self._command("delete", {"deletes": [{"q": filter, "limit": 1}]}, lambda: self._delete(filter, multi=False))
+
+    async def delete_many(self, filter, **kwargs) -> DeleteResult:
+        return self._command("delete", {"deletes": [{"q": filter, "limit": 0}]}, lambda: self._delete(filter, multi=True))
+
+    def _delete(self, filter, multi: bool) -> DeleteResult:
+        entries = self._matching(filter)
+        if not multi:
+            entries = entries[:1]
+        for entry in entries:
+            self._remove(_hash_key(entry.doc["_id"]))
+        return DeleteResult({"n": len(entries)}, True)
+
+    async def find_one_and_update(self, filter, update, projection=None, sort=None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE, **kwargs) -> Optional[Dict[str, Any]]:
+        def run():
+            sort_spec = _normalize_sort(sort) if sort else None
+            _, before, after = self._update(filter, update, upsert, multi=False, sort=sort_spec)
+            entry = after if return_document == ReturnDocument.AFTER else before
+            return self._copy(entry, projection) if entry is not None else None
+        return self._command("findAndModify", {"query": filter, "update": update, "upsert": upsert}, run)
+
+    async def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs) -> Optional[Dict[str, Any]]:
+        def run():
+            entries = self._matching(filter)
+            if sort:
+                docs = sort_documents([entry.doc for entry in entries], _normalize_sort(sort))
+                entries = [self._entries[_hash_key(doc["_id"])] for doc in docs]
+            if not entries:
+                return None
+            entry = self._remove(_hash_key(entries[0].doc["_id"]))
+            return self._copy(entry, projection)
+        return self._command("findAndModify", {"query": filter, "remove": True}, run)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result = {
+            "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+            "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+        }
+        # Like pymongo, consecutive requests of one kind go out as one command
+        for command_name, group in itertools.groupby(enumerate(requests), key=lambda item: _bulk_command(item[1])):
+            group = list(group)
+            body = {BULK_STATEMENTS[command_name]: [_bulk_statement(request) for _, request in group]}
+            self._command(command_name, body, lambda: self._bulk_run(group, result, ordered))
+            if ordered and result["writeErrors"]:
+                break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def _bulk_run(self, group: List[Tuple[int, Any]], result: Dict[str, Any], ordered: bool):
+        for index, request in group:
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany)):
+                    raw, _, _ = self._update(request._filter, request._doc, request._upsert,
+                                             multi=isinstance(request, UpdateMany))
+                    if "upserted" in raw:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": raw["upserted"]})
+                    else:
+                        result["nMatched"] += raw["n"]
+                        result["nModified"] += raw["nModified"]
+                elif isinstance(request, ReplaceOne):
+                    update_result = self._replace_one(request._filter, request._doc, request._upsert)
+                    if update_result.upserted_id is not None:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": update_result.upserted_id})
+                    else:
+                        result["nMatched"] += update_result.matched_count
+                        result["nModified"] += update_result.modified_count
+                else:
+                    multi = isinstance(request, DeleteMany)
+                    result["nRemoved"] += self._delete(request._filter, multi=multi).deleted_count
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": index, "code": DUPLICATE_KEY, "errmsg": str(e), "op": request})
+                if ordered:
+                    break
+
+
+    async def create_index(self, keys: Any, unique: bool = False, partialFilterExpression=None,
+                           name: Optional[str] = None, **kwargs) -> str:
+        key_spec = _normalize_sort(keys)
+        name = name or "_".join(f"{key}_{direction}" for key, direction in key_spec)
+        if name in self._index_specs:
+            return name
+        self._index_specs[name] = {"key": key_spec, "unique": unique, **kwargs}
+        fields = tuple(key for key, _ in key_spec)
+
+        if unique:
+            index = _UniqueIndex(name, fields, partialFilterExpression)
+            for primary, entry in self._entries.items():
+                key = index.key(entry.doc)
+                if key is None:
+                    continue
+                if key in index.owners:
+                    del self._index_specs[name]
+                    raise DuplicateKeyError(f"E11000 duplicate key error building index {name}", DUPLICATE_KEY)
+                index.owners[key] = primary
+            self._unique[name] = index
+
+        # Only the ascending/descending keys ahead of any 2dsphere key are hash-indexed
+        hashed = tuple(key for key, _ in itertools.takewhile(lambda item: item[1] in (1, -1), key_spec))
+        for length in range(1, min(len(hashed), MAX_INDEX_PREFIX) + 1):
+            prefix = hashed[:length]
+            if prefix not in self._indexes and "_id" not in prefix:
+                hash_index = self._indexes[prefix] = _HashIndex(prefix)
+                for primary, entry in self._entries.items():
+                    hash_index.add(primary, entry.doc)
+        return name
+
+    async def create_indexes(self, models: List[Any], **kwargs) -> List[str]:
+        return [await self.create_index(model.document["key"], **{k: v for k, v in model.document.items() if k != "key"})
+                for model in models]
+
+    async def index_information(self) -> Dict[str, Dict[str, Any]]:
+        return dict(self._index_specs)
+
+    async def drop(self):
+        await self.database.drop_collection(self.name)
+
+class _CursorBase:
+    def __init__(self):
+        self._results: Optional[List[Dict[str, Any]]] = None
+        self._position = 0
+
+    def _materialize(self) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @property
+    def alive(self) -> bool:
+        return self._results is None or self._position < len(self._results)
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        if self._results is None:
+            self._results = self._materialize()
+        end = len(self._results) if not length else self._position + length
+        batch = self._results[self._position:end]
+        self._position += len(batch)
+        return batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        if self._results is None:
+            self._results = self._materialize()
+        if self._position >= len(self._results):
+            raise StopAsyncIteration
+        self._position += 1
+        return self._results[self._position - 1]
+
+    async def close(self):
+        self._results = []
+
+class MemoryCursor(_CursorBase):
+    """find() cursor; the query runs when the first result is requested."""
+
+    def __init__(self, collection: MemoryCollection, query: Dict[str, Any], projection):
+        super().__init__()
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list: Any, direction: Optional[int] = None) -> "MemoryCursor":
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int) -> "MemoryCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int) -> "MemoryCursor":
+        return self
+
+    def _run(self) -> List[Dict[str, Any]]:
+        entries = self._collection._matching(self._query)
+        if self._sort:
+            by_doc = {id(entry.doc): entry for entry in entries}
+            entries = [by_doc[id(doc)] for doc in sort_documents([entry.doc for entry in entries], self._sort)]
+        end = self._skip + self._limit if self._limit else None
+        return [self._collection._copy(entry, self._projection) for entry in entries[self._skip:end]]
+
+    def _materialize(self) -> List[Dict[str, Any]]:
+        body = {"filter": self._query, "sort": dict(self._sort), "skip": self._skip, "limit": self._limit}
+        return self._collection._command("find", body, self._run)
+
+class MemoryCommandCursor(_CursorBase):
+    """aggregate() cursor over a pipeline run on first use."""
+
+    def __init__(self, collection: MemoryCollection, pipeline: List[Dict[str, Any]], run: Callable[[], List[Dict[str, Any]]]):
+        super().__init__()
+        self._collection = collection
+        self._pipeline = pipeline
+        self._run = run
+
+    def _materialize(self) -> List[Dict[str, Any]]:
+        return self._collection._command("aggregate", {"pipeline": self._pipeline}, self._run)
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def _touch(self):
+        self.client.version += 1
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> MemoryCollection:
+        return self[name]
+
+    async def create_collection(self, name: str, **kwargs) -> MemoryCollection:
+        if name in self._collections:
+            raise CollectionInvalid(f"collection {name} already exists")
+        return self[name]
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return list(self._collections)
+
+    async def drop_collection(self, name: str, **kwargs):
+        if self._collections.pop(name, None) is not None:
+            self._touch()
+
+    async def command(self, command: Any, **kwargs):
+        raise OperationFailure(f"Command {command!r} is not supported by the embedded engine", code=59)
+
+class MemoryClient:
+    """In-process stand-in for AsyncIOMotorClient, optionally persisted to a BSON snapshot file."""
+
+    def __init__(self, snapshot_path: Optional[str] = None, event_listeners: Iterable[Any] = ()):
+        self.snapshot_path = snapshot_path
+        # pymongo CommandListeners, told about every collection command as Motor would
+        self.event_listeners = list(event_listeners)
+        self.request_ids = itertools.count(1)
+        self.version = 0
+        self._saved_version = 0
+        self._databases: Dict[str, MemoryDatabase] = {}
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._lock_file = None
+        if snapshot_path:
+            self._lock_file = self._lock(snapshot_path)
+            if os.path.exists(snapshot_path):
+                self._load(snapshot_path)
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(self, name)
+        return database
+
+    def get_database(self, name: str, **kwargs) -> MemoryDatabase:
+        return self[name]
+
+    async def drop_database(self, name: str):
+        self._databases.pop(name, None)
+        self.version += 1
+
+    async def list_database_names(self) -> List[str]:
+        return list(self._databases)
+
+
+    @staticmethod
+    def _lock(path: str):
+        # Snapshots are replaced by rename, so the lock lives in a file of its own
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        lock_file = open(f"{path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise RuntimeError(
+                f"Storage snapshot {path} is in use by another process; "
+                "the memory backend supports a single worker per snapshot"
+            ) from None
+        return lock_file
+
+    def _load(self, path: str):
+        started = datetime.utcnow()
+        collection = None
+        count = 0
+        with open(path, "rb") as f:
+            for record in bson.decode_file_iter(f):
+                marker = record.get("__collection__")
+                if marker is not None:
+                    database_name, _, collection_name = marker.partition("/")
+                    collection = self[database_name][collection_name]
+                    continue
+                entry = _Entry(bson.encode(record))
+                collection._add(_hash_key(entry.doc["_id"]), entry)
+                count += 1
+        self._saved_version = self.version
+        logger.info("Loaded %d documents from %s in %.1fs", count, path,
+                    (datetime.utcnow() - started).total_seconds())
+
+    def _snapshot_records(self) -> List[bytes]:
+        records = []
+        for database in self._databases.values():
+            for collection in database._collections.values():
+                records.append(bson.encode({"__collection__": f"{database.name}/{collection.name}"}))
+                records.extend(entry.raw for entry in collection._entries.values())
+        return records
+
+    @staticmethod
+    def _write(path: str, records: List[bytes]):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for record in records:
+                    f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def save_snapshot(self):
+        """Write every collection to the snapshot file if anything changed since the last write."""
+        if not self.snapshot_path or self.version == self._saved_version:
+            return
+        version = self.version
+        self._write(self.snapshot_path, self._snapshot_records())
+        self._saved_version = version
+
+    async def save_snapshot_async(self):
+        """Like save_snapshot, with the file written off the event loop."""
+        if not self.snapshot_path or self.version == self._saved_version:
+            return
+        version = self.version
+        # Stored BSON is immutable, so collecting it on the loop gives a consistent snapshot
+        records = self._snapshot_records()
+        await asyncio.get_running_loop().run_in_executor(None, self._write, self.snapshot_path, records)
+        self._saved_version = version
+
+    def start_snapshots(self, interval: float = SNAPSHOT_INTERVAL_SECONDS):
+        if self.snapshot_path and self._snapshot_task is None:
+            self._snapshot_task = asyncio.create_task(self._snapshot_loop(interval))
+
+    async def _snapshot_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.save_snapshot_async()
+            except Exception:
+                logger.exception("Failed to write storage snapshot %s", self.snapshot_path)
+
+    def close(self):
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            self._snapshot_task = None
+        self.save_snapshot()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
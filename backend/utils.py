@@ -1,8 +1,48 @@
-from typing import Dict, Any, List
-from datetime import datetime
-import base64
-import uuid
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone, time
+from zoneinfo import ZoneInfo
+import calendar
+import math
 import os
+import re
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+# Wall-clock timezone that event dates and times are entered in
+EVENT_TIMEZONE = ZoneInfo(os.environ.get("EVENT_TIMEZONE", "Asia/Kolkata"))
+
+EVENT_TIME_FORMATS = ("%H:%M", "%H:%M:%S", "%I:%M %p", "%I:%M%p", "%I %p", "%I%p")
+
+# Month names and abbreviations as stored in legacy financial records
+MONTH_NUMBERS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTH_NUMBERS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+# Indian financial years run April-March
+FISCAL_YEAR_START_MONTH = 4
+
+# Amounts as entered in price and budget fields: "₹1.2 Cr", "45 Lakh", "₹85,000/month", "50L"
+AMOUNT_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(crores?|cr|lakhs?|lacs?|lac|l|k)?(?![a-z])", re.IGNORECASE)
+AMOUNT_UNITS = {"cr": 1e7, "crore": 1e7, "crores": 1e7, "lakh": 1e5, "lakhs": 1e5, "lac": 1e5, "lacs": 1e5, "l": 1e5, "k": 1e3}
+UPPER_BOUND_WORDS = ("under", "below", "upto", "up to", "max", "within", "less than")
+LOWER_BOUND_WORDS = ("above", "over", "min", "more than", "+")
+
+def _orjson_default(value: Any) -> Any:
+    """Encode the few BSON types orjson does not handle natively."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson.
+    
+    orjson encodes datetime, UUID and Enum values natively, so MongoDB documents
+    read with an ``{"_id": 0}`` projection can be returned as-is without a
+    serialize_doc pass. Returning a Response from a route also skips FastAPI's
+    response_model validation and jsonable_encoder walk.
+    """
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
 
 def serialize_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
     """Convert MongoDB document to JSON serializable format."""
@@ -28,45 +68,115 @@ def serialize_docs(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Convert list of MongoDB documents to JSON serializable format."""
     return [serialize_doc(doc) for doc in docs]
 
-def save_base64_image(base64_string: str, folder: str = "uploads") -> str:
-    """Save base64 image to file and return file path."""
-    try:
-        # Create uploads directory if it doesn't exist
-        os.makedirs(folder, exist_ok=True)
-        
-        # Extract the base64 data (remove data:image/png;base64, part)
-        if ',' in base64_string:
-            header, data = base64_string.split(',', 1)
-        else:
-            data = base64_string
-        
-        # Decode base64
-        image_data = base64.b64decode(data)
-        
-        # Generate unique filename
-        filename = f"{uuid.uuid4()}.png"
-        file_path = os.path.join(folder, filename)
-        
-        # Save file
-        with open(file_path, 'wb') as f:
-            f.write(image_data)
-        
-        return file_path
-    except Exception as e:
-        print(f"Error saving image: {e}")
+def add_months(value: datetime, months: int) -> datetime:
+    """Shift a datetime by whole months, clamping to the last day of the target month."""
+    month_index = value.month - 1 + months
+    year = value.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+def parse_event_time(value: Optional[str]) -> Optional[time]:
+    """Parse a free-form event time such as "14:00" or "9:30 AM"."""
+    if not value:
         return None
+    cleaned = value.strip().upper()
+    for fmt in EVENT_TIME_FORMATS:
+        try:
+            return datetime.strptime(cleaned, fmt).time()
+        except ValueError:
+            continue
+    return None
+
+def local_to_utc(value: datetime) -> datetime:
+    """Convert a wall-clock datetime in EVENT_TIMEZONE to naive UTC (as stored by MongoDB)."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=EVENT_TIMEZONE)
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def utc_to_local(value: datetime) -> datetime:
+    """Convert a naive UTC datetime to naive wall-clock time in EVENT_TIMEZONE."""
+    return value.replace(tzinfo=timezone.utc).astimezone(EVENT_TIMEZONE).replace(tzinfo=None)
+
+def compute_event_timestamp(event_date: datetime, event_time: Optional[str]) -> datetime:
+    """Combine an event's date and free-form time into a single UTC timestamp.
+
+    Falls back to the time carried by ``event_date`` itself when ``event_time``
+    cannot be parsed.
+    """
+    parsed_time = parse_event_time(event_time)
+    if parsed_time is not None:
+        event_date = datetime.combine(event_date.date(), parsed_time, tzinfo=event_date.tzinfo)
+    return local_to_utc(event_date)
+
+def expand_recurrence(event: Dict[str, Any], window_start: datetime, window_end: datetime) -> List[Dict[str, Any]]:
+    """Expand a (possibly recurring) event into its occurrences starting inside [window_start, window_end].
+
+    Window bounds are naive UTC. Series are stepped in EVENT_TIMEZONE wall-clock
+    time so monthly rules keep their local day, and the first occurrence in the
+    window is reached arithmetically instead of by walking the whole series.
+    """
+    starts_at = event["starts_at"]
+    rule = event.get("recurrence")
+    if not rule:
+        return [event] if window_start <= starts_at <= window_end else []
 
-def load_image_as_base64(file_path: str) -> str:
-    """Load image file and convert to base64."""
-    try:
-        with open(file_path, 'rb') as f:
-            image_data = f.read()
-        
-        base64_string = base64.b64encode(image_data).decode('utf-8')
-        return f"data:image/png;base64,{base64_string}"
-    except Exception as e:
-        print(f"Error loading image: {e}")
+    interval = rule.get("interval") or 1
+    count = rule.get("count")
+    if rule.get("until") is not None:
+        window_end = min(window_end, local_to_utc(datetime.combine(rule["until"].date(), time.max)))
+    if window_end < starts_at:
+        return []
+
+    first = utc_to_local(starts_at)
+    local_start = utc_to_local(window_start)
+    if rule.get("frequency") == "monthly":
+        months_between = (local_start.year - first.year) * 12 + local_start.month - first.month
+        index = max(0, months_between // interval)
+        occurrence_at = lambda i: add_months(first, i * interval)
+    else:
+        step = timedelta(days=interval * (7 if rule.get("frequency") == "weekly" else 1))
+        index = max(0, -((first - local_start) // step))
+        occurrence_at = lambda i: first + i * step
+
+    duration = event["ends_at"] - starts_at if event.get("ends_at") else None
+    occurrences = []
+    while count is None or index < count:
+        occurrence_local = occurrence_at(index)
+        occurrence_start = local_to_utc(occurrence_local)
+        if occurrence_start > window_end:
+            break
+        if occurrence_start >= window_start:
+            occurrence = dict(event)
+            occurrence["date"] = event["date"] + (occurrence_local - first)
+            occurrence["starts_at"] = occurrence_start
+            if duration is not None:
+                occurrence["ends_at"] = occurrence_start + duration
+            occurrence["series_id"] = event["id"]
+            occurrences.append(occurrence)
+        index += 1
+    return occurrences
+
+def series_end(event: Dict[str, Any]) -> Optional[datetime]:
+    """UTC start of a recurring event's last occurrence, or a bound no occurrence starts after.
+
+    None for one-off events and for series without ``until`` or ``count``.
+    """
+    rule = event.get("recurrence")
+    if not rule:
         return None
+    ends = []
+    if rule.get("until") is not None:
+        ends.append(local_to_utc(datetime.combine(rule["until"].date(), time.max)))
+    if rule.get("count") is not None:
+        first = utc_to_local(event["starts_at"])
+        steps = (rule["count"] - 1) * (rule.get("interval") or 1)
+        if rule.get("frequency") == "monthly":
+            last = add_months(first, steps)
+        else:
+            last = first + timedelta(days=steps * (7 if rule.get("frequency") == "weekly" else 1))
+        ends.append(local_to_utc(last))
+    return min(ends) if ends else None
 
 def calculate_dashboard_stats(user_id: str, role: str, db) -> Dict[str, Any]:
     """Calculate dashboard statistics for a user."""
@@ -99,6 +209,70 @@ def format_currency(amount: float) -> str:
     else:
         return f"₹{amount:,.0f}"
 
+def parse_amounts(text: Optional[str]) -> List[float]:
+    """Rupee amounts in a price or budget string; a unit on a range's upper end
+    applies to the lower end too ("₹20-30 Lakh")."""
+    if not text:
+        return []
+    matches = AMOUNT_RE.findall(text.replace(",", ""))
+    amounts = []
+    unit = None
+    for number, suffix in reversed(matches):
+        if suffix:
+            unit = AMOUNT_UNITS[suffix.lower()]
+        amounts.append(float(number) * (unit or 1))
+    return amounts[::-1]
+
+def parse_amount(text: Optional[str]) -> Optional[float]:
+    """The first amount in a price string, e.g. "₹1.2 Cr" -> 12000000.0."""
+    amounts = parse_amounts(text)
+    return amounts[0] if amounts else None
+
+def brokerage_amount(deal: Dict[str, Any]) -> float:
+    """A deal's brokerage in rupees ("₹2.5 Lakh" -> 250000.0); 0 when missing or unparseable."""
+    return parse_amount(deal.get("brokerage_amount")) or 0.0
+
+def brokerage_total(deals: Iterable[Dict[str, Any]]) -> float:
+    """Total brokerage of deals in rupees."""
+    return sum(brokerage_amount(deal) for deal in deals)
+
+def parse_amount_range(text: Optional[str]) -> Tuple[Optional[float], Optional[float]]:
+    """(low, high) of a budget string; open ends are 0 and infinity, unparseable is (None, None)."""
+    amounts = parse_amounts(text)
+    if not amounts:
+        return None, None
+    if len(amounts) > 1:
+        return min(amounts), max(amounts)
+    lowered = text.lower()
+    if any(word in lowered for word in UPPER_BOUND_WORDS):
+        return 0.0, amounts[0]
+    if any(word in lowered for word in LOWER_BOUND_WORDS):
+        return amounts[0], math.inf
+    return amounts[0], amounts[0]
+
+def parse_month(value: Any) -> Optional[int]:
+    """Month number 1-12 from an int, a numeric string or an English month name or abbreviation."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        month = int(value)
+        return month if month == value and 1 <= month <= 12 else None
+    if not isinstance(value, str):
+        return None
+    text = value.strip().lower()
+    if text.isdigit():
+        return parse_month(int(text))
+    return MONTH_NUMBERS.get(text) or MONTH_NUMBERS.get(text[:3])
+
+def fiscal_period(year: int, month: int) -> Tuple[int, int]:
+    """(financial year, quarter) of a calendar month; financial years start in April and are
+    named by their starting year, so March 2026 is (2025, 4)."""
+    offset = (month - FISCAL_YEAR_START_MONTH) % 12
+    return (year if month >= FISCAL_YEAR_START_MONTH else year - 1), offset // 3 + 1
+
+def fiscal_year_label(fiscal_year: int) -> str:
+    return f"FY{fiscal_year}-{(fiscal_year + 1) % 100:02d}"
+
 def validate_phone(phone: str) -> bool:
     """Validate Indian phone number format."""
     import re
@@ -656,5 +656,39 @@ class RealEstateAPITest(unittest.TestCase):
         self.assertIn("message", response.json())
         print("✅ Delete project test passed")
 
+    def test_31_event_range_with_recurrence(self):
+        """Test range queries expanding a recurring event"""
+        if not self.broker_token:
+            self.skipTest("Broker token not available")
+        
+        event_data = {
+            "title": "Weekly Site Visit",
+            "type": "visit",
+            "date": "2030-01-07T10:00:00",
+            "time": "10:00",
+            "customer": "Jane Customer",
+            "phone": "9876543213",
+            "location": "Test Area",
+            "recurrence": {"frequency": "weekly", "count": 10}
+        }
+        
+        response = requests.post(
+            f"{BACKEND_URL}/events",
+            json=event_data,
+            headers={"Authorization": f"Bearer {self.broker_token}"}
+        )
+        self.assertEqual(response.status_code, 200)
+        series_id = response.json()["id"]
+        
+        response = requests.get(
+            f"{BACKEND_URL}/events",
+            params={"from": "2030-01-01", "to": "2030-01-31"},
+            headers={"Authorization": f"Bearer {self.broker_token}"}
+        )
+        self.assertEqual(response.status_code, 200)
+        occurrences = [e for e in response.json() if e.get("series_id") == series_id]
+        self.assertEqual(len(occurrences), 4)
+        print("✅ Event range with recurrence test passed")
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
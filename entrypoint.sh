@@ -4,9 +4,14 @@ set -e
 # Start the FastAPI backend
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
+if [ "${STORAGE_BACKEND:-mongo}" = "memory" ] && [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+    echo "STORAGE_BACKEND=memory runs in a single process; set WEB_CONCURRENCY=1"
+    exit 1
+fi
+
 echo "Starting FastAPI backend"
 # Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
+uvicorn server:app --host 0.0.0.0 --port 8001 --workers "${WEB_CONCURRENCY:-1}" &
 BACKEND_PID=$!
 
 echo "Waiting for backend to start..."
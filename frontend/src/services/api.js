@@ -120,6 +120,21 @@ export const notificationsAPI = {
   markAllRead: () => api.patch('/notifications/mark-all-read'),
   delete: (id) => api.delete(`/notifications/${id}`),
   getUnreadCount: () => api.get('/notifications/unread/count'),
+  // Push channel; EventSource reconnects on its own and resumes via Last-Event-ID
+  openStream: () => new EventSource(
+    `${API_BASE_URL}/notifications/stream?token=${encodeURIComponent(localStorage.getItem('token') || '')}`
+  ),
+};
+
+// Images API
+export const imagesAPI = {
+  // Resolves to { id, url, size, content_type }; store `url` in property.images
+  // The file is the request body, so the server can stream it and stop at the size limit
+  upload: (file) => api.post('/images', file, {
+    headers: { 'Content-Type': file.type || 'application/octet-stream' },
+  }),
+  // Stored references are API paths; external URLs pass through unchanged
+  src: (ref) => (ref.startsWith('/api/') ? `${process.env.REACT_APP_BACKEND_URL}${ref}` : ref),
 };
 
 export default api;
\ No newline at end of file
@@ -0,0 +1,33 @@
+import asyncio
+import inspect
+import os
+import sys
+
+import pytest
+
+# Backend modules import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import database  # noqa: E402
+from query_budget import query_monitor  # noqa: E402
+from storage import MemoryClient  # noqa: E402
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Run ``async def`` tests to completion on a fresh event loop."""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
+
+@pytest.fixture
+def db():
+    """An empty embedded database installed as this process's connection.
+
+    Its commands are reported to query_monitor, so track_queries counts them.
+    """
+    client = MemoryClient(event_listeners=[query_monitor])
+    database._connection = database.Connection(client, client["test"])
+    yield database.get_db()
+    database._connection = None
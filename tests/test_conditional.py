@@ -0,0 +1,99 @@
+import pytest
+
+import conditional
+from conditional import CHANGE_LOG_SIZE, TenantCache, bump_generation, read_generation
+from search import SearchIndexCache, TenantIndex
+
+async def insert_customer(db, customer_id, name):
+    await db.customers.insert_one({"id": customer_id, "user_id": "u1", "name": name})
+
+async def cached_index(db, reloads):
+    cache = SearchIndexCache()
+    for i in range(3):
+        await insert_customer(db, f"c{i}", f"Customer {i}")
+    await bump_generation("u1", "customers", ["c0", "c1", "c2"])
+    index = await cache.get("u1")
+
+    original = TenantIndex.reload
+
+    async def counting_reload(self, sources, generations):
+        reloads.extend(sources)
+        await original(self, sources, generations)
+
+    index.reload = counting_reload.__get__(index)
+    return cache, index
+
+def names(index):
+    return sorted(entry[1]["title"] for entry in index.documents["customers"].values())
+
+async def test_other_workers_writes_are_replayed_without_a_reload(db):
+    reloads = []
+    cache, index = await cached_index(db, reloads)
+
+    # Writes made by another worker: this worker's index never saw them
+    await db.customers.update_one({"id": "c0"}, {"$set": {"name": "Renamed"}})
+    await bump_generation("u1", "customers", ["c0"])
+    await insert_customer(db, "c3", "Added")
+    await bump_generation("u1", "customers", ["c3"])
+    await db.customers.delete_one({"id": "c1"})
+    await bump_generation("u1", "customers", ["c1"])
+
+    assert await cache.get("u1") is index
+    assert reloads == []
+    assert names(index) == ["Added", "Customer 2", "Renamed"]
+    assert index.generations["customers"] == 4
+    assert index.vocabulary == sorted(index.postings)
+
+async def test_local_write_after_a_missed_one_is_replayed(db):
+    reloads = []
+    cache, index = await cached_index(db, reloads)
+    # Another worker's write, then one made in this worker
+    await insert_customer(db, "c3", "Remote")
+    await bump_generation("u1", "customers", ["c3"])
+    await db.customers.update_one({"id": "c0"}, {"$set": {"name": "Local"}})
+    generation = await bump_generation("u1", "customers", ["c0"])
+    assert cache.caught_up("u1", "customers", generation) is None
+
+    assert await cache.get("u1") is index
+    assert reloads == []
+    assert names(index) == ["Customer 1", "Customer 2", "Local", "Remote"]
+    assert index.generations["customers"] == generation
+
+async def test_write_without_entity_ids_reloads(db):
+    reloads = []
+    cache, index = await cached_index(db, reloads)
+    await db.customers.update_many({}, {"$set": {"name": "Bulk"}})
+    await bump_generation("u1", "customers")
+
+    await cache.get("u1")
+    assert reloads == ["customers"]
+    assert names(index) == ["Bulk"] * 3
+
+async def test_writes_beyond_the_change_log_reload(db):
+    reloads = []
+    cache, index = await cached_index(db, reloads)
+    for _ in range(CHANGE_LOG_SIZE + 1):
+        await bump_generation("u1", "customers", ["c0"])
+
+    await cache.get("u1")
+    assert reloads == ["customers"]
+    assert index.generations["customers"] == CHANGE_LOG_SIZE + 2
+
+async def test_change_log_is_capped_and_not_read_by_list_validators(db):
+    for i in range(CHANGE_LOG_SIZE + 5):
+        generation = await bump_generation("u1", "customers", [f"c{i}"])
+    counter = await db[conditional.GENERATIONS_COLLECTION].find_one({"_id": "u1:customers"})
+    assert len(counter["changes"]) == CHANGE_LOG_SIZE
+    assert counter["changes"][-1] == {"ids": [f"c{generation - 1}"]}
+    assert (await read_generation("u1", "customers"))[0] == generation
+
+@pytest.mark.parametrize("cached, generation, changes, expected", [
+    (2, 4, [{"ids": ["a"]}, {"ids": ["b"]}, {"ids": ["c"]}], {"b", "c"}),
+    (3, 4, [{"ids": ["a"]}, {"ids": None}], None),
+    (2, 4, [{"ids": ["a"]}, {"ids": None}], None),
+    (1, 4, [{"ids": ["a"]}, {"ids": ["b"]}], None),
+    (None, 4, [{"ids": ["a"]}], None),
+    (5, 4, [{"ids": ["a"]}], None),
+])
+def test_changed_ids(cached, generation, changes, expected):
+    assert TenantCache.changed_ids(cached, {"generation": generation, "changes": changes}) == expected
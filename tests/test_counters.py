@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from counters import COUNTERS_COLLECTION, increment_unread, reconcile_unread_counters
+
+USER = "u1"
+
+def notification(notification_id):
+    return {"id": notification_id, "user_id": USER, "type": "payment", "is_read": False, "created_at": datetime(2025, 1, 1)}
+
+async def stored_unread(db):
+    counter = await db[COUNTERS_COLLECTION].find_one({"_id": USER})
+    return counter["unread"], counter["by_type"]
+
+async def test_reconciler_skips_counters_changed_while_it_counted(db, monkeypatch):
+    await db.notifications.insert_one(notification("n1"))
+    # Drifted: one notification, five counted
+    await db[COUNTERS_COLLECTION].insert_one(
+        {"_id": USER, "unread": 5, "by_type": {"payment": 5}, "updated_at": datetime(2025, 1, 1)}
+    )
+    counters = db[COUNTERS_COLLECTION]
+    original = counters.bulk_write
+
+    async def deliver_then_write(*args, **kwargs):
+        # A notification is delivered after the count, before the counters are rewritten
+        monkeypatch.setattr(counters, "bulk_write", original)
+        await db.notifications.insert_one(notification("n2"))
+        await increment_unread([notification("n2")])
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(counters, "bulk_write", deliver_then_write)
+    await reconcile_unread_counters()
+    monkeypatch.undo()
+    # Overwriting with the count taken before the delivery would lose it
+    assert await stored_unread(db) == (6, {"payment": 6})
+
+    await reconcile_unread_counters()
+    assert await stored_unread(db) == (2, {"payment": 2})
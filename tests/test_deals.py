@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from models import UserResponse
+from routes.deals import get_brokerage_analytics
+
+USER = "u1"
+
+def closed_deal(deal_id, brokerage, close_date, status="Closed"):
+    return {"id": deal_id, "user_id": USER, "status": status, "brokerage_amount": brokerage, "close_date": close_date}
+
+async def test_brokerage_analytics_sums_amounts_in_any_unit(db):
+    await db.deals.insert_many([
+        closed_deal("d1", "₹2 Lakh", datetime(2025, 1, 10)),
+        closed_deal("d2", "₹50,000", datetime(2025, 1, 20)),
+        closed_deal("d3", "₹1.2 Cr", datetime(2025, 3, 5)),
+        closed_deal("d4", "n/a", datetime(2025, 3, 6)),
+        closed_deal("d5", "₹1 Lakh", None),
+        closed_deal("d6", "₹9 Lakh", datetime(2025, 3, 7), status="Agreement"),
+    ])
+    # Five later months fill the last six with March, leaving January out
+    await db.deals.insert_many([
+        closed_deal(f"m{month}", "₹10,000", datetime(2025, month, 1)) for month in range(4, 9)
+    ])
+    broker = UserResponse(
+        id=USER, email="b@example.com", full_name="Broker", phone=None, role="broker",
+        is_active=True, created_at=datetime(2025, 1, 1)
+    )
+    result = await get_brokerage_analytics(current_user=broker, db=db)
+    assert result["brokerage_data"] == [
+        {"month": "Mar", "amount": 12000000.0, "deals_count": 2},
+        {"month": "Apr", "amount": 10000.0, "deals_count": 1},
+        {"month": "May", "amount": 10000.0, "deals_count": 1},
+        {"month": "Jun", "amount": 10000.0, "deals_count": 1},
+        {"month": "Jul", "amount": 10000.0, "deals_count": 1},
+        {"month": "Aug", "amount": 10000.0, "deals_count": 1},
+    ]
+
+    await db.deals.delete_many({"id": {"$regex": "^m"}})
+    result = await get_brokerage_analytics(current_user=broker, db=db)
+    assert result["brokerage_data"][0] == {"month": "Jan", "amount": 250000.0, "deals_count": 2}
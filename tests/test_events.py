@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from conditional import read_generation
+from query_budget import track_queries
+from routes.events import (
+    EVENT_TIMESTAMPS_MIGRATION, apply_event_timestamps, backfill_event_timestamps, backfill_series_ends,
+    find_events_in_window, series_window
+)
+
+async def test_event_timestamp_backfill_runs_once_and_invalidates_tenants(db):
+    await db.events.insert_many([
+        {"id": "e1", "user_id": "u1", "date": datetime(2025, 4, 1), "time": "10:00", "end_time": "11:30"},
+        {"id": "e2", "user_id": "u1"},
+        {"id": "e3", "user_id": "u2", "date": datetime(2025, 4, 1), "starts_at": datetime(2025, 4, 1)},
+    ])
+
+    await backfill_event_timestamps()
+    event = await db.events.find_one({"id": "e1"})
+    # Wall-clock times in Asia/Kolkata, stored as UTC
+    assert (event["starts_at"], event["ends_at"]) == (datetime(2025, 4, 1, 4, 30), datetime(2025, 4, 1, 6, 0))
+    assert "starts_at" not in await db.events.find_one({"id": "e2"})
+    assert await db.migrations.find_one({"_id": EVENT_TIMESTAMPS_MIGRATION})
+    assert (await read_generation("u1", "events"))[0] == 1
+    assert (await read_generation("u2", "events"))[0] == 0
+
+    # Later startups skip the scan
+    await db.events.insert_one({"id": "e4", "user_id": "u1", "date": datetime(2025, 5, 1), "time": "09:00"})
+    await backfill_event_timestamps()
+    assert "starts_at" not in await db.events.find_one({"id": "e4"})
+    assert (await read_generation("u1", "events"))[0] == 1
+
+def series(event_id, day, **rule):
+    return apply_event_timestamps({
+        "id": event_id, "user_id": "u1", "date": datetime(2025, 1, day), "time": "10:00",
+        "recurrence": {"frequency": "daily", **rule}
+    })
+
+def legacy_series(event_id, day, **rule):
+    """A series written before series_ends_at was stored."""
+    event = series(event_id, day, **rule)
+    del event["series_ends_at"]
+    return event
+
+async def test_window_reads_skip_series_that_ended_before_it(db):
+    await db.events.insert_many([
+        series("ended", 1, count=5),
+        series("until", 1, until=datetime(2025, 3, 31)),
+        series("open", 1),
+        legacy_series("legacy", 2, count=5),
+    ])
+    window_start, window_end = datetime(2025, 3, 1), datetime(2025, 3, 2)
+    with track_queries() as stats:
+        events = await find_events_in_window(db, {"user_id": "u1"}, window_start, window_end)
+    assert sorted({event["series_id"] for event in events}) == ["open", "until"]
+    assert stats.count == 2
+
+    # Series that ended before the window are not read; legacy ones are until backfilled
+    query = {"user_id": "u1", **series_window(window_start, window_end)}
+    assert sorted(await db.events.distinct("id", query)) == ["legacy", "open", "until"]
+
+async def test_series_end_backfill_runs_once(db):
+    await db.events.insert_many([legacy_series("legacy", 1, count=5), series("open", 1)])
+
+    await backfill_series_ends()
+    assert (await db.events.find_one({"id": "legacy"}))["series_ends_at"] == datetime(2025, 1, 5, 4, 30)
+    assert (await read_generation("u1", "events"))[0] == 1
+    await backfill_series_ends()
+    assert (await read_generation("u1", "events"))[0] == 1
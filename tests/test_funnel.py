@@ -0,0 +1,162 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import funnel
+from models import DealCreate, UserResponse
+from routes.deals import update_deal
+from funnel import FUNNEL_STAGES, FUNNELS_COLLECTION, build_funnel, get_funnel, record_transition, release_deal, status_fields
+
+USER = "u1"
+START = datetime(2025, 1, 1)
+
+async def create_deal(db, deal_id, status, now):
+    await db.deals.insert_one(
+        {"id": deal_id, "user_id": USER, "status": status, "start_date": now, **status_fields(None, status, now)}
+    )
+    await record_transition(USER, deal_id, None, status, now)
+
+async def move_deal(db, deal_id, status, now):
+    existing = await db.deals.find_one({"id": deal_id})
+    await db.deals.update_one({"id": deal_id}, {"$set": {"status": status, **status_fields(existing, status, now)}})
+    await record_transition(USER, deal_id, existing, status, now)
+
+async def delete_deal(db, deal_id):
+    existing = await db.deals.find_one({"id": deal_id})
+    await db.deals.delete_one({"id": deal_id})
+    await release_deal(USER, existing)
+
+def counters(funnel_doc):
+    """Counters without bookkeeping fields or zero entries, which builds never contain."""
+    def nonzero(counts):
+        return {key: count for key, count in counts.items() if count}
+    return {
+        "current": nonzero(funnel_doc["current"]),
+        "furthest": nonzero(funnel_doc["furthest"]),
+        "dwell": {status: nonzero(days) for status, days in funnel_doc["dwell"].items() if nonzero(days)},
+        "transitions": funnel_doc["transitions"],
+    }
+
+async def stored_funnel(db):
+    return await db[FUNNELS_COLLECTION].find_one({"_id": USER})
+
+async def test_incremental_counters_match_a_rebuild(db):
+    rng = random.Random(5)
+    statuses = FUNNEL_STAGES + ["Cancelled"]
+    now = START
+    live = []
+    for i in range(20):
+        await create_deal(db, f"d{i}", rng.choice(statuses[:3]), now)
+        live.append(f"d{i}")
+    # The funnel is built here; everything after is applied as increments
+    await get_funnel(USER)
+
+    for step in range(200):
+        now += timedelta(hours=rng.randint(1, 96))
+        action = rng.random()
+        if action < 0.1:
+            deal_id = f"n{step}"
+            await create_deal(db, deal_id, rng.choice(statuses), now)
+            live.append(deal_id)
+        elif action < 0.15 and live:
+            await delete_deal(db, live.pop(rng.randrange(len(live))))
+        elif live:
+            await move_deal(db, rng.choice(live), rng.choice(statuses), now)
+
+    assert counters(await stored_funnel(db)) == await build_funnel(USER)
+    assert counters(await get_funnel(USER)) == await build_funnel(USER)
+
+async def test_deals_predating_the_log_are_counted_once(db):
+    await db.deals.insert_one({"id": "old", "user_id": USER, "status": "Visit Done", "created_at": START})
+    await create_deal(db, "new", "Interested", START)
+    built = counters(await get_funnel(USER))
+    assert built["current"] == {"Visit Done": 1, "Interested": 1}
+    assert built["furthest"] == {"Visit Done": 1, "Interested": 1}
+    assert built["transitions"] == 2
+
+    await move_deal(db, "old", "Finalized", START + timedelta(days=3))
+    assert counters(await stored_funnel(db)) == await build_funnel(USER)
+
+async def test_writes_during_a_build_are_not_lost(db, monkeypatch):
+    await create_deal(db, "d1", "Interested", START)
+    await create_deal(db, "d2", "Call", START)
+    original = funnel.build_funnel
+    writes = iter([
+        lambda: create_deal(db, "d3", "Visit Done", START + timedelta(days=1)),
+        lambda: move_deal(db, "d1", "Call", START + timedelta(days=2)),
+    ])
+
+    async def build_then_write(user_id):
+        # Writes made by other requests after the build has read its sources
+        built = await original(user_id)
+        write = next(writes, None)
+        if write is not None:
+            await write()
+        return built
+
+    monkeypatch.setattr(funnel, "build_funnel", build_then_write)
+    await get_funnel(USER)
+    monkeypatch.setattr(funnel, "build_funnel", original)
+
+    stored = await stored_funnel(db)
+    assert not stored["building"]
+    assert counters(stored) == await build_funnel(USER)
+
+async def test_build_that_keeps_changing_is_redone_by_the_next_read(db, monkeypatch):
+    await create_deal(db, "d1", "Interested", START)
+    original = funnel.build_funnel
+    writes = iter(range(funnel.MAX_BUILD_ATTEMPTS))
+
+    async def build_then_write(user_id):
+        built = await original(user_id)
+        step = next(writes, None)
+        if step is not None:
+            await create_deal(db, f"n{step}", "Call", START + timedelta(days=step))
+        return built
+
+    monkeypatch.setattr(funnel, "build_funnel", build_then_write)
+    await get_funnel(USER)
+    assert (await stored_funnel(db))["building"]
+
+    await move_deal(db, "d1", "Visit Done", START + timedelta(days=5))
+    assert counters(await get_funnel(USER)) == await original(USER)
+    assert not (await stored_funnel(db))["building"]
+
+async def test_unfinished_build_is_rebuilt_by_the_next_reader(db):
+    await create_deal(db, "d1", "Interested", START)
+    # A worker that died mid-build leaves the marker behind
+    await db[FUNNELS_COLLECTION].insert_one({"_id": USER, "building": True})
+    await move_deal(db, "d1", "Call", START + timedelta(days=1))
+    assert counters(await get_funnel(USER)) == await build_funnel(USER)
+
+def deal_update(status):
+    return DealCreate(
+        property_id="p1", customer_id="c1", property_title="Villa", customer_name="Asha",
+        status=status, deal_value="₹80 Lakh", brokerage_amount="₹1.6 Lakh"
+    )
+
+async def test_concurrent_status_changes_log_one_transition_each(db, monkeypatch):
+    await create_deal(db, "d1", "Interested", START)
+    await get_funnel(USER)
+    broker = UserResponse(
+        id=USER, email="b@example.com", full_name="Broker", phone=None, role="broker",
+        is_active=True, created_at=START
+    )
+    original = db.deals.find_one
+
+    async def find_then_yield(*args, **kwargs):
+        # Both requests read the deal before either writes
+        found = await original(*args, **kwargs)
+        await asyncio.sleep(0)
+        return found
+
+    monkeypatch.setattr(db.deals, "find_one", find_then_yield)
+    await asyncio.gather(
+        update_deal("d1", deal_update("Call"), current_user=broker, db=db),
+        update_deal("d1", deal_update("Visit Done"), current_user=broker, db=db),
+    )
+    monkeypatch.setattr(db.deals, "find_one", original)
+
+    stored = counters(await stored_funnel(db))
+    assert stored == await build_funnel(USER)
+    assert stored["transitions"] == 3
@@ -0,0 +1,36 @@
+import base64
+import hashlib
+
+import pytest
+
+import image_store
+from image_store import INLINE_IMAGES_MIGRATION, migrate_inline_images, stored_content_type
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, "IMAGE_STORAGE_DIR", tmp_path)
+    image_store._cached_content_type.cache_clear()
+
+def test_missing_image_is_found_once_stored():
+    digest = hashlib.sha256(PNG).hexdigest()
+    assert stored_content_type(digest) is None
+
+    image_store._store_bytes(PNG)
+
+    assert stored_content_type(digest) == "image/png"
+
+async def test_inline_image_migration_runs_once(db):
+    inline = base64.b64encode(PNG).decode()
+    await db.properties.insert_one({"id": "p1", "user_id": "u1", "images": [inline]})
+
+    await migrate_inline_images()
+    migrated = await db.properties.find_one({"id": "p1"})
+    assert migrated["images"] == [image_store.image_url(hashlib.sha256(PNG).hexdigest())]
+    assert await db.migrations.find_one({"_id": INLINE_IMAGES_MIGRATION})
+
+    # Later startups skip the scan; the write paths handle new inline images
+    await db.properties.insert_one({"id": "p2", "user_id": "u1", "images": [inline]})
+    await migrate_inline_images()
+    assert (await db.properties.find_one({"id": "p2"}))["images"] == [inline]
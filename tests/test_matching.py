@@ -0,0 +1,151 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from matching import (
+    COL_AREAS, FACINGS, TenantMatcher, budget_fit, customer_preferences, customer_text, mentions_area
+)
+from routes.matching import with_documents
+
+@pytest.mark.parametrize("price, expected", [
+    (150, 1.0),
+    (100, 1.0),
+    (200, 1.0),
+    # Half the low end scores 0, linearly from the low end
+    (75, 0.5),
+    (50, 0.0),
+    (10, 0.0),
+    # 20% over the high end scores 0
+    (220, 0.5),
+    (240, 0.0),
+    (900, 0.0),
+])
+def test_budget_fit(price, expected):
+    fit = budget_fit(np.array([100.0]), np.array([200.0]), np.array([float(price)]))
+    assert fit[0] == pytest.approx(expected)
+
+def test_budget_fit_open_ends_and_broadcasting():
+    low = np.array([[0.0], [100.0]])
+    high = np.array([[200.0], [math.inf]])
+    price = np.array([[10.0, 230.0, 1e9]])
+    fit = budget_fit(low, high, price)
+    assert fit.shape == (2, 3)
+    # "under 200": nothing is too cheap; "above 100": nothing is too expensive
+    np.testing.assert_allclose(fit, [[1.0, 0.25, 0.0], [0.0, 1.0, 1.0]])
+
+@pytest.mark.parametrize("text, types, bedrooms, facings, vastu", [
+    ("3bhk villa or flat, east facing, vastu compliant", {"Villa", "Apartment"}, {3}, {"East"}, True),
+    ("2 BHK or 3 bhk apartment", {"Apartment"}, {2, 3}, set(), False),
+    ("north east facing bungalow", {"Villa"}, set(), {"North-East"}, False),
+    ("south-west facing plot or land", {"Plot"}, set(), {"South-West"}, False),
+    ("7bhk house", {"House"}, {5}, set(), False),
+    # Keywords only count as whole words
+    ("flatmate near the plotting office, vastushastra", set(), set(), set(), False),
+    ("", set(), set(), set(), False),
+])
+def test_customer_preferences(text, types, bedrooms, facings, vastu):
+    preferences = customer_preferences(text.lower())
+    assert preferences == {
+        "types": types, "bedrooms": bedrooms, "facings": {FACINGS.index(f) for f in facings}, "vastu": vastu
+    }
+
+def test_customer_text_reads_interest_and_notes():
+    assert customer_text({"interest": "Villa", "notes": None}) == "villa "
+    assert customer_text({"interest": "Plot", "notes": "Near BANER"}) == "plot near baner"
+
+@pytest.mark.parametrize("text, name, expected", [
+    ("near baner, pune", "baner", True),
+    ("baner", "baner", True),
+    ("mr banerjee, call after 6", "baner", False),
+    ("prefers old-baner or aundh", "baner", True),
+    ("banerjee knows baner well", "baner", True),
+    ("koregaon park or kalyani nagar", "koregaon park", True),
+    ("koregaon parkside", "koregaon park", False),
+    ("pimpri-chinchwad", "pimpri-chinchwad", True),
+])
+def test_mentions_area(text, name, expected):
+    assert mentions_area(text, name) is expected
+
+def prefers_area(matcher, customer_id):
+    return bool(matcher.customers.features[matcher.customers.rows[customer_id], COL_AREAS:].any())
+
+def test_area_preferences_match_whole_words():
+    matcher = TenantMatcher()
+    matcher.upsert("customers", {"id": "c1", "notes": "Mr Banerjee wants a flat", "status": "Interested"})
+    matcher.upsert("customers", {"id": "c2", "notes": "near Baner, Pune", "status": "Interested"})
+    # A new area flags the customers already loaded
+    matcher.upsert("properties", {"id": "p1", "area": "Baner", "type": "Apartment", "price": "₹80 Lakh"})
+    assert not prefers_area(matcher, "c1")
+    assert prefers_area(matcher, "c2")
+    # Customers added later are matched against known areas
+    matcher.upsert("customers", {"id": "c3", "notes": "Banerjee again", "status": "Interested"})
+    matcher.upsert("customers", {"id": "c4", "interest": "Flat in baner", "status": "Interested"})
+    assert not prefers_area(matcher, "c3")
+    assert prefers_area(matcher, "c4")
+
+AREAS = ["Baner", "Aundh", "Wakad", "Kothrud", "Koregaon Park", "Hinjewadi"]
+NOTE_WORDS = ["3bhk", "2 bhk", "villa", "flat", "plot", "east facing", "north-east facing", "vastu",
+              "banerjee", "urgent", "near", "school"] + [area.lower() for area in AREAS]
+BUDGETS = ["₹40 Lakh - ₹80 Lakh", "under ₹1 Cr", "above ₹50 Lakh", "₹60 Lakh", "₹1.2 Cr - ₹2 Cr", "", None]
+
+def random_property(rng, i):
+    return {
+        "id": f"p{i}",
+        "type": rng.choice(["Villa", "Apartment", "Plot", "House"]),
+        "area": rng.choice(AREAS),
+        "bedrooms": rng.randint(0, 6),
+        "facing": rng.choice(FACINGS + [None]),
+        "vastu_compliant": rng.random() < 0.3,
+        "price": rng.choice([f"₹{rng.randint(20, 250)} Lakh", f"₹{rng.randint(1, 3)} Cr", None]),
+        "deal_status": rng.choice([None, "Interested", "Agreement", "Finalized"]),
+    }
+
+def random_customer(rng, i):
+    return {
+        "id": f"c{i}",
+        "budget": rng.choice(BUDGETS),
+        "interest": rng.choice(["Villa", "Apartment", "Plot", None]),
+        "notes": " ".join(rng.sample(NOTE_WORDS, rng.randint(0, 3))),
+        "status": rng.choice(["Interested", "Visit", "Follow-up", "Deal Lost", "Closed"]),
+    }
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_properties_for_all_customers_matches_brute_force(monkeypatch, seed):
+    # Small blocks so budget windows and block boundaries are exercised
+    monkeypatch.setattr("matching.SCORE_BLOCK", 4)
+    rng = random.Random(seed)
+    matcher = TenantMatcher()
+    for i in range(120):
+        matcher.upsert("properties", random_property(rng, i))
+    for i in range(80):
+        matcher.upsert("customers", random_customer(rng, i))
+    # Deletes move rows around
+    for i in range(0, 120, 7):
+        matcher.remove("properties", f"p{i}")
+    for i in range(0, 80, 9):
+        matcher.remove("customers", f"c{i}")
+
+    limit = 10
+    results = matcher.properties_for_all_customers(limit)
+    active = {matcher.customers.ids[row] for row in np.flatnonzero(matcher.customers.column("active"))}
+    assert set(results) == active
+
+    for customer_id, ranked in results.items():
+        scores = matcher._scores(np.array([matcher.customers.rows[customer_id]]))[0]
+        expected = sorted((float(s) for s in scores if s > 0), reverse=True)[:limit]
+        assert [score for _, score in ranked] == pytest.approx(expected, rel=1e-5), customer_id
+        assert len({property_id for property_id, _ in ranked}) == len(ranked)
+        for property_id, score in ranked:
+            assert score == pytest.approx(float(scores[matcher.properties.rows[property_id]]), rel=1e-5)
+
+async def test_matched_documents_are_the_users_own(db):
+    await db.properties.insert_many([
+        {"id": "p1", "user_id": "u1", "title": "Mine"},
+        # Another tenant's documents are never attached, whatever their id
+        {"id": "p1", "user_id": "u2", "title": "Theirs"},
+        {"id": "p2", "user_id": "u2", "title": "Theirs too"},
+    ])
+    matches = await with_documents(db.properties, "u1", [("p2", 0.9), ("p1", 0.5)], "property")
+    assert matches == [{"score": 0.5, "property": {"id": "p1", "user_id": "u1", "title": "Mine"}}]
@@ -0,0 +1,185 @@
+import random
+from datetime import datetime
+
+import pytest
+from pymongo import ReturnDocument
+
+from conditional import bump_generation, read_generation
+from pnl import (
+    FINANCIAL_MONTHS_MIGRATION, PAYMENTS_CATEGORY, ROLLUP_COLLECTION, ROLLUP_STATE_COLLECTION, WRITER_TIMEOUT,
+    apply_record, build_rollup, ensure_rollup, normalize_financial_months, record_write, replace_project_payments,
+    trend
+)
+
+async def test_financial_month_normalization_runs_once_and_invalidates_tenants(db):
+    await db.financial_records.insert_many([
+        {"id": "r1", "user_id": "u1", "year": 2025, "month": "March", "revenue": 1.0, "expenses": 0.0},
+        {"id": "r2", "user_id": "u1", "year": 2025, "month": "13", "revenue": 1.0, "expenses": 0.0},
+        {"id": "r3", "user_id": "u2", "year": 2025, "month": 4, "fiscal_year": 2025, "fiscal_quarter": 1},
+    ])
+    await db[ROLLUP_STATE_COLLECTION].insert_many([{"_id": "u1"}, {"_id": "u2"}])
+
+    await normalize_financial_months()
+    normalized = await db.financial_records.find_one({"id": "r1"})
+    assert (normalized["month"], normalized["fiscal_year"], normalized["fiscal_quarter"]) == (3, 2024, 4)
+    assert (await db.financial_records.find_one({"id": "r2"}))["month"] == "13"
+    assert await db.migrations.find_one({"_id": FINANCIAL_MONTHS_MIGRATION})
+    # Only the tenant whose records changed has stale lists and rollup
+    assert (await read_generation("u1", "financial_records"))[0] == 1
+    assert (await read_generation("u2", "financial_records"))[0] == 0
+    assert await db[ROLLUP_STATE_COLLECTION].find({}, {"building": 1}).to_list(None) == [
+        {"_id": "u1", "building": True}, {"_id": "u2"}
+    ]
+
+    # Later startups skip the scan
+    await db.financial_records.insert_one({"id": "r4", "user_id": "u1", "year": 2025, "month": "May"})
+    await normalize_financial_months()
+    assert (await db.financial_records.find_one({"id": "r4"}))["month"] == "May"
+    assert (await read_generation("u1", "financial_records"))[0] == 1
+
+USER = "u1"
+
+def make_record(record_id, revenue, expenses=0.0, year=2025, month=4, category="sales", project_id=None):
+    return {"id": record_id, "user_id": USER, "project_id": project_id, "category": category,
+            "year": year, "month": month, "revenue": revenue, "expenses": expenses}
+
+async def add_record(db, record_id, revenue, expenses=0.0, **fields):
+    record = make_record(record_id, revenue, expenses, **fields)
+    async with record_write(USER):
+        await db.financial_records.insert_one(dict(record))
+        await bump_generation(USER, "financial_records", [record_id])
+        await apply_record(USER, record)
+
+async def update_record(db, record_id, **changes):
+    async with record_write(USER):
+        existing = await db.financial_records.find_one_and_update(
+            {"id": record_id}, {"$set": changes}, projection={"_id": 0}, return_document=ReturnDocument.BEFORE
+        )
+        await bump_generation(USER, "financial_records", [record_id])
+        await apply_record(USER, existing, -1)
+        await apply_record(USER, {**existing, **changes})
+
+async def delete_record(db, record_id):
+    async with record_write(USER):
+        existing = await db.financial_records.find_one_and_delete({"id": record_id}, {"_id": 0})
+        await bump_generation(USER, "financial_records", [record_id])
+        await apply_record(USER, existing, -1)
+
+async def set_payments(db, project_id, payments):
+    plots = [{"number": "1", "payments": payments}]
+    await db.projects.update_one({"id": project_id, "user_id": USER}, {"$set": {"plots": plots}}, upsert=True)
+    await bump_generation(USER, "projects", [project_id])
+    await replace_project_payments(USER, project_id, plots)
+
+async def rollup_rows(db):
+    return {row.pop("_id"): row async for row in db[ROLLUP_COLLECTION].find({"user_id": USER})}
+
+async def assert_matches_rebuild(db):
+    incremental = await rollup_rows(db)
+    await build_rollup(USER)
+    rebuilt = await rollup_rows(db)
+    assert set(incremental) == set(rebuilt)
+    for row_id, row in rebuilt.items():
+        assert incremental[row_id] == {**row, "revenue": pytest.approx(row["revenue"]),
+                                       "expenses": pytest.approx(row["expenses"])}, row_id
+
+async def test_incremental_updates_match_a_rebuild(db):
+    rng = random.Random(3)
+    await add_record(db, "seed", 100.0)
+    await ensure_rollup(USER)
+
+    records = ["seed"]
+    for step in range(150):
+        action = rng.random()
+        if action < 0.4:
+            record_id = f"r{step}"
+            await add_record(db, record_id, round(rng.uniform(0, 1000), 2), round(rng.uniform(0, 500), 2),
+                             month=rng.randint(1, 12), category=rng.choice(["sales", "rent", "salaries"]),
+                             project_id=rng.choice([None, "p1", "p2"]))
+            records.append(record_id)
+        elif action < 0.6 and records:
+            await delete_record(db, records.pop(rng.randrange(len(records))))
+        elif action < 0.8 and records:
+            await update_record(db, rng.choice(records), month=rng.randint(1, 12),
+                                revenue=round(rng.uniform(0, 1000), 2))
+        else:
+            payments = [
+                {"amount": f"₹{rng.randint(1, 50)} Lakh", "status": rng.choice(["Paid", "Pending"]),
+                 "date": datetime(2025, rng.randint(1, 12), 5)}
+                for _ in range(rng.randint(0, 4))
+            ]
+            await set_payments(db, rng.choice(["p1", "p2"]), payments)
+
+    await assert_matches_rebuild(db)
+
+async def test_month_emptied_despite_float_residue_is_removed(db):
+    await ensure_rollup(USER)
+    for record_id, amount in (("a", 0.1), ("b", 0.2), ("c", 0.3)):
+        await add_record(db, record_id, amount)
+    # 0.1 + 0.2 + 0.3 - 0.3 - 0.1 - 0.2 leaves about 5.6e-17
+    for record_id in ("c", "a", "b"):
+        await delete_record(db, record_id)
+    assert await rollup_rows(db) == {}
+
+async def test_writes_before_the_first_build_are_left_to_it(db):
+    await add_record(db, "a", 10.0)
+    await set_payments(db, "p1", [{"amount": "₹1 Lakh", "status": "Paid", "date": datetime(2025, 4, 2)}])
+    assert await rollup_rows(db) == {}
+
+    await ensure_rollup(USER)
+    assert len(await rollup_rows(db)) == 2
+
+async def test_writes_during_a_build_are_not_lost(db, monkeypatch):
+    await add_record(db, "a", 10.0)
+    await set_payments(db, "p1", [{"amount": "₹1 Lakh", "status": "Paid", "date": datetime(2025, 4, 2)}])
+    rollup = db[ROLLUP_COLLECTION]
+    original = rollup.delete_many
+    writes = iter([lambda: add_record(db, "b", 5.0, month=5), lambda: delete_record(db, "a")])
+
+    async def write_then_delete(*args, **kwargs):
+        # Another request writes after the build read its sources, before it replaces the rows
+        write = next(writes, None)
+        if write is not None:
+            await write()
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(rollup, "delete_many", write_then_delete)
+    await ensure_rollup(USER)
+    monkeypatch.undo()
+
+    assert not (await db[ROLLUP_STATE_COLLECTION].find_one({"_id": USER}))["building"]
+    rows = await rollup_rows(db)
+    assert {row["category"]: row["revenue"] for row in rows.values()} == {"sales": 5.0, PAYMENTS_CATEGORY: 100000.0}
+    await assert_matches_rebuild(db)
+
+async def test_write_read_by_a_build_is_not_applied_twice(db):
+    await add_record(db, "a", 10.0)
+    record = make_record("b", 5.0)
+    async with record_write(USER):
+        await db.financial_records.insert_one(dict(record))
+        # A trend read builds the rollup after this write's insert, before its bump
+        await ensure_rollup(USER)
+        await bump_generation(USER, "financial_records", ["b"])
+        await apply_record(USER, record)
+
+    await ensure_rollup(USER)
+    rows = await rollup_rows(db)
+    assert [row["revenue"] for row in rows.values()] == [15.0]
+    await assert_matches_rebuild(db)
+
+async def test_writers_that_died_do_not_block_builds(db):
+    await add_record(db, "a", 10.0)
+    stale = datetime.utcnow() - WRITER_TIMEOUT
+    await db[ROLLUP_STATE_COLLECTION].update_one({"_id": USER}, {"$push": {"writers": {"token": "x", "at": stale}}})
+    await ensure_rollup(USER)
+    state = await db[ROLLUP_STATE_COLLECTION].find_one({"_id": USER})
+    assert not state["building"]
+    assert state["writers"] == []
+
+async def test_trend_amounts_are_rounded_to_paise(db):
+    await add_record(db, "a", 0.1, month=1)
+    await add_record(db, "b", 0.2, month=1)
+    result = await trend(USER, [3])
+    point = result["series"][0]["points"][0]
+    assert point == {"period": "2025-01", "revenue": 0.3, "expenses": 0.0, "profit": 0.3,
+                     "3m": {"revenue": 0.3, "expenses": 0.0, "profit": 0.3}}
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from starlette.requests import Request
+
+from funnel import get_funnel, record_transition, status_fields
+from models import DealCreate, UserResponse
+from query_budget import QUERY_BUDGET, track_queries
+from routes.deals import get_deal, update_deal
+
+USER = "u1"
+START = datetime(2025, 1, 1)
+
+async def test_embedded_engine_commands_are_counted(db):
+    with track_queries() as stats:
+        await db.customers.insert_one({"id": "c1", "user_id": USER})
+        await db.customers.find_one({"id": "c1"})
+        await db.customers.find({"user_id": USER}).to_list(None)
+        await db.customers.count_documents({"user_id": USER})
+        await db.customers.bulk_write([
+            InsertOne({"id": "c2", "user_id": USER}),
+            InsertOne({"id": "c3", "user_id": USER}),
+            UpdateOne({"id": "c1"}, {"$set": {"name": "A"}}),
+            DeleteOne({"id": "c2"}),
+        ])
+        # A cursor's query runs once, however it is consumed
+        cursor = db.customers.find({"user_id": USER})
+        assert len([doc async for doc in cursor]) == 2
+    assert stats.count == 8
+    assert stats.repeats == {
+        ("customers", "insert", ()): 2,
+        ("customers", "find", ("id",)): 1,
+        ("customers", "find", ("user_id",)): 2,
+        ("customers", "aggregate", ("user_id",)): 1,
+        ("customers", "update", ("id",)): 1,
+        ("customers", "delete", ("id",)): 1,
+    }
+
+def deal_update(status):
+    return DealCreate(
+        property_id="p1", customer_id="c1", property_title="Villa", customer_name="Asha",
+        status=status, deal_value="₹80 Lakh", brokerage_amount="₹1.6 Lakh"
+    )
+
+async def test_deal_handlers_stay_within_their_query_budget(db):
+    await db.deals.insert_one({"id": "d1", "user_id": USER, "status": "Interested", **status_fields(None, "Interested", START)})
+    await record_transition(USER, "d1", None, "Interested", START)
+    await get_funnel(USER)
+    broker = UserResponse(
+        id=USER, email="b@example.com", full_name="Broker", phone=None, role="broker",
+        is_active=True, created_at=START
+    )
+    request = Request({"type": "http", "method": "GET", "path": "/api/deals/d1", "headers": [], "query_string": b""})
+
+    # (handler call, commands it may issue)
+    budgets = [
+        (lambda: get_deal("d1", request, current_user=broker, db=db), 1),
+        # Read, conditional write, generation bump, re-read, plus the transition log and funnel counters
+        (lambda: update_deal("d1", deal_update("Call"), current_user=broker, db=db), 6),
+        (lambda: update_deal("d1", deal_update("Call"), current_user=broker, db=db), 4),
+    ]
+    for call, budget in budgets:
+        with track_queries() as stats:
+            await call()
+        assert stats.count <= min(budget, QUERY_BUDGET), stats.repeats
+        assert not stats.repeated()
@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+from counters import get_unread_counts
+from retention import archive_matching
+
+USER = "u1"
+OLD = datetime(2024, 1, 1)
+
+async def test_archiving_uncounts_only_notifications_it_deleted_unread(db, monkeypatch):
+    await db.notifications.insert_many([
+        {"id": f"n{i}", "user_id": USER, "type": "payment", "is_read": i == 0, "created_at": OLD + timedelta(minutes=i)}
+        for i in range(4)
+    ])
+    assert await get_unread_counts(USER) == {"unread": 3, "by_type": {"payment": 3}}
+
+    archive = db.notifications_archive
+    original = archive.insert_many
+
+    async def insert_then_race(*args, **kwargs):
+        # Requests mark one notification read and delete another after the batch was read
+        result = await original(*args, **kwargs)
+        await db.notifications.update_one({"id": "n1"}, {"$set": {"is_read": True}})
+        await db.notifications.delete_one({"id": "n2"})
+        await db.notification_counters.update_one({"_id": USER}, {"$inc": {"unread": -2, "by_type.payment": -2}})
+        return result
+
+    monkeypatch.setattr(archive, "insert_many", insert_then_race)
+    assert await archive_matching({"created_at": {"$lt": datetime(2025, 1, 1)}}) == 4
+    monkeypatch.undo()
+
+    assert await db.notifications.count_documents({}) == 0
+    counter = await db.notification_counters.find_one({"_id": USER})
+    assert (counter["unread"], counter["by_type"]) == (0, {"payment": 0})
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+from database import create_indexes
+from scheduler import FIRED_COLLECTION, REFRESH_INTERVAL, TICK_SECONDS, ReminderScheduler
+from utils import utc_to_local
+
+def customer(due_at, **fields):
+    return {
+        "id": "c1", "user_id": "u1", "name": "Asha", "status": "Interested",
+        "follow_up_date": utc_to_local(due_at), **fields,
+    }
+
+async def test_reminder_written_on_another_worker_fires_after_leader_ticks_past_it(db):
+    await create_indexes()
+    leader, follower = ReminderScheduler(), ReminderScheduler()
+    leader.worker_id, follower.worker_id = "leader", "follower"
+    now = datetime.utcnow()
+
+    await leader._tick(now)
+    assert leader.is_leader
+
+    # Saved on the follower, due before the leader's next reload
+    doc = customer(now + timedelta(seconds=30))
+    await db.customers.insert_one(dict(doc))
+    follower.track("customer", doc)
+
+    tick = now
+    while tick < now + REFRESH_INTERVAL:
+        tick += timedelta(seconds=TICK_SECONDS)
+        await leader._tick(tick)
+
+    notifications = await db.notifications.find({"related_id": "c1"}).to_list(None)
+    assert len(notifications) == 1
+    assert await db[FIRED_COLLECTION].count_documents({}) == 1
+
+async def test_fired_reminder_is_not_delivered_again_after_reload(db):
+    await create_indexes()
+    scheduler = ReminderScheduler()
+    scheduler.worker_id = "leader"
+    now = datetime.utcnow()
+    doc = customer(now - timedelta(minutes=5))
+    await db.customers.insert_one(dict(doc))
+
+    await scheduler._tick(now)
+    # The user clears the notification; the marker still says the reminder fired
+    await db.notifications.delete_many({})
+    await scheduler._tick(now + REFRESH_INTERVAL)
+    scheduler.track("customer", doc)
+    await scheduler._tick(now + REFRESH_INTERVAL + timedelta(seconds=1))
+
+    assert await db.notifications.count_documents({}) == 0
+    assert await db[FIRED_COLLECTION].count_documents({}) == 1
+
+async def test_deleted_follow_up_does_not_fire(db):
+    await create_indexes()
+    scheduler = ReminderScheduler()
+    scheduler.worker_id = "leader"
+    now = datetime.utcnow()
+    await db.customers.insert_one(customer(now + timedelta(seconds=30)))
+
+    await scheduler._tick(now)
+    await db.customers.delete_one({"id": "c1"})
+    await scheduler._tick(now + timedelta(seconds=40))
+
+    assert await db.notifications.count_documents({}) == 0
@@ -0,0 +1,137 @@
+import random
+
+import pytest
+
+import search
+from search import ENTITY_SPECS, PREFIX_WEIGHT, SEARCH_TYPES, TenantIndex, document_tokens, query_terms
+
+@pytest.mark.parametrize("query, expected", [
+    ("Priya Sharma priya", ["priya", "sharma"]),
+    ("Baner, 3BHK", ["baner", "3bhk"]),
+    ("villa_plot", ["villa", "plot"]),
+    ("+91 98450-12345", ["9845012345"]),
+    ("(022) 2345 6789", ["2223456789"]),
+    ("98450", ["98450"]),
+    # Too short to be a phone fragment; matched as an ordinary token
+    ("1234", ["1234"]),
+    ("  ", []),
+])
+def test_query_terms(query, expected):
+    assert query_terms(query) == expected
+
+def test_phone_tokens_drop_the_country_code():
+    tokens = document_tokens(ENTITY_SPECS["customers"], {"id": "c1", "phone": "+91 98450 12345"})
+    assert set(tokens) == {"98450", "12345", "919845012345", "9845012345"}
+    assert "91" not in tokens
+    assert set(tokens.values()) == {8}
+
+def test_phone_tokens_without_country_code():
+    tokens = document_tokens(ENTITY_SPECS["customers"], {"id": "c1", "phone": "98450-12345"})
+    assert set(tokens) == {"98450", "12345", "9845012345"}
+
+def test_document_tokens_keep_the_best_field_weight():
+    tokens = document_tokens(ENTITY_SPECS["properties"], {
+        "id": "p1", "title": "Baner Villa", "area": "Baner", "address": "Near Baner Road", "owner": {"name": "Rao"}
+    })
+    assert tokens == {"baner": 8, "villa": 8, "near": 3, "road": 3, "rao": 5}
+
+def make_index(**collections):
+    index = TenantIndex()
+    for collection in ENTITY_SPECS:
+        index.replace_collection(collection, collections.get(collection, []), generation=0)
+    return index
+
+def test_prefix_expansion():
+    index = make_index(customers=[
+        {"id": "c1", "name": "Sharma"}, {"id": "c2", "name": "Shah"}, {"id": "c3", "name": "Sen"}, {"id": "c4", "name": "S"}
+    ])
+    assert index._expand("sh") == ["shah", "sharma"]
+    assert index._expand("sharmas") == []
+    # Single characters only match whole tokens
+    assert index._expand("s") == ["s"]
+
+def test_prefix_expansion_is_capped(monkeypatch):
+    monkeypatch.setattr(search, "MAX_PREFIX_EXPANSION", 2)
+    index = make_index(customers=[{"id": f"c{i}", "name": f"ab{i}"} for i in range(5)])
+    assert index._expand("ab") == ["ab0", "ab1"]
+
+PROPERTIES = [
+    {"id": "p1", "title": "Green Villa", "area": "Baner"},
+    {"id": "p2", "title": "Baner Heights", "area": "Wakad"},
+    {"id": "p3", "title": "Sunrise", "address": "Near Baner Road"},
+]
+
+def test_search_ranks_by_field_weight():
+    index = make_index(properties=PROPERTIES)
+    results = index.search(["baner"], list(ENTITY_SPECS), 10)
+    assert [(r["id"], r["score"]) for r in results] == [("p2", 8), ("p1", 5), ("p3", 3)]
+    assert results[0] == {"type": "property", "id": "p2", "title": "Baner Heights", "subtitle": "Wakad", "score": 8}
+
+def test_search_scores_prefixes_below_whole_tokens():
+    index = make_index(properties=PROPERTIES)
+    results = index.search(["ban"], list(ENTITY_SPECS), 10)
+    assert [(r["id"], r["score"]) for r in results] == [
+        ("p2", 8 * PREFIX_WEIGHT), ("p1", 5 * PREFIX_WEIGHT), ("p3", 3 * PREFIX_WEIGHT)
+    ]
+
+def test_search_requires_every_term_and_sums_their_scores():
+    index = make_index(properties=PROPERTIES, customers=[{"id": "c1", "name": "Villa Baner"}])
+    results = index.search(["baner", "villa"], list(ENTITY_SPECS), 10)
+    assert [(r["id"], r["score"]) for r in results] == [("c1", 16), ("p1", 13)]
+    assert index.search(["baner", "missing"], list(ENTITY_SPECS), 10) == []
+
+def test_search_filters_types_and_limits():
+    index = make_index(properties=PROPERTIES, customers=[{"id": "c1", "name": "Baner"}])
+    assert [r["id"] for r in index.search(["baner"], ["customers"], 10)] == ["c1"]
+    assert [r["id"] for r in index.search(["baner"], list(ENTITY_SPECS), 2)] == ["p2", "c1"]
+
+def test_upsert_and_remove_keep_the_vocabulary_sorted():
+    index = make_index(properties=PROPERTIES)
+    index.upsert("properties", {"id": "p2", "title": "Aundh Towers", "area": "Wakad"})
+    index.remove("properties", "p3")
+    assert index.vocabulary == sorted(index.postings)
+    assert "heights" not in index.postings and "sunrise" not in index.postings
+    assert [r["id"] for r in index.search(["baner"], list(ENTITY_SPECS), 10)] == ["p1"]
+
+def brute_force(docs, terms, limit):
+    ranked = []
+    for collection, doc in docs:
+        weights = document_tokens(ENTITY_SPECS[collection], doc)
+        total = 0
+        for term in terms:
+            scores = [
+                weight * (1.0 if token == term else PREFIX_WEIGHT)
+                for token, weight in weights.items()
+                if token == term or (len(term) >= search.MIN_PREFIX_LENGTH and token.startswith(term))
+            ]
+            if not scores:
+                break
+            total += max(scores)
+        else:
+            ranked.append((total, (collection, doc["id"])))
+    return sorted(ranked, reverse=True)[:limit]
+
+@pytest.mark.parametrize("tiered_size", [search.TIERED_POSTING_SIZE, 3])
+def test_search_matches_brute_force_ranking(monkeypatch, tiered_size):
+    monkeypatch.setattr(search, "TIERED_POSTING_SIZE", tiered_size)
+    rng = random.Random(11)
+    words = ["baner", "bandra", "banjara", "villa", "vista", "green", "greenwood", "sharma", "shah", "plot"]
+    docs = {collection: [] for collection in ENTITY_SPECS}
+    for i in range(300):
+        collection = rng.choice(list(ENTITY_SPECS))
+        doc = {"id": f"{collection[0]}{i}"}
+        for path in rng.sample(list(ENTITY_SPECS[collection].fields), 2):
+            value = " ".join(rng.sample(words, rng.randint(1, 3)))
+            if "." in path:
+                parent, child = path.split(".")
+                doc.setdefault(parent, {})[child] = value
+            else:
+                doc[path] = value
+        docs[collection].append(doc)
+    index = make_index(**docs)
+    everything = [(collection, doc) for collection, group in docs.items() for doc in group]
+
+    for terms in (["baner"], ["ban"], ["green", "villa"], ["sh", "gr", "v"], ["plot", "ba"], ["vi"]):
+        expected = brute_force(everything, terms, 15)
+        results = index.search(terms, list(ENTITY_SPECS), 15)
+        assert [(r["score"], (SEARCH_TYPES[r["type"]], r["id"])) for r in results] == expected, terms
@@ -0,0 +1,614 @@
+"""The embedded engine against the results MongoDB returns for the same operations.
+
+Expected values are what a MongoDB 6/7 server returns for the same documents,
+filters, updates and pipelines.
+"""
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from storage import MemoryClient
+
+@pytest.fixture
+def collection(db):
+    return db.things
+
+async def ids(cursor):
+    return [doc["id"] for doc in await cursor.to_list(None)]
+
+async def seed(collection, *docs):
+    await collection.insert_many([dict(doc) for doc in docs])
+
+# Query operators
+
+async def test_equality_matches_array_elements_and_null_matches_missing(collection):
+    await seed(
+        collection,
+        {"id": "a", "tags": ["x", "y"], "owner": None},
+        {"id": "b", "tags": "x"},
+        {"id": "c", "tags": ["z"], "owner": "u1"},
+    )
+    assert await ids(collection.find({"tags": "x"})) == ["a", "b"]
+    assert await ids(collection.find({"tags": ["x", "y"]})) == ["a"]
+    assert await ids(collection.find({"owner": None})) == ["a", "b"]
+    assert await ids(collection.find({"owner": {"$ne": None}})) == ["c"]
+
+async def test_comparisons_only_match_values_of_the_same_type(collection):
+    await seed(
+        collection,
+        {"id": "int", "value": 5},
+        {"id": "float", "value": 7.5},
+        {"id": "string", "value": "9"},
+        {"id": "missing"},
+    )
+    assert await ids(collection.find({"value": {"$gt": 4}})) == ["int", "float"]
+    assert await ids(collection.find({"value": {"$gte": "0"}})) == ["string"]
+    assert await ids(collection.find({"value": {"$lt": 6, "$gte": 5}})) == ["int"]
+    # 5 == 5.0 in Mongo
+    assert await ids(collection.find({"value": 5.0})) == ["int"]
+
+async def test_in_nin_exists_and_type(collection):
+    await seed(
+        collection,
+        {"id": "a", "status": "Open", "month": 4},
+        {"id": "b", "status": "Closed", "month": "April"},
+        {"id": "c", "month": 2 ** 40},
+    )
+    assert await ids(collection.find({"status": {"$in": ["Open", "Closed"]}})) == ["a", "b"]
+    assert await ids(collection.find({"status": {"$nin": ["Open"]}})) == ["b", "c"]
+    assert await ids(collection.find({"status": {"$exists": False}})) == ["c"]
+    assert await ids(collection.find({"month": {"$type": "int"}})) == ["a"]
+    assert await ids(collection.find({"month": {"$type": "string"}})) == ["b"]
+    assert await ids(collection.find({"month": {"$type": ["long", "string"]}})) == ["b", "c"]
+
+async def test_regex_options_and_negation(collection):
+    await seed(
+        collection,
+        {"id": "a", "images": ["/api/images/abc", "https://cdn/x.png"]},
+        {"id": "b", "images": ["iVBORw0KGgo"]},
+        {"id": "c", "name": "Baner Heights"},
+    )
+    inline = {"images": {"$elemMatch": {"$not": {"$regex": r"^(https?://|/api/images/)"}}}}
+    assert await ids(collection.find(inline)) == ["b"]
+    assert await ids(collection.find({"name": {"$regex": "baner", "$options": "i"}})) == ["c"]
+    assert await ids(collection.find({"name": {"$not": {"$regex": "^Ban"}}})) == ["a", "b"]
+
+async def test_dotted_paths_elem_match_size_and_all(collection):
+    await seed(
+        collection,
+        {"id": "p1", "plots": [{"number": "1", "status": "Sold"}, {"number": "2", "status": "Available"}]},
+        {"id": "p2", "plots": [{"number": "3", "status": "Sold"}]},
+        {"id": "p3", "plots": []},
+    )
+    assert await ids(collection.find({"plots.status": "Available"})) == ["p1"]
+    assert await ids(collection.find({"plots.0.number": "3"})) == ["p2"]
+    assert await ids(collection.find({"plots": {"$elemMatch": {"number": "1", "status": "Sold"}}})) == ["p1"]
+    # Conditions on separate elements still match without $elemMatch
+    assert await ids(collection.find({"plots.number": "1", "plots.status": "Available"})) == ["p1"]
+    assert await ids(collection.find({"plots": {"$size": 0}})) == ["p3"]
+    assert await ids(collection.find({"plots.status": {"$all": ["Sold", "Available"]}})) == ["p1"]
+
+async def test_logical_operators(collection):
+    await seed(
+        collection,
+        {"id": "a", "role": "broker", "active": True},
+        {"id": "b", "role": "builder", "active": False},
+        {"id": "c", "role": "builder", "active": True},
+    )
+    assert await ids(collection.find({"$or": [{"role": "broker"}, {"active": False}]})) == ["a", "b"]
+    assert await ids(collection.find({"$and": [{"role": "builder"}, {"active": True}]})) == ["c"]
+    assert await ids(collection.find({"$nor": [{"role": "broker"}, {"active": False}]})) == ["c"]
+    # True is not 1 in BSON comparisons
+    assert await ids(collection.find({"active": 1})) == []
+
+async def test_unknown_operator_is_rejected(collection):
+    await seed(collection, {"id": "a"})
+    with pytest.raises(OperationFailure):
+        await collection.find({"id": {"$almost": "a"}}).to_list(None)
+
+# Reads: projection, sort, skip, limit, distinct, counts
+
+async def test_projection_inclusion_exclusion_and_nested_fields(collection):
+    await seed(collection, {"id": "a", "name": "N", "buyer": {"name": "B", "phone": "1"}, "secret": 1})
+    assert await collection.find_one({"id": "a"}, {"_id": 0, "name": 1, "buyer.phone": 1}) == {
+        "name": "N", "buyer": {"phone": "1"}
+    }
+    assert await collection.find_one({"id": "a"}, {"_id": 0, "secret": 0, "buyer": 0}) == {"id": "a", "name": "N"}
+    assert set(await collection.find_one({"id": "a"}, {"name": 1})) == {"_id", "name"}
+
+async def test_sort_orders_types_like_mongo(collection):
+    await seed(
+        collection,
+        {"id": "string", "value": "a"},
+        {"id": "float", "value": 1.5},
+        {"id": "null", "value": None},
+        {"id": "int", "value": 1},
+        {"id": "missing"},
+        {"id": "date", "value": datetime(2025, 1, 1)},
+    )
+    # Missing and null sort together first, then numbers, strings and dates
+    assert await ids(collection.find({}).sort("value", 1)) == ["null", "missing", "int", "float", "string", "date"]
+    assert await ids(collection.find({}).sort([("value", -1)]).limit(2)) == ["date", "string"]
+    assert await ids(collection.find({}).sort("value", 1).skip(2).limit(2)) == ["int", "float"]
+
+async def test_sort_on_arrays_uses_smallest_ascending_and_largest_descending(collection):
+    await seed(collection, {"id": "a", "scores": [5, 1]}, {"id": "b", "scores": [3]}, {"id": "c", "scores": [2, 9]})
+    assert await ids(collection.find({}).sort("scores", 1)) == ["a", "c", "b"]
+    assert await ids(collection.find({}).sort("scores", -1)) == ["c", "a", "b"]
+
+async def test_distinct_unwinds_arrays_and_counts(collection):
+    await seed(
+        collection,
+        {"id": "a", "user_id": "u1", "tags": ["x", "y"]},
+        {"id": "b", "user_id": "u1", "tags": "x"},
+        {"id": "c", "user_id": "u2", "tags": ["z"]},
+    )
+    assert sorted(await collection.distinct("tags", {"user_id": "u1"})) == ["x", "y"]
+    assert await collection.count_documents({"user_id": "u1"}) == 2
+    assert await collection.count_documents({}, limit=2) == 2
+    assert await collection.count_documents({"user_id": "u1"}, skip=1) == 1
+
+async def test_reads_return_copies(collection):
+    await seed(collection, {"id": "a", "plots": [{"number": "1"}]})
+    doc = await collection.find_one({"id": "a"})
+    doc["plots"].append({"number": "2"})
+    assert (await collection.find_one({"id": "a"}))["plots"] == [{"number": "1"}]
+
+async def test_values_round_trip_through_bson(collection):
+    created = datetime(2025, 4, 1, 12, 30, 15, 123456)
+    document = {"id": "a", "count": 3, "ratio": 3.0, "at": created}
+    await collection.insert_one(document)
+    # Like pymongo, the caller's dict receives the generated _id
+    assert isinstance(document["_id"], ObjectId)
+    stored = await collection.find_one({"id": "a"})
+    assert type(stored["count"]) is int and type(stored["ratio"]) is float
+    # BSON dates have millisecond precision
+    assert stored["at"] == datetime(2025, 4, 1, 12, 30, 15, 123000)
+
+# Writes
+
+async def test_update_operators(collection):
+    await seed(collection, {"id": "a", "counts": {"open": 1}, "tags": ["x"], "low": 5, "old": True})
+    result = await collection.update_one({"id": "a"}, {
+        "$set": {"profile.city": "Pune"},
+        "$inc": {"counts.open": 2, "counts.closed": 1},
+        "$unset": {"old": ""},
+        "$min": {"low": 3},
+        "$max": {"high": 10},
+        "$addToSet": {"tags": {"$each": ["x", "y"]}},
+    })
+    assert (result.matched_count, result.modified_count) == (1, 1)
+    assert await collection.find_one({"id": "a"}, {"_id": 0}) == {
+        "id": "a", "counts": {"open": 3, "closed": 1}, "tags": ["x", "y"], "low": 3,
+        "profile": {"city": "Pune"}, "high": 10,
+    }
+
+async def test_push_with_slice_and_pull_by_condition(collection):
+    await seed(collection, {"id": "a", "events": [1, 2], "payments": [{"status": "Paid"}, {"status": "Pending"}]})
+    await collection.update_one({"id": "a"}, {
+        "$push": {"events": {"$each": [3, 4], "$slice": -3}},
+        "$pull": {"payments": {"status": "Pending"}},
+    })
+    doc = await collection.find_one({"id": "a"})
+    assert doc["events"] == [2, 3, 4]
+    assert doc["payments"] == [{"status": "Paid"}]
+
+async def test_unchanged_update_is_matched_but_not_modified(collection):
+    await seed(collection, {"id": "a", "status": "Open"})
+    result = await collection.update_one({"id": "a"}, {"$set": {"status": "Open"}})
+    assert (result.matched_count, result.modified_count) == (1, 0)
+
+async def test_update_requires_operators_and_keeps_id(collection):
+    await seed(collection, {"id": "a"})
+    with pytest.raises(ValueError):
+        await collection.update_one({"id": "a"}, {"status": "Open"})
+    with pytest.raises(OperationFailure):
+        await collection.update_one({"id": "a"}, {"$set": {"_id": "other"}})
+
+async def test_upsert_seeds_from_equality_filter_and_applies_set_on_insert(collection):
+    result = await collection.update_one(
+        {"_id": "u1", "kind": "counter", "n": {"$gt": 0}},
+        {"$inc": {"n": 1}, "$setOnInsert": {"created": True}},
+        upsert=True,
+    )
+    assert result.upserted_id == "u1"
+    assert await collection.find_one({"_id": "u1"}) == {"_id": "u1", "kind": "counter", "n": 1, "created": True}
+
+    await collection.update_one({"_id": "u1"}, {"$inc": {"n": 1}, "$setOnInsert": {"created": False}}, upsert=True)
+    assert await collection.find_one({"_id": "u1"}) == {"_id": "u1", "kind": "counter", "n": 2, "created": True}
+
+async def test_pipeline_update(collection):
+    await seed(collection, {"id": "a", "is_read": True, "updated_at": datetime(2025, 1, 2)})
+    await collection.update_many({"is_read": True}, [{"$set": {"read_at": "$updated_at"}}])
+    assert (await collection.find_one({"id": "a"}))["read_at"] == datetime(2025, 1, 2)
+
+async def test_update_many_replace_and_delete(collection):
+    await seed(collection, {"id": "a", "n": 1}, {"id": "b", "n": 1}, {"id": "c", "n": 2})
+    result = await collection.update_many({"n": 1}, {"$set": {"n": 3}})
+    assert (result.matched_count, result.modified_count) == (2, 2)
+
+    await collection.replace_one({"id": "c"}, {"id": "c", "replaced": True})
+    assert await collection.find_one({"id": "c"}, {"_id": 0}) == {"id": "c", "replaced": True}
+
+    assert (await collection.delete_one({"n": 3})).deleted_count == 1
+    assert (await collection.delete_many({})).deleted_count == 2
+
+async def test_find_one_and_update_and_delete(collection):
+    await seed(collection, {"id": "a", "n": 2}, {"id": "b", "n": 1})
+    before = await collection.find_one_and_update({}, {"$inc": {"n": 10}}, sort=[("n", 1)])
+    assert (before["id"], before["n"]) == ("b", 1)
+    after = await collection.find_one_and_update(
+        {"id": "a"}, {"$inc": {"n": 10}}, projection={"_id": 0, "n": 1}, return_document=ReturnDocument.AFTER
+    )
+    assert after == {"n": 12}
+    deleted = await collection.find_one_and_delete({}, sort=[("n", -1)])
+    assert deleted["id"] == "a"
+    assert await ids(collection.find({})) == ["b"]
+
+async def test_bulk_write_counts(collection):
+    await seed(collection, {"id": "a", "n": 1})
+    result = await collection.bulk_write([
+        InsertOne({"id": "b", "n": 1}),
+        UpdateOne({"id": "a"}, {"$inc": {"n": 1}}),
+        UpdateOne({"id": "z"}, {"$set": {"n": 0}}, upsert=True),
+        UpdateMany({"n": 1}, {"$set": {"n": 5}}),
+        ReplaceOne({"id": "a"}, {"id": "a", "n": 9}),
+        DeleteOne({"id": "z"}),
+    ], ordered=False)
+    assert (result.inserted_count, result.matched_count, result.modified_count) == (1, 3, 3)
+    assert (result.upserted_count, result.deleted_count) == (1, 1)
+    assert sorted((doc["id"], doc["n"]) for doc in await collection.find({}).to_list(None)) == [("a", 9), ("b", 5)]
+
+# Indexes
+
+async def test_unique_index_rejects_duplicates_on_insert_and_update(collection):
+    await collection.create_index("email", unique=True)
+    await seed(collection, {"id": "a", "email": "a@x.in"}, {"id": "b", "email": "b@x.in"})
+    with pytest.raises(DuplicateKeyError):
+        await collection.insert_one({"id": "c", "email": "a@x.in"})
+    with pytest.raises(DuplicateKeyError):
+        await collection.update_one({"id": "b"}, {"$set": {"email": "a@x.in"}})
+    # A freed key can be reused
+    await collection.delete_one({"id": "a"})
+    await collection.insert_one({"id": "c", "email": "a@x.in"})
+
+async def test_unique_index_build_fails_on_existing_duplicates(collection):
+    await seed(collection, {"id": "a", "email": "x"}, {"id": "b", "email": "x"})
+    with pytest.raises(DuplicateKeyError):
+        await collection.create_index("email", unique=True)
+    assert "email_1" not in await collection.index_information()
+
+async def test_partial_unique_index_only_covers_matching_documents(collection):
+    await collection.create_index(
+        "reminder_key", unique=True, partialFilterExpression={"reminder_key": {"$exists": True}}
+    )
+    await seed(collection, {"id": "a"}, {"id": "b"}, {"id": "c", "reminder_key": "k"})
+    with pytest.raises(BulkWriteError) as raised:
+        await collection.insert_many([{"id": "d", "reminder_key": "k"}, {"id": "e", "reminder_key": "l"}], ordered=False)
+    assert [error["index"] for error in raised.value.details["writeErrors"]] == [0]
+    assert raised.value.details["nInserted"] == 1
+    assert await collection.count_documents({}) == 4
+
+async def test_compound_unique_index(collection):
+    await collection.create_index([("user_id", 1), ("phone", 1)], unique=True)
+    await seed(collection, {"id": "a", "user_id": "u1", "phone": "1"}, {"id": "b", "user_id": "u2", "phone": "1"})
+    with pytest.raises(DuplicateKeyError):
+        await collection.insert_one({"id": "c", "user_id": "u1", "phone": "1"})
+
+async def test_duplicate_id_is_rejected(collection):
+    await collection.insert_one({"_id": "x"})
+    with pytest.raises(DuplicateKeyError):
+        await collection.insert_one({"_id": "x"})
+
+async def test_indexed_and_unindexed_reads_agree(collection):
+    docs = [{"id": str(i), "user_id": f"u{i % 3}", "status": ["Open", "Closed"][i % 2], "n": i} for i in range(30)]
+    await collection.insert_many([dict(doc) for doc in docs])
+    await collection.create_index([("user_id", 1), ("status", 1)])
+    query = {"user_id": "u1", "status": {"$in": ["Open"]}, "n": {"$gte": 10}}
+    expected = [doc["id"] for doc in docs if doc["user_id"] == "u1" and doc["status"] == "Open" and doc["n"] >= 10]
+    assert await ids(collection.find(query)) == expected
+    # Updates move documents between index buckets
+    await collection.update_many({"user_id": "u1"}, {"$set": {"user_id": "u9"}})
+    assert await collection.count_documents({"user_id": "u1"}) == 0
+    assert await collection.count_documents({"user_id": "u9"}) == 10
+
+# Aggregation
+
+async def test_group_accumulators_and_sort(collection):
+    await seed(
+        collection,
+        {"id": "a", "category": "sales", "revenue": 10, "month": 1},
+        {"id": "b", "category": "sales", "revenue": 30, "month": 2},
+        {"id": "c", "category": "ops", "revenue": 5.5, "month": 2},
+        {"id": "d", "category": "ops", "month": 3},
+    )
+    rows = await collection.aggregate([
+        {"$group": {
+            "_id": "$category",
+            "total": {"$sum": "$revenue"},
+            "average": {"$avg": "$revenue"},
+            "low": {"$min": "$revenue"},
+            "high": {"$max": "$revenue"},
+            "months": {"$addToSet": "$month"},
+            "ids": {"$push": "$id"},
+            "first": {"$first": "$id"},
+            "records": {"$sum": 1},
+        }},
+        {"$sort": {"total": -1}},
+    ]).to_list(None)
+    assert rows == [
+        {"_id": "sales", "total": 40, "average": 20.0, "low": 10, "high": 30,
+         "months": [1, 2], "ids": ["a", "b"], "first": "a", "records": 2},
+        {"_id": "ops", "total": 5.5, "average": 5.5, "low": 5.5, "high": 5.5,
+         "months": [2, 3], "ids": ["c", "d"], "first": "c", "records": 2},
+    ]
+
+async def test_group_by_date_parts_and_conditional_sum(collection):
+    await seed(
+        collection,
+        {"id": "a", "close_date": datetime(2025, 3, 31, 23), "amount": 1, "status": "Closed"},
+        {"id": "b", "close_date": datetime(2025, 4, 1), "amount": 2, "status": "Closed"},
+        {"id": "c", "close_date": datetime(2025, 4, 9), "amount": 4, "status": "Open"},
+    )
+    rows = await collection.aggregate([
+        {"$group": {
+            "_id": {"year": {"$year": "$close_date"}, "month": {"$month": "$close_date"}},
+            "closed": {"$sum": {"$cond": [{"$eq": ["$status", "Closed"]}, "$amount", 0]}},
+        }},
+        {"$sort": {"_id.year": 1, "_id.month": 1}},
+    ]).to_list(None)
+    assert rows == [
+        {"_id": {"year": 2025, "month": 3}, "closed": 1},
+        {"_id": {"year": 2025, "month": 4}, "closed": 2},
+    ]
+
+async def test_unwind_project_and_replace_root(collection):
+    await seed(
+        collection,
+        {"id": "p1", "plots": [{"number": "1", "price": 10}, {"number": "2", "price": 20}]},
+        {"id": "p2", "plots": []},
+    )
+    rows = await collection.aggregate([
+        {"$unwind": {"path": "$plots", "includeArrayIndex": "position", "preserveNullAndEmptyArrays": True}},
+        {"$project": {"_id": 0, "project": "$id", "number": "$plots.number", "position": 1,
+                      "double": {"$multiply": ["$plots.price", 2]}}},
+    ]).to_list(None)
+    assert rows == [
+        {"position": 0, "project": "p1", "number": "1", "double": 20},
+        {"position": 1, "project": "p1", "number": "2", "double": 40},
+        {"position": None, "project": "p2", "double": None},
+    ]
+    roots = await collection.aggregate([
+        {"$unwind": "$plots"},
+        {"$replaceRoot": {"newRoot": "$plots"}},
+    ]).to_list(None)
+    assert roots == [{"number": "1", "price": 10}, {"number": "2", "price": 20}]
+
+async def test_facet_count_and_sort_by_count(collection):
+    await seed(
+        collection,
+        {"id": "a", "area": "Baner", "type": "Flat"},
+        {"id": "b", "area": "Wakad", "type": "Flat"},
+        {"id": "c", "area": "Baner", "type": "Plot"},
+    )
+    result = await collection.aggregate([
+        {"$match": {"type": {"$exists": True}}},
+        {"$facet": {
+            "items": [{"$sort": {"id": -1}}, {"$limit": 2}, {"$project": {"_id": 0, "id": 1}}],
+            "total": [{"$count": "count"}],
+            "by_area": [{"$group": {"_id": "$area", "count": {"$sum": 1}}}, {"$sort": {"count": -1, "_id": 1}}],
+            "by_type": [{"$sortByCount": "$type"}],
+            "none": [{"$match": {"area": "Aundh"}}, {"$count": "count"}],
+        }},
+    ]).to_list(None)
+    assert result == [{
+        "items": [{"id": "c"}, {"id": "b"}],
+        "total": [{"count": 3}],
+        "by_area": [{"_id": "Baner", "count": 2}, {"_id": "Wakad", "count": 1}],
+        "by_type": [{"_id": "Flat", "count": 2}, {"_id": "Plot", "count": 1}],
+        "none": [],
+    }]
+
+async def test_unsupported_stage_is_rejected(collection):
+    await seed(collection, {"id": "a"})
+    with pytest.raises(OperationFailure):
+        await collection.aggregate([{"$lookup": {"from": "x"}}]).to_list(None)
+
+# Geo
+
+PUNE = [73.8567, 18.5204]
+MUMBAI = [72.8777, 19.0760]
+BANER = [73.7868, 18.5590]
+
+async def geo_collection(collection):
+    await collection.create_index([("user_id", 1), ("location", "2dsphere")])
+    await seed(
+        collection,
+        {"id": "mumbai", "user_id": "u1", "location": {"type": "Point", "coordinates": MUMBAI}},
+        {"id": "baner", "user_id": "u1", "location": {"type": "Point", "coordinates": BANER}},
+        {"id": "other", "user_id": "u2", "location": {"type": "Point", "coordinates": PUNE}},
+        {"id": "nowhere", "user_id": "u1"},
+    )
+    return collection
+
+async def test_geo_near_orders_by_distance_with_query_and_max_distance(collection):
+    await geo_collection(collection)
+    rows = await collection.aggregate([
+        {"$geoNear": {
+            "near": {"type": "Point", "coordinates": PUNE}, "key": "location", "distanceField": "distance_km",
+            "distanceMultiplier": 0.001, "spherical": True, "query": {"user_id": "u1"},
+        }},
+        {"$project": {"_id": 0, "id": 1, "distance_km": 1}},
+    ]).to_list(None)
+    assert [row["id"] for row in rows] == ["baner", "mumbai"]
+    # Great-circle distances on MongoDB's 6378.1 km sphere
+    assert rows[0]["distance_km"] == pytest.approx(8.5, abs=0.1)
+    assert rows[1]["distance_km"] == pytest.approx(120.3, abs=0.5)
+
+    nearby = await collection.aggregate([
+        {"$geoNear": {"near": {"type": "Point", "coordinates": PUNE}, "distanceField": "d",
+                      "maxDistance": 50000, "query": {"user_id": "u1"}}},
+    ]).to_list(None)
+    assert [row["id"] for row in nearby] == ["baner"]
+
+async def test_geo_near_must_be_the_first_stage(collection):
+    await geo_collection(collection)
+    with pytest.raises(OperationFailure) as raised:
+        await collection.aggregate([
+            {"$match": {"user_id": "u1"}},
+            {"$geoNear": {"near": {"type": "Point", "coordinates": PUNE}, "distanceField": "d"}},
+        ]).to_list(None)
+    assert raised.value.code == 40603
+
+async def test_geo_near_requires_a_2dsphere_index(db):
+    await db.plain.insert_one({"location": {"type": "Point", "coordinates": PUNE}})
+    with pytest.raises(OperationFailure):
+        await db.plain.aggregate([
+            {"$geoNear": {"near": {"type": "Point", "coordinates": PUNE}, "distanceField": "d"}}
+        ]).to_list(None)
+
+async def test_geo_within_polygon(collection):
+    await geo_collection(collection)
+    ring = [[73.5, 18.3], [74.0, 18.3], [74.0, 18.8], [73.5, 18.8], [73.5, 18.3]]
+    query = {"location": {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [ring]}}}}
+    assert sorted(await ids(collection.find(query))) == ["baner", "other"]
+
+# $densify and $setWindowFields
+
+async def test_densify_months_per_partition(collection):
+    await seed(
+        collection,
+        {"key": "a", "period": datetime(2025, 1, 1), "revenue": 1},
+        {"key": "a", "period": datetime(2025, 4, 1), "revenue": 4},
+        {"key": "b", "period": datetime(2025, 2, 1), "revenue": 2},
+    )
+    rows = await collection.aggregate([
+        {"$project": {"_id": 0}},
+        {"$densify": {"field": "period", "partitionByFields": ["key"],
+                      "range": {"step": 1, "unit": "month", "bounds": "partition"}}},
+        {"$sort": {"key": 1, "period": 1}},
+    ]).to_list(None)
+    assert rows == [
+        {"key": "a", "period": datetime(2025, 1, 1), "revenue": 1},
+        {"key": "a", "period": datetime(2025, 2, 1)},
+        {"key": "a", "period": datetime(2025, 3, 1)},
+        {"key": "a", "period": datetime(2025, 4, 1), "revenue": 4},
+        {"key": "b", "period": datetime(2025, 2, 1), "revenue": 2},
+    ]
+
+async def test_densify_full_and_explicit_bounds(collection):
+    await seed(collection, {"key": "a", "n": 0}, {"key": "b", "n": 4})
+    full = await collection.aggregate([
+        {"$project": {"_id": 0}},
+        {"$densify": {"field": "n", "partitionByFields": ["key"], "range": {"step": 2, "bounds": "full"}}},
+        {"$sort": {"key": 1, "n": 1}},
+    ]).to_list(None)
+    assert full == [
+        {"key": "a", "n": 0}, {"key": "a", "n": 2}, {"key": "a", "n": 4},
+        {"key": "b", "n": 0}, {"key": "b", "n": 2}, {"key": "b", "n": 4},
+    ]
+    # Explicit bounds exclude the upper bound
+    explicit = await collection.aggregate([
+        {"$match": {"key": "a"}},
+        {"$project": {"_id": 0, "n": 1}},
+        {"$densify": {"field": "n", "range": {"step": 1, "bounds": [0, 3]}}},
+        {"$sort": {"n": 1}},
+    ]).to_list(None)
+    assert explicit == [{"n": 0}, {"n": 1}, {"n": 2}]
+
+async def test_set_window_fields_document_and_month_range_windows(collection):
+    await seed(
+        collection,
+        {"key": "a", "period": datetime(2025, 1, 1), "revenue": 1},
+        {"key": "a", "period": datetime(2025, 2, 1), "revenue": 2},
+        {"key": "a", "period": datetime(2025, 5, 1), "revenue": 5},
+        {"key": "b", "period": datetime(2025, 1, 1), "revenue": 10},
+    )
+    rows = await collection.aggregate([
+        {"$setWindowFields": {
+            "partitionBy": "$key",
+            "sortBy": {"period": 1},
+            "output": {
+                "running": {"$sum": "$revenue", "window": {"documents": ["unbounded", "current"]}},
+                "pair": {"$avg": "$revenue", "window": {"documents": [-1, 0]}},
+                "quarter": {"$sum": "$revenue", "window": {"range": [-2, 0], "unit": "month"}},
+                "next": {"$max": "$revenue", "window": {"documents": [1, 1]}},
+                "rows": {"$count": {}},
+            },
+        }},
+        {"$project": {"_id": 0, "revenue": 0}},
+        {"$sort": {"key": 1, "period": 1}},
+    ]).to_list(None)
+    assert rows == [
+        {"key": "a", "period": datetime(2025, 1, 1), "running": 1, "pair": 1.0, "quarter": 1, "next": 2, "rows": 3},
+        {"key": "a", "period": datetime(2025, 2, 1), "running": 3, "pair": 1.5, "quarter": 3, "next": 5, "rows": 3},
+        # March and April are empty, so only May itself is within two months
+        {"key": "a", "period": datetime(2025, 5, 1), "running": 8, "pair": 3.5, "quarter": 5, "next": None, "rows": 3},
+        {"key": "b", "period": datetime(2025, 1, 1), "running": 10, "pair": 10.0, "quarter": 10, "next": None, "rows": 1},
+    ]
+
+async def test_set_window_fields_range_requires_one_sort_key(collection):
+    await seed(collection, {"a": 1, "b": 1})
+    with pytest.raises(OperationFailure):
+        await collection.aggregate([{"$setWindowFields": {
+            "sortBy": {"a": 1, "b": 1},
+            "output": {"s": {"$sum": "$a", "window": {"range": [-1, 0]}}},
+        }}]).to_list(None)
+
+# Snapshots
+
+async def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.bson")
+    client = MemoryClient(path)
+    db = client["app"]
+    await db.users.insert_one({"id": "u1", "email": "a@x.in", "created_at": datetime(2025, 1, 1, 9, 30)})
+    await db.projects.insert_one({"id": "p1", "user_id": "u1", "plots": [{"number": "1", "payments": []}]})
+    await db.users.update_one({"id": "u1"}, {"$set": {"role": "builder"}})
+    await db.projects.delete_one({"id": "missing"})
+    client.close()
+
+    reloaded = MemoryClient(path)["app"]
+    assert await reloaded.users.find_one({"id": "u1"}, {"_id": 0}) == {
+        "id": "u1", "email": "a@x.in", "created_at": datetime(2025, 1, 1, 9, 30), "role": "builder"
+    }
+    assert await reloaded.projects.find_one({"user_id": "u1"}, {"_id": 0}) == {
+        "id": "p1", "user_id": "u1", "plots": [{"number": "1", "payments": []}]
+    }
+    # _ids survive, so documents keep their identity across restarts
+    assert (await reloaded.users.find_one({}))["_id"] == (await db.users.find_one({}))["_id"]
+    # Indexes are recreated at startup and enforced over loaded documents
+    await reloaded.users.create_index("email", unique=True)
+    with pytest.raises(DuplicateKeyError):
+        await reloaded.users.insert_one({"id": "u2", "email": "a@x.in"})
+
+async def test_snapshot_is_only_written_when_data_changed(tmp_path):
+    path = tmp_path / "snapshot.bson"
+    client = MemoryClient(str(path))
+    client.save_snapshot()
+    assert not path.exists()
+
+    await client["app"].users.insert_one({"id": "u1"})
+    await client.save_snapshot_async()
+    written = path.stat().st_mtime_ns
+    client.save_snapshot()
+    assert path.stat().st_mtime_ns == written
+
+async def test_snapshot_is_locked_to_one_client(tmp_path):
+    path = str(tmp_path / "snapshot.bson")
+    client = MemoryClient(path)
+    with pytest.raises(RuntimeError):
+        MemoryClient(path)
+    client.close()
+    MemoryClient(path).close()
+
+async def test_memory_backend_refuses_several_workers(monkeypatch):
+    import database
+
+    monkeypatch.setattr(database, "STORAGE_BACKEND", "memory")
+    monkeypatch.setenv("WEB_CONCURRENCY", "2")
+    with pytest.raises(RuntimeError):
+        await database.connect_to_mongo()
+    assert database._connection is None
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pytest
+
+from utils import brokerage_amount, brokerage_total, expand_recurrence, series_end
+
+@pytest.mark.parametrize("text, expected", [
+    ("₹2.5 Lakh", 250000.0),
+    ("₹50,000", 50000.0),
+    ("₹1.2 Cr", 12000000.0),
+    ("", 0.0),
+    ("n/a", 0.0),
+    (None, 0.0),
+])
+def test_brokerage_amount_in_rupees(text, expected):
+    assert brokerage_amount({"brokerage_amount": text}) == expected
+
+def test_brokerage_total_mixes_units():
+    deals = [{"brokerage_amount": "₹2 Lakh"}, {"brokerage_amount": "₹50,000"}, {}]
+    assert brokerage_total(deals) == 250000.0
+
+# 10:00 in Asia/Kolkata
+SERIES_START = datetime(2025, 1, 31, 4, 30)
+
+@pytest.mark.parametrize("rule, expected", [
+    (None, None),
+    ({"frequency": "daily"}, None),
+    ({"frequency": "daily", "count": 1}, SERIES_START),
+    ({"frequency": "weekly", "interval": 2, "count": 3}, datetime(2025, 2, 28, 4, 30)),
+    # Clamped to the last day of the month, as occurrences are
+    ({"frequency": "monthly", "count": 2}, datetime(2025, 2, 28, 4, 30)),
+    # End of the local day
+    ({"frequency": "daily", "until": datetime(2025, 3, 1)}, datetime(2025, 3, 1, 18, 29, 59, 999999)),
+    ({"frequency": "daily", "count": 3, "until": datetime(2025, 3, 1)}, datetime(2025, 2, 2, 4, 30)),
+])
+def test_series_end(rule, expected):
+    event = {"id": "e1", "date": datetime(2025, 1, 31), "starts_at": SERIES_START, "recurrence": rule}
+    assert series_end(event) == expected
+    if expected is not None and rule:
+        occurrences = expand_recurrence(event, SERIES_START, datetime(2026, 1, 1))
+        assert occurrences[-1]["starts_at"] <= expected